@@ -1,12 +1,16 @@
 #include <DriverKit/IOLib.h>
 #include <DriverKit/IOBufferMemoryDescriptor.h>
+#include <DriverKit/IODispatchQueue.h>
+#include <DriverKit/IOTimerDispatchSource.h>
 #include <DriverKit/OSCollections.h>
 #include <USBDriverKit/IOUSBHostDevice.h>
 #include <USBDriverKit/IOUSBHostInterface.h>
 #include <USBDriverKit/AppleUSBDefinitions.h>
 #include <HIDDriverKit/HIDDriverKit.h>
+#include <mach/mach_time.h>
 
 #include "HORIRacingWheelDriver.h"
+#include "wheel_report.h"
 
 #define LOG_PREFIX "HORIRacingWheelDriver: "
 
@@ -15,14 +19,74 @@
 #define LOG_ERROR(fmt, ...) IOLog(LOG_PREFIX fmt "\n", ##__VA_ARGS__)
 #define LOG_INFO(fmt, ...) IOLog(LOG_PREFIX fmt "\n", ##__VA_ARGS__)
 
+#define kReportBufferSize 64
+
+// Report dispatch policy (mirrors DispatchPolicy in report_source.py)
+// Idle wheels stream byte-identical reports; only changes, coalesced bursts
+// and a periodic heartbeat are forwarded to HandleInputReport/handleReport.
+#define kSuppressDuplicates       true
+#define kCoalesceWindowNs         0ULL             // 0 = forward every change
+#define kHeartbeatIntervalNs      1000000000ULL    // 1 second, 0 = no heartbeat
+#define kDispatchStatsLogInterval 10000            // Log counters every N reports
+
 struct HORIRacingWheelDriver_IVars
 {
     IOUSBHostInterface *interface;
     IOUSBHostPipe *inPipe;
     OSAction *completionAction;
     IOBufferMemoryDescriptor *reportBuffer;
+
+    // Flushes a coalesced change once its window expires, so the last state
+    // before the wheel goes quiet still reaches HID (same queue as
+    // ReadComplete, so no locking)
+    IODispatchQueue *defaultQueue;
+    IOTimerDispatchSource *flushTimer;
+    OSAction *flushAction;
+
+    // Dispatch policy (windows converted to completion timestamp ticks in Start)
+    uint64_t coalesceWindowTicks;
+    uint64_t heartbeatIntervalTicks;
+
+    // Last forwarded report and the change held back by coalescing
+    uint8_t lastSentReport[kReportBufferSize];
+    uint32_t lastSentLength;
+    uint64_t lastSentTime;
+    uint8_t pendingReport[kReportBufferSize];
+    uint32_t pendingLength;
+    bool hasLastSent;
+    bool hasPending;
+
+    // Dispatch counters
+    uint64_t reportsReceived;
+    uint64_t reportsForwarded;
+    uint64_t reportsDuplicate;
+    uint64_t reportsCoalesced;
+    uint64_t reportsHeartbeat;
+
+    // Completion timestamp -> ReadComplete delivery delay (mach ticks), so
+    // host-side timestamps can be checked against the USB completion time
+    uint64_t deliveryTicksSum;
+    uint64_t deliveryTicksMax;
 };
 
+static uint64_t NanosecondsToTicks(uint64_t ns)
+{
+    mach_timebase_info_data_t timebase;
+    if (mach_timebase_info(&timebase) != KERN_SUCCESS || timebase.numer == 0) {
+        return ns;
+    }
+    return ns * timebase.denom / timebase.numer;
+}
+
+static uint64_t TicksToNanoseconds(uint64_t ticks)
+{
+    mach_timebase_info_data_t timebase;
+    if (mach_timebase_info(&timebase) != KERN_SUCCESS || timebase.denom == 0) {
+        return ticks;
+    }
+    return ticks * timebase.numer / timebase.denom;
+}
+
 bool HORIRacingWheelDriver::init()
 {
     bool result = false;
@@ -116,8 +180,34 @@ kern_return_t HORIRacingWheelDriver::Start_Impl(IOService *provider)
         return kIOReturnError;
     }
 
+    // Dispatch policy windows are compared against completion timestamps
+    ivars->coalesceWindowTicks = NanosecondsToTicks(kCoalesceWindowNs);
+    ivars->heartbeatIntervalTicks = NanosecondsToTicks(kHeartbeatIntervalNs);
+
+    if (ivars->coalesceWindowTicks != 0) {
+        ret = CopyDispatchQueue(kIOServiceDefaultQueueName, &ivars->defaultQueue);
+        if (ret == kIOReturnSuccess) {
+            ret = IOTimerDispatchSource::Create(ivars->defaultQueue, &ivars->flushTimer);
+        }
+        if (ret == kIOReturnSuccess) {
+            ret = CreateActionFlushPending(0, &ivars->flushAction);
+        }
+        if (ret == kIOReturnSuccess) {
+            ret = ivars->flushTimer->SetHandler(ivars->flushAction);
+        }
+        if (ret != kIOReturnSuccess) {
+            // Without the flush timer a held change could be stuck until the
+            // next report, so forward every change instead
+            LOG_ERROR("Failed to create coalescing flush timer: 0x%x, coalescing disabled", ret);
+            ivars->coalesceWindowTicks = 0;
+            OSSafeReleaseNULL(ivars->flushAction);
+            OSSafeReleaseNULL(ivars->flushTimer);
+            OSSafeReleaseNULL(ivars->defaultQueue);
+        }
+    }
+
     // Allocate report buffer
-    ret = IOBufferMemoryDescriptor::Create(kIOMemoryDirectionIn, 64, 0, &ivars->reportBuffer);
+    ret = IOBufferMemoryDescriptor::Create(kIOMemoryDirectionIn, kReportBufferSize, 0, &ivars->reportBuffer);
     if (ret != kIOReturnSuccess || !ivars->reportBuffer) {
         LOG_ERROR("Failed to allocate report buffer: 0x%x", ret);
         OSSafeReleaseNULL(ivars->inPipe);
@@ -142,7 +232,7 @@ kern_return_t HORIRacingWheelDriver::Start_Impl(IOService *provider)
     }
 
     // Start reading from the device
-    ret = ivars->inPipe->AsyncIO(ivars->reportBuffer, 64, ivars->completionAction, 0);
+    ret = ivars->inPipe->AsyncIO(ivars->reportBuffer, kReportBufferSize, ivars->completionAction, 0);
     if (ret != kIOReturnSuccess) {
         LOG_ERROR("Failed to start async IO: 0x%x", ret);
         OSSafeReleaseNULL(ivars->completionAction);
@@ -165,12 +255,28 @@ kern_return_t HORIRacingWheelDriver::Start_Impl(IOService *provider)
 kern_return_t HORIRacingWheelDriver::Stop_Impl(IOService *provider)
 {
     LOG_INFO("Stop called");
+    LOG_INFO("Reports: received %llu, forwarded %llu, duplicate %llu, coalesced %llu, heartbeat %llu",
+             ivars->reportsReceived, ivars->reportsForwarded, ivars->reportsDuplicate,
+             ivars->reportsCoalesced, ivars->reportsHeartbeat);
+    if (ivars->reportsReceived) {
+        LOG_INFO("Completion delivery: mean %llu us, max %llu us",
+                 TicksToNanoseconds(ivars->deliveryTicksSum / ivars->reportsReceived) / 1000,
+                 TicksToNanoseconds(ivars->deliveryTicksMax) / 1000);
+    }
 
     if (ivars->inPipe) {
         ivars->inPipe->Abort(0, kIOReturnAborted, this);
         OSSafeReleaseNULL(ivars->inPipe);
     }
 
+    if (ivars->flushTimer) {
+        ivars->flushTimer->SetEnable(false);
+        ivars->flushTimer->Cancel(^{});
+        OSSafeReleaseNULL(ivars->flushTimer);
+    }
+    OSSafeReleaseNULL(ivars->flushAction);
+    OSSafeReleaseNULL(ivars->defaultQueue);
+
     if (ivars->completionAction) {
         ivars->completionAction->release();
         ivars->completionAction = nullptr;
@@ -213,27 +319,127 @@ void HORIRacingWheelDriver::ReadComplete_Impl(OSAction *action, IOReturn status,
         return;
     }
 
+    // completionTimestamp is in the same mach_absolute_time domain as the
+    // host, so the difference is how late this callback ran
+    uint64_t now = mach_absolute_time();
+    uint64_t delivery = now > completionTimestamp ? now - completionTimestamp : 0;
+    ivars->deliveryTicksSum += delivery;
+    if (delivery > ivars->deliveryTicksMax) {
+        ivars->deliveryTicksMax = delivery;
+    }
+
     if (actualByteCount > 0) {
         uint8_t *reportData = nullptr;
         uint64_t reportLength = 0;
 
         ret = ivars->reportBuffer->Map(0, 0, 0, 0, (uint64_t*)&reportData, &reportLength);
         if (ret == kIOReturnSuccess && reportData) {
-            // Handle the report
-            HandleInputReport(completionTimestamp, reportData, actualByteCount);
-
-            // Dispatch the report to the HID system
-            handleReport(completionTimestamp, reportData, actualByteCount, kIOHIDReportTypeInput, 0);
+            uint32_t dispatchLength = 0;
+            uint8_t *dispatchReport = ApplyDispatchPolicy(completionTimestamp, reportData,
+                                                          actualByteCount, &dispatchLength);
+            if (dispatchReport) {
+                // Handle the report
+                HandleInputReport(completionTimestamp, dispatchReport, dispatchLength);
+
+                // Dispatch the report to the HID system
+                handleReport(completionTimestamp, dispatchReport, dispatchLength, kIOHIDReportTypeInput, 0);
+            }
         }
     }
 
     // Queue next read
-    ret = ivars->inPipe->AsyncIO(ivars->reportBuffer, 64, ivars->completionAction, 0);
+    ret = ivars->inPipe->AsyncIO(ivars->reportBuffer, kReportBufferSize, ivars->completionAction, 0);
     if (ret != kIOReturnSuccess) {
         LOG_ERROR("Failed to queue next read: 0x%x", ret);
     }
 }
 
+uint8_t *HORIRacingWheelDriver::ApplyDispatchPolicy(uint64_t timestamp, uint8_t *report, uint32_t reportLength, uint32_t *dispatchLength)
+{
+    // Returns the report to forward (the new report or the change held back
+    // by coalescing), or nullptr when the report is suppressed.
+    if (reportLength > kReportBufferSize) {
+        reportLength = kReportBufferSize;
+    }
+
+    if ((++ivars->reportsReceived % kDispatchStatsLogInterval) == 0) {
+        LOG_INFO("Reports: received %llu, forwarded %llu, duplicate %llu, coalesced %llu, heartbeat %llu",
+                 ivars->reportsReceived, ivars->reportsForwarded, ivars->reportsDuplicate,
+                 ivars->reportsCoalesced, ivars->reportsHeartbeat);
+    }
+
+    uint64_t sinceLastSent = timestamp - ivars->lastSentTime;
+
+    if (ivars->hasPending) {
+        if (reportLength == ivars->pendingLength &&
+            memcmp(report, ivars->pendingReport, reportLength) == 0) {
+            ivars->reportsDuplicate++;
+            if (sinceLastSent < ivars->coalesceWindowTicks) {
+                return nullptr;
+            }
+            // Coalescing window elapsed: forward the held change
+            ivars->hasPending = false;
+            return ForwardReport(timestamp, ivars->pendingReport, ivars->pendingLength, dispatchLength);
+        }
+        // A newer change supersedes the held one before it was ever sent
+        ivars->reportsCoalesced++;
+        ivars->hasPending = false;
+    }
+
+    // Cheap 64-byte compare against the last forwarded copy
+    if (kSuppressDuplicates && ivars->hasLastSent && reportLength == ivars->lastSentLength &&
+        memcmp(report, ivars->lastSentReport, reportLength) == 0) {
+        if (ivars->heartbeatIntervalTicks == 0 || sinceLastSent < ivars->heartbeatIntervalTicks) {
+            ivars->reportsDuplicate++;
+            return nullptr;
+        }
+        ivars->reportsHeartbeat++;
+        return ForwardReport(timestamp, report, reportLength, dispatchLength);
+    }
+
+    if (ivars->coalesceWindowTicks != 0 && ivars->hasLastSent &&
+        sinceLastSent < ivars->coalesceWindowTicks) {
+        memcpy(ivars->pendingReport, report, reportLength);
+        ivars->pendingLength = reportLength;
+        ivars->hasPending = true;
+        // Forwarded by the next report after the window, or by the timer if
+        // there is none
+        if (ivars->flushTimer) {
+            ivars->flushTimer->WakeAtTime(kIOTimerClockMachAbsoluteTime,
+                                          ivars->lastSentTime + ivars->coalesceWindowTicks, 0);
+        }
+        return nullptr;
+    }
+
+    return ForwardReport(timestamp, report, reportLength, dispatchLength);
+}
+
+void HORIRacingWheelDriver::FlushPending_Impl(OSAction *action, uint64_t time)
+{
+    // A report arriving after the window may already have forwarded it
+    if (!ivars->hasPending) {
+        return;
+    }
+    uint64_t now = mach_absolute_time();
+    uint32_t dispatchLength = 0;
+    ivars->hasPending = false;
+    uint8_t *dispatchReport = ForwardReport(now, ivars->pendingReport, ivars->pendingLength, &dispatchLength);
+    HandleInputReport(now, dispatchReport, dispatchLength);
+    handleReport(now, dispatchReport, dispatchLength, kIOHIDReportTypeInput, 0);
+}
+
+uint8_t *HORIRacingWheelDriver::ForwardReport(uint64_t timestamp, uint8_t *report, uint32_t reportLength, uint32_t *dispatchLength)
+{
+    memcpy(ivars->lastSentReport, report, reportLength);
+    ivars->lastSentLength = reportLength;
+    ivars->lastSentTime = timestamp;
+    ivars->hasLastSent = true;
+    ivars->reportsForwarded++;
+
+    *dispatchLength = reportLength;
+    return ivars->lastSentReport;
+}
+
 void HORIRacingWheelDriver::HandleInputReport(uint64_t timestamp, uint8_t *report, uint32_t reportLength)
 {
     // Log raw report for debugging
@@ -289,59 +495,38 @@ void HORIRacingWheelDriver::ParseWheelData(uint8_t *report, uint32_t reportLengt
     //           0x8000 to 0xFFFF = Turn LEFT (32768 to 65535, or -32768 to -1 if interpreted as signed)
     // Byte 8+:  Vendor-specific data
 
-    if (reportLength < 8) {
+    // Decoding lives in wheel_report.c, shared with the Python tools
+    // (wheel_report_c.py) so the two can't drift apart
+    hori_wheel_state state;
+    if (!hori_wheel_parse(report, reportLength, &state)) {
         LOG_ERROR("Report too short: %d bytes", reportLength);
         return;
     }
 
-    // Extract button state (TODO: map buttons to find actual positions)
-    uint16_t buttons = report[0] | ((report[1] & 0xFF) << 8);  // Guess: bytes 0-1
-
-    // Extract D-pad (individual bits, not hat switch encoding)
-    uint8_t dpad_bits = report[2] & 0x0F;
-    // Convert individual bits to hat switch encoding for compatibility
-    // 0x01=Up, 0x02=Down, 0x04=Left, 0x08=Right
-    uint8_t dpad = 8;  // Default: centered
-    if (dpad_bits == 0x01) dpad = 0;      // Up
-    else if (dpad_bits == 0x09) dpad = 1; // NE (Up+Right)
-    else if (dpad_bits == 0x08) dpad = 2; // Right
-    else if (dpad_bits == 0x0A) dpad = 3; // SE (Down+Right)
-    else if (dpad_bits == 0x02) dpad = 4; // Down
-    else if (dpad_bits == 0x06) dpad = 5; // SW (Down+Left)
-    else if (dpad_bits == 0x04) dpad = 6; // Left
-    else if (dpad_bits == 0x05) dpad = 7; // NW (Up+Left)
-
-    // Extract shoulder buttons and plus/minus from byte 2 (upper 4 bits)
-    bool btn_plus = (report[2] & 0x10) != 0;   // Bit 4: + button
-    bool btn_minus = (report[2] & 0x20) != 0;  // Bit 5: - button
-    bool btn_lsb = (report[2] & 0x40) != 0;    // Bit 6: LSB (Left Shoulder Button)
-    bool btn_rsb = (report[2] & 0x80) != 0;    // Bit 7: RSB (Right Shoulder Button)
-
-    // Extract axes (CORRECTED POSITIONS!)
-    uint8_t brake = report[4];     // Byte 4: Brake
-    uint8_t accel = report[5];     // Byte 5: Accelerator
-
-    // Extract 16-bit steering (bytes 6-7, little-endian)
-    // 0x0000 = center, 0x0001-0x7FFF = right, 0x8000-0xFFFF = left
-    uint16_t steering16 = report[6] | ((uint16_t)report[7] << 8);
-    int16_t steering_signed = (int16_t)steering16;  // Can also interpret as signed: -32768 to +32767
-
-    // Extract paddle shifters and face buttons (byte 3)
-    bool paddle_gear_down = (report[3] & 0x01) != 0;  // Bit 0: left paddle
-    bool paddle_gear_up = (report[3] & 0x02) != 0;    // Bit 1: right paddle
-    bool btn_home = (report[3] & 0x04) != 0;          // Bit 2: home button
-    // Bit 3 (0x08): unknown
-    bool btn_a = (report[3] & 0x10) != 0;             // Bit 4: A button
-    bool btn_b = (report[3] & 0x20) != 0;             // Bit 5: B button
-    bool btn_x = (report[3] & 0x40) != 0;             // Bit 6: X button
-    bool btn_y = (report[3] & 0x80) != 0;             // Bit 7: Y button
+    uint16_t steering16 = state.steering16;
+    int16_t steering_signed = state.steering_signed;
+    uint8_t brake = state.brake;
+    uint8_t accel = state.accel;
+    uint8_t dpad = state.dpad;
+    uint16_t flags = state.flags;
+
+    bool btn_plus = (flags & HORI_WHEEL_PLUS) != 0;
+    bool btn_minus = (flags & HORI_WHEEL_MINUS) != 0;
+    bool btn_lsb = (flags & HORI_WHEEL_LSB) != 0;
+    bool btn_rsb = (flags & HORI_WHEEL_RSB) != 0;
+    bool paddle_gear_down = (flags & HORI_WHEEL_PADDLE_DOWN) != 0;
+    bool paddle_gear_up = (flags & HORI_WHEEL_PADDLE_UP) != 0;
+    bool btn_home = (flags & HORI_WHEEL_HOME) != 0;
+    bool btn_a = (flags & HORI_WHEEL_A) != 0;
+    bool btn_b = (flags & HORI_WHEEL_B) != 0;
+    bool btn_x = (flags & HORI_WHEEL_X) != 0;
+    bool btn_y = (flags & HORI_WHEEL_Y) != 0;
 
     // ZL and ZR buttons share the same axis as the pedals (intentional hardware design)
     // When byte 4 or 5 = 0xFF, it could be either the pedal at 100% OR the button pressed
     // Games expect one input source (analog pedals OR digital buttons), not both
-    // This design provides digital fallback controls when pedals aren't connected
-    bool btn_zl = (brake == 0xFF);
-    bool btn_zr = (accel == 0xFF);
+    bool btn_zl = (flags & HORI_WHEEL_ZL) != 0;
+    bool btn_zr = (flags & HORI_WHEEL_ZR) != 0;
 
     // Log parsed values (can be disabled in production)
     static uint32_t logCounter = 0;
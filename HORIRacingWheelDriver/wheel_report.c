@@ -0,0 +1,63 @@
+// HORI Racing Wheel - portable report decoder (see wheel_report.h)
+
+#include "wheel_report.h"
+
+// D-pad bits (0x01=Up, 0x02=Down, 0x04=Left, 0x08=Right) -> hat switch 0-7,
+// 8 = neutral. Opposing or three-way combinations are neutral.
+static const uint8_t kDpadFromBits[16] = {
+    8, 0, 4, 8, 6, 7, 5, 8, 2, 1, 3, 8, 8, 8, 8, 8
+};
+
+int hori_wheel_parse(const uint8_t *report, size_t length, hori_wheel_state *out)
+{
+    if (length < HORI_WHEEL_MIN_REPORT) {
+        return 0;
+    }
+
+    uint8_t b2 = report[2];
+    uint8_t b3 = report[3];
+
+    out->byte0 = report[0];
+    out->byte1 = report[1];
+    out->byte2 = b2;
+    out->byte3 = b3;
+    out->buttons = (uint16_t)(report[0] | (report[1] << 8));
+    out->dpad_bits = b2 & 0x0F;
+    out->dpad = kDpadFromBits[b2 & 0x0F];
+    out->brake = report[4];
+    out->accel = report[5];
+
+    uint16_t steering16 = (uint16_t)(report[6] | (report[7] << 8));
+    out->steering16 = steering16;
+    // Spelled out rather than cast: out-of-range conversion to int16_t is
+    // implementation-defined before C23
+    out->steering_signed = steering16 < 0x8000 ? (int16_t)steering16
+                                               : (int16_t)((int32_t)steering16 - 0x10000);
+
+    // Byte 2 upper nibble -> bits 0-3; byte 3 bits 0-2 -> 4-6, bits 4-7 -> 7-10
+    uint16_t flags = (uint16_t)(b2 >> 4);
+    flags |= (uint16_t)((b3 & 0x07) << 4);
+    flags |= (uint16_t)((b3 >> 4) << 7);
+    // ZL/ZR overlay the pedal axes at full scale
+    if (report[4] == 0xFF) flags |= HORI_WHEEL_ZL;
+    if (report[5] == 0xFF) flags |= HORI_WHEEL_ZR;
+    out->flags = flags;
+    return 1;
+}
+
+size_t hori_wheel_parse_batch(const uint8_t *reports, size_t count, size_t stride,
+                              hori_wheel_state *out)
+{
+    if (stride < HORI_WHEEL_MIN_REPORT) {
+        return 0;
+    }
+    for (size_t i = 0; i < count; i++) {
+        hori_wheel_parse(reports + i * stride, stride, &out[i]);
+    }
+    return count;
+}
+
+int hori_wheel_abi_version(void)
+{
+    return HORI_WHEEL_ABI_VERSION;
+}
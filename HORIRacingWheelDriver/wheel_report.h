@@ -0,0 +1,79 @@
+// HORI Racing Wheel - portable report decoder
+//
+// The one implementation of the input report layout (see
+// DISCOVERED_MAPPING.md), shared by the DriverKit driver and the Python
+// tools (wheel_report_c.py loads it through ctypes). Plain C99 with no
+// dependencies beyond <stdint.h>/<stddef.h>, so it builds unchanged in the
+// dext and as a shared library on macOS or Linux.
+//
+// parse_report() in wheel_state.py remains the Python reference; the two
+// are differentially fuzzed with `python3 wheel_report_c.py fuzz`.
+
+#ifndef HORI_WHEEL_REPORT_H
+#define HORI_WHEEL_REPORT_H
+
+#include <stddef.h>
+#include <stdint.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+// Reports shorter than this can't be decoded
+#define HORI_WHEEL_MIN_REPORT 8
+
+// Bump when the layout of hori_wheel_state changes (checked by the binding)
+#define HORI_WHEEL_ABI_VERSION 1
+
+// Hat switch value for "no direction"
+#define HORI_WHEEL_DPAD_NEUTRAL 8
+
+// Bits of hori_wheel_state.flags, one per digital control
+enum {
+    HORI_WHEEL_PLUS        = 1u << 0,   // byte 2 bit 4
+    HORI_WHEEL_MINUS       = 1u << 1,   // byte 2 bit 5
+    HORI_WHEEL_LSB         = 1u << 2,   // byte 2 bit 6
+    HORI_WHEEL_RSB         = 1u << 3,   // byte 2 bit 7
+    HORI_WHEEL_PADDLE_DOWN = 1u << 4,   // byte 3 bit 0
+    HORI_WHEEL_PADDLE_UP   = 1u << 5,   // byte 3 bit 1
+    HORI_WHEEL_HOME        = 1u << 6,   // byte 3 bit 2
+    HORI_WHEEL_A           = 1u << 7,   // byte 3 bit 4
+    HORI_WHEEL_B           = 1u << 8,   // byte 3 bit 5
+    HORI_WHEEL_X           = 1u << 9,   // byte 3 bit 6
+    HORI_WHEEL_Y           = 1u << 10,  // byte 3 bit 7
+    HORI_WHEEL_ZL          = 1u << 11,  // brake == 0xFF (shares the pedal axis)
+    HORI_WHEEL_ZR          = 1u << 12,  // accel == 0xFF (shares the pedal axis)
+};
+
+// Decoded report. Fixed-width fields only, 16 bytes, no padding.
+typedef struct {
+    uint8_t  byte0;
+    uint8_t  byte1;
+    uint8_t  byte2;
+    uint8_t  byte3;
+    uint16_t buttons;          // byte0 | byte1 << 8 (positions not yet mapped)
+    uint8_t  dpad_bits;        // byte 2 low nibble: 0x01 Up, 0x02 Down, 0x04 Left, 0x08 Right
+    uint8_t  dpad;             // hat switch 0-7 clockwise from Up, 8 = neutral
+    uint8_t  brake;            // byte 4
+    uint8_t  accel;            // byte 5
+    uint16_t steering16;       // bytes 6-7 little-endian, 0x0000 = center
+    int16_t  steering_signed;  // steering16 as two's complement, right positive
+    uint16_t flags;            // HORI_WHEEL_* bits
+} hori_wheel_state;
+
+// Decode one report. Returns 1 on success, 0 if it is too short (out untouched).
+int hori_wheel_parse(const uint8_t *report, size_t length, hori_wheel_state *out);
+
+// Decode `count` reports spaced `stride` bytes apart (stride >= 8) into
+// out[0..count). Returns the number decoded.
+size_t hori_wheel_parse_batch(const uint8_t *reports, size_t count, size_t stride,
+                              hori_wheel_state *out);
+
+// HORI_WHEEL_ABI_VERSION of the compiled library
+int hori_wheel_abi_version(void);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif // HORI_WHEEL_REPORT_H
@@ -50,3 +50,13 @@ print()
 print("Feature Report (Output):")
 print("  8 bytes for vendor-specific feature 0x2621")
 print()
+print("=" * 70)
+print("Layout Decoded From Descriptor (hid_descriptor.py):")
+print("=" * 70)
+print()
+
+from hid_descriptor import format_layout, parse_descriptor
+
+for line in format_layout(parse_descriptor(descriptor)):
+    print(f"  {line}")
+print()
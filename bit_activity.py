@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Bit Activity Heatmap
+
+Counts how often every bit of the 64-byte report toggles, so a control that
+flips a bit for a few milliseconds still shows up on a display that redraws
+ten times a second. Reports are buffered into batches; each batch is
+XORed against the report before it and the toggles of all 512 bits are
+counted at once with np.unpackbits, so every report is counted, not just
+the ones that coincide with a redraw.
+
+Counts decay exponentially with a time constant of `window` seconds (a
+sliding window without storing reports); totals since the start are kept
+too. render_heatmap() draws the decayed map as two 32-byte columns.
+
+Used by map_controls.py (menu entry or --heatmap).
+
+Usage:
+    python3 bit_activity.py bench [--reports N]
+"""
+
+import math
+import sys
+import time
+import argparse
+
+from report_source import REPORT_SIZE
+from wheel_state import require
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Reports per vectorized batch (flushed early on every redraw)
+BATCH = 256
+
+# Shades for the decayed toggle rate: never, not recently, then by toggles/s
+SHADES = ((0.0, '·'), (0.05, '░'), (1.0, '▒'), (10.0, '▓'), (100.0, '█'))
+
+class BitActivity:
+    """Per-bit toggle counts over a decaying window, fed one report at a time.
+
+    Needs numpy (raises ImportError without it).
+    """
+
+    def __init__(self, window=2.0, report_size=REPORT_SIZE, batch=BATCH, clock=time.monotonic):
+        require(np, 'numpy')
+        self.window = window
+        self.report_size = report_size
+        self.clock = clock
+        # Row 0 holds the last report of the previous batch. Reports are
+        # copied in with bytearray slice assignment (no NumPy call per
+        # report); _rows is an array view of the same memory
+        self._buffer = bytearray((batch + 1) * report_size)
+        self._rows = np.frombuffer(self._buffer, dtype=np.uint8).reshape(batch + 1, report_size)
+        self._last_row = batch
+        self._count = 0
+        self._primed = False
+        self.activity = np.zeros(report_size * 8, dtype=np.float64)   # [byte * 8 + bit]
+        self.totals = np.zeros(report_size * 8, dtype=np.int64)
+        self.reports = 0
+        self._last_flush = clock()
+
+    @property
+    def current(self):
+        """The most recent report (zeros before the first)."""
+        return self._rows[self._count]
+
+    def add(self, report):
+        """Count one report's bit flips against the previous report."""
+        size = self.report_size
+        if not self._primed:
+            # Nothing to compare the first report against
+            start = 0
+            self._primed = True
+        else:
+            self._count += 1
+            start = self._count * size
+        n = len(report)
+        if n >= size:
+            self._buffer[start:start + size] = report[:size]
+        else:
+            self._buffer[start:start + size] = bytes(report) + bytes(size - n)
+        self.reports += 1
+        if self._count == self._last_row:
+            self.flush()
+
+    def flush(self, now=None):
+        """Fold the buffered reports into the counts and apply the decay."""
+        now = self.clock() if now is None else now
+        decay = math.exp(-(now - self._last_flush) / self.window) if self.window > 0 else 0.0
+        self._last_flush = now
+        self.activity *= decay
+        count = self._count
+        if not count:
+            return
+        rows = self._rows[:count + 1]
+        flips = np.bitwise_xor(rows[1:], rows[:-1])
+        toggles = np.unpackbits(flips, axis=1, bitorder='little').sum(axis=0, dtype=np.int64)
+        self.activity += toggles
+        self.totals += toggles
+        self._rows[0] = self._rows[count]
+        self._count = 0
+
+    def rates(self):
+        """Decayed toggles per second for each bit, shape (report_size, 8)."""
+        return (self.activity / self.window if self.window > 0 else self.activity).reshape(-1, 8)
+
+    def hottest(self, limit=5):
+        """[(byte, bit, toggles/s)] for the most active bits."""
+        rates = self.rates().ravel()
+        order = np.argsort(rates)[::-1][:limit]
+        return [(int(i) // 8, int(i) % 8, float(rates[i])) for i in order if rates[i] > 0]
+
+def _shade(rate, seen):
+    if not seen:
+        return ' '
+    char = SHADES[0][1]
+    for threshold, shade in SHADES[1:]:
+        if rate >= threshold:
+            char = shade
+    return char
+
+def render_heatmap(activity, colors=None, title="BIT ACTIVITY HEATMAP"):
+    """The decayed map as lines of text: bytes 0-31 and 32-63 side by side."""
+    rates = activity.rates()
+    totals = activity.totals.reshape(-1, 8)
+    current = activity.current
+    reset = colors.RESET if colors else ''
+    hot = colors.GREEN if colors else ''
+    warm = colors.YELLOW if colors else ''
+    half = (activity.report_size + 1) // 2
+    lines = [title,
+             f"{activity.reports} reports, window {activity.window:g} s   "
+             f"shades: ' ' never  · earlier  ░ <1/s  ▒ 1-10/s  ▓ 10-100/s  █ >100/s",
+             "",
+             f"{'Byte Hex  76543210':24s}{'Byte Hex  76543210'}"]
+
+    def cell(byte):
+        shades = ''.join(_shade(rates[byte, bit], totals[byte, bit]) for bit in range(7, -1, -1))
+        peak = rates[byte].max()
+        color = hot if peak >= 10 else warm if peak > 0.05 else ''
+        return f"{color}{byte:4d}  {current[byte]:02X}  {shades}{reset if color else ''}"
+
+    for row in range(half):
+        left = cell(row)
+        right = cell(row + half) if row + half < activity.report_size else ''
+        lines.append(f"{left}      {right}")
+    hottest = activity.hottest()
+    if hottest:
+        lines.append("")
+        lines.append("Most active: " + ", ".join(f"byte {b} bit {i} ({r:.1f}/s)" for b, i, r in hottest))
+    return lines
+
+def _reference_toggles(reports):
+    """Per-bit toggle counts from a plain Python loop (bench check)."""
+    totals = [0] * (REPORT_SIZE * 8)
+    previous = None
+    for report in reports:
+        if previous is not None:
+            for i in range(REPORT_SIZE):
+                flips = report[i] ^ previous[i]
+                while flips:
+                    low = flips & -flips
+                    totals[i * 8 + low.bit_length() - 1] += 1
+                    flips ^= low
+        previous = report
+    return totals
+
+def run_benchmark(reports=200000):
+    """Per-report cost of BitActivity against a Python XOR loop, and a redraw."""
+    from synth_wheel import SyntheticWheel
+
+    require(np, 'numpy')
+    stream = [report for report, _ in SyntheticWheel(1000, noise=8).generate(reports)]
+    activity = BitActivity(window=2.0)
+    start = time.perf_counter_ns()
+    for report in stream:
+        activity.add(report)
+    activity.flush()
+    vector = (time.perf_counter_ns() - start) / reports
+
+    sample = stream[:min(reports, 20000)]
+    start = time.perf_counter_ns()
+    reference = _reference_toggles(sample)
+    loop = (time.perf_counter_ns() - start) / len(sample)
+
+    check = BitActivity(window=2.0)
+    for report in sample:
+        check.add(report)
+    check.flush()
+    same = check.totals.tolist() == reference
+
+    start = time.perf_counter_ns()
+    lines = render_heatmap(activity)
+    render = (time.perf_counter_ns() - start) / 1e6
+
+    print(f"BitActivity.add():  {vector:8.0f} ns/report  ({reports} reports, batch {BATCH})")
+    print(f"Python XOR loop:    {loop:8.0f} ns/report  ({len(sample)} reports)")
+    print(f"Toggle counts vs loop: {'match' if same else 'MISMATCH'}")
+    print(f"render_heatmap():   {render:8.2f} ms/frame ({len(lines)} lines)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Bit activity heatmap")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('bench', help='per-report cost against a Python loop')
+    p.add_argument('--reports', type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        try:
+            run_benchmark(args.reports)
+        except ImportError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Streaming Auto-Calibration
+
+draw_ui() assumes the steering rests at exactly 0x0000 and the pedals span
+exactly 0-255. Real wheels drift, so the calibrator keeps estimating, from
+the live report stream and in bounded memory:
+
+    steering rest position  - P2 median of the samples taken while the wheel
+                              sits still near center
+    steering noise floor    - P2 95th percentile of |x - rest| at rest
+    pedal rest / full travel and noise floor
+                            - decaying 256-bin histograms (the pedals are
+                              8-bit, so the quantiles are exact)
+
+Accelerator samples are only counted while the brake is released, so the
+documented brake cross-talk (0-86 on byte 5) isn't mistaken for a drifting
+accelerator rest.
+
+Every observation is O(1). A background thread turns the estimates into
+lookup tables (steering16 -> signed, pedal byte -> pedal byte), and
+CalibratedState applies them in the decode path with three indexed loads.
+The tables leave 0xFF alone on the pedals, so ZL/ZR still read as buttons.
+
+Usage:
+    python3 test_wheel.py --auto-calibrate
+    python3 calibration.py bench [--reports N]
+"""
+
+import array
+import random
+import threading
+import time
+import argparse
+from collections import namedtuple
+
+from wheel_state import WheelState
+
+# Current estimates; NOMINAL is what the tools assumed before (identity tables)
+Calibration = namedtuple('Calibration', 'steering_center steering_noise brake_rest brake_noise '
+                                        'brake_full accel_rest accel_noise accel_full')
+NOMINAL = Calibration(0, 0, 0, 0, 0xFE, 0, 0, 0xFE)
+
+# The wheel counts as resting when it is this close to the current center...
+REST_WINDOW = 0x1000
+# ...and has stayed within REST_DELTA of one position for REST_RUN reports
+REST_DELTA = 64
+REST_RUN = 50
+# Pedal samples this far above the low edge belong to the rest cluster
+PEDAL_REST_WINDOW = 10
+# Pedal ranges narrower than this are not trusted
+MIN_PEDAL_SPAN = 64
+# Observations needed before an estimate replaces the nominal value
+MIN_SAMPLES = 200
+
+class P2Quantile:
+    """Jain & Chlamtac P2 estimate of one quantile: five markers, O(1) per sample."""
+
+    __slots__ = ('p', 'count', 'heights', 'positions', 'desired', 'increments')
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        desired = self.desired
+        increments = self.increments
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            desired[i] += increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, falling back to linear
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def value(self):
+        """Current estimate (None before the first sample)."""
+        if not self.count:
+            return None
+        if self.count <= 5:
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+class DriftingQuantile:
+    """P2 over windows of `window` samples, folded into a smoothed estimate.
+
+    A single P2 sketch converges on the quantile of everything it has ever
+    seen; restarting it every window and blending each window's result in
+    lets the estimate follow slow drift without keeping any samples.
+    """
+
+    __slots__ = ('p', 'window', 'smoothing', 'sketch', 'estimate')
+
+    def __init__(self, p, window=2000, smoothing=0.5):
+        self.p = p
+        self.window = window
+        self.smoothing = smoothing
+        self.sketch = P2Quantile(p)
+        self.estimate = None
+
+    def add(self, x):
+        sketch = self.sketch
+        sketch.add(x)
+        if sketch.count >= self.window:
+            value = sketch.value()
+            if self.estimate is None:
+                self.estimate = value
+            else:
+                self.estimate += self.smoothing * (value - self.estimate)
+            self.sketch = P2Quantile(self.p)
+
+    def value(self):
+        """Smoothed estimate, or the running window's once it has MIN_SAMPLES."""
+        if self.estimate is not None:
+            return self.estimate
+        if self.sketch.count >= MIN_SAMPLES:
+            return self.sketch.value()
+        return None
+
+def _histogram_quantile(hist, p, lo=0, hi=255):
+    """Value at quantile p of hist[lo:hi], or None if that range is empty."""
+    total = sum(hist[lo:hi])
+    if not total:
+        return None
+    target = p * total
+    seen = 0
+    for value in range(lo, hi):
+        seen += hist[value]
+        if seen >= target:
+            return value
+    return hi - 1
+
+def _pedal_estimate(hist, nominal_rest, nominal_noise, nominal_full):
+    """(rest, noise, full) from a pedal histogram; 0xFF (ZL/ZR) is ignored."""
+    if sum(hist[:255]) < MIN_SAMPLES:
+        return nominal_rest, nominal_noise, nominal_full
+
+    # Rest is the low edge (a pedal can't read below its stop); the noise
+    # floor is the spread of the cluster just above it
+    rest = _histogram_quantile(hist, 0.01)
+    noise = _histogram_quantile(hist, 0.95, rest, min(255, rest + PEDAL_REST_WINDOW)) - rest
+
+    # Full travel: near the top of the samples in the upper half of the range
+    full = nominal_full
+    middle = (rest + noise + 0xFE) // 2
+    if sum(hist[middle:255]) >= MIN_SAMPLES // 4:
+        full = _histogram_quantile(hist, 0.98, middle, 255)
+    if full - rest - noise < MIN_PEDAL_SPAN:
+        return nominal_rest, nominal_noise, nominal_full
+    return rest, noise, full
+
+def steering_table(center, deadband):
+    """steering16 -> calibrated signed steering, re-spanning both sides to full scale."""
+    right = 32767 / max(1, 32767 - center - deadband)
+    left = 32768 / max(1, 32768 + center - deadband)
+    table = array.array('h', bytes(2 * 65536))
+    for raw in range(65536):
+        offset = (raw if raw < 32768 else raw - 65536) - center
+        if offset > deadband:
+            table[raw] = min(32767, int(round((offset - deadband) * right)))
+        elif offset < -deadband:
+            table[raw] = max(-32768, int(round((offset + deadband) * left)))
+    return table
+
+def pedal_table(rest, noise, full):
+    """Pedal byte -> 0..0xFE from the dead zone to full travel; 0xFF passes through."""
+    start = rest + noise
+    scale = 0xFE / max(1, full - start)
+    table = array.array('B', bytes(256))
+    for raw in range(255):
+        table[raw] = max(0, min(0xFE, int(round((raw - start) * scale))))
+    table[255] = 0xFF
+    return table
+
+class AutoCalibrator:
+    """Streaming estimates of the wheel's rest positions, ranges and noise.
+
+    observe() runs on the read thread for every report received (the tools
+    hook it in as the ReportSource observer, ahead of duplicate suppression,
+    since the resting wheel is mostly duplicates); rebuild() (from the
+    background thread started by start(), or called directly) refreshes
+    `calibration` and swaps in new lookup `tables` when the estimates move.
+    `stride` thins the P2 updates on the steering rest samples.
+    """
+
+    def __init__(self, window=2000, history=20000, stride=4):
+        self.history = history
+        self.stride = max(1, stride)
+        self.calibration = NOMINAL
+        self.tables = (steering_table(0, 0), pedal_table(0, 0, 0xFE), pedal_table(0, 0, 0xFE))
+        self.observed = 0
+        self.rebuilds = 0
+        self._center = DriftingQuantile(0.5, window)
+        self._noise = DriftingQuantile(0.95, window)
+        self._brake = [0] * 256
+        self._accel = [0] * 256
+        self._anchor = 0
+        self._run = 0
+        self._rest_seen = 0
+        self._center_estimate = 0
+        self._brake_released = 0
+        # Set by rebuild(), applied by observe(): only the read thread writes
+        # the histograms, so no count is lost to a concurrent halving
+        self._age = False
+        self._thread = None
+        self._stop = threading.Event()
+
+    def observe(self, data):
+        """Fold one raw report's axes into the estimates (O(1))."""
+        if len(data) < 8:
+            return
+        self.observed += 1
+        steering = data[6] | (data[7] << 8)
+        if steering >= 32768:
+            steering -= 65536
+        if -REST_DELTA <= steering - self._anchor <= REST_DELTA:
+            self._run += 1
+            at_rest = self._run >= REST_RUN
+        else:
+            self._anchor = steering
+            self._run = 0
+            at_rest = False
+        if at_rest and -REST_WINDOW < steering - self._center_estimate < REST_WINDOW:
+            self._rest_seen += 1
+            if self._rest_seen % self.stride == 0:
+                self._center.add(steering)
+                live = self._center.value()
+                if live is not None:
+                    self._noise.add(abs(steering - live))
+
+        if self._age:
+            self._age = False
+            self._age_histograms()
+
+        brake = data[4]
+        self._brake[brake] += 1
+        if brake <= self._brake_released:
+            self._accel[data[5]] += 1
+
+    def estimate(self):
+        """Calibration from the current sketches (nominal where data is short)."""
+        center = self._center.value()
+        noise = self._noise.value()
+        brake = _pedal_estimate(self._brake, *NOMINAL[2:5])
+        accel = _pedal_estimate(self._accel, *NOMINAL[5:8])
+        return Calibration(int(round(center)) if center is not None else 0,
+                           int(round(noise)) if noise is not None else 0,
+                           *brake, *accel)
+
+    def _age_histograms(self):
+        """Halve the histograms that hold more than `history` samples (read thread)."""
+        for hist in (self._brake, self._accel):
+            if sum(hist) > self.history:
+                for i in range(256):
+                    hist[i] >>= 1
+
+    def rebuild(self):
+        """Refresh the estimates and, if they moved, the lookup tables. Returns True if so."""
+        # Age the histograms so old samples stop counting; the halving runs
+        # on the read thread at its next observe()
+        self._age = True
+
+        calibration = self.estimate()
+        self._brake_released = calibration.brake_rest + calibration.brake_noise
+        self._center_estimate = calibration.steering_center
+        if calibration == self.calibration:
+            return False
+        old = self.calibration
+        steering = self.tables[0]
+        if calibration[:2] != old[:2]:
+            steering = steering_table(calibration.steering_center, calibration.steering_noise)
+        # One tuple assignment, so readers always see a consistent set
+        self.tables = (steering, pedal_table(*calibration[2:5]), pedal_table(*calibration[5:8]))
+        self.calibration = calibration
+        self.rebuilds += 1
+        return True
+
+    def start(self, interval=1.0):
+        """Rebuild every `interval` seconds from a daemon thread."""
+        def run():
+            while not self._stop.wait(interval):
+                self.rebuild()
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='calibration', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def summary(self):
+        """One line, e.g. 'center +312 (±6) | brake 12-230 (±2) | accel 10-228 (±3)'."""
+        c = self.calibration
+        return (f"center {c.steering_center:+d} (±{c.steering_noise}) | "
+                f"brake {c.brake_rest}-{c.brake_full} (±{c.brake_noise}) | "
+                f"accel {c.accel_rest}-{c.accel_full} (±{c.accel_noise})")
+
+class CalibratedState(WheelState):
+    """WheelState whose steering and pedals go through the calibrator's tables.
+
+    Decoding only looks the values up; feeding the calibrator is the
+    source's job (see state_from_args). The raw axes stay available as raw_steering16, raw_brake and raw_accel.
+    """
+
+    __slots__ = ('calibrator', 'raw_steering16', 'raw_brake', 'raw_accel')
+
+    def __init__(self, calibrator):
+        WheelState.__init__(self)
+        self.calibrator = calibrator
+        self.raw_steering16 = self.raw_brake = self.raw_accel = 0
+
+    def update(self, data):
+        if not WheelState.update(self, data):
+            return False
+        steering16 = self.raw_steering16 = self.steering16
+        brake = self.raw_brake = self.brake
+        accel = self.raw_accel = self.accel
+        steering_lut, brake_lut, accel_lut = self.calibrator.tables
+        steering = steering_lut[steering16]
+        self.steering_signed = steering
+        self.steering16 = steering & 0xFFFF
+        self.brake = brake_lut[brake]
+        self.accel = accel_lut[accel]
+        return True
+
+def add_calibration_arguments(parser):
+    """Add the --auto-calibrate option."""
+    parser.add_argument('--auto-calibrate', action='store_true',
+                        help='continuously estimate steering center and pedal ranges and '
+                             'correct the decoded values')
+
+def state_from_args(args, source):
+    """(state, calibrator): a CalibratedState fed from `source`, or a plain WheelState."""
+    if not getattr(args, 'auto_calibrate', False):
+        return WheelState(), None
+    calibrator = AutoCalibrator().start()
+    source.observer = calibrator.observe
+    return CalibratedState(calibrator), calibrator
+
+# Miscalibrated wheel for the benchmark: off-center steering, narrow pedals
+BENCH_WHEEL = Calibration(312, 6, 12, 2, 230, 9, 3, 221)
+
+def _miscalibrated(reports, wheel=BENCH_WHEEL, seed=0):
+    """Re-render ideal synthetic reports as a wheel with `wheel`'s offsets, ranges and noise."""
+    rng = random.Random(seed)
+    out = []
+    for report in reports:
+        report = bytearray(report)
+        steering = report[6] | (report[7] << 8)
+        steering = steering if steering < 32768 else steering - 65536
+        # The sensor still reaches both stops, so the offset squeezes each side
+        center = wheel.steering_center
+        scale = (32767 - center) / 32767 if steering >= 0 else (32768 + center) / 32768
+        steering = center + int(round(steering * scale))
+        steering += rng.randint(-wheel.steering_noise, wheel.steering_noise)
+        steering = max(-32768, min(32767, steering)) & 0xFFFF
+        report[6] = steering & 0xFF
+        report[7] = steering >> 8
+        for i, (rest, noise, full) in ((4, wheel[2:5]), (5, wheel[5:8])):
+            if report[i] != 0xFF:
+                value = rest + report[i] * (full - rest) // 0xFE + rng.randint(0, noise)
+                report[i] = max(0, min(0xFE, value))
+        out.append(bytes(report))
+    return out
+
+def _decode_cost(state, reports, observe=None):
+    update = state.update
+    start = time.perf_counter_ns()
+    if observe is None:
+        for report in reports:
+            update(report)
+    else:
+        for report in reports:
+            observe(report)
+            update(report)
+    return (time.perf_counter_ns() - start) / len(reports)
+
+def run_benchmark(reports=120000, rate=1000):
+    """Estimate accuracy on a miscalibrated synthetic wheel, and the decode-path overhead."""
+    from synth_wheel import SyntheticWheel
+
+    wheel = SyntheticWheel(rate=rate)
+    truths = []
+    ideal = []
+    for report, truth in wheel.generate(reports):
+        ideal.append(report)
+        truths.append(truth)
+    stream = _miscalibrated(ideal)
+
+    print("=" * 80)
+    print(f"Auto-calibration ({reports} reports at {rate} Hz, {reports / rate:.0f} s)")
+    print("=" * 80)
+
+    # Rebuild once per simulated second, as the background thread would
+    calibrator = AutoCalibrator()
+    state = CalibratedState(calibrator)
+    rebuild_ns = []
+    for i, report in enumerate(stream):
+        calibrator.observe(report)
+        state.update(report)
+        if i % rate == rate - 1:
+            start = time.perf_counter_ns()
+            if calibrator.rebuild():
+                rebuild_ns.append(time.perf_counter_ns() - start)
+
+    print(f"{'':16s} {'injected':>10s} {'estimated':>10s}")
+    for field, injected, estimated in zip(Calibration._fields, BENCH_WHEEL, calibrator.calibration):
+        print(f"  {field:14s} {injected:10d} {estimated:10d}")
+    print()
+
+    # Error against the ground truth over the last pass, raw vs calibrated
+    plain = WheelState()
+    errors = {'raw': [0, 0, 0], 'calibrated': [0, 0, 0]}
+    tail = range(reports - min(reports, 10 * rate), reports)
+    for i in tail:
+        truth = truths[i]
+        plain.update(stream[i])
+        calibrator.observe(stream[i])
+        state.update(stream[i])
+        for name, s in (('raw', plain), ('calibrated', state)):
+            e = errors[name]
+            e[0] += abs(s.steering_signed - truth.steering)
+            if not truth.zl:
+                e[1] += abs(s.brake - truth.brake)
+            if not truth.zr:
+                e[2] += abs(s.accel - min(0xFE, truth.accel + wheel._crosstalk[truth.brake]))
+    print(f"Mean absolute error vs ground truth (last {len(tail)} reports):")
+    print(f"  {'':12s} {'steering':>10s} {'brake':>8s} {'accel':>8s}")
+    for name, (steering, brake, accel) in errors.items():
+        n = len(tail)
+        print(f"  {name:12s} {steering / n:10.1f} {brake / n:8.2f} {accel / n:8.2f}")
+    print()
+
+    # Decode-path cost, interleaved so machine noise hits both alike
+    sample = stream[:20000]
+    paths = (('WheelState.update', lambda: _decode_cost(WheelState(), sample)),
+             ('CalibratedState.update', lambda: _decode_cost(CalibratedState(calibrator), sample)),
+             ('  + observe()', lambda: _decode_cost(CalibratedState(calibrator), sample,
+                                                    calibrator.observe)))
+    best = {name: float('inf') for name, _ in paths}
+    for _ in range(5):
+        for name, run in paths:
+            best[name] = min(best[name], run())
+    print("Per report (best of 5):")
+    baseline = best['WheelState.update']
+    for name, ns in best.items():
+        print(f"  {name:28s} {ns:7.0f} ns/report  ({ns - baseline:+.0f} ns)")
+    if rebuild_ns:
+        print(f"  {'rebuild (background)':28s} {min(rebuild_ns) / 1e6:7.1f} - "
+              f"{max(rebuild_ns) / 1e6:.1f} ms, {len(rebuild_ns)} of {reports // rate} rebuilds "
+              f"changed the tables")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel streaming auto-calibration")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('bench', help='estimate accuracy and decode overhead on a synthetic wheel')
+    p.add_argument('--reports', type=int, default=120000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(args.reports)
+
+if __name__ == "__main__":
+    main()
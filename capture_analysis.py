@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Sharded Capture Analysis
+
+Offline statistics over (multi-hour) capture files, split into time-aligned
+chunks and processed in a ProcessPoolExecutor. Workers mmap the capture
+themselves and receive only (path, first record, end record), so no report
+data is pickled; each returns a small Partial that merges associatively:
+
+    - per-byte value histograms (min/max and value sets derive from these)
+    - per-byte change counts and per-bit 0->1 transition counts
+    - signed steering min/max/sum
+
+Merging two adjacent partials also counts the transitions across their
+boundary, so any chunking gives the same totals as one pass.
+
+Within a chunk, each byte position is handled as a column sliced out of the
+records with a stride, so the per-report work runs in C (Counter, big-int
+XOR and bit counts) instead of a Python loop over 64 bytes.
+
+Usage:
+    python3 capture_analysis.py analyze capture.hcap [--workers N] [--chunk-seconds S] [--timeline]
+    python3 capture_analysis.py bench [--reports N]
+"""
+
+import array
+import bisect
+import mmap
+import os
+import sys
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import add
+
+from capture_file import HEADER, RECORD_HEADER, RECORD_SIZE, CaptureFormatError, CaptureReader
+from report_source import REPORT_SIZE
+
+# Records analyzed per column pass inside a worker (~5.5 MB of input)
+BLOCK_RECORDS = 1 << 16
+
+# Names for the bits of bytes 2 and 3 (see DISCOVERED_MAPPING.md)
+BUTTON_BITS = {
+    (2, 0): 'D-Pad Up', (2, 1): 'D-Pad Down', (2, 2): 'D-Pad Left', (2, 3): 'D-Pad Right',
+    (2, 4): 'Plus', (2, 5): 'Minus', (2, 6): 'LSB', (2, 7): 'RSB',
+    (3, 0): 'Paddle Down', (3, 1): 'Paddle Up', (3, 2): 'Home', (3, 3): 'Byte 3 bit 3',
+    (3, 4): 'A', (3, 5): 'B', (3, 6): 'X', (3, 7): 'Y',
+}
+
+def classify_byte(values, value_range, max_values=16, max_range=15):
+    """Classify a byte from its distinct values: BUTTON/BIT, MULTI-BIT or ANALOG.
+
+    A byte is MULTI-BIT with at most `max_values` distinct values spanning at
+    most `max_range`.
+    """
+    if len(values) == 2 and set(values).issubset({0, 1}):
+        return "BUTTON/BIT"
+    if len(values) <= max_values and value_range <= max_range:
+        return "MULTI-BIT"
+    return "ANALOG"
+
+class Partial:
+    """Statistics over a contiguous run of records; merge() is associative."""
+
+    __slots__ = ('count', 'first_ns', 'last_ns', 'hist', 'changes', 'rises',
+                 'steering_min', 'steering_max', 'steering_sum', 'first', 'last')
+
+    def __init__(self):
+        self.count = 0
+        self.first_ns = self.last_ns = 0
+        self.hist = array.array('q', bytes(8 * REPORT_SIZE * 256))   # [byte * 256 + value]
+        self.changes = array.array('q', bytes(8 * REPORT_SIZE))      # [byte]
+        self.rises = array.array('q', bytes(8 * REPORT_SIZE * 8))    # [byte * 8 + bit]
+        self.steering_min = 32767
+        self.steering_max = -32768
+        self.steering_sum = 0
+        self.first = self.last = b''
+
+    def merge(self, other):
+        """Combine with the partial for the records immediately after these."""
+        if not self.count:
+            return other
+        if not other.count:
+            return self
+        merged = Partial()
+        merged.count = self.count + other.count
+        merged.first_ns, merged.last_ns = self.first_ns, other.last_ns
+        merged.first, merged.last = self.first, other.last
+        merged.hist = array.array('q', map(add, self.hist, other.hist))
+        merged.changes = array.array('q', map(add, self.changes, other.changes))
+        merged.rises = array.array('q', map(add, self.rises, other.rises))
+        merged.steering_min = min(self.steering_min, other.steering_min)
+        merged.steering_max = max(self.steering_max, other.steering_max)
+        merged.steering_sum = self.steering_sum + other.steering_sum
+
+        # The one transition between the two runs
+        for i, (prev, cur) in enumerate(zip(self.last, other.first)):
+            if prev != cur:
+                merged.changes[i] += 1
+                rose = ~prev & cur
+                for bit in range(8):
+                    if rose >> bit & 1:
+                        merged.rises[i * 8 + bit] += 1
+        return merged
+
+    def values(self, byte):
+        """Distinct values seen at a byte position."""
+        base = byte * 256
+        return [v for v in range(256) if self.hist[base + v]]
+
+    def mean(self, byte):
+        base = byte * 256
+        total = sum(v * self.hist[base + v] for v in range(256))
+        return total / self.count if self.count else 0.0
+
+def _column_stats(partial, i, column):
+    """Fold one byte column into the histogram and transition counts."""
+    hist = partial.hist
+    base = i * 256
+    first = column[0]
+    if column.count(first) == len(column):
+        hist[base + first] += len(column)   # constant column: the common case
+        return
+    for value, count in Counter(column).items():
+        hist[base + value] += count
+
+    # Transitions, one big-int operation per column: a = previous, b = current
+    n = len(column) - 1
+    a = int.from_bytes(column[:-1], 'little')
+    b = int.from_bytes(column[1:], 'little')
+    diff = (a ^ b).to_bytes(n, 'little')
+    partial.changes[i] += n - diff.count(0)
+    rose = (a ^ ((1 << (8 * n)) - 1)) & b
+    if rose:
+        ones = int.from_bytes(b'\x01' * n, 'little')
+        for bit in range(8):
+            partial.rises[i * 8 + bit] += ((rose >> bit) & ones).bit_count()
+
+def analyze_block(buf):
+    """Partial for a buffer of whole records."""
+    partial = Partial()
+    count = len(buf) // RECORD_SIZE
+    if not count:
+        return partial
+    header = RECORD_HEADER.size
+    partial.count = count
+    partial.first_ns = RECORD_HEADER.unpack_from(buf, 0)[0]
+    partial.last_ns = RECORD_HEADER.unpack_from(buf, (count - 1) * RECORD_SIZE)[0]
+    partial.first = bytes(buf[header:header + REPORT_SIZE])
+    partial.last = bytes(buf[(count - 1) * RECORD_SIZE + header:count * RECORD_SIZE])
+
+    columns = []
+    for i in range(REPORT_SIZE):
+        column = buf[header + i::RECORD_SIZE]
+        columns.append(column)
+        _column_stats(partial, i, column)
+
+    # Steering: interleave bytes 6/7 into native int16s
+    pairs = bytearray(2 * count)
+    pairs[0::2] = columns[6]
+    pairs[1::2] = columns[7]
+    steering = array.array('h', pairs)
+    if sys.byteorder == 'big':
+        steering.byteswap()
+    partial.steering_min = min(steering)
+    partial.steering_max = max(steering)
+    partial.steering_sum = sum(steering)
+    return partial
+
+def _open(path):
+    f = open(path, 'rb')
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:   # empty file
+        f.close()
+        raise
+
+def analyze_range(path, start, stop):
+    """Partial for records [start, stop) of a capture (runs in the workers)."""
+    f, mm = _open(path)
+    try:
+        result = Partial()
+        for block in range(start, stop, BLOCK_RECORDS):
+            end = min(stop, block + BLOCK_RECORDS)
+            offset = HEADER.size + block * RECORD_SIZE
+            result = result.merge(analyze_block(mm[offset:offset + (end - block) * RECORD_SIZE]))
+        return result
+    finally:
+        mm.close()
+        f.close()
+
+class _Timestamps:
+    """Sequence view of record host timestamps, for bisect."""
+
+    def __init__(self, mm, count):
+        self.mm = mm
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return RECORD_HEADER.unpack_from(self.mm, HEADER.size + i * RECORD_SIZE)[0]
+
+def plan_chunks(path, chunk_seconds=60.0):
+    """Split a capture into [start, stop) record ranges on chunk_seconds boundaries."""
+    count = len(CaptureReader(path))
+    if not count:
+        return []
+    f, mm = _open(path)
+    try:
+        times = _Timestamps(mm, count)
+        first, last = times[0], times[count - 1]
+        step = max(1, int(chunk_seconds * 1e9))
+        bounds = [0]
+        t = first + step
+        while t <= last:
+            index = bisect.bisect_left(times, t, bounds[-1])
+            if index > bounds[-1]:
+                bounds.append(index)
+            t += step
+        bounds.append(count)
+    finally:
+        mm.close()
+        f.close()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def analyze_capture(path, workers=None, chunk_seconds=60.0):
+    """Analyze a capture; returns (total Partial, per-chunk Partials in time order).
+
+    workers=0 runs in this process, otherwise a pool of `workers` processes
+    (default: one per CPU).
+    """
+    chunks = plan_chunks(path, chunk_seconds)
+    starts = [start for start, _ in chunks]
+    stops = [stop for _, stop in chunks]
+    if workers == 0:
+        partials = [analyze_range(path, start, stop) for start, stop in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(analyze_range, repeat(path), starts, stops))
+
+    total = Partial()
+    for partial in partials:
+        total = total.merge(partial)
+    return total, partials
+
+def print_analysis(total, chunks=None):
+    """Byte classification and decoded-state statistics."""
+    if not total.count:
+        print("No reports")
+        return
+    duration = (total.last_ns - total.first_ns) / 1e9
+    print(f"Reports:  {total.count}  ({duration:.1f} s)")
+    print()
+    print("Changing bytes:")
+    for i in range(REPORT_SIZE):
+        values = total.values(i)
+        if len(values) < 2:
+            continue
+        kind = classify_byte(values, values[-1] - values[0])
+        print(f"  Byte {i:2d}: {kind:10s} range 0x{values[0]:02X}-0x{values[-1]:02X}  "
+              f"{len(values):3d} values  {total.changes[i]:9d} changes")
+    print()
+    print("Decoded state:")
+    print(f"  Steering: {total.steering_min:+6d} .. {total.steering_max:+6d}  "
+          f"mean {total.steering_sum / total.count:+9.1f}")
+    print(f"  Brake:    mean {total.mean(4):6.1f}   ZL held in {total.hist[4 * 256 + 255]} reports")
+    print(f"  Accel:    mean {total.mean(5):6.1f}   ZR held in {total.hist[5 * 256 + 255]} reports")
+    presses = [(name, total.rises[byte * 8 + bit]) for (byte, bit), name in BUTTON_BITS.items()]
+    print("  Presses:  " + ", ".join(f"{name} {count}" for name, count in presses if count))
+
+    if chunks:
+        print()
+        print("Timeline:")
+        for partial in chunks:
+            if not partial.count:
+                continue
+            start = (partial.first_ns - total.first_ns) / 1e9
+            print(f"  {start:9.1f} s  {partial.count:8d} reports  steering "
+                  f"{partial.steering_min:+6d}..{partial.steering_max:+6d}  "
+                  f"changes {sum(partial.changes):8d}")
+
+def _same(a, b):
+    return (a.count == b.count and a.hist == b.hist and a.changes == b.changes
+            and a.rises == b.rises and a.steering_sum == b.steering_sum)
+
+def run_benchmark(reports=2000000, chunk_seconds=60.0):
+    """Scaling at 1/2/4/8 workers against a single in-process pass."""
+    from synth_wheel import write_long_capture
+
+    path = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'capture-analysis-bench.hcap')
+    print(f"Writing {reports} synthetic reports ({reports / 3.6e6:.1f} h at 1 kHz)...")
+    write_long_capture(path, reports)
+    try:
+        print("=" * 80)
+        print(f"Sharded analysis ({reports} reports, {chunk_seconds:g} s chunks, "
+              f"{os.cpu_count()} CPUs)")
+        print("=" * 80)
+        start = time.perf_counter()
+        reference, _ = analyze_capture(path, workers=0, chunk_seconds=chunk_seconds)
+        base = time.perf_counter() - start
+        print(f"  {'in-process':12s} {base:7.2f} s  {reports / base:12,.0f} reports/s")
+        for workers in (1, 2, 4, 8):
+            start = time.perf_counter()
+            total, _ = analyze_capture(path, workers=workers, chunk_seconds=chunk_seconds)
+            elapsed = time.perf_counter() - start
+            same = _same(total, reference)
+            print(f"  {workers:2d} workers   {elapsed:7.2f} s  {reports / elapsed:12,.0f} reports/s  "
+                  f"speedup {base / elapsed:4.2f}x  {'matches' if same else 'MISMATCH'}")
+
+        # Chunking must not change the result: compare against one chunk
+        whole = analyze_range(path, 0, reports)
+        print()
+        print(f"  Merge check vs single pass: {'identical' if _same(whole, reference) else 'MISMATCH'}")
+    finally:
+        os.remove(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Sharded Capture Analysis")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('analyze', help='statistics for a capture file')
+    p.add_argument('path')
+    p.add_argument('--workers', type=int, default=None,
+                   help='worker processes (default: one per CPU, 0 = in-process)')
+    p.add_argument('--chunk-seconds', type=float, default=60.0,
+                   help='time span of each chunk (default: 60)')
+    p.add_argument('--timeline', action='store_true', help='also print per-chunk statistics')
+    p = sub.add_parser('bench', help='scaling benchmark at 1/2/4/8 workers')
+    p.add_argument('--reports', type=int, default=2000000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(args.reports)
+        return
+
+    try:
+        total, chunks = analyze_capture(args.path, args.workers, args.chunk_seconds)
+    except (OSError, ValueError, CaptureFormatError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_analysis(total, chunks if args.timeline else None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Columnar Capture Export
+
+Converts capture files into typed columns for pandas/Polars/DuckDB, as
+Parquet (one row group per batch) or Arrow IPC (one record batch per
+batch). Records are read and decoded BATCH_ROWS at a time into a reused
+buffer, and each batch is written before the next is read, so memory stays
+flat however long the capture is.
+
+Columns:
+
+    host_ns     int64              host timestamp (monotonic clock, ns)
+    device_ns   int64              device timestamp (ns, 0 if unavailable)
+    steering    int16              bytes 6-7, right positive
+    accel       uint8              byte 5 (255 = full or ZR)
+    brake       uint8              byte 4 (255 = full or ZL)
+    buttons     uint16             byte 2 | byte 3 << 8 (bit layout in the
+                                   schema metadata; D-pad is bits 0-3)
+    hat         uint8              D-pad as a hat switch, 0-7 from Up clockwise, 8 = neutral
+    byte01      uint16             bytes 0-1 (not yet mapped)
+    vendor      fixed_size_binary  bytes 8-63, vendor data
+    length      uint8              report length (shorter reports are zero padded)
+
+Requires pyarrow (python3 -m pip install pyarrow) and numpy.
+
+Usage:
+    python3 capture_export.py export capture.hcap capture.parquet [--batch-rows N]
+    python3 capture_export.py export capture.hcap capture.arrow
+    python3 capture_export.py bench [--reports N]
+"""
+
+import json
+import os
+import sys
+import time
+import argparse
+
+from capture_analysis import BUTTON_BITS
+from capture_file import HEADER, RECORD_SIZE, CaptureFormatError, CaptureReader, record_dtype
+from report_source import REPORT_SIZE
+from wheel_state import DPAD_FROM_BITS, require
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# Records decoded and written per batch (one Parquet row group), ~5.8 MB read buffer
+BATCH_ROWS = 65536
+
+VENDOR_OFFSET = 8
+VENDOR_SIZE = REPORT_SIZE - VENDOR_OFFSET
+
+FORMATS = {'.parquet': 'parquet', '.pq': 'parquet',
+           '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+
+def _require_pyarrow():
+    require(np, 'numpy')
+    require(pa, 'pyarrow')
+
+def export_schema(source=None):
+    """The Arrow schema, with the button bit layout in its metadata."""
+    buttons = {str((byte - 2) * 8 + bit): name for (byte, bit), name in sorted(BUTTON_BITS.items())}
+    metadata = {'hori.buttons': json.dumps(buttons),
+                'hori.hat': 'D-pad hat switch: 0=Up, clockwise to 7=Up-Left, 8=neutral'}
+    if source:
+        metadata['hori.source'] = os.path.basename(source)
+    return pa.schema([('host_ns', pa.int64()), ('device_ns', pa.int64()),
+                      ('steering', pa.int16()), ('accel', pa.uint8()), ('brake', pa.uint8()),
+                      ('buttons', pa.uint16()), ('hat', pa.uint8()), ('byte01', pa.uint16()),
+                      ('vendor', pa.binary(VENDOR_SIZE)), ('length', pa.uint8())],
+                     metadata=metadata)
+
+_HAT = None
+
+def decode_batch(records, schema):
+    """A record array (capture record dtype) as a pyarrow.RecordBatch."""
+    global _HAT
+    if _HAT is None:
+        _HAT = np.array(DPAD_FROM_BITS, dtype=np.uint8)
+    report = records['report']
+    n = len(records)
+    vendor = np.ascontiguousarray(report[:, VENDOR_OFFSET:])
+    columns = [
+        records['host_ns'],
+        records['device_ns'],
+        report[:, 6:8].copy().view('<i2').ravel(),
+        report[:, 5],
+        report[:, 4],
+        report[:, 2:4].copy().view('<u2').ravel(),
+        _HAT[report[:, 2] & 0x0F],
+        report[:, 0:2].copy().view('<u2').ravel(),
+        pa.FixedSizeBinaryArray.from_buffers(pa.binary(VENDOR_SIZE), n,
+                                             [None, pa.py_buffer(vendor)]),
+        np.minimum(records['length'], 255).astype(np.uint8),
+    ]
+    arrays = [c if isinstance(c, pa.Array) else pa.array(np.ascontiguousarray(c), type=f.type)
+              for c, f in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _format_for(path, fmt=None):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        raise ValueError(f"{path}: unknown output format (use .parquet or .arrow, or --format)")
+    return FORMATS[ext]
+
+def export_capture(path, output, fmt=None, batch_rows=BATCH_ROWS, compression='zstd', progress=None):
+    """Stream a capture into Parquet or Arrow IPC. Returns (rows, batches, peak Arrow bytes)."""
+    _require_pyarrow()
+    fmt = _format_for(output, fmt)
+    total = len(CaptureReader(path))   # validates the header
+    schema = export_schema(path)
+    dtype = record_dtype()
+    buffer = bytearray(batch_rows * RECORD_SIZE)
+    view = memoryview(buffer)
+    rows = batches = 0
+    peak = pa.total_allocated_bytes()
+
+    if fmt == 'parquet':
+        writer = pa.parquet.ParquetWriter(output, schema, compression=compression)
+        write = lambda batch: writer.write_batch(batch, row_group_size=batch_rows)
+    elif fmt == 'arrow':
+        options = pa.ipc.IpcWriteOptions(compression=None if compression in (None, 'none') else compression)
+        writer = pa.ipc.new_file(output, schema, options=options)
+        write = writer.write_batch
+    else:
+        raise ValueError(f"unknown format {fmt!r}")
+
+    try:
+        with open(path, 'rb') as f:
+            f.seek(HEADER.size)
+            while rows < total:
+                n = f.readinto(view) // RECORD_SIZE
+                if not n:
+                    break
+                records = np.frombuffer(buffer, dtype=dtype, count=n)
+                write(decode_batch(records, schema))
+                rows += n
+                batches += 1
+                peak = max(peak, pa.total_allocated_bytes())
+                if progress is not None:
+                    progress(rows, total)
+    finally:
+        writer.close()
+    return rows, batches, peak
+
+def _reference_table(path, schema):
+    """The same table from a CaptureReader + parse_report() loop (bench check)."""
+    from wheel_state import parse_report
+
+    columns = {name: [] for name in schema.names}
+    for host_ns, device_ns, report in CaptureReader(path):
+        state = parse_report(report + bytes(REPORT_SIZE - len(report)))
+        columns['host_ns'].append(host_ns)
+        columns['device_ns'].append(device_ns)
+        columns['steering'].append(state['steering_signed'])
+        columns['accel'].append(state['accel'])
+        columns['brake'].append(state['brake'])
+        columns['buttons'].append(state['byte2'] | state['byte3'] << 8)
+        columns['hat'].append(state['dpad'])
+        columns['byte01'].append(state['buttons'])
+        columns['vendor'].append(bytes(report[VENDOR_OFFSET:]).ljust(VENDOR_SIZE, b'\x00'))
+        columns['length'].append(len(report))
+    return pa.table(columns, schema=schema)
+
+def run_benchmark(reports=2000000, batch_rows=BATCH_ROWS):
+    """Export throughput and peak Arrow memory, Parquet and IPC, two capture lengths."""
+    import tempfile
+    from synth_wheel import write_long_capture
+
+    _require_pyarrow()
+    with tempfile.TemporaryDirectory() as tmp:
+        print("=" * 80)
+        print(f"Capture export benchmark (batches of {batch_rows} rows)")
+        print("=" * 80)
+        for count in (reports // 10, reports):
+            path = os.path.join(tmp, f'bench-{count}.hcap')
+            write_long_capture(path, count)
+            size = os.path.getsize(path)
+            for fmt, ext in (('parquet', 'parquet'), ('arrow', 'arrow')):
+                output = os.path.join(tmp, f'bench-{count}.{ext}')
+                before = pa.total_allocated_bytes()
+                start = time.perf_counter()
+                rows, batches, peak = export_capture(path, output, batch_rows=batch_rows)
+                elapsed = time.perf_counter() - start
+                print(f"  {count:9d} reports -> {fmt:7s} {rows / elapsed:12,.0f} rows/s  "
+                      f"{size / elapsed / 1e6:6.0f} MB/s in  {os.path.getsize(output) / size * 100:5.1f}% size  "
+                      f"peak Arrow {(peak - before) / 1e6:5.1f} MB")
+
+        # Loop baseline and a column-for-column check on a small capture
+        sample = min(reports, 50000)
+        path = os.path.join(tmp, 'check.hcap')
+        write_long_capture(path, sample)
+        output = os.path.join(tmp, 'check.parquet')
+        export_capture(path, output, batch_rows=max(1, sample // 7))
+        start = time.perf_counter()
+        reference = _reference_table(path, export_schema(path))
+        elapsed = time.perf_counter() - start
+        exported = pa.parquet.read_table(output)
+        same = exported.equals(reference.replace_schema_metadata(exported.schema.metadata))
+    print(f"  parse_report() loop baseline: {sample / elapsed:12,.0f} rows/s")
+    print(f"  Exported table vs loop: {'match' if same else 'MISMATCH'}")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Columnar capture export")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('export', help='convert a capture to Parquet or Arrow IPC')
+    p.add_argument('capture')
+    p.add_argument('output', help='OUTPUT.parquet or OUTPUT.arrow')
+    p.add_argument('--format', choices=['parquet', 'arrow'], default=None,
+                   help='output format (default: from the file extension)')
+    p.add_argument('--batch-rows', type=int, default=BATCH_ROWS,
+                   help=f'records per batch / row group (default: {BATCH_ROWS})')
+    p.add_argument('--compression', default='zstd',
+                   help="zstd, lz4, snappy (Parquet only) or none (default: zstd)")
+    p = sub.add_parser('bench', help='export throughput and memory against capture length')
+    p.add_argument('--reports', type=int, default=2000000)
+    p.add_argument('--batch-rows', type=int, default=BATCH_ROWS)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'bench':
+            run_benchmark(args.reports, args.batch_rows)
+            return
+        _require_pyarrow()
+    except ImportError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    def progress(rows, total):
+        print(f"\r  {rows}/{total} records ({rows * 100 // max(total, 1)}%)", end='', flush=True)
+
+    start = time.perf_counter()
+    try:
+        rows, batches, _ = export_capture(args.capture, args.output, args.format, args.batch_rows,
+                                          args.compression, progress)
+    except (OSError, ValueError, CaptureFormatError, pa.ArrowException) as e:
+        print(f"\nError: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+    print()
+    print(f"✓ {rows} records in {batches} batches -> {args.output} "
+          f"({os.path.getsize(args.output)} bytes, {rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Capture File Format
+
+Binary capture of raw input reports with fixed-size records, so captures can
+be replayed through the tools (ReplayDevice) and indexed by record number.
+
+File layout:
+    Header (16 bytes):  magic b'HORICAP\\0', uint16 version, uint16 record size,
+                        uint32 reserved
+    Record (88 bytes):  int64 host timestamp (ns, monotonic clock),
+                        int64 device timestamp (ns, 0 if unavailable),
+                        uint16 report length, 6 bytes padding,
+                        64 bytes report data (zero padded)
+
+Usage:
+    python3 capture_file.py info capture.hcap
+    python3 capture_file.py dump capture.hcap [--limit N]
+"""
+
+import os
+import struct
+import sys
+import time
+import argparse
+
+from report_source import REPORT_SIZE
+
+MAGIC = b'HORICAP\x00'
+VERSION = 1
+
+HEADER = struct.Struct('<8sHHI')
+RECORD_HEADER = struct.Struct('<qqH6x')
+RECORD_SIZE = RECORD_HEADER.size + REPORT_SIZE
+
+def record_dtype():
+    """NumPy dtype of one record: RECORD_HEADER followed by the report."""
+    import numpy as np
+
+    dtype = np.dtype([('host_ns', '<i8'), ('device_ns', '<i8'), ('length', '<u2'),
+                      ('pad', 'V6'), ('report', 'u1', (REPORT_SIZE,))])
+    assert dtype.itemsize == RECORD_SIZE
+    return dtype
+
+def pack_header():
+    """The file header for this version."""
+    return HEADER.pack(MAGIC, VERSION, RECORD_SIZE, 0)
+
+def pack_record_into(buffer, offset, report, host_ns, device_ns=0):
+    """Write one record at `offset` in `buffer`, the report truncated or zero padded."""
+    length = min(len(report), REPORT_SIZE)
+    start = offset + RECORD_HEADER.size
+    RECORD_HEADER.pack_into(buffer, offset, host_ns, device_ns, length)
+    buffer[start:start + length] = report[:length]
+    if length < REPORT_SIZE:
+        buffer[start + length:offset + RECORD_SIZE] = bytes(REPORT_SIZE - length)
+
+class CaptureFormatError(Exception):
+    """Raised when a file is not a valid capture."""
+
+class CaptureWriter:
+    """Appends reports to a capture file.
+
+    With index=True a zone-map index (capture_index.py) is built alongside
+    as the reports are written.
+    """
+
+    def __init__(self, path, clock=time.monotonic_ns, index=False):
+        self.path = path
+        self.clock = clock
+        self.count = 0
+        self._record = bytearray(RECORD_SIZE)
+        self._file = open(path, 'wb')
+        self._file.write(pack_header())
+        self.index = None
+        if index:
+            from capture_index import ZoneMapBuilder
+            self.index = ZoneMapBuilder(path)
+
+    def write(self, report, host_ns=None, device_ns=0):
+        """Append one report; host_ns defaults to the monotonic clock."""
+        if host_ns is None:
+            host_ns = self.clock()
+        pack_record_into(self._record, 0, report, host_ns, device_ns)
+        self._file.write(self._record)
+        if self.index is not None:
+            self.index.add(report, host_ns)
+        self.count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if self.index is not None:
+            self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CaptureReader:
+    """Reads records from a capture file."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise CaptureFormatError(f"{path}: file too short")
+        magic, version, record_size, _ = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise CaptureFormatError(f"{path}: not a capture file")
+        if version != VERSION or record_size != RECORD_SIZE:
+            raise CaptureFormatError(f"{path}: unsupported version {version} (record size {record_size})")
+
+    def __len__(self):
+        return (os.path.getsize(self.path) - HEADER.size) // RECORD_SIZE
+
+    def __iter__(self):
+        """Yield (host_ns, device_ns, report) tuples."""
+        header_size = RECORD_HEADER.size
+        with open(self.path, 'rb') as f:
+            f.seek(HEADER.size)
+            while True:
+                record = f.read(RECORD_SIZE)
+                if len(record) < RECORD_SIZE:
+                    break
+                host_ns, device_ns, length = RECORD_HEADER.unpack_from(record)
+                yield host_ns, device_ns, record[header_size:header_size + length]
+
+    def reports(self):
+        """Yield just the report bytes."""
+        for _, _, report in self:
+            yield report
+
+class ReplayDevice:
+    """Fake device that replays a capture through the pyusb read() interface.
+
+    With realtime=True reports are delivered at their recorded spacing,
+    otherwise as fast as they are read. When the capture is exhausted,
+    read() raises EOFError unless loop=True. Like pyusb, read() accepts
+    either a size or a buffer to fill (returning the byte count).
+    `device_ns` is the recorded device timestamp of the last report (0 if
+    the capture has none), for clock_sync.Timestamper.
+    """
+
+    def __init__(self, path, realtime=False, loop=False):
+        self.capture = CaptureReader(path)
+        self.realtime = realtime
+        self.loop = loop
+        self._records = iter(self.capture)
+        self._first_ns = None
+        self._start_ns = None
+        self.device_ns = 0
+
+    def read(self, endpoint, size, timeout=None):
+        # `size` is a byte count or, pyusb-style, a buffer to read into
+        try:
+            host_ns, device_ns, report = next(self._records)
+        except StopIteration:
+            if not self.loop:
+                raise EOFError(f"end of capture {self.capture.path}")
+            self._records = iter(self.capture)
+            self._first_ns = None
+            try:
+                host_ns, device_ns, report = next(self._records)
+            except StopIteration:
+                # Looping would spin forever
+                raise EOFError(f"{self.capture.path}: capture has no records") from None
+        self.device_ns = device_ns
+
+        if self.realtime:
+            if self._first_ns is None:
+                self._first_ns = host_ns
+                self._start_ns = time.monotonic_ns()
+            delay = (host_ns - self._first_ns) - (time.monotonic_ns() - self._start_ns)
+            if delay > 0:
+                time.sleep(delay / 1e9)
+
+        if isinstance(size, int):
+            return report[:size]
+        n = min(len(report), len(size))
+        memoryview(size)[:n] = report[:n]
+        return n
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect HORI Racing Wheel capture files")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('info', help='show capture summary')
+    p.add_argument('path')
+    p = sub.add_parser('dump', help='print reports as hex')
+    p.add_argument('path')
+    p.add_argument('--limit', type=int, default=None, help='stop after N reports')
+    args = parser.parse_args()
+
+    try:
+        capture = CaptureReader(args.path)
+    except (OSError, CaptureFormatError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.command == 'info':
+        count = len(capture)
+        first = last = None
+        for host_ns, _, _ in capture:
+            if first is None:
+                first = host_ns
+            last = host_ns
+        print(f"File:     {args.path}")
+        print(f"Reports:  {count}")
+        if count > 1:
+            duration = (last - first) / 1e9
+            print(f"Duration: {duration:.3f} s ({(count - 1) / duration if duration else 0:.1f} reports/s)")
+    else:
+        for i, (host_ns, _, report) in enumerate(capture):
+            if args.limit is not None and i >= args.limit:
+                break
+            hex_str = " ".join(f"{b:02X}" for b in report)
+            print(f"{host_ns / 1e9:14.6f} [{len(report):2d} bytes]: {hex_str}")
+
+if __name__ == "__main__":
+    main()
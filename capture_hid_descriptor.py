@@ -9,11 +9,15 @@ Requirements:
     pip install pyusb
 
 Usage:
-    sudo python3 capture_hid_descriptor.py
+    sudo python3 capture_hid_descriptor.py [--record capture.hcap] [--duration SECONDS]
+    sudo python3 capture_hid_descriptor.py --trigger 'byte[4] == 0xFF and bit(3,3)' [--pre S] [--post S]
+    python3 capture_hid_descriptor.py --replay capture.hcap --profile
+    python3 capture_hid_descriptor.py --synthetic 1000 --record synthetic.hcap
 """
 
 import sys
 import struct
+import argparse
 
 try:
     import usb.core
@@ -23,6 +27,13 @@ except ImportError:
     print("Install with: pip3 install pyusb")
     sys.exit(1)
 
+from capture_file import CaptureWriter
+from hid_descriptor import HIDDescriptorError, format_layout, parse_descriptor
+from profiling import Profiler, StageTimer, add_profile_arguments
+from report_source import PASSTHROUGH, ReportSource
+from synth_wheel import fake_device_from_args
+from trigger_capture import TriggerError, TriggeredCapture, add_trigger_arguments, event_prefix
+
 # HORI Racing Wheel USB IDs
 VENDOR_ID = 0x0F0D
 PRODUCT_ID = 0x013E
@@ -178,40 +189,139 @@ def format_collection(value):
     }
     return collections.get(value, f"Reserved 0x{value:02X}")
 
-def capture_reports(dev, interface_num, endpoint_addr, duration=5):
-    """Capture and display raw input reports."""
+def capture_reports(dev, interface_num, endpoint_addr, duration=5, output=None, profiler=None):
+    """Capture and display raw input reports, optionally recording them to a capture file."""
     print(f"\n{'='*60}")
-    print(f"CAPTURING RAW INPUT REPORTS (for {duration} seconds)")
+    if profiler is not None:
+        print(f"CAPTURING RAW INPUT REPORTS (profiling {profiler.max_reports} reports)")
+    else:
+        print(f"CAPTURING RAW INPUT REPORTS (for {duration} seconds)")
     print(f"{'='*60}")
     print("Please move the steering wheel, press pedals, and push buttons...")
     print()
 
     import time
-    start_time = time.time()
+    from clock_sync import Timestamper
+    start_time = time.monotonic()
     report_count = 0
+    # Raw capture: record every report, including byte-identical ones
+    source = ReportSource(dev, endpoint_addr, PASSTHROUGH)
+    writer = CaptureWriter(output, index=True) if output else None
+    # Device timestamps are recorded when the source has a device clock
+    # (replays, synthetic streams); the wheel through pyusb records 0
+    stamper = Timestamper(dev)
+    timer = StageTimer()
 
     try:
-        while time.time() - start_time < duration:
+        while profiler is not None or time.monotonic() - start_time < duration:
+            if profiler is not None and profiler.done:
+                break
             try:
-                data = dev.read(endpoint_addr, 64, timeout=100)
+                timer.begin()
+                data = source.read_raw()
+                timer.mark('read')
                 if data:
                     report_count += 1
+                    if writer is not None:
+                        host_ns, device_ns, _ = stamper.stamp()
+                        writer.write(data, host_ns, device_ns)
+                        timer.mark('write')
                     hex_str = " ".join([f"{b:02X}" for b in data])
                     print(f"Report {report_count:3d} [{len(data):2d} bytes]: {hex_str}")
+                    timer.mark('print')
+                    if profiler is not None:
+                        profiler.count()
             except usb.core.USBError as e:
-                if e.errno != 110:  # Ignore timeout errors
-                    print(f"USB Error: {e}")
+                print(f"USB Error: {e}")
+    except EOFError:
+        print("\nEnd of capture")
     except KeyboardInterrupt:
         print("\nCapture interrupted by user")
+    finally:
+        if writer is not None:
+            writer.close()
 
     print(f"\n{'='*60}")
     print(f"Captured {report_count} reports")
+    if writer is not None:
+        print(f"✓ Saved to {output}")
+    print(f"Stages: {timer.summary()}")
     print(f"{'='*60}\n")
 
-def main():
+def capture_triggered(dev, endpoint_addr, args, profiler=None):
+    """Keep the last --pre seconds in a ring and save a window around each trigger."""
+    # Raw capture: the ring needs every report, including byte-identical ones
+    source = ReportSource(dev, endpoint_addr, PASSTHROUGH)
+    try:
+        capture = TriggeredCapture(source, args.trigger, pre=args.pre, post=args.post,
+                                   prefix=event_prefix(args.record))
+    except TriggerError as e:
+        print(f"Error: {e}")
+        return
+
+    print(f"\n{'='*60}")
+    print(f"TRIGGERED CAPTURE: {args.trigger}")
+    print(f"{'='*60}")
+    print(f"Compiled: lambda r, p: {capture.trigger.source}")
+    print(f"Keeping {args.pre:g} s before and {args.post:g} s after each match "
+          f"(ring of {capture.ring.capacity} reports)")
+    print("Waiting for trigger... (Ctrl+C to stop)")
+    print()
+
+    try:
+        capture.run(args.duration, args.events, profiler)
+    except KeyboardInterrupt:
+        capture.close()
+        print("\nCapture interrupted by user")
+
+    print(f"\n{'='*60}")
+    print(f"Watched {capture.reports} reports, saved {len(capture.events)} events")
+    print(f"Stages: {capture.timer.summary()}")
+    print(f"{'='*60}\n")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel HID Descriptor Capture Tool")
+    parser.add_argument('--record', metavar='CAPTURE', default=None,
+                        help='save captured reports to a capture file (see capture_file.py)')
+    parser.add_argument('--duration', type=float, default=None,
+                        help='report capture duration in seconds (default: 5, '
+                             'or until Ctrl+C with --trigger)')
+    add_trigger_arguments(parser)
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def run_capture(dev, interface_num, endpoint_in, args):
+    """Capture reports, under the profiler when --profile is given."""
+    if args.trigger:
+        if not args.profile:
+            capture_triggered(dev, endpoint_in, args)
+            return
+        with Profiler(args.profile_reports, output=args.profile_output) as profiler:
+            capture_triggered(dev, endpoint_in, args, profiler)
+        profiler.dump()
+        return
+
+    duration = args.duration if args.duration is not None else 5
+    if not args.profile:
+        capture_reports(dev, interface_num, endpoint_in, duration, output=args.record)
+        return
+
+    with Profiler(args.profile_reports, output=args.profile_output) as profiler:
+        capture_reports(dev, interface_num, endpoint_in, duration,
+                        output=args.record, profiler=profiler)
+    profiler.dump()
+
+def main(args):
     print("="*60)
     print("HORI Racing Wheel HID Descriptor Capture Tool")
     print("="*60)
+
+    dev = fake_device_from_args(args)
+    if dev is not None:
+        # No descriptor to retrieve from a capture or generator, only reports
+        run_capture(dev, 0, None, args)
+        return
+
     print(f"Looking for device: VID=0x{VENDOR_ID:04X}, PID=0x{PRODUCT_ID:04X}")
 
     # Find the device
@@ -304,6 +414,13 @@ def main():
 
             # Parse and display
             parse_hid_descriptor(hid_descriptor)
+            try:
+                print("Report layout:")
+                for line in format_layout(parse_descriptor(hid_descriptor)):
+                    print(f"  {line}")
+                print()
+            except HIDDescriptorError as e:
+                print(f"⚠ Could not build report layout: {e}")
 
             # Save to file
             with open("hid_descriptor.bin", "wb") as f:
@@ -332,7 +449,7 @@ def main():
         print("\nWould you like to capture raw input reports? (y/n): ", end="")
         response = input().strip().lower()
         if response == 'y':
-            capture_reports(dev, interface_num, endpoint_in)
+            run_capture(dev, interface_num, endpoint_in, args)
 
     # Cleanup
     try:
@@ -343,11 +460,13 @@ def main():
     print("\nDone!")
 
 if __name__ == "__main__":
+    args = parse_args()
+
     if sys.platform != "darwin":
         print("Warning: This script is designed for macOS but may work on other systems")
 
     try:
-        main()
+        main(args)
     except KeyboardInterrupt:
         print("\n\nInterrupted by user")
         sys.exit(0)
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Capture Zone-Map Index
+
+A sidecar index (PATH.idx) next to a capture file, with one entry per block
+of K reports:
+
+    first/last host timestamp
+    min/max of steering (signed), brake and accelerator
+    OR and AND masks of bytes 0-3 (buttons, D-pad)
+
+The header records the capture's size and mtime when the index was
+finished; an index that no longer matches them is stale and has to be
+rebuilt.
+
+Queries over decoded fields are planned against the index: a block is only
+read and decoded if its zone map says it can contain a match, so selective
+questions ("brake > 200 while steering is past 50% left") touch a small
+fraction of a long capture.
+
+Query syntax (combine with and, or, not and parentheses):
+
+    steering, brake, accel, byte0-byte3  compared with < <= > >= == !=
+    btn_a btn_b btn_x btn_y btn_home btn_plus btn_minus btn_lsb btn_rsb
+    paddle_up paddle_down dpad_up dpad_down dpad_left dpad_right btn_zl btn_zr
+
+Usage:
+    python3 capture_index.py build capture.hcap [--block-size K]
+    python3 capture_index.py query capture.hcap 'brake > 200 and steering < -16384' [--no-index]
+    python3 capture_index.py bench [--reports N]
+
+Captures recorded with capture_hid_descriptor.py --record are indexed as
+they are written.
+"""
+
+import array
+import ast
+import mmap
+import os
+import struct
+import sys
+import time
+import argparse
+
+from capture_file import HEADER, RECORD_HEADER, RECORD_SIZE, CaptureFormatError, CaptureReader
+
+INDEX_MAGIC = b'HORIIDX\x00'
+INDEX_VERSION = 2
+DEFAULT_BLOCK_SIZE = 1024
+
+# magic, version, block size, record size, size and mtime (ns) of the indexed capture
+INDEX_HEADER = struct.Struct('<8sHIHQq')
+# first_ns, last_ns, steering min/max, brake min/max, accel min/max,
+# OR masks of bytes 0-3, AND masks of bytes 0-3
+INDEX_ENTRY = struct.Struct('<qqhhBBBB4s4s')
+
+class CaptureIndexError(Exception):
+    """Raised when an index is missing, stale or malformed, or a query is invalid."""
+
+# Decoded field -> (kind, byte offset)
+FIELDS = {
+    'steering': ('s16', 6), 'brake': ('u8', 4), 'accel': ('u8', 5),
+    'byte0': ('u8', 0), 'byte1': ('u8', 1), 'byte2': ('u8', 2), 'byte3': ('u8', 3),
+}
+
+# Button name -> (byte, bit), as in parse_report()
+BUTTONS = {
+    'dpad_up': (2, 0), 'dpad_down': (2, 1), 'dpad_left': (2, 2), 'dpad_right': (2, 3),
+    'btn_plus': (2, 4), 'btn_minus': (2, 5), 'btn_lsb': (2, 6), 'btn_rsb': (2, 7),
+    'paddle_down': (3, 0), 'paddle_up': (3, 1), 'btn_home': (3, 2),
+    'btn_a': (3, 4), 'btn_b': (3, 5), 'btn_x': (3, 6), 'btn_y': (3, 7),
+}
+
+# ZL/ZR overlay the pedal axes
+OVERLAYS = {'btn_zl': 'brake', 'btn_zr': 'accel'}
+
+_COMPARE = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Eq: '==', ast.NotEq: '!='}
+_FLIP = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+_NEGATE = {'<': '>=', '<=': '>', '>': '<=', '>=': '<', '==': '!=', '!=': '=='}
+
+class ZoneMap:
+    """Statistics for one block of reports."""
+
+    __slots__ = ('first_ns', 'last_ns', 'steering_min', 'steering_max', 'brake_min', 'brake_max',
+                 'accel_min', 'accel_max', 'or_mask', 'and_mask')
+
+    def __init__(self, first_ns, last_ns, steering_min, steering_max, brake_min, brake_max,
+                 accel_min, accel_max, or_mask, and_mask):
+        self.first_ns = first_ns
+        self.last_ns = last_ns
+        self.steering_min = steering_min
+        self.steering_max = steering_max
+        self.brake_min = brake_min
+        self.brake_max = brake_max
+        self.accel_min = accel_min
+        self.accel_max = accel_max
+        self.or_mask = or_mask      # bytes 0-3
+        self.and_mask = and_mask
+
+    def field_range(self, field):
+        """(min, max) bound of a decoded field within this block."""
+        if field == 'steering':
+            return self.steering_min, self.steering_max
+        if field == 'brake':
+            return self.brake_min, self.brake_max
+        if field == 'accel':
+            return self.accel_min, self.accel_max
+        byte = FIELDS[field][1]
+        return self.and_mask[byte], self.or_mask[byte]
+
+    def pack(self):
+        return INDEX_ENTRY.pack(self.first_ns, self.last_ns, self.steering_min, self.steering_max,
+                                self.brake_min, self.brake_max, self.accel_min, self.accel_max,
+                                bytes(self.or_mask), bytes(self.and_mask))
+
+    @classmethod
+    def unpack_from(cls, data, offset=0):
+        return cls(*INDEX_ENTRY.unpack_from(data, offset))
+
+class ZoneMapBuilder:
+    """Accumulates zone maps report by report and writes PATH.idx.
+
+    CaptureWriter feeds it when created with index=True.
+    """
+
+    def __init__(self, capture_path, block_size=DEFAULT_BLOCK_SIZE):
+        self.capture_path = capture_path
+        self.path = index_path(capture_path)
+        self.block_size = block_size
+        self.blocks = 0
+        self._file = open(self.path, 'wb')
+        self._write_header(0, 0)
+        self._reset()
+
+    def _write_header(self, size, mtime_ns):
+        self._file.seek(0)
+        self._file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.block_size, RECORD_SIZE,
+                                           size, mtime_ns))
+
+    def _reset(self):
+        self._count = 0
+        self._first_ns = self._last_ns = 0
+        self._smin, self._smax = 32767, -32768
+        self._bmin = self._amin = 255
+        self._bmax = self._amax = 0
+        self._or = [0, 0, 0, 0]
+        self._and = [255, 255, 255, 255]
+
+    def add(self, report, host_ns):
+        """Account one report (at least 8 bytes; shorter ones count as zeros)."""
+        if len(report) < 8:
+            report = bytes(report) + bytes(8 - len(report))
+        if not self._count:
+            self._first_ns = host_ns
+        self._last_ns = host_ns
+        steering = report[6] | (report[7] << 8)
+        if steering >= 32768:
+            steering -= 65536
+        if steering < self._smin:
+            self._smin = steering
+        if steering > self._smax:
+            self._smax = steering
+        brake = report[4]
+        accel = report[5]
+        if brake < self._bmin:
+            self._bmin = brake
+        if brake > self._bmax:
+            self._bmax = brake
+        if accel < self._amin:
+            self._amin = accel
+        if accel > self._amax:
+            self._amax = accel
+        masks_or = self._or
+        masks_and = self._and
+        for i in range(4):
+            masks_or[i] |= report[i]
+            masks_and[i] &= report[i]
+        self._count += 1
+        if self._count == self.block_size:
+            self._flush()
+
+    def add_block(self, zone):
+        """Append a zone map computed elsewhere (build_index)."""
+        self._file.write(zone.pack())
+        self.blocks += 1
+
+    def _flush(self):
+        if self._count:
+            self.add_block(ZoneMap(self._first_ns, self._last_ns, self._smin, self._smax,
+                                   self._bmin, self._bmax, self._amin, self._amax,
+                                   bytes(self._or), bytes(self._and)))
+        self._reset()
+
+    def close(self):
+        """Write the last block and stamp the header with the finished capture's size and mtime."""
+        if not self._file.closed:
+            self._flush()
+            st = os.stat(self.capture_path)
+            self._write_header(st.st_size, st.st_mtime_ns)
+            self._file.close()
+
+def index_path(capture_path):
+    return f"{capture_path}.idx"
+
+def _column_mask(column, op):
+    """OR/AND of every byte in a column, via its distinct values."""
+    result = 0 if op == 'or' else 255
+    for value in set(column):
+        result = result | value if op == 'or' else result & value
+    return result
+
+def zone_for_block(buf):
+    """ZoneMap for a buffer of whole capture records (column-wise, in C)."""
+    header = RECORD_HEADER.size
+    count = len(buf) // RECORD_SIZE
+    columns = [buf[header + i::RECORD_SIZE] for i in range(8)]
+    pairs = bytearray(2 * count)
+    pairs[0::2] = columns[6]
+    pairs[1::2] = columns[7]
+    steering = array.array('h', pairs)
+    if sys.byteorder == 'big':
+        steering.byteswap()
+    return ZoneMap(RECORD_HEADER.unpack_from(buf, 0)[0],
+                   RECORD_HEADER.unpack_from(buf, (count - 1) * RECORD_SIZE)[0],
+                   min(steering), max(steering), min(columns[4]), max(columns[4]),
+                   min(columns[5]), max(columns[5]),
+                   bytes(_column_mask(columns[i], 'or') for i in range(4)),
+                   bytes(_column_mask(columns[i], 'and') for i in range(4)))
+
+def _open(path):
+    f = open(path, 'rb')
+    try:
+        return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:   # empty file
+        f.close()
+        raise
+
+def build_index(capture_path, block_size=DEFAULT_BLOCK_SIZE):
+    """Write PATH.idx for an existing capture. Returns the number of blocks."""
+    count = len(CaptureReader(capture_path))
+    builder = ZoneMapBuilder(capture_path, block_size)
+    if count:
+        f, mm = _open(capture_path)
+        try:
+            for start in range(0, count, block_size):
+                end = min(count, start + block_size)
+                offset = HEADER.size + start * RECORD_SIZE
+                builder.add_block(zone_for_block(mm[offset:offset + (end - start) * RECORD_SIZE]))
+        finally:
+            mm.close()
+            f.close()
+    builder.close()
+    return builder.blocks
+
+class CaptureIndex:
+    """Loaded zone maps for a capture."""
+
+    def __init__(self, capture_path):
+        path = index_path(capture_path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise CaptureIndexError(f"{path}: no index (run: python3 capture_index.py build)") from None
+        if len(data) < INDEX_HEADER.size:
+            raise CaptureIndexError(f"{path}: file too short")
+        magic, version, block_size, record_size, size, mtime_ns = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION or record_size != RECORD_SIZE:
+            raise CaptureIndexError(f"{path}: not a version {INDEX_VERSION} capture index, rebuild it")
+        st = os.stat(capture_path)
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            # Rewritten with the same number of records, or still being written
+            raise CaptureIndexError(f"{path}: stale index (the capture changed since it was "
+                                    f"indexed), rebuild it")
+        self.block_size = block_size
+        body = len(data) - INDEX_HEADER.size
+        self.zones = [ZoneMap.unpack_from(data, INDEX_HEADER.size + k * INDEX_ENTRY.size)
+                      for k in range(body // INDEX_ENTRY.size)]
+        records = len(CaptureReader(capture_path))
+        if len(self.zones) != -(-records // block_size):
+            raise CaptureIndexError(f"{path}: stale index ({len(self.zones)} blocks for "
+                                    f"{records} reports), rebuild it")
+        self.records = records
+
+class Query:
+    """A parsed query: a block-level may-match test and a per-report predicate."""
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            tree = ast.parse(text.strip(), mode='eval').body
+        except SyntaxError as e:
+            raise CaptureIndexError(f"syntax error in query: {e.msg}") from None
+        self.plan = self._parse(tree)
+        self.source = self._lower(self.plan)
+        # match(buffer, offset): offset is where the report's byte 0 starts
+        self.match = eval(f"lambda b, o: {self.source}", {'__builtins__': {}})
+
+    # Plan nodes: ('and', [...]) ('or', [...]) ('cmp', field, op, value) ('bit', byte, bit, value)
+
+    def _parse(self, node, negate=False):
+        if isinstance(node, ast.BoolOp):
+            kind = 'and' if isinstance(node.op, ast.And) else 'or'
+            if negate:   # De Morgan
+                kind = 'or' if kind == 'and' else 'and'
+            return (kind, [self._parse(v, negate) for v in node.values])
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return self._parse(node.operand, not negate)
+        if isinstance(node, ast.Name):
+            if node.id in BUTTONS:
+                byte, bit = BUTTONS[node.id]
+                return ('bit', byte, bit, 0 if negate else 1)
+            if node.id in OVERLAYS:
+                return ('cmp', OVERLAYS[node.id], '!=' if negate else '==', 255)
+            raise CaptureIndexError(f"unknown name {node.id!r}")
+        if isinstance(node, ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in _COMPARE:
+            op = _COMPARE[type(node.ops[0])]
+            left, right = node.left, node.comparators[0]
+            if isinstance(left, ast.Name):
+                field, value = left.id, right
+            else:
+                field, value, op = getattr(right, 'id', None), left, _FLIP[op]
+            if field not in FIELDS:
+                raise CaptureIndexError(f"comparisons need a field ({', '.join(FIELDS)}) and a number")
+            try:
+                value = ast.literal_eval(value)
+            except ValueError:
+                value = None
+            if type(value) is not int:
+                raise CaptureIndexError(f"{ast.unparse(node)!r}: compare {field} with an integer")
+            return ('cmp', field, _NEGATE[op] if negate else op, value)
+        raise CaptureIndexError(f"unsupported query syntax: {ast.unparse(node)!r}")
+
+    def _lower(self, node):
+        kind = node[0]
+        if kind in ('and', 'or'):
+            return '(' + f' {kind} '.join(self._lower(n) for n in node[1]) + ')'
+        if kind == 'bit':
+            _, byte, bit, value = node
+            return f"(b[o + {byte}] >> {bit} & 1) == {value}"
+        _, field, op, value = node
+        kind, offset = FIELDS[field]
+        if kind == 's16':
+            expr = f"((b[o + {offset}] | b[o + {offset + 1}] << 8) ^ 32768) - 32768"
+        else:
+            expr = f"b[o + {offset}]"
+        return f"{expr} {op} {value}"
+
+    def may_match(self, zone, node=None):
+        """False only if no report in the block can satisfy the query."""
+        node = self.plan if node is None else node
+        kind = node[0]
+        if kind == 'and':
+            return all(self.may_match(zone, n) for n in node[1])
+        if kind == 'or':
+            return any(self.may_match(zone, n) for n in node[1])
+        if kind == 'bit':
+            _, byte, bit, value = node
+            if value:
+                return bool(zone.or_mask[byte] >> bit & 1)      # someone had it set
+            return not zone.and_mask[byte] >> bit & 1           # someone had it clear
+        _, field, op, value = node
+        low, high = zone.field_range(field)
+        if op == '<':
+            return low < value
+        if op == '<=':
+            return low <= value
+        if op == '>':
+            return high > value
+        if op == '>=':
+            return high >= value
+        if op == '==':
+            return low <= value <= high
+        return not (low == high == value)
+
+def _scan(mm, start, stop, match, intervals):
+    """Append matching runs in records [start, stop) as [first, last] pairs."""
+    header = HEADER.size + RECORD_HEADER.size
+    offset = header + start * RECORD_SIZE
+    for record in range(start, stop):
+        if match(mm, offset):
+            if intervals and intervals[-1][1] == record - 1:
+                intervals[-1][1] = record
+            else:
+                intervals.append([record, record])
+        offset += RECORD_SIZE
+
+def query_capture(capture_path, query, use_index=True):
+    """Matching intervals as (first record, last record, first ns, last ns).
+
+    Returns (intervals, stats) where stats counts blocks and reports examined.
+    """
+    if isinstance(query, str):
+        query = Query(query)
+    count = len(CaptureReader(capture_path))
+    stats = {'blocks': 0, 'candidates': 0, 'decoded': 0}
+    intervals = []
+    if not count:
+        return [], stats
+    f, mm = _open(capture_path)
+    try:
+        if use_index:
+            index = CaptureIndex(capture_path)
+            block_size = index.block_size
+            stats['blocks'] = len(index.zones)
+            for k, zone in enumerate(index.zones):
+                if query.may_match(zone):
+                    start = k * block_size
+                    stop = min(count, start + block_size)
+                    stats['candidates'] += 1
+                    stats['decoded'] += stop - start
+                    _scan(mm, start, stop, query.match, intervals)
+        else:
+            stats['decoded'] = count
+            _scan(mm, 0, count, query.match, intervals)
+
+        def ns(record):
+            return RECORD_HEADER.unpack_from(mm, HEADER.size + record * RECORD_SIZE)[0]
+
+        result = [(first, last, ns(first), ns(last)) for first, last in intervals]
+    finally:
+        mm.close()
+        f.close()
+    return result, stats
+
+def _parse_report_scan(capture_path, query, limit):
+    """Today's approach: parse_report() on every report, then test the dict."""
+    from wheel_state import parse_report
+
+    def test(node, state):
+        kind = node[0]
+        if kind == 'and':
+            return all(test(n, state) for n in node[1])
+        if kind == 'or':
+            return any(test(n, state) for n in node[1])
+        if kind == 'bit':
+            _, byte, bit, value = node
+            return (state[f'byte{byte}'] >> bit & 1) == value
+        _, field, op, value = node
+        actual = state['steering_signed'] if field == 'steering' else state[field]
+        return {'<': actual < value, '<=': actual <= value, '>': actual > value,
+                '>=': actual >= value, '==': actual == value, '!=': actual != value}[op]
+
+    matches = 0
+    for i, report in enumerate(CaptureReader(capture_path).reports()):
+        if i >= limit:
+            break
+        if test(query.plan, parse_report(report)):
+            matches += 1
+    return matches
+
+BENCH_QUERIES = (
+    'brake > 200 and steering < -16384',
+    'btn_zl',
+    'btn_a and btn_b',
+    'steering > 32000 and accel > 100',
+)
+
+def run_benchmark(reports=100000000, block_size=DEFAULT_BLOCK_SIZE, sample=1000000):
+    """Query latency with and without the index on a synthetic capture."""
+    from synth_wheel import write_long_capture
+
+    path = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'capture-index-bench.hcap')
+    print(f"Writing {reports} synthetic reports ({reports * RECORD_SIZE / 1e9:.1f} GB)...")
+    start = time.perf_counter()
+    write_long_capture(path, reports)
+    print(f"  written in {time.perf_counter() - start:.1f} s")
+    try:
+        start = time.perf_counter()
+        blocks = build_index(path, block_size)
+        print(f"  index: {blocks} blocks of {block_size} in {time.perf_counter() - start:.1f} s "
+              f"({os.path.getsize(index_path(path)) / 1024:.0f} KiB)")
+        print("=" * 80)
+        print(f"Query latency ({reports} reports)")
+        print("=" * 80)
+        for text in BENCH_QUERIES:
+            query = Query(text)
+            print(f"  {text}")
+
+            sample = min(sample, reports)
+            start = time.perf_counter()
+            _parse_report_scan(path, query, sample)
+            legacy = (time.perf_counter() - start) * reports / sample
+            label = "" if sample == reports else f" (extrapolated from {sample})"
+            print(f"    parse_report full scan   {legacy:9.3f} s{label}")
+
+            start = time.perf_counter()
+            full, _ = query_capture(path, query, use_index=False)
+            scan = time.perf_counter() - start
+            print(f"    compiled full scan       {scan:9.3f} s")
+
+            start = time.perf_counter()
+            indexed, stats = query_capture(path, query)
+            elapsed = time.perf_counter() - start
+            print(f"    zone-map index           {elapsed:9.3f} s  "
+                  f"{stats['candidates']}/{stats['blocks']} blocks decoded  "
+                  f"{len(indexed)} intervals  {'matches scan' if indexed == full else 'MISMATCH'}  "
+                  f"({legacy / elapsed:,.0f}x vs parse_report)")
+    finally:
+        os.remove(path)
+        os.remove(index_path(path))
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Capture Zone-Map Index")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('build', help='(re)build the index for a capture')
+    p.add_argument('path')
+    p.add_argument('--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+                   help=f'reports per zone map (default: {DEFAULT_BLOCK_SIZE})')
+    p = sub.add_parser('query', help='print intervals where a query holds')
+    p.add_argument('path')
+    p.add_argument('query')
+    p.add_argument('--no-index', action='store_true', help='scan every report')
+    p.add_argument('--limit', type=int, default=50, help='intervals to print (default: 50)')
+    p = sub.add_parser('bench', help='query latency with and without the index')
+    p.add_argument('--reports', type=int, default=100000000,
+                   help='capture size (default: 100M reports, ~8.8 GB in TMPDIR)')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'build':
+            blocks = build_index(args.path, args.block_size)
+            print(f"✓ Wrote {index_path(args.path)} ({blocks} blocks)")
+        elif args.command == 'query':
+            start = time.perf_counter()
+            intervals, stats = query_capture(args.path, args.query, not args.no_index)
+            elapsed = time.perf_counter() - start
+            first_ns = next(iter(CaptureReader(args.path)), (0,))[0]
+            for first, last, start_ns, end_ns in intervals[:args.limit]:
+                print(f"  {(start_ns - first_ns) / 1e9:12.3f} s - {(end_ns - first_ns) / 1e9:12.3f} s"
+                      f"  records {first}-{last} ({last - first + 1})")
+            if len(intervals) > args.limit:
+                print(f"  ... {len(intervals) - args.limit} more")
+            print(f"{len(intervals)} intervals, {stats['decoded']} reports decoded "
+                  f"({stats['candidates']}/{stats['blocks']} blocks) in {elapsed * 1000:.1f} ms")
+        else:
+            run_benchmark(args.reports)
+    except (OSError, CaptureFormatError, CaptureIndexError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
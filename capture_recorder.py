@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Background Capture Recorder
+
+Records to a capture file (capture_file.py format) without putting disk
+I/O on the read loop, so a live UI can record at the same time
+(test_wheel.py --record).
+
+The reader's write() packs the record into the current batch buffer, with
+no syscall and no allocation. A full batch (or one older than
+MAX_BATCH_AGE) goes over a bounded queue to a writer thread. That thread
+issues large page-aligned writes and group-commits them with one fsync
+per `fsync_interval`. It also takes an aged partial batch itself, so an
+idle wheel loses at most MAX_BATCH_AGE + fsync_interval of reports.
+
+Memory is bounded: `depth` batch buffers of BATCH_RECORDS records each,
+plus a staging buffer of at most WRITE_SIZE and one batch. When the disk falls behind and every
+buffer is queued, the policy decides:
+
+    block   the reader waits for a free buffer (up to block_timeout,
+            after which the report is dropped, and later ones too until
+            a buffer frees up) - nothing is lost while the disk keeps up
+            on average, and a stalled disk never holds the read loop for
+            longer than block_timeout
+    drop    the report is dropped at once - the read loop never waits
+
+Dropped reports are counted, and the spans they fall in are kept as
+(first_ns, last_ns, count), so a gap in the capture can be told from an
+idle wheel.
+
+Writes are whole pages except at a commit, where the partial last page is
+written as well so the fsync covers it. That page is written again when
+it fills. write_amplification is the bytes written over the bytes
+recorded.
+
+Usage:
+    python3 test_wheel.py --synthetic 1000 --record capture.hcap
+    python3 capture_recorder.py bench [--seconds S] [--rate HZ]
+"""
+
+import os
+import threading
+import time
+import argparse
+from collections import deque
+
+from capture_file import HEADER, RECORD_SIZE, pack_header, pack_record_into
+
+BLOCK = 'block'
+DROP = 'drop'
+POLICIES = (BLOCK, DROP)
+
+PAGE_SIZE = 4096
+# 512 records = 45056 bytes = 11 pages, so full batches stay page-aligned
+BATCH_RECORDS = 512
+# Batch buffers (the memory bound): 16 x 44 KiB, ~8 s of reports at 1 kHz
+DEFAULT_DEPTH = 16
+# The writer thread writes once at least this much is staged (or at a commit)
+WRITE_SIZE = 64 * PAGE_SIZE
+# A partial batch is handed over once its first report is this old
+MAX_BATCH_AGE = 0.25
+DEFAULT_FSYNC_INTERVAL = 1.0
+# Longest the block policy holds the reader (a few USB timeouts' worth)
+DEFAULT_BLOCK_TIMEOUT = 0.05
+
+class OSDisk:
+    """pwrite/fsync straight to the file descriptor."""
+
+    def pwrite(self, fd, data, offset):
+        return os.pwrite(fd, data, offset)
+
+    def fsync(self, fd):
+        os.fsync(fd)
+
+class SlowDisk(OSDisk):
+    """A disk with per-call latency, limited bandwidth and periodic stalls (bench)."""
+
+    def __init__(self, latency=0.0005, bandwidth=2e6, fsync_time=0.03, stall_every=1.0,
+                 stall_time=0.3):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fsync_time = fsync_time
+        self.stall_every = stall_every
+        self.stall_time = stall_time
+        self._next_stall = time.monotonic() + stall_every
+
+    def _stall(self):
+        if self.stall_every and time.monotonic() >= self._next_stall:
+            time.sleep(self.stall_time)
+            self._next_stall = time.monotonic() + self.stall_every
+
+    def pwrite(self, fd, data, offset):
+        self._stall()
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        return super().pwrite(fd, data, offset)
+
+    def fsync(self, fd):
+        self._stall()
+        time.sleep(self.fsync_time)
+        super().fsync(fd)
+
+class BackgroundCaptureWriter:
+    """CaptureWriter with the disk work on a writer thread (see module docstring)."""
+
+    def __init__(self, path, policy=BLOCK, depth=DEFAULT_DEPTH, fsync_interval=DEFAULT_FSYNC_INTERVAL,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT, clock=time.monotonic_ns, disk=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r} (expected one of {', '.join(POLICIES)})")
+        if depth < 2:
+            raise ValueError("depth must be at least 2")
+        self.path = path
+        self.policy = policy
+        self.depth = depth
+        self.fsync_interval = fsync_interval
+        self.block_timeout = block_timeout
+        self.clock = clock
+        self.disk = disk or OSDisk()
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+        self._free = deque(bytearray(BATCH_RECORDS * RECORD_SIZE) for _ in range(depth - 1))
+        self._full = deque()        # (buffer, records)
+        self._lock = threading.Lock()
+        self._has_free = threading.Condition(self._lock)
+        self._has_full = threading.Condition(self._lock)
+        self._batch = bytearray(BATCH_RECORDS * RECORD_SIZE)
+        self._used = 0               # records in _batch
+        self._batch_ns = 0           # host_ns of the first record in _batch
+        self._batch_started = 0.0    # time.monotonic() of the first record in _batch
+        self._max_age_ns = int(MAX_BATCH_AGE * 1e9)
+        self._closing = False
+        self._starved = False        # a block wait timed out; drop until a buffer frees up
+
+        # Reader-side counters
+        self.count = 0
+        self.dropped = 0
+        self.drop_spans = []         # [first_ns, last_ns, count]
+        self.blocked = 0
+        self.blocked_ns = 0
+        self.max_queued = 0
+
+        # Writer-side counters
+        self.bytes_recorded = HEADER.size
+        self.bytes_written = 0
+        self.writes = 0
+        self.fsyncs = 0
+        self.max_write_time = 0.0
+        self.max_fsync_time = 0.0
+        self.error = None
+
+        self._staged = bytearray(pack_header())
+        self._offset = 0             # file offset of _staged[0], always page-aligned
+        self.thread = threading.Thread(target=self._run, name='capture-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, report, host_ns=None, device_ns=0):
+        """Queue one report. Returns False if it was dropped."""
+        if host_ns is None:
+            host_ns = self.clock()
+        full = self._used == BATCH_RECORDS
+        if full or (self._used and host_ns - self._batch_ns >= self._max_age_ns):
+            # Only a full batch makes the reader wait; a partial one that
+            # can't be handed over yet keeps filling
+            if not self._hand_over(wait=full and self.policy == BLOCK) and full:
+                return self._drop(host_ns)
+        # The writer thread may take an aged partial batch, so the record
+        # goes in under the lock
+        with self._lock:
+            if not self._used:
+                self._batch_ns = host_ns
+                self._batch_started = time.monotonic()
+                self._has_full.notify()
+            pack_record_into(self._batch, self._used * RECORD_SIZE, report, host_ns, device_ns)
+            self._used += 1
+        self.count += 1
+        if self._used == BATCH_RECORDS:
+            # If no buffer is free, the next write() tries again
+            self._hand_over(wait=False)
+        return True
+
+    def _hand_over(self, wait):
+        """Queue the current batch and take a free buffer. False if none is free."""
+        with self._lock:
+            if not self._used:
+                # The writer thread took it in the meantime
+                return True
+            if not self._free:
+                if not wait or self._starved:
+                    return False
+                start = time.monotonic_ns()
+                self.blocked += 1
+                self._has_free.wait_for(lambda: self._free or self.error, self.block_timeout)
+                self.blocked_ns += time.monotonic_ns() - start
+                if not self._free:
+                    self._starved = True
+                    return False
+            self._starved = False
+            self._queue_batch()
+            self._has_full.notify()
+        return True
+
+    def _queue_batch(self):
+        """Move the current batch to the writer's queue (caller holds the lock)."""
+        self._full.append((self._batch, self._used))
+        self.max_queued = max(self.max_queued, len(self._full))
+        self._batch = self._free.popleft()
+        self._used = 0
+
+    def _wait_for_work(self, commit_at):
+        """Wait for queued batches, closing, the commit deadline or an aged partial batch.
+
+        An aged batch is taken here, so fsync_interval bounds what is lost
+        while the wheel is idle. Caller holds the lock.
+        """
+        while not (self._full or self._closing):
+            now = time.monotonic()
+            timeout = None if commit_at is None else commit_at - now
+            if timeout is not None and timeout <= 0:
+                return
+            if self._used and self._free:
+                age_timeout = self._batch_started + MAX_BATCH_AGE - now
+                if age_timeout <= 0:
+                    self._queue_batch()
+                    return
+                timeout = age_timeout if timeout is None else min(timeout, age_timeout)
+            self._has_full.wait(timeout)
+
+    def _drop(self, host_ns):
+        self.dropped += 1
+        spans = self.drop_spans
+        # Drops within a second of the last one extend its span
+        if spans and host_ns - spans[-1][1] < 1_000_000_000:
+            spans[-1][1] = host_ns
+            spans[-1][2] += 1
+        else:
+            spans.append([host_ns, host_ns, 1])
+        return False
+
+    def _flush_staged(self, commit):
+        """Write whole pages of the staging buffer; at a commit, the partial page too."""
+        staged = self._staged
+        aligned = len(staged) - len(staged) % PAGE_SIZE
+        if aligned and (aligned >= WRITE_SIZE or commit):
+            start = time.perf_counter()
+            self.disk.pwrite(self.fd, staged[:aligned], self._offset)
+            self.max_write_time = max(self.max_write_time, time.perf_counter() - start)
+            self.writes += 1
+            self.bytes_written += aligned
+            self._offset += aligned
+            del staged[:aligned]
+        if commit and staged:
+            start = time.perf_counter()
+            self.disk.pwrite(self.fd, staged, self._offset)
+            self.max_write_time = max(self.max_write_time, time.perf_counter() - start)
+            self.writes += 1
+            self.bytes_written += len(staged)
+
+    def _commit(self):
+        self._flush_staged(commit=True)
+        start = time.perf_counter()
+        self.disk.fsync(self.fd)
+        self.max_fsync_time = max(self.max_fsync_time, time.perf_counter() - start)
+        self.fsyncs += 1
+
+    def _run(self):
+        last_commit = time.monotonic()
+        dirty = False
+        try:
+            while True:
+                with self._lock:
+                    commit_at = None
+                    if dirty and self.fsync_interval is not None:
+                        commit_at = last_commit + self.fsync_interval
+                    self._wait_for_work(commit_at)
+                    batches = list(self._full)
+                    self._full.clear()
+                    closing = self._closing
+                for buffer, records in batches:
+                    self._staged += memoryview(buffer)[:records * RECORD_SIZE]
+                    self.bytes_recorded += records * RECORD_SIZE
+                    dirty = True
+                    with self._lock:
+                        self._free.append(buffer)
+                        self._has_free.notify()
+                    # Staging never holds more than WRITE_SIZE plus one batch
+                    self._flush_staged(commit=False)
+                if closing:
+                    break
+                if dirty and self.fsync_interval is not None \
+                        and time.monotonic() - last_commit >= self.fsync_interval:
+                    self._commit()
+                    last_commit = time.monotonic()
+                    dirty = False
+            self._commit()
+        except OSError as e:
+            self.error = e
+            with self._lock:
+                self._has_free.notify_all()
+
+    def close(self):
+        """Hand over the last batch, write and fsync everything, close the file."""
+        if self._closing:
+            return
+        with self._lock:
+            if self._used:
+                self._full.append((self._batch, self._used))
+                self._used = 0
+            self._closing = True
+            self._has_full.notify()
+        self.thread.join()
+        os.close(self.fd)
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def write_amplification(self):
+        return self.bytes_written / self.bytes_recorded if self.bytes_recorded else 0.0
+
+    def summary(self):
+        text = (f"{self.count} recorded, {self.dropped} dropped, {self.writes} writes, "
+                f"{self.fsyncs} fsyncs, amplification {self.write_amplification:.2f}x")
+        if self.blocked:
+            text += f", reader blocked {self.blocked}x ({self.blocked_ns / 1e6:.1f} ms)"
+        if self.writes:
+            text += (f", slowest write {self.max_write_time * 1000:.1f} ms, "
+                     f"fsync {self.max_fsync_time * 1000:.1f} ms")
+        return text
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+class _NaiveWriter:
+    """Per-report pwrite on the read loop, fsync every interval (bench baseline)."""
+
+    def __init__(self, path, disk, fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        self.disk = disk
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.disk.pwrite(self.fd, pack_header(), 0)
+        self.offset = HEADER.size
+        self.record = bytearray(RECORD_SIZE)
+        self.fsync_interval = fsync_interval
+        self.last_sync = time.monotonic()
+        self.count = self.writes = self.fsyncs = self.dropped = 0
+        self.bytes_recorded = self.bytes_written = HEADER.size
+
+    def write(self, report, host_ns=None, device_ns=0):
+        pack_record_into(self.record, 0, report, host_ns or time.monotonic_ns(), device_ns)
+        self.disk.pwrite(self.fd, self.record, self.offset)
+        self.offset += RECORD_SIZE
+        self.count += 1
+        self.writes += 1
+        self.bytes_recorded += RECORD_SIZE
+        self.bytes_written += RECORD_SIZE
+        if time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.disk.fsync(self.fd)
+            self.fsyncs += 1
+            self.last_sync = time.monotonic()
+        return True
+
+    def close(self):
+        self.disk.fsync(self.fd)
+        self.fsyncs += 1
+        os.close(self.fd)
+
+    write_amplification = property(lambda self: self.bytes_written / self.bytes_recorded)
+
+def _bench_case(name, writer, reports, rate, path):
+    """Feed `reports` at `rate`, timing every write() call on the reader."""
+    from capture_file import CaptureReader
+
+    latencies = []
+    interval_ns = int(1e9 / rate)
+    start = time.monotonic_ns()
+    for i, report in enumerate(reports):
+        due = start + i * interval_ns
+        delay = due - time.monotonic_ns()
+        if delay > 1_000_000:
+            time.sleep(delay / 1e9)
+        begin = time.perf_counter_ns()
+        writer.write(report, due)
+        latencies.append(time.perf_counter_ns() - begin)
+    close_start = time.perf_counter()
+    writer.close()
+    close_time = time.perf_counter() - close_start
+    stored = len(CaptureReader(path))
+    print(f"  {name:26s} {_percentile(latencies, 0.5) / 1e3:7.1f} {_percentile(latencies, 0.99) / 1e3:9.1f} "
+          f"{max(latencies) / 1e6:9.2f}  {writer.dropped:6d} {stored:7d} {writer.writes:7d} "
+          f"{writer.fsyncs:5d}  {writer.write_amplification:5.2f}x  {close_time * 1000:6.0f}")
+    if stored != writer.count:
+        print(f"    stored {stored} records, expected {writer.count}")
+    return writer
+
+def run_benchmark(seconds=4.0, rate=1000.0):
+    """Reader-side write() latency and disk traffic, fast and simulated slow disk."""
+    import tempfile
+    from synth_wheel import SyntheticWheel
+
+    reports = [r for r, _ in SyntheticWheel(rate, noise=8).generate(int(seconds * rate))]
+    data_rate = rate * RECORD_SIZE
+    # Slow disk: 0.5 ms per call, 2 MB/s, 30 ms fsync, 300 ms stall every second.
+    # The starved disk can't even keep up with the data rate
+    slow = lambda: SlowDisk()
+    starved = lambda: SlowDisk(bandwidth=data_rate * 0.5, stall_time=0.5)
+    print("=" * 100)
+    print(f"Capture recorder benchmark: {len(reports)} reports at {rate:g} Hz "
+          f"({data_rate / 1e3:.0f} KB/s), fsync every {DEFAULT_FSYNC_INTERVAL:g} s")
+    print("=" * 100)
+    print(f"  {'':26s} {'write() us':>17s} {'max ms':>9s}  {'dropped':>6s} {'stored':>7s} "
+          f"{'writes':>7s} {'fsync':>5s}  {'ampl':>6s}  {'close ms':>6s}")
+    print(f"  {'':26s} {'p50':>7s} {'p99':>9s}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.hcap')
+        cases = (
+            ('naive, real disk', lambda: _NaiveWriter(path, OSDisk())),
+            ('naive, slow disk', lambda: _NaiveWriter(path, slow())),
+            ('background, real disk', lambda: BackgroundCaptureWriter(path)),
+            ('background, slow disk', lambda: BackgroundCaptureWriter(path, disk=slow())),
+            ('block, starved disk', lambda: BackgroundCaptureWriter(path, BLOCK, depth=4, disk=starved())),
+            ('drop, starved disk', lambda: BackgroundCaptureWriter(path, DROP, depth=4, disk=starved())),
+        )
+        for name, make in cases:
+            writer = _bench_case(name, make(), reports, rate, path)
+            if getattr(writer, 'drop_spans', None):
+                origin = writer.drop_spans[0][0]
+                spans = ', '.join(f"{(first - origin) / 1e9:.2f}-{(last - origin) / 1e9:.2f} s ({n})"
+                                  for first, last, n in writer.drop_spans[:4])
+                print(f"    drop spans (from the first drop): {spans}")
+    print()
+    print(f"Memory bound: {DEFAULT_DEPTH} x {BATCH_RECORDS * RECORD_SIZE // 1024} KiB batches "
+          f"+ {WRITE_SIZE // 1024} KiB staging (+ one batch)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Background capture recorder")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('bench', help='reader latency and write amplification, real and slow disk')
+    p.add_argument('--seconds', type=float, default=4.0)
+    p.add_argument('--rate', type=float, default=1000.0)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(args.seconds, args.rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Device/Host Clock Correlation
+
+Every report can carry two timestamps: when the device side says it
+happened (USB completion time, a frame counter, the recorded device_ns of a
+capture) and when the host read it (time.monotonic_ns()). The two clocks
+differ by an offset and a drift of tens of ppm, and the host side adds
+scheduling jitter that is always positive - a report is never read before
+it completed, but is sometimes read milliseconds late.
+
+ClockCorrelator estimates host = offset + slope * device online:
+
+    - each block of BLOCK samples contributes its least-delayed sample
+      (the one with the lowest residual), which filters out the jitter
+    - a least-squares line through the last BLOCKS of those minima, refit
+      through the half lying below it (the lower envelope: block minima
+      still carry tick truncation), gives the slope (drift); the line then
+      moves down onto the lowest minimum so corrected times sit on the
+      delay floor
+
+That is O(1) per sample plus a small fit every BLOCK samples. The
+corrected time of a report is its device timestamp mapped into the host
+clock. Two devices mapped this way align to the difference of their
+minimum transfer latencies, which is constant, instead of to their read
+jitter.
+
+Devices expose their clock by setting `device_ns` after each read
+(SyntheticDevice, ReplayDevice); Timestamper pairs it with the host clock.
+
+Usage:
+    python3 clock_sync.py simulate [--skew-ppm 80] [--jitter-us 150] [--seconds 600]
+    python3 clock_sync.py analyze capture.hcap
+    python3 clock_sync.py bench [--samples N]
+"""
+
+import random
+import sys
+import time
+import argparse
+from collections import deque
+
+# Samples per block; each block keeps its least-delayed sample
+BLOCK = 256
+# Block minima in the line fit (BLOCK * BLOCKS samples, ~33 s at 1 kHz).
+# Device ticks are coarse (125 us microframes, 1 ms frames), so the drift
+# needs a long baseline: a 125 us step over 33 s is ~4 ppm
+BLOCKS = 128
+
+def _least_squares(points):
+    """(slope, intercept) of the least-squares line through (x, y) points."""
+    n = len(points)
+    if n < 2:
+        return None
+    mean_x = sum(p[0] for p in points) / n
+    mean_y = sum(p[1] for p in points) / n
+    sxx = sxy = 0.0
+    for x, y in points:
+        dx = x - mean_x
+        sxx += dx * dx
+        sxy += dx * (y - mean_y)
+    if sxx <= 0:
+        return None
+    slope = sxy / sxx
+    return slope, mean_y - slope * mean_x
+
+class ClockCorrelator:
+    """Online linear map from a device clock to the host monotonic clock (ns)."""
+
+    def __init__(self, block=BLOCK, blocks=BLOCKS, resolution_ns=0):
+        self.block = block
+        self.resolution_ns = resolution_ns   # device tick, 0 if unknown or exact
+        self.points = deque(maxlen=blocks)
+        self.slope = 1.0
+        self.intercept = 0.0
+        self.samples = 0
+        self.fits = 0
+        self._device0 = None
+        self._host0 = 0
+        self._last_x = 0
+        self._count = 0
+        self._best = None
+        self._best_residual = 0.0
+
+    @property
+    def ready(self):
+        """True once the drift has been fitted (two blocks)."""
+        return self.fits > 0
+
+    @property
+    def drift_ppm(self):
+        """How fast the device clock runs relative to the host clock."""
+        return (1.0 / self.slope - 1.0) * 1e6
+
+    @property
+    def offset_ns(self):
+        """host - device at the most recent sample."""
+        if self._device0 is None:
+            return 0
+        return self._host0 - self._device0 + round(self.intercept + (self.slope - 1.0) * self._last_x)
+
+    def observe(self, device_ns, host_ns):
+        """Add one (device, host) timestamp pair."""
+        if self._device0 is None:
+            self._device0 = device_ns
+            self._host0 = host_ns
+        x = device_ns - self._device0
+        y = host_ns - self._host0
+        self._last_x = x
+        self.samples += 1
+        residual = y - (self.slope * x + self.intercept)
+        if self._best is None or residual < self._best_residual:
+            self._best = (x, y)
+            self._best_residual = residual
+        if residual < 0 and not self.fits:
+            # Until there is a fit, track the delay floor directly
+            self.intercept += residual
+        self._count += 1
+        if self._count >= self.block:
+            self.points.append(self._best)
+            self._best = None
+            self._count = 0
+            self._fit()
+
+    def _fit(self):
+        points = self.points
+        n = len(points)
+        if n < 2:
+            x, y = points[0]
+            self.intercept = y - self.slope * x
+            return
+        line = _least_squares(points)
+        if line is None:
+            return
+        slope, intercept = line
+        if n >= 8:
+            below = [(x, y) for x, y in points if y <= slope * x + intercept]
+            line = _least_squares(below)
+            if line is not None:
+                slope, intercept = line
+        # Down onto the lowest block minimum: the line is the delay floor
+        intercept += min(y - (slope * x + intercept) for x, y in points)
+        self.slope = slope
+        self.intercept = intercept
+        self.fits += 1
+
+    def to_host(self, device_ns):
+        """A device timestamp in the host clock (ns)."""
+        if self._device0 is None:
+            return device_ns
+        return self._host0 + round(self.intercept + self.slope * (device_ns - self._device0))
+
+    def corrected(self, device_ns, host_ns):
+        """Best host-clock time of a report read at host_ns.
+
+        A device stamp truncated to resolution_ns ticks says the report
+        happened up to one tick after to_host(); it can't have happened
+        after it was read either, so take the middle of what is left.
+        """
+        floor = self.to_host(device_ns)
+        if not self.resolution_ns:
+            return floor
+        span = min(self.resolution_ns * self.slope, max(0, host_ns - floor))
+        return floor + round(span / 2)
+
+    def excess_latency(self, device_ns, host_ns):
+        """How much later than the delay floor a report was read (ns)."""
+        return host_ns - self.to_host(device_ns)
+
+    def summary(self):
+        if not self.ready:
+            return f"{self.samples} samples, not fitted yet"
+        return (f"drift {self.drift_ppm:+.2f} ppm, offset {self.offset_ns / 1e6:+.3f} ms "
+                f"over {self.samples} samples")
+
+class Timestamper:
+    """Host and device timestamps for each read, with the device clock correlated.
+
+    Call stamp() right after a read. Devices without a clock (the real wheel
+    through pyusb) get device_ns 0 and corrected == host.
+    """
+
+    def __init__(self, dev, correlator=None, clock=time.monotonic_ns):
+        self.dev = dev
+        self.correlator = correlator if correlator is not None else ClockCorrelator()
+        self.clock = clock
+
+    def stamp(self):
+        """(host_ns, device_ns, corrected_ns) for the report just read."""
+        host_ns = self.clock()
+        device_ns = getattr(self.dev, 'device_ns', 0)
+        if not device_ns:
+            return host_ns, 0, host_ns
+        self.correlator.observe(device_ns, host_ns)
+        return host_ns, device_ns, self.correlator.corrected(device_ns, host_ns)
+
+class SimulatedClock:
+    """A device clock with known skew, offset, tick resolution and read jitter.
+
+    sample(true_ns) returns (device_ns, host_ns) for an event at true host
+    time true_ns: the device timestamp runs `skew_ppm` fast from `offset_ns`
+    and is truncated to `resolution_ns` ticks; the host reads it after
+    `base_us` plus exponential jitter (mean `jitter_us`), and with
+    probability `spike_rate` after an extra 1-10 ms scheduling stall.
+    """
+
+    def __init__(self, skew_ppm=80.0, offset_ns=12_345_678_901, resolution_ns=125_000,
+                 base_us=120.0, jitter_us=150.0, spike_rate=0.01, seed=0):
+        self.skew = skew_ppm * 1e-6
+        self.offset_ns = offset_ns
+        self.resolution_ns = resolution_ns
+        self.base_ns = base_us * 1000
+        self.jitter_ns = jitter_us * 1000
+        self.spike_rate = spike_rate
+        self._random = random.Random(seed)
+
+    def device_time(self, true_ns):
+        device = self.offset_ns + true_ns * (1.0 + self.skew)
+        if self.resolution_ns:
+            device -= device % self.resolution_ns
+        return int(device)
+
+    def sample(self, true_ns):
+        delay = self.base_ns + self._random.expovariate(1.0 / self.jitter_ns) if self.jitter_ns else self.base_ns
+        if self._random.random() < self.spike_rate:
+            delay += self._random.uniform(1e6, 10e6)
+        return self.device_time(true_ns), int(true_ns + delay)
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] if ordered else float('nan')
+
+def simulate(seconds=600.0, rate=1000.0, skew_ppm=80.0, jitter_us=150.0, spike_rate=0.01,
+             resolution_us=125.0, warmup=40.0, seed=0):
+    """Estimate a simulated clock and report corrected-time error against the truth."""
+    clocks = (SimulatedClock(skew_ppm, resolution_ns=int(resolution_us * 1000),
+                             jitter_us=jitter_us, spike_rate=spike_rate, seed=seed),
+              SimulatedClock(-skew_ppm / 2, offset_ns=-987_654_321, resolution_ns=int(resolution_us * 1000),
+                             jitter_us=jitter_us, spike_rate=spike_rate, seed=seed + 1))
+    resolution_ns = int(resolution_us * 1000)
+    correlators = (ClockCorrelator(resolution_ns=resolution_ns), ClockCorrelator(resolution_ns=resolution_ns))
+    errors = ([], [])
+    naive = []
+    align = []
+    align_naive = []
+    period = 1e9 / rate
+    count = int(seconds * rate)
+    for i in range(count):
+        true_ns = i * period
+        stamps = []
+        for clock, correlator in zip(clocks, correlators):
+            device_ns, host_ns = clock.sample(true_ns)
+            correlator.observe(device_ns, host_ns)
+            stamps.append((device_ns, host_ns))
+        if true_ns < warmup * 1e9:
+            continue
+        # Every 10th report keeps the statistics cheap
+        if i % 10:
+            continue
+        base = clocks[0].base_ns
+        (d0, h0), (d1, h1) = stamps
+        c0 = correlators[0].corrected(d0, h0)
+        c1 = correlators[1].corrected(d1, h1)
+        errors[0].append(abs(c0 - base - true_ns))
+        errors[1].append(abs(c1 - base - true_ns))
+        naive.append(abs(h0 - base - true_ns))
+        align.append(abs(c0 - c1))
+        align_naive.append(abs(h0 - h1))
+
+    print("=" * 80)
+    print(f"Clock correlation ({seconds:g} s at {rate:g} Hz, skew {skew_ppm:+g}/{-skew_ppm / 2:+g} ppm, "
+          f"jitter {jitter_us:g} us, spikes {spike_rate:.1%}, ticks {resolution_us:g} us)")
+    print("=" * 80)
+    print(f"  {'timestamps':34s} {'p50':>9s} {'p99':>9s} {'max':>9s}  (us, after {warmup:g} s warmup)")
+    for label, values in (("host read time (no correction)", naive),
+                          ("correlated, device 1", errors[0]),
+                          ("correlated, device 2", errors[1]),
+                          ("2-device alignment, host reads", align_naive),
+                          ("2-device alignment, correlated", align)):
+        print(f"  {label:34s} {_percentile(values, 0.5) / 1000:9.1f} {_percentile(values, 0.99) / 1000:9.1f} "
+              f"{max(values) / 1000:9.1f}")
+    print()
+    for k, (clock, correlator) in enumerate(zip(clocks, correlators), 1):
+        print(f"  Device {k}: true skew {clock.skew * 1e6:+.2f} ppm, estimated {correlator.drift_ppm:+.2f} ppm")
+    worst = max(max(errors[0]), max(errors[1]), max(align))
+    print(f"  Sub-millisecond: {'yes' if worst < 1e6 else 'NO'} (worst {worst / 1000:.1f} us)")
+    return errors, naive, align
+
+def analyze_capture(path):
+    """Fit a capture's device_ns column against host_ns and show the read jitter."""
+    from capture_file import CaptureReader
+
+    correlator = ClockCorrelator()
+    pairs = []
+    for host_ns, device_ns, _ in CaptureReader(path):
+        if device_ns:
+            correlator.observe(device_ns, host_ns)
+            pairs.append((device_ns, host_ns))
+    if len(pairs) < 2 * BLOCK:
+        print(f"{path}: {len(pairs)} records with device timestamps (need {2 * BLOCK})")
+        return None
+    excess = [correlator.excess_latency(d, h) for d, h in pairs[len(pairs) // 2:]]
+    print(f"{path}: {len(pairs)} records with device timestamps")
+    print(f"  {correlator.summary()}")
+    print(f"  Read delay above the floor (second half): p50 {_percentile(excess, 0.5) / 1000:.1f} us, "
+          f"p99 {_percentile(excess, 0.99) / 1000:.1f} us, max {max(excess) / 1000:.1f} us")
+    return correlator
+
+def run_benchmark(samples=500000):
+    """Cost of observe() and to_host() per sample."""
+    clock = SimulatedClock()
+    pairs = [clock.sample(i * 1e6) for i in range(samples)]
+    correlator = ClockCorrelator()
+    start = time.perf_counter_ns()
+    for device_ns, host_ns in pairs:
+        correlator.observe(device_ns, host_ns)
+    observe = (time.perf_counter_ns() - start) / samples
+    start = time.perf_counter_ns()
+    for device_ns, _ in pairs:
+        correlator.to_host(device_ns)
+    to_host = (time.perf_counter_ns() - start) / samples
+    print(f"observe(): {observe:6.0f} ns/sample   to_host(): {to_host:6.0f} ns/sample   "
+          f"({samples} samples, {correlator.fits} fits)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Device/host clock correlation")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('simulate', help='validate against clocks with known skew and jitter')
+    p.add_argument('--seconds', type=float, default=600.0)
+    p.add_argument('--rate', type=float, default=1000.0)
+    p.add_argument('--skew-ppm', type=float, default=80.0)
+    p.add_argument('--jitter-us', type=float, default=150.0)
+    p.add_argument('--spike-rate', type=float, default=0.01)
+    p.add_argument('--resolution-us', type=float, default=125.0,
+                   help='device timestamp tick (default: 125 us, a USB microframe)')
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('analyze', help='drift and read jitter of a capture with device timestamps')
+    p.add_argument('path')
+    p = sub.add_parser('bench', help='per-sample cost of the filter')
+    p.add_argument('--samples', type=int, default=500000)
+    args = parser.parse_args()
+
+    if args.command == 'simulate':
+        simulate(args.seconds, args.rate, args.skew_ppm, args.jitter_us, args.spike_rate,
+                 args.resolution_us, seed=args.seed)
+    elif args.command == 'analyze':
+        try:
+            analyze_capture(args.path)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    elif args.command == 'bench':
+        run_benchmark(args.samples)
+
+if __name__ == "__main__":
+    main()
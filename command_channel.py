@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Output/Feature Report Command Channel
+
+The wheel's descriptor declares an 8-byte vendor feature report (usage page
+0xFF00, usage 0x2621, no report ID), but nothing could send it. This is an
+asynchronous channel for HID SET_REPORT control transfers:
+
+    - callers enqueue and return immediately; a daemon thread does the writes
+    - a command still waiting for the same report (kind + report ID) is
+      replaced rather than queued behind it, so only the latest state is
+      ever sent (LED or vendor-feature updates are state, not events)
+    - writes are paced by a token bucket, so a burst of commands can never
+      keep the device busy on EP0 long enough to delay the interrupt IN
+      stream read by another thread
+    - queue depth, coalesced commands and enqueue-to-written latency are
+      tracked for summary() and register_metrics()
+
+Writes that fail because the wheel is away (see usb_session) are retried
+unless a newer command for the same report has arrived.
+
+Usage:
+    sudo python3 command_channel.py feature 00 00 00 00 00 00 00 00 [--get]
+    python3 command_channel.py bench [--commands N]
+"""
+
+import array
+import errno
+import sys
+import threading
+import time
+import argparse
+from collections import deque, namedtuple
+
+# HID class requests (HID 1.11, 7.2)
+SET_REPORT_REQUEST_TYPE = 0x21   # host-to-device, class, interface
+GET_REPORT_REQUEST_TYPE = 0xA1   # device-to-host, class, interface
+GET_REPORT = 0x01
+SET_REPORT = 0x09
+REPORT_TYPES = {'input': 1, 'output': 2, 'feature': 3}
+
+# The vendor feature report declared by the descriptor
+FEATURE_USAGE = 0xFF002621
+FEATURE_REPORT_SIZE = 8
+
+CONTROL_TIMEOUT_MS = 100
+
+# Give up on a command after this many failed writes
+MAX_ATTEMPTS = 3
+
+Command = namedtuple('Command', 'kind report_id payload queued_ns attempts')
+
+class CommandChannel:
+    """Queue of output/feature reports written from a background thread.
+
+    `dev` needs a pyusb-style ctrl_transfer(). At most `burst` writes go out
+    back to back; after that they are spaced `min_interval` seconds apart.
+    """
+
+    LATENCY_SAMPLES = 4096
+
+    def __init__(self, dev, interface=0, min_interval=0.01, burst=4,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.dev = dev
+        self.interface = interface
+        self.min_interval = min_interval
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.submitted = 0
+        self.coalesced = 0
+        self.written = 0
+        self.retries = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.last_error = None
+        self.latency_ns = array.array('q', bytes(8 * self.LATENCY_SAMPLES))
+        self._pending = {}          # (kind, report_id) -> Command
+        self._order = deque()       # keys in first-queued order
+        self._cond = threading.Condition()
+        self._tokens = float(burst)
+        self._refilled = clock()
+        self._busy = False
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def depth(self):
+        return len(self._pending)
+
+    def submit(self, kind, payload, report_id=0):
+        """Queue a report write; replaces a still-queued one for the same report."""
+        if kind not in ('output', 'feature'):
+            raise ValueError(f"can only write output or feature reports, not {kind!r}")
+        if kind == 'feature' and report_id == 0 and len(payload) != FEATURE_REPORT_SIZE:
+            raise ValueError(f"feature report is {FEATURE_REPORT_SIZE} bytes, got {len(payload)}")
+        key = (kind, report_id)
+        command = Command(kind, report_id, bytes(payload), time.perf_counter_ns(), 0)
+        with self._cond:
+            self.submitted += 1
+            if key in self._pending:
+                self.coalesced += 1
+            else:
+                self._order.append(key)
+            self._pending[key] = command
+            self.max_depth = max(self.max_depth, len(self._pending))
+            self._cond.notify()
+
+    def send_feature(self, payload, report_id=0):
+        self.submit('feature', payload, report_id)
+
+    def send_output(self, payload, report_id=0):
+        self.submit('output', payload, report_id)
+
+    def get_feature(self, report_id=0, size=FEATURE_REPORT_SIZE):
+        """Synchronous GET_REPORT of a feature report (bypasses the queue)."""
+        return bytes(self.dev.ctrl_transfer(GET_REPORT_REQUEST_TYPE, GET_REPORT,
+                                            (REPORT_TYPES['feature'] << 8) | report_id,
+                                            self.interface, size, CONTROL_TIMEOUT_MS))
+
+    def _wait_for_token(self):
+        """Block until the rate limit allows another write; the token is not taken."""
+        while True:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) / self.min_interval)
+            self._refilled = now
+            if self._tokens >= 1:
+                return
+            self.sleep((1 - self._tokens) * self.min_interval)
+
+    def _write(self, command):
+        value = (REPORT_TYPES[command.kind] << 8) | command.report_id
+        self.dev.ctrl_transfer(SET_REPORT_REQUEST_TYPE, SET_REPORT, value, self.interface,
+                               command.payload, CONTROL_TIMEOUT_MS)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._pending:
+                    return
+            # Wait for the rate limit before taking the command, so anything
+            # that supersedes it in the meantime is what gets written. The
+            # token is only spent once there is a command to write
+            self._wait_for_token()
+            with self._cond:
+                if not self._order:
+                    continue
+                key = self._order.popleft()
+                command = self._pending.pop(key)
+                self._busy = True
+            self._tokens -= 1
+            try:
+                self._write(command)
+            except OSError as e:
+                self.last_error = e
+                with self._cond:
+                    self._busy = False
+                    # Retry unless a newer command for the report is already queued
+                    if key not in self._pending and command.attempts + 1 < MAX_ATTEMPTS:
+                        self.retries += 1
+                        self._pending[key] = command._replace(attempts=command.attempts + 1)
+                        self._order.append(key)
+                    else:
+                        self.failed += 1
+                    self._cond.notify_all()
+                if e.errno == errno.ENODEV:
+                    self.sleep(self.min_interval * 10)
+                continue
+            except Exception as e:
+                # Not a transfer failure (a bad payload, a broken backend):
+                # drop the command but keep the thread, so flush() returns
+                self.last_error = e
+                with self._cond:
+                    self._busy = False
+                    self.failed += 1
+                    self._cond.notify_all()
+                continue
+            latency = time.perf_counter_ns() - command.queued_ns
+            with self._cond:
+                self.latency_ns[self.written % self.LATENCY_SAMPLES] = latency
+                self.written += 1
+                self._busy = False
+                self._cond.notify_all()
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='commands', daemon=True)
+        self._thread.start()
+        return self
+
+    def flush(self, timeout=None):
+        """Wait until every queued command has been written (or dropped). Returns True if so."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+    def stop(self, flush=True):
+        """Stop the writer thread, by default after writing what is queued."""
+        if self._thread is None:
+            return
+        if flush:
+            self.flush(timeout=5.0)
+        with self._cond:
+            self._stopping = True
+            if not flush:
+                self._pending.clear()
+                self._order.clear()
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def latency_percentiles(self, *percentiles):
+        """Enqueue-to-written latency in seconds at the given percentiles (recent writes)."""
+        n = min(self.written, self.LATENCY_SAMPLES)
+        if not n:
+            return [float('nan')] * len(percentiles)
+        samples = sorted(self.latency_ns[:n])
+        return [samples[min(n - 1, int(p / 100 * n))] / 1e9 for p in percentiles]
+
+    def register_metrics(self, registry):
+        """Expose queue depth, command counts and write latency on a metrics.Registry."""
+        registry.function('hori_commands_queued', 'Commands waiting to be written',
+                          lambda: self.depth)
+        for attr, name, help in (
+                ('submitted', 'hori_commands_submitted_total', 'Commands submitted'),
+                ('written', 'hori_commands_written_total', 'Commands written to the wheel'),
+                ('coalesced', 'hori_commands_coalesced_total', 'Commands replaced by a newer one before the write'),
+                ('retries', 'hori_commands_retried_total', 'Failed writes queued again'),
+                ('failed', 'hori_commands_failed_total', 'Commands given up on')):
+            registry.function(name, help, lambda attr=attr: getattr(self, attr), kind='counter')
+        for p in (50, 99):
+            registry.function('hori_command_latency_seconds', 'Submit-to-written latency (recent writes)',
+                              lambda p=p: self.latency_percentiles(p)[0], labels={'quantile': str(p / 100)})
+        return registry
+
+    def summary(self):
+        """One line, e.g. 'queued 0 (max 2), written 100, coalesced 900, ... p50 10.2ms'."""
+        p50, p99 = self.latency_percentiles(50, 99)
+        return (f"queued {self.depth} (max {self.max_depth}), submitted {self.submitted}, "
+                f"written {self.written}, coalesced {self.coalesced}, retries {self.retries}, "
+                f"failed {self.failed}, latency p50 {p50 * 1000:.2f}ms p99 {p99 * 1000:.2f}ms")
+
+class MockDevice:
+    """Records control transfers; IN reads come from a SyntheticDevice.
+
+    Each control transfer keeps the mock busy for `transfer_time` seconds,
+    and an IN read that arrives meanwhile waits for it, the way a device
+    servicing EP0 is late with its next interrupt report. `fail` is an
+    optional errno raised by the next that many transfers.
+    """
+
+    def __init__(self, inner=None, transfer_time=0.001, feature=None):
+        self.inner = inner
+        self.transfer_time = transfer_time
+        self.transfers = []
+        self.feature = bytearray(feature or bytes(FEATURE_REPORT_SIZE))
+        self.fail = None
+        self.fail_count = 0
+        self._busy = threading.Lock()
+
+    def ctrl_transfer(self, request_type, request, value=0, index=0, data_or_length=None,
+                      timeout=None):
+        with self._busy:
+            if self.fail_count:
+                self.fail_count -= 1
+                raise OSError(self.fail, "mock transfer failure")
+            # Spin rather than sleep: USB turnaround is shorter than a timer tick
+            end = time.perf_counter() + self.transfer_time
+            while time.perf_counter() < end:
+                pass
+            self.transfers.append((time.monotonic(), request_type, request, value, index,
+                                   bytes(data_or_length) if not isinstance(data_or_length, int)
+                                   else data_or_length))
+            if request_type == GET_REPORT_REQUEST_TYPE:
+                return array.array('B', self.feature[:data_or_length])
+            if request == SET_REPORT and value >> 8 == REPORT_TYPES['feature']:
+                self.feature[:] = data_or_length
+            return len(data_or_length)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        with self._busy:
+            pass
+        return self.inner.read(endpoint, size_or_buffer, timeout)
+
+def _in_stream_gaps(dev, seconds):
+    """Read a realtime IN stream on this thread; returns the inter-report gaps in seconds."""
+    gaps = []
+    buffer = array.array('B', bytes(64))
+    end = time.perf_counter() + seconds
+    last = None
+    while True:
+        dev.read(0x81, buffer, 100)
+        now = time.perf_counter()
+        if last is not None:
+            gaps.append(now - last)
+        last = now
+        if now >= end:
+            return gaps
+
+def run_benchmark(commands=2000, seconds=2.0, rate=1000):
+    """Flood the channel while a 1 kHz IN stream is read, with and without pacing."""
+    from synth_wheel import SyntheticDevice, SyntheticWheel
+
+    print("=" * 80)
+    print(f"Command channel benchmark ({commands} feature writes over {seconds:g} s, "
+          f"{rate:g} Hz IN stream, 1 ms per control transfer)")
+    print("=" * 80)
+    for name, min_interval, burst in (('unpaced (no rate limit)', 1e-9, 1 << 30),
+                                      ('paced 10 ms, burst 4', 0.01, 4)):
+        dev = MockDevice(SyntheticDevice(SyntheticWheel(rate), realtime=True))
+        channel = CommandChannel(dev, min_interval=min_interval, burst=burst).start()
+
+        def flood():
+            interval = seconds / commands
+            for i in range(commands):
+                # LED-style state updates: a few distinct values, mostly superseded
+                channel.send_feature(bytes([i & 0x07]) + bytes(7))
+                time.sleep(interval)
+
+        producer = threading.Thread(target=flood, daemon=True)
+        producer.start()
+        gaps = sorted(_in_stream_gaps(dev, seconds))
+        producer.join()
+        channel.stop()
+        expected = 1.0 / rate
+        late = sum(1 for g in gaps if g > 1.5 * expected)
+        print(f"  {name}")
+        print(f"    channel:   {channel.summary()}")
+        print(f"    IN stream: {len(gaps)} gaps, p99 {gaps[len(gaps) * 99 // 100] * 1000:.2f} ms, "
+              f"max {gaps[-1] * 1000:.2f} ms, {late} reports late by >50%")
+        print(f"    last feature written: {dev.feature.hex(' ')} "
+              f"(last submitted: {bytes([(commands - 1) & 0x07]).hex()} 00 ...)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel output/feature report channel")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('feature', help='write (and optionally read back) the 8-byte feature report')
+    p.add_argument('data', nargs=FEATURE_REPORT_SIZE, help='payload bytes in hex')
+    p.add_argument('--get', action='store_true', help='read the feature report back afterwards')
+    p = sub.add_parser('bench', help='flood the channel against a mock device')
+    p.add_argument('--commands', type=int, default=2000)
+    p.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(args.commands, args.seconds)
+        return
+
+    payload = bytes(int(b, 16) for b in args.data)
+    from test_wheel import INTERFACE_NUM, open_device
+    dev, _ = open_device()
+    channel = CommandChannel(dev, INTERFACE_NUM).start()
+    channel.send_feature(payload)
+    channel.stop()
+    print(f"Feature report 0x{FEATURE_USAGE & 0xFFFF:04X}: {channel.summary()}")
+    if channel.failed:
+        print(f"Error: write failed: {channel.last_error}")
+        sys.exit(1)
+    if args.get:
+        print(f"Read back: {channel.get_feature().hex(' ')}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Live Web Dashboard
+
+Serves the wheel's live state to browsers (pit-wall screens) over
+WebSocket, standard library only. Open http://HOST:PORT/ for the built-in
+page, or connect to ws://HOST:PORT/ws?fps=N from anything else.
+
+The reader does the same work however many clients are connected: it
+overwrites one 8-byte packed state (wheel_state.STATE_STRUCT) per report.
+Each client's connection thread wakes at that client's render rate, so
+reports that arrive between two frames are coalesced into one, and
+nothing is sent when the state hasn't changed.
+
+Frames are binary and carry only the state bytes that differ from the
+last frame the client acknowledged:
+
+    server -> client   'S' seq:u32 state:8              full snapshot
+                       'D' seq:u32 base:u32 mask:u8 ... changed bytes, in order
+    client -> server   'A' seq:u32                      acknowledge frame seq
+                       'R' fps:u32                      change render rate
+
+A client that has acknowledged nothing yet (a late joiner) gets a
+snapshot. At most MAX_UNACKED frames are in flight per client; a client
+that stops acknowledging stops receiving until it catches up.
+
+Usage:
+    sudo python3 dashboard.py serve [--port 8765] [--host 127.0.0.1]
+    python3 dashboard.py serve --synthetic 1000
+    python3 dashboard.py bench [--clients 0,12,48] [--fps 30] [--seconds 3]
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import select
+import socket
+import struct
+import hashlib
+import argparse
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from report_source import DispatchPolicy
+from wheel_state import STATE_SIZE
+
+DEFAULT_PORT = 8765
+DEFAULT_FPS = 30
+MAX_FPS = 120
+
+# Frames sent but not yet acknowledged before a client is paused
+MAX_UNACKED = 16
+
+# A client whose socket won't take a frame for this long is dropped
+SEND_TIMEOUT = 2.0
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+SNAPSHOT = struct.Struct('<cI8s')
+DELTA = struct.Struct('<cIIB')
+CLIENT_MESSAGE = struct.Struct('<cI')
+
+# WebSocket opcodes
+OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+class LiveState:
+    """The newest wheel state, shared by the reader and every client.
+
+    update() is the only per-report work; one bytes assignment is atomic,
+    so readers need no lock. Reports too short to decode are ignored.
+    """
+
+    def __init__(self):
+        self.packed = bytes(STATE_SIZE)
+        self.reports = 0
+        self.closed = False
+
+    def update(self, report):
+        """Publish a report's state. Returns False if it is too short."""
+        if len(report) < STATE_SIZE:
+            return False
+        self.packed = bytes(report[:STATE_SIZE])
+        self.reports += 1
+        return True
+
+def encode_frame(payload, opcode=OP_BINARY, mask=False):
+    """One unfragmented WebSocket frame (clients must mask, servers must not)."""
+    n = len(payload)
+    header = bytearray([0x80 | opcode])
+    bit = 0x80 if mask else 0
+    if n < 126:
+        header.append(bit | n)
+    elif n < 65536:
+        header.append(bit | 126)
+        header += struct.pack('>H', n)
+    else:
+        header.append(bit | 127)
+        header += struct.pack('>Q', n)
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = bytes(b ^ key[i & 3] for i, b in enumerate(payload))
+    return bytes(header) + payload
+
+def _recv_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+def read_frame(sock):
+    """Read one frame. Returns (opcode, payload); control frames included."""
+    first, second = _recv_exact(sock, 2)
+    opcode = first & 0x0F
+    n = second & 0x7F
+    if n == 126:
+        n = struct.unpack('>H', _recv_exact(sock, 2))[0]
+    elif n == 127:
+        n = struct.unpack('>Q', _recv_exact(sock, 8))[0]
+    key = _recv_exact(sock, 4) if second & 0x80 else None
+    payload = _recv_exact(sock, n) if n else b''
+    if key:
+        payload = bytes(b ^ key[i & 3] for i, b in enumerate(payload))
+    return opcode, payload
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+def encode_state(state, seq, base=None, base_seq=0):
+    """A snapshot of `state`, or a delta against `base` if one is given."""
+    if base is None:
+        return SNAPSHOT.pack(b'S', seq, state)
+    mask = 0
+    changed = bytearray()
+    for i in range(STATE_SIZE):
+        if state[i] != base[i]:
+            mask |= 1 << i
+            changed.append(state[i])
+    return DELTA.pack(b'D', seq, base_seq, mask) + changed
+
+def apply_frame(payload, states):
+    """Decode a server frame given {seq: state} of earlier frames. Returns (seq, state)."""
+    if payload[:1] == b'S':
+        _, seq, state = SNAPSHOT.unpack(payload)
+        return seq, state
+    _, seq, base_seq, mask = DELTA.unpack_from(payload)
+    state = bytearray(states[base_seq])
+    values = iter(payload[DELTA.size:])
+    for i in range(STATE_SIZE):
+        if mask & (1 << i):
+            state[i] = next(values)
+    return seq, bytes(state)
+
+class ClientSession:
+    """One WebSocket client: sends coalesced deltas at its render rate."""
+
+    def __init__(self, sock, live, fps=DEFAULT_FPS, address=None):
+        self.sock = sock
+        self.live = live
+        self.fps = fps
+        self.address = address
+        self.seq = 0
+        self.acked_seq = 0
+        self.acked_state = None
+        self.unacked = {}            # seq -> state, frames in flight
+        self.last_sent = None
+        self.frames = 0
+        self.snapshots = 0
+        self.bytes_sent = 0
+        self.paused = 0              # ticks skipped waiting for acks
+        self.open = True
+
+    def _send(self, payload, opcode=OP_BINARY):
+        self.sock.sendall(encode_frame(payload, opcode))
+
+    def tick(self):
+        """Send the current state if it changed since the last frame."""
+        state = self.live.packed
+        if state == self.last_sent:
+            return
+        if len(self.unacked) >= MAX_UNACKED:
+            self.paused += 1
+            return
+        self.seq += 1
+        if self.acked_state is None:
+            payload = encode_state(state, self.seq)
+            self.snapshots += 1
+        else:
+            payload = encode_state(state, self.seq, self.acked_state, self.acked_seq)
+        self._send(payload)
+        self.unacked[self.seq] = state
+        self.last_sent = state
+        self.frames += 1
+        self.bytes_sent += len(payload) + 2
+
+    def receive(self):
+        """Handle one incoming frame. Returns False when the client has gone."""
+        opcode, payload = read_frame(self.sock)
+        if opcode == OP_CLOSE:
+            self._send(payload[:2], OP_CLOSE)
+            return False
+        if opcode == OP_PING:
+            self._send(payload, OP_PONG)
+        elif opcode in (OP_BINARY, OP_TEXT) and len(payload) == CLIENT_MESSAGE.size:
+            kind, value = CLIENT_MESSAGE.unpack(payload)
+            if kind == b'A' and value in self.unacked:
+                self.acked_seq = value
+                self.acked_state = self.unacked[value]
+                self.unacked = {s: v for s, v in self.unacked.items() if s > value}
+            elif kind == b'R':
+                self.fps = min(max(value, 1), MAX_FPS)
+        return True
+
+    def serve(self):
+        """Run until the client disconnects or the dashboard stops."""
+        self.sock.settimeout(SEND_TIMEOUT)
+        next_tick = time.monotonic()
+        try:
+            while not self.live.closed:
+                wait = next_tick - time.monotonic()
+                if wait > 0:
+                    readable, _, _ = select.select([self.sock], [], [], wait)
+                    if readable:
+                        if not self.receive():
+                            break
+                        continue
+                next_tick += 1.0 / self.fps
+                now = time.monotonic()
+                if next_tick < now:
+                    next_tick = now + 1.0 / self.fps
+                self.tick()
+        except (OSError, ConnectionError, struct.error):
+            pass
+        finally:
+            self.open = False
+
+class DashboardServer:
+    """Serves the page at / and WebSocket clients at /ws from daemon threads."""
+
+    def __init__(self, live, port=DEFAULT_PORT, host='127.0.0.1', fps=DEFAULT_FPS):
+        self.live = live
+        self.sessions = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                url = urlsplit(handler.path)
+                if url.path == '/':
+                    body = PAGE.encode()
+                    handler.send_response(200)
+                    handler.send_header('Content-Type', 'text/html; charset=utf-8')
+                    handler.send_header('Content-Length', str(len(body)))
+                    handler.end_headers()
+                    handler.wfile.write(body)
+                elif url.path == '/ws':
+                    key = handler.headers.get('Sec-WebSocket-Key')
+                    if handler.headers.get('Upgrade', '').lower() != 'websocket' or not key:
+                        handler.send_error(400, "expected a WebSocket upgrade")
+                        return
+                    try:
+                        rate = int(parse_qs(url.query).get('fps', [fps])[0])
+                    except ValueError:
+                        rate = fps
+                    handler.send_response(101)
+                    handler.send_header('Upgrade', 'websocket')
+                    handler.send_header('Connection', 'Upgrade')
+                    handler.send_header('Sec-WebSocket-Accept', accept_key(key))
+                    handler.end_headers()
+                    handler.wfile.flush()
+                    handler.close_connection = True
+                    session = ClientSession(handler.connection, live, min(max(rate, 1), MAX_FPS),
+                                            handler.client_address)
+                    with server.lock:
+                        server.sessions = [s for s in server.sessions if s.open] + [session]
+                    session.serve()
+                else:
+                    handler.send_error(404)
+
+            def log_message(handler, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='dashboard', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def clients(self):
+        return [s for s in self.sessions if s.open]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.live.closed = True
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def summary(self):
+        sessions = self.sessions
+        frames = sum(s.frames for s in sessions)
+        sent = sum(s.bytes_sent for s in sessions)
+        return (f"{len(sessions)} clients served, {frames} frames "
+                f"({sum(s.snapshots for s in sessions)} snapshots), {sent} bytes, "
+                f"{sum(s.paused for s in sessions)} ticks paused for acks")
+
+class DashboardClient:
+    """Minimal Python client: reconstructs the state and acks every frame."""
+
+    def __init__(self, host, port, fps=DEFAULT_FPS):
+        self.sock = socket.create_connection((host, port))
+        key = base64.b64encode(os.urandom(16)).decode()
+        self.sock.sendall((f"GET /ws?fps={fps} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                           f"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                           f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = self.sock.recv(1024)
+            if not chunk:
+                raise ConnectionError("closed during handshake")
+            response += chunk
+        status = response.split(b'\r\n', 1)[0]
+        if b' 101 ' not in status or accept_key(key).encode() not in response:
+            raise ConnectionError(f"handshake failed: {status!r}")
+        self.states = {}
+        self.state = None
+        self.frames = 0
+        self.bytes = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def receive(self):
+        opcode, payload = read_frame(self.sock)
+        if opcode != OP_BINARY:
+            return opcode != OP_CLOSE
+        seq, self.state = apply_frame(payload, self.states)
+        self.states[seq] = self.state
+        if len(self.states) > 2 * MAX_UNACKED:
+            for old in sorted(self.states)[:-MAX_UNACKED]:
+                del self.states[old]
+        self.frames += 1
+        self.bytes += len(payload) + 2
+        self.sock.sendall(encode_frame(CLIENT_MESSAGE.pack(b'A', seq), mask=True))
+        return True
+
+    def close(self):
+        try:
+            self.sock.sendall(encode_frame(struct.pack('>H', 1000), OP_CLOSE, mask=True))
+        except OSError:
+            pass
+        self.sock.close()
+
+def run_clients(port, count, fps, seconds, host='127.0.0.1'):
+    """Connect `count` clients, receive for `seconds` and print a JSON summary."""
+    clients = [DashboardClient(host, port, fps) for _ in range(count)]
+    deadline = time.monotonic() + seconds
+    while clients and time.monotonic() < deadline:
+        readable, _, _ = select.select(clients, [], [], 0.1)
+        for client in readable:
+            client.receive()
+    print(json.dumps([{'frames': c.frames, 'bytes': c.bytes,
+                       'state': c.state.hex() if c.state else None} for c in clients]))
+    for client in clients:
+        client.close()
+
+def serve(args):
+    from usb_session import open_source
+
+    # Duplicates change nothing on screen; clients coalesce everything else
+    source, session = open_source(args, DispatchPolicy(coalesce_window=0.0, heartbeat_interval=0.0))
+    live = LiveState()
+    try:
+        server = DashboardServer(live, args.port, args.host, args.fps).start()
+    except OSError as e:
+        print(f"Error: could not listen on {args.host}:{args.port}: {e}")
+        sys.exit(1)
+    print(f"Dashboard at {server.url} (Ctrl+C to stop)")
+    last = time.monotonic()
+    try:
+        while True:
+            data = source.read_buffered()
+            if data:
+                live.update(data)
+            now = time.monotonic()
+            if now - last >= 5.0:
+                last = now
+                print(f"  {len(server.clients)} clients, {live.reports} reports")
+    except EOFError:
+        print("End of capture")
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.stop()
+        if session is not None:
+            session.close()
+    print(server.summary())
+
+def _bench_case(clients, fps, rate, seconds, reports):
+    live = LiveState()
+    server = DashboardServer(live, 0, fps=fps).start()
+    port = server.httpd.server_address[1]
+    viewers = None
+    if clients:
+        # Clients run in their own process so their CPU isn't charged to the server
+        viewers = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'clients',
+                                    '--port', str(port), '--count', str(clients), '--fps', str(fps),
+                                    '--seconds', str(seconds + 1.5)],
+                                   stdout=subprocess.PIPE, text=True)
+        deadline = time.monotonic() + 10
+        while len(server.clients) < clients and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # update() in a tight loop, with the clients connected (best of 3)
+    update = live.update
+    update_ns = float('inf')
+    for _ in range(3):
+        begin = time.perf_counter_ns()
+        for report in reports:
+            update(report)
+        update_ns = min(update_ns, (time.perf_counter_ns() - begin) / len(reports))
+
+    def reader():
+        start = time.monotonic()
+        sent = 0
+        while sent < len(reports):
+            due = min(int((time.monotonic() - start) * rate) + 1, len(reports))
+            while sent < due:
+                live.update(reports[sent])
+                sent += 1
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=reader)
+    cpu = time.process_time()
+    start = time.monotonic()
+    thread.start()
+    thread.join()
+    wall = time.monotonic() - start
+    cpu = time.process_time() - cpu
+
+    results = []
+    if viewers is not None:
+        out, _ = viewers.communicate()
+        results = json.loads(out.strip().splitlines()[-1])
+    server.stop()
+    frames = sum(r['frames'] for r in results)
+    sent = sum(r['bytes'] for r in results)
+    final = live.packed.hex()
+    return {'clients': clients,
+            'update_ns': update_ns,
+            'cpu': cpu / wall * 100,
+            'fps': frames / max(clients, 1) / wall,
+            'bps': sent / max(clients, 1) / wall,
+            'frame': sent / frames if frames else 0.0,
+            'match': all(r['state'] == final for r in results)}
+
+def run_benchmark(clients=(0, 12, 48), fps=DEFAULT_FPS, rate=1000.0, seconds=3.0):
+    """Server CPU and per-client traffic as the number of clients grows."""
+    from synth_wheel import SyntheticWheel
+
+    reports = [r for r, _ in SyntheticWheel(rate, noise=8).generate(int(rate * seconds))]
+    print("=" * 80)
+    print(f"Dashboard benchmark: {rate:g} reports/s for {seconds:g} s, clients at {fps} fps")
+    print("=" * 80)
+    print(f"  {'clients':>7s}  {'reader cost':>13s}  {'server CPU':>10s}  {'frames/s':>8s}  "
+          f"{'bytes/s':>8s}  {'frame':>7s}  final state")
+    for count in clients:
+        r = _bench_case(count, fps, rate, seconds, reports)
+        check = ('match' if r['match'] else 'MISMATCH') if count else '-'
+        print(f"  {r['clients']:7d}  {r['update_ns']:8.0f} ns/r  {r['cpu']:9.1f}%  {r['fps']:8.1f}  "
+              f"{r['bps']:8.0f}  {r['frame']:5.1f} B  {check}")
+    print()
+    print("reader cost is LiveState.update() per report, timed in a tight loop; server CPU is")
+    print(f"the paced {rate:g} Hz run including every client thread. frames/s and bytes/s are per")
+    print("client (WebSocket header included).")
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>HORI Racing Wheel</title>
+<style>
+body { font: 16px monospace; background: #111; color: #ddd; margin: 2em; }
+.bar { height: 1.2em; background: #333; width: 30em; position: relative; margin: .3em 0 1em; }
+.fill { height: 100%; position: absolute; }
+#steer .fill { background: #4af; } #brake .fill { background: #e44; } #accel .fill { background: #4c4; }
+.btn { display: inline-block; padding: .2em .5em; margin: .15em; background: #333; }
+.btn.on { background: #fc3; color: #000; }
+</style></head><body>
+<h2>HORI Racing Wheel <small id="status">connecting...</small></h2>
+Steering <span id="steerv"></span><div class="bar" id="steer"><div class="fill"></div></div>
+Brake <span id="brakev"></span><div class="bar" id="brake"><div class="fill"></div></div>
+Accelerator <span id="accelv"></span><div class="bar" id="accel"><div class="fill"></div></div>
+<div id="buttons"></div>
+<script>
+// [byte, bit, label] from DISCOVERED_MAPPING.md
+const BUTTONS = [[2,0,'Up'],[2,1,'Down'],[2,2,'Left'],[2,3,'Right'],[2,4,'+'],[2,5,'-'],
+  [2,6,'LSB'],[2,7,'RSB'],[3,0,'Gear-'],[3,1,'Gear+'],[3,2,'Home'],[3,4,'A'],[3,5,'B'],
+  [3,6,'X'],[3,7,'Y'],[4,-1,'ZL'],[5,-1,'ZR']];
+const fps = new URLSearchParams(location.search).get('fps') || 30;
+document.getElementById('buttons').innerHTML =
+  BUTTONS.map((b, i) => `<span class="btn" id="b${i}">${b[2]}</span>`).join('');
+const states = new Map();
+let state = null;
+function connect() {
+  const ws = new WebSocket(`ws://${location.host}/ws?fps=${fps}`);
+  ws.binaryType = 'arraybuffer';
+  ws.onopen = () => document.getElementById('status').textContent = `live, ${fps} fps`;
+  ws.onclose = () => { document.getElementById('status').textContent = 'reconnecting...';
+                       states.clear(); setTimeout(connect, 1000); };
+  ws.onmessage = (event) => {
+    const v = new DataView(event.data), seq = v.getUint32(1, true);
+    if (v.getUint8(0) === 0x53) {          // 'S' snapshot
+      state = new Uint8Array(event.data.slice(5, 13));
+    } else {                                // 'D' delta against an acked frame
+      state = new Uint8Array(states.get(v.getUint32(5, true)));
+      const mask = v.getUint8(9);
+      for (let i = 0, k = 10; i < 8; i++) if (mask & (1 << i)) state[i] = v.getUint8(k++);
+    }
+    states.set(seq, state);
+    for (const old of states.keys()) if (old < seq - 32) states.delete(old);
+    const ack = new DataView(new ArrayBuffer(5));
+    ack.setUint8(0, 0x41); ack.setUint32(1, seq, true);
+    ws.send(ack.buffer);
+    requestAnimationFrame(render);
+  };
+}
+function bar(id, value, center) {
+  const fill = document.querySelector(`#${id} .fill`);
+  if (center) { fill.style.left = `${Math.min(50, 50 + value * 50)}%`; fill.style.width = `${Math.abs(value) * 50}%`; }
+  else { fill.style.left = '0'; fill.style.width = `${value * 100}%`; }
+}
+function render() {
+  if (!state) return;
+  const steering = new DataView(state.buffer).getInt16(6, true);
+  bar('steer', steering / 32768, true);
+  bar('brake', state[4] / 255);
+  bar('accel', state[5] / 255);
+  document.getElementById('steerv').textContent = steering;
+  document.getElementById('brakev').textContent = state[4];
+  document.getElementById('accelv').textContent = state[5];
+  BUTTONS.forEach((b, i) => document.getElementById(`b${i}`).classList.toggle('on',
+    b[1] < 0 ? state[b[0]] === 255 : (state[b[0]] >> b[1]) & 1));
+}
+connect();
+</script></body></html>
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Live web dashboard")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('serve', help='serve the live dashboard')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--host', default='127.0.0.1', help='address to listen on (default: localhost)')
+    p.add_argument('--fps', type=int, default=DEFAULT_FPS,
+                   help=f'render rate for clients that do not ask for one (default: {DEFAULT_FPS})')
+    p.add_argument('--replay', metavar='CAPTURE', default=None,
+                   help='serve a capture file instead of the device')
+    p.add_argument('--synthetic', metavar='HZ', type=float, default=None,
+                   help='serve generated reports at HZ reports/s instead of the device')
+    p = sub.add_parser('bench', help='server CPU and traffic with many localhost clients')
+    p.add_argument('--clients', default='0,12,48', help='comma-separated client counts')
+    p.add_argument('--fps', type=int, default=DEFAULT_FPS)
+    p.add_argument('--rate', type=float, default=1000.0, help='reports per second (default: 1000)')
+    p.add_argument('--seconds', type=float, default=3.0)
+    p = sub.add_parser('clients', help=argparse.SUPPRESS)
+    p.add_argument('--port', type=int, required=True)
+    p.add_argument('--count', type=int, default=1)
+    p.add_argument('--fps', type=int, default=DEFAULT_FPS)
+    p.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args)
+    elif args.command == 'bench':
+        run_benchmark([int(c) for c in args.clients.split(',')], args.fps, args.rate, args.seconds)
+    elif args.command == 'clients':
+        run_clients(args.port, args.count, args.fps, args.seconds)
+
+if __name__ == "__main__":
+    main()
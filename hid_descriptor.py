@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - HID Report Descriptor Parser
+
+Parses a HID report descriptor into an immutable, hashable model instead of
+printing as it goes (capture_hid_descriptor.parse_hid_descriptor still does
+the annotated dump).
+
+    - items are decoded through a 256-entry table indexed by the prefix byte
+      (size, type and tag resolved once, then a handler call)
+    - global items live in a state list with a proper Push/Pop stack; local
+      items are reset after every main item
+    - results are memoized by descriptor bytes
+
+Usage:
+    python3 hid_descriptor.py parse hid_descriptor.bin
+    python3 hid_descriptor.py bench [--size BYTES]
+    python3 hid_descriptor.py fuzz [--iterations N] [--seed S]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from collections import namedtuple
+from functools import lru_cache
+
+class HIDDescriptorError(Exception):
+    """Raised for malformed report descriptors."""
+
+# One Input/Output/Feature main item with the global and local state in effect
+Field = namedtuple('Field', [
+    'kind',            # 'input', 'output' or 'feature'
+    'report_id',       # 0 when the descriptor has no Report ID items
+    'bit_offset',      # offset within the report, excluding the report ID byte
+    'bit_size',        # Report Size
+    'count',           # Report Count
+    'flags',           # main item data (bit 0 constant, bit 1 variable, ...)
+    'usages',          # tuple of 32-bit usages (page << 16 | id)
+    'usage_min',       # 32-bit usage or None
+    'usage_max',       # 32-bit usage or None
+    'logical_min',
+    'logical_max',
+    'physical_min',
+    'physical_max',
+    'unit',
+    'unit_exponent',
+    'collection',      # index into Descriptor.collections, -1 at top level
+])
+
+Collection = namedtuple('Collection', ['kind', 'usage', 'parent'])
+
+Descriptor = namedtuple('Descriptor', [
+    'fields',          # tuple of Field
+    'collections',     # tuple of Collection
+    'report_bits',     # tuple of ((kind, report_id), total bits)
+])
+
+def report_length(descriptor, kind, report_id=0):
+    """Report length in bytes for (kind, report_id), including the ID byte if any."""
+    for key, bits in descriptor.report_bits:
+        if key == (kind, report_id):
+            return (bits + 7) // 8 + (1 if report_id else 0)
+    return 0
+
+# Global state tuple indexes
+G_USAGE_PAGE, G_LOGICAL_MIN, G_LOGICAL_MAX, G_PHYSICAL_MIN, G_PHYSICAL_MAX, \
+    G_UNIT_EXPONENT, G_UNIT, G_REPORT_SIZE, G_REPORT_ID, G_REPORT_COUNT = range(10)
+
+INITIAL_GLOBALS = [0, 0, (0, 0), 0, (0, 0), 0, 0, 0, 0, 0]
+
+MAIN_KINDS = {8: 'input', 9: 'output', 11: 'feature'}
+
+class _Parser:
+    """Mutable parse state; one instance per parse."""
+
+    __slots__ = ('globals', 'stack', 'usages', 'usage_min', 'usage_max',
+                 'fields', 'collections', 'open', 'offsets')
+
+    def __init__(self):
+        self.globals = list(INITIAL_GLOBALS)
+        self.stack = []
+        self.usages = []
+        self.usage_min = None
+        self.usage_max = None
+        self.fields = []
+        self.collections = []
+        self.open = []
+        self.offsets = {}
+
+    def reset_locals(self):
+        self.usages = []
+        self.usage_min = None
+        self.usage_max = None
+
+    def full_usage(self, value, size):
+        # 4-byte usages carry their own page; shorter ones use the current page
+        if size == 4:
+            return value
+        return (self.globals[G_USAGE_PAGE] << 16) | value
+
+# Item handlers: handler(parser, unsigned value, size, tag)
+
+def _signed(value, size):
+    bits = size * 8
+    if size and value >= 1 << (bits - 1):
+        return value - (1 << bits)
+    return value
+
+def _set_global(index):
+    def handler(p, value, size, tag):
+        p.globals[index] = value
+    return handler
+
+def _set_global_signed(index):
+    def handler(p, value, size, tag):
+        p.globals[index] = _signed(value, size)
+    return handler
+
+def _set_global_max(index):
+    # Maximums keep (signed, unsigned) and are resolved against the minimum
+    def handler(p, value, size, tag):
+        p.globals[index] = (_signed(value, size), value)
+    return handler
+
+def _push(p, value, size, tag):
+    p.stack.append(p.globals[:])
+
+def _pop(p, value, size, tag):
+    if not p.stack:
+        raise HIDDescriptorError("Pop without matching Push")
+    p.globals = p.stack.pop()
+
+def _report_id(p, value, size, tag):
+    if value == 0:
+        raise HIDDescriptorError("Report ID 0 is reserved")
+    p.globals[G_REPORT_ID] = value
+
+def _usage(p, value, size, tag):
+    p.usages.append(p.full_usage(value, size))
+
+def _usage_min(p, value, size, tag):
+    p.usage_min = p.full_usage(value, size)
+
+def _usage_max(p, value, size, tag):
+    p.usage_max = p.full_usage(value, size)
+
+def _ignore(p, value, size, tag):
+    pass
+
+def _resolve_max(minimum, maximum):
+    signed, unsigned = maximum
+    return unsigned if minimum >= 0 else signed
+
+def _main_field(p, value, size, tag):
+    g = p.globals
+    kind = MAIN_KINDS[tag]
+    report_id = g[G_REPORT_ID]
+    key = (kind, report_id)
+    offset = p.offsets.get(key, 0)
+    bits = g[G_REPORT_SIZE] * g[G_REPORT_COUNT]
+    p.offsets[key] = offset + bits
+    p.fields.append(Field(
+        kind, report_id, offset, g[G_REPORT_SIZE], g[G_REPORT_COUNT], value,
+        tuple(p.usages), p.usage_min, p.usage_max,
+        g[G_LOGICAL_MIN], _resolve_max(g[G_LOGICAL_MIN], g[G_LOGICAL_MAX]),
+        g[G_PHYSICAL_MIN], _resolve_max(g[G_PHYSICAL_MIN], g[G_PHYSICAL_MAX]),
+        g[G_UNIT], g[G_UNIT_EXPONENT],
+        p.open[-1] if p.open else -1))
+    p.reset_locals()
+
+def _collection(p, value, size, tag):
+    usage = p.usages[0] if p.usages else 0
+    p.collections.append(Collection(value, usage, p.open[-1] if p.open else -1))
+    p.open.append(len(p.collections) - 1)
+    p.reset_locals()
+
+def _end_collection(p, value, size, tag):
+    if not p.open:
+        raise HIDDescriptorError("End Collection without Collection")
+    p.open.pop()
+    p.reset_locals()
+
+def _main_other(p, value, size, tag):
+    p.reset_locals()
+
+# (type, tag) -> handler
+_HANDLERS = {
+    (0, 8): _main_field,          # Input
+    (0, 9): _main_field,          # Output
+    (0, 10): _collection,
+    (0, 11): _main_field,         # Feature
+    (0, 12): _end_collection,
+    (1, 0): _set_global(G_USAGE_PAGE),
+    (1, 1): _set_global_signed(G_LOGICAL_MIN),
+    (1, 2): _set_global_max(G_LOGICAL_MAX),
+    (1, 3): _set_global_signed(G_PHYSICAL_MIN),
+    (1, 4): _set_global_max(G_PHYSICAL_MAX),
+    (1, 5): _set_global_signed(G_UNIT_EXPONENT),
+    (1, 6): _set_global(G_UNIT),
+    (1, 7): _set_global(G_REPORT_SIZE),
+    (1, 8): _report_id,
+    (1, 9): _set_global(G_REPORT_COUNT),
+    (1, 10): _push,
+    (1, 11): _pop,
+    (2, 0): _usage,
+    (2, 1): _usage_min,
+    (2, 2): _usage_max,
+}
+
+def _build_item_table():
+    table = []
+    for prefix in range(256):
+        size = (0, 1, 2, 4)[prefix & 0x03]
+        item_type = (prefix >> 2) & 0x03
+        tag = prefix >> 4
+        main = item_type == 0
+        handler = _HANDLERS.get((item_type, tag), _main_other if main else _ignore)
+        table.append((size, tag, handler))
+    return tuple(table)
+
+# Prefix byte -> (data size, tag, handler)
+ITEM_TABLE = _build_item_table()
+
+LONG_ITEM_PREFIX = 0xFE
+
+def _parse(data):
+    p = _Parser()
+    table = ITEM_TABLE
+    i = 0
+    n = len(data)
+    from_bytes = int.from_bytes
+
+    while i < n:
+        prefix = data[i]
+        if prefix == LONG_ITEM_PREFIX:
+            # Long item: bDataSize, bLongItemTag, data (no defined long items)
+            if i + 2 >= n or i + 3 + data[i + 1] > n:
+                raise HIDDescriptorError(f"truncated long item at offset {i}")
+            i += 3 + data[i + 1]
+            continue
+
+        size, tag, handler = table[prefix]
+        end = i + 1 + size
+        if end > n:
+            raise HIDDescriptorError(f"truncated item 0x{prefix:02X} at offset {i}")
+        if size == 1:
+            value = data[i + 1]
+        elif size == 2:
+            value = data[i + 1] | (data[i + 2] << 8)
+        elif size:
+            value = from_bytes(data[i + 1:end], 'little')
+        else:
+            value = 0
+        handler(p, value, size, tag)
+        i = end
+
+    if p.open:
+        raise HIDDescriptorError(f"{len(p.open)} collection(s) not closed")
+
+    return Descriptor(tuple(p.fields), tuple(p.collections), tuple(sorted(p.offsets.items())))
+
+_parse_cached = lru_cache(maxsize=256)(_parse)
+
+def parse_descriptor(data):
+    """Parse a report descriptor (bytes-like) into a Descriptor, memoized by content."""
+    return _parse_cached(bytes(data))
+
+FLAG_NAMES = ((0x01, 'Cnst', 'Data'), (0x02, 'Var', 'Arr'), (0x04, 'Rel', 'Abs'))
+
+def format_layout(descriptor):
+    """Human-readable report layout lines for a parsed descriptor."""
+    lines = []
+    for (kind, report_id), bits in descriptor.report_bits:
+        rid = f" ID {report_id}" if report_id else ""
+        lines.append(f"{kind.capitalize()} report{rid}: {bits} bits "
+                     f"({report_length(descriptor, kind, report_id)} bytes)")
+        for f in descriptor.fields:
+            if f.kind != kind or f.report_id != report_id:
+                continue
+            flags = ",".join(on if f.flags & bit else off for bit, on, off in FLAG_NAMES)
+            if f.usages:
+                usages = " ".join(f"{u >> 16:04X}:{u & 0xFFFF:04X}" for u in f.usages[:6])
+                if len(f.usages) > 6:
+                    usages += " ..."
+            elif f.usage_min is not None:
+                usages = (f"{f.usage_min >> 16:04X}:{f.usage_min & 0xFFFF:04X}-"
+                          f"{(f.usage_max or 0) & 0xFFFF:04X}")
+            else:
+                usages = "padding" if f.flags & 0x01 else "-"
+            lines.append(f"  byte {f.bit_offset // 8:3d} bit {f.bit_offset % 8}: "
+                         f"{f.count:3d} x {f.bit_size:2d} bits [{flags}] "
+                         f"{f.logical_min}..{f.logical_max}  {usages}")
+    return lines
+
+# HORI Racing Wheel descriptor (captured, also in analyze_descriptor.py)
+HORI_DESCRIPTOR = bytes([
+    0x05, 0x01, 0x09, 0x05, 0xA1, 0x01, 0x15, 0x00, 0x25, 0x01, 0x35, 0x00, 0x45, 0x01, 0x75, 0x01,
+    0x95, 0x0D, 0x05, 0x09, 0x19, 0x01, 0x29, 0x0D, 0x81, 0x02, 0x95, 0x03, 0x81, 0x01, 0x05, 0x01,
+    0x25, 0x07, 0x46, 0x3B, 0x01, 0x75, 0x04, 0x95, 0x01, 0x65, 0x14, 0x09, 0x39, 0x81, 0x42, 0x65,
+    0x00, 0x95, 0x01, 0x81, 0x01, 0x26, 0xFF, 0x00, 0x46, 0xFF, 0x00, 0x09, 0x30, 0x09, 0x31, 0x09,
+    0x32, 0x09, 0x35, 0x75, 0x08, 0x95, 0x04, 0x81, 0x02, 0x06, 0x00, 0xFF, 0x09, 0x20, 0x09, 0x21,
+    0x09, 0x22, 0x09, 0x23, 0x09, 0x24, 0x09, 0x25, 0x09, 0x26, 0x09, 0x27, 0x09, 0x28, 0x09, 0x29,
+    0x09, 0x2A, 0x09, 0x2B, 0x95, 0x0C, 0x81, 0x02, 0x0A, 0x21, 0x26, 0x95, 0x08, 0xB1, 0x02, 0xC0,
+])
+
+def vendor_descriptor(size=4096):
+    """Synthetic multi-report vendor descriptor of roughly `size` bytes.
+
+    Wraps copies of the HORI application collection body in Report IDs,
+    each bracketed by Push/Pop, to exercise the global state stack.
+    """
+    body = HORI_DESCRIPTOR[6:-1]  # between Collection (Application) and End Collection
+    out = bytearray(HORI_DESCRIPTOR[:6])
+    report_id = 1
+    while len(out) + len(body) + 8 < size and report_id < 256:
+        out += bytes([0xA4, 0x85, report_id]) + body + bytes([0xB4])
+        report_id += 1
+    out.append(0xC0)
+    return bytes(out)
+
+def run_benchmark(size=4096, seconds=2.0):
+    """Uncached and cached parse throughput on the HORI and a vendor descriptor."""
+    print("=" * 80)
+    print("HID descriptor parser benchmark")
+    print("=" * 80)
+    for name, data in (("HORI descriptor", HORI_DESCRIPTOR),
+                       ("vendor descriptor", vendor_descriptor(size))):
+        parses = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for _ in range(20):
+                _parse(data)
+            parses += 20
+        elapsed = time.perf_counter() - start
+        d = _parse(data)
+        print(f"  {name} ({len(data)} bytes, {len(d.fields)} fields, {len(d.report_bits)} reports)")
+        print(f"    uncached: {parses / elapsed:10,.0f} parses/s  "
+              f"{parses * len(data) / elapsed / 1e6:7.2f} MB/s  {elapsed / parses * 1e6:8.1f} us/parse")
+
+        parse_descriptor(data)
+        start = time.perf_counter()
+        for _ in range(100000):
+            parse_descriptor(data)
+        elapsed = time.perf_counter() - start
+        print(f"    cached:   {100000 / elapsed:10,.0f} lookups/s")
+
+def run_fuzz(iterations=100000, max_len=512, seed=None):
+    """Random and mutated descriptors must parse or raise HIDDescriptorError, nothing else."""
+    seed = seed if seed is not None else int.from_bytes(os.urandom(4), 'little')
+    rng = random.Random(seed)
+    seeds = (HORI_DESCRIPTOR, vendor_descriptor(2048))
+    parsed = rejected = 0
+    slowest = 0.0
+
+    print(f"Fuzzing {iterations} inputs (seed {seed})...")
+    start = time.perf_counter()
+    for i in range(iterations):
+        if i % 2:
+            data = bytes(rng.getrandbits(8) for _ in range(rng.randrange(max_len)))
+        else:
+            data = bytearray(rng.choice(seeds))
+            for _ in range(rng.randrange(1, 8)):
+                data[rng.randrange(len(data))] = rng.getrandbits(8)
+            data = bytes(data[:rng.randrange(1, len(data) + 1)])
+
+        t = time.perf_counter()
+        try:
+            d = _parse(data)
+            hash(d)
+            if d != _parse(data):
+                print(f"✗ Non-deterministic result for input {data.hex()}")
+                sys.exit(1)
+            parsed += 1
+        except HIDDescriptorError:
+            rejected += 1
+        except Exception as e:
+            print(f"✗ {type(e).__name__}: {e} for input {data.hex()}")
+            sys.exit(1)
+        slowest = max(slowest, time.perf_counter() - t)
+
+    elapsed = time.perf_counter() - start
+    print(f"✓ {iterations} inputs in {elapsed:.2f} s ({iterations / elapsed:,.0f}/s): "
+          f"{parsed} parsed, {rejected} rejected, slowest {slowest * 1e6:.0f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description="HID report descriptor parser")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('parse', help='print the report layout of a descriptor file')
+    p.add_argument('path', nargs='?', default=None, help='raw descriptor (default: built-in HORI descriptor)')
+    p = sub.add_parser('bench', help='parser throughput')
+    p.add_argument('--size', type=int, default=4096, help='vendor descriptor size in bytes')
+    p = sub.add_parser('fuzz', help='fuzz the parser with random byte strings')
+    p.add_argument('--iterations', type=int, default=100000)
+    p.add_argument('--max-len', type=int, default=512)
+    p.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        data = HORI_DESCRIPTOR
+        if args.path:
+            with open(args.path, 'rb') as f:
+                data = f.read()
+        try:
+            descriptor = parse_descriptor(data)
+        except HIDDescriptorError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        for line in format_layout(descriptor):
+            print(line)
+    elif args.command == 'bench':
+        run_benchmark(args.size)
+    else:
+        run_fuzz(args.iterations, args.max_len, args.seed)
+
+if __name__ == "__main__":
+    main()
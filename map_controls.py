@@ -7,11 +7,19 @@ by detecting changes as you move controls one at a time.
 
 Usage:
     sudo python3 map_controls.py
+    python3 map_controls.py --replay capture.hcap
+    python3 map_controls.py --replay capture.hcap --profile [--profile-reports N]
+    python3 map_controls.py --synthetic 1000 [--profile]
+    python3 map_controls.py --synthetic 1000 --heatmap [--window 2]
+    sudo python3 map_controls.py --metrics-port 9105
+    sudo python3 map_controls.py --session rig2.hmap
+    python3 mapping_session.py reanalyze mapping_session.hmap
 """
 
 import sys
 import time
 import os
+import argparse
 from collections import deque
 
 try:
@@ -22,9 +30,19 @@ except ImportError:
     print("Install with: sudo python3 -m pip install --break-system-packages pyusb")
     sys.exit(1)
 
+from capture_analysis import classify_byte
+from mapping_session import (DEFAULT_PATH as DEFAULT_SESSION, SessionFormatError, SessionWriter,
+                             WindowRecorder)
+from metrics import add_metrics_arguments, start_metrics
+from profiling import Profiler, StageTimer, add_profile_arguments
+from report_source import DispatchPolicy, ReportSource
+from synth_wheel import fake_device_from_args
+from usb_session import session_from_device
+
 # HORI Racing Wheel USB IDs
 VENDOR_ID = 0x0F0D
 PRODUCT_ID = 0x013E
+INTERFACE_NUM = 0
 
 # ANSI color codes
 class Colors:
@@ -44,24 +62,31 @@ class ControlMapper:
         self.baseline = None
         self.report_size = 64  # Read full 64 bytes to catch everything
         self.history = deque(maxlen=100)
+        # Raw reports of the last detect_changes() window, for the session file
+        self.window = WindowRecorder(self.report_size)
+        # Duplicates add nothing to value sets or min/max; never coalesce,
+        # since every intermediate value matters when classifying a control
+        self.source = ReportSource(dev, endpoint,
+                                   DispatchPolicy(suppress_duplicates=True,
+                                                  coalesce_window=0.0,
+                                                  heartbeat_interval=0.0),
+                                   report_size=self.report_size)
 
     def read_report(self):
-        """Read a single report from the device."""
-        try:
-            data = self.dev.read(self.endpoint, self.report_size, timeout=100)
-            return bytes(data)
-        except usb.core.USBError as e:
-            if e.errno != 110:  # Ignore timeout
-                raise
-            return None
+        """Read the next report that differs from the last one forwarded.
+
+        Returns a view of the source's reused buffer, valid until the next read.
+        """
+        return self.source.read_buffered()
 
     def capture_baseline(self, samples=20):
         """Capture baseline state (neutral position)."""
         print(f"{Colors.YELLOW}Capturing baseline... Keep all controls in neutral position!{Colors.RESET}")
 
+        # Baseline is the mode of the raw samples, so bypass duplicate suppression
         reports = []
         for i in range(samples):
-            report = self.read_report()
+            report = self.source.read_raw()
             if report:
                 reports.append(report)
             time.sleep(0.05)
@@ -78,9 +103,16 @@ class ControlMapper:
         print()
         return True
 
-    def detect_changes(self, duration=5, threshold=1):
-        """Detect which bytes change during the specified duration."""
-        print(f"{Colors.CYAN}Monitoring for {duration} seconds...{Colors.RESET}")
+    def detect_changes(self, duration=5, threshold=1, profiler=None, timer=None):
+        """Detect which bytes change during the specified duration.
+
+        In --profile mode the window ends when the profiler's report limit
+        is reached instead.
+        """
+        if profiler is not None:
+            print(f"{Colors.CYAN}Monitoring for {profiler.max_reports} reports...{Colors.RESET}")
+        else:
+            print(f"{Colors.CYAN}Monitoring for {duration} seconds...{Colors.RESET}")
         print(f"{Colors.YELLOW}MOVE THE CONTROL NOW!{Colors.RESET}")
         print()
 
@@ -88,13 +120,24 @@ class ControlMapper:
         min_values = [255] * self.report_size
         max_values = [0] * self.report_size
 
-        start_time = time.time()
+        start_time = time.monotonic()
         sample_count = 0
-
-        while time.time() - start_time < duration:
+        window = self.window = WindowRecorder(self.report_size)
+        suppressed_before = self.source.stats.suppressed
+        # Start the window from a clean slate so the first report is always seen
+        self.source.dispatcher.reset()
+
+        while time.monotonic() - start_time < duration:
+            if profiler is not None and profiler.done:
+                break
+            if timer is not None:
+                timer.begin()
             report = self.read_report()
+            if timer is not None:
+                timer.mark('read')
             if report:
                 sample_count += 1
+                window.add(report, time.monotonic_ns())
 
                 # Compare with baseline
                 for i in range(min(len(report), len(self.baseline))):
@@ -107,7 +150,14 @@ class ControlMapper:
                     min_values[i] = min(min_values[i], report[i])
                     max_values[i] = max(max_values[i], report[i])
 
-        print(f"{Colors.GREEN}✓ Captured {sample_count} samples{Colors.RESET}")
+                if timer is not None:
+                    timer.mark('compare')
+                if profiler is not None:
+                    profiler.count()
+
+        suppressed = self.source.stats.suppressed - suppressed_before
+        print(f"{Colors.GREEN}✓ Captured {sample_count} samples "
+              f"({suppressed} identical reports suppressed){Colors.RESET}")
         print()
 
         return changes, min_values, max_values, sample_count
@@ -129,15 +179,8 @@ class ControlMapper:
             value_range = max_values[byte_idx] - min_values[byte_idx]
 
             # Determine if it's a bit field or analog value
-            if len(values) == 2 and set(values).issubset({0, 1}):
-                change_type = "BUTTON/BIT"
-                color = Colors.MAGENTA
-            elif len(values) <= 16 and value_range <= 15:
-                change_type = "MULTI-BIT"
-                color = Colors.CYAN
-            else:
-                change_type = "ANALOG"
-                color = Colors.GREEN
+            change_type = classify_byte(values, value_range)
+            color = {"BUTTON/BIT": Colors.MAGENTA, "MULTI-BIT": Colors.CYAN}.get(change_type, Colors.GREEN)
 
             print(f"  {color}Byte {byte_idx:2d}{Colors.RESET}: {change_type}")
             print(f"    Range: 0x{min_values[byte_idx]:02X} - 0x{max_values[byte_idx]:02X} ({min_values[byte_idx]:3d} - {max_values[byte_idx]:3d})")
@@ -167,8 +210,15 @@ class ControlMapper:
 
         return results
 
-    def compare_reports_live(self, duration=10):
-        """Show live comparison of current report vs baseline."""
+    def compare_reports_live(self, duration=10, heatmap=False, window=2.0, fps=10.0):
+        """Show live comparison of current report vs baseline.
+
+        With heatmap=True, show per-bit toggle activity for all 64 bytes
+        instead (see heatmap_live).
+        """
+        if heatmap:
+            self.heatmap_live(window, fps)
+            return
         print(f"{Colors.CYAN}Live comparison mode (Ctrl+C to stop){Colors.RESET}")
         print()
 
@@ -211,6 +261,39 @@ class ControlMapper:
         except KeyboardInterrupt:
             print(f"\n{Colors.GREEN}✓ Live mode stopped{Colors.RESET}\n")
 
+    def heatmap_live(self, window=2.0, fps=10.0, duration=None):
+        """Per-bit toggle heatmap of every report, redrawn at `fps` frames per second.
+
+        Every report read feeds the counts, whether or not a frame is drawn;
+        a bit that flipped between frames stays visible for ~`window` seconds.
+        Raises ImportError without numpy.
+        """
+        from bit_activity import BitActivity, render_heatmap
+
+        activity = BitActivity(window)
+        frame = 1.0 / fps
+        start = next_frame = time.monotonic()
+        sys.stdout.write('\033[2J')
+        try:
+            while duration is None or time.monotonic() - start < duration:
+                # Suppressed duplicates would XOR to zero, so skipping them loses nothing
+                report = self.read_report()
+                if report:
+                    activity.add(report)
+                now = time.monotonic()
+                if now >= next_frame:
+                    activity.flush(now)
+                    lines = render_heatmap(activity, Colors, f"{Colors.BOLD}BIT ACTIVITY HEATMAP{Colors.RESET}")
+                    lines.append("")
+                    lines.append(f"{Colors.YELLOW}Move controls to see changes. Press Ctrl+C to exit.{Colors.RESET}")
+                    sys.stdout.write('\033[H' + '\n'.join(line + '\033[K' for line in lines) + '\033[J')
+                    sys.stdout.flush()
+                    next_frame = max(next_frame + frame, now)
+        except KeyboardInterrupt:
+            pass
+        print(f"\n{Colors.GREEN}✓ Heatmap stopped ({activity.reports} reports){Colors.RESET}\n")
+        return activity
+
 def print_header():
     """Print welcome header."""
     print()
@@ -222,9 +305,22 @@ def print_header():
     print("by detecting changes as you move controls one at a time.")
     print()
 
-def main():
-    print_header()
-
+def parse_args():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Interactive Control Mapper")
+    parser.add_argument('--heatmap', action='store_true',
+                        help='go straight to the bit activity heatmap (no baseline or menu)')
+    parser.add_argument('--window', type=float, default=2.0,
+                        help='heatmap decay window in seconds (default: 2)')
+    parser.add_argument('--session', default=DEFAULT_SESSION, metavar='PATH',
+                        help=f'append raw mapping windows to PATH (default: {DEFAULT_SESSION})')
+    parser.add_argument('--no-session', action='store_true',
+                        help='do not keep raw mapping windows')
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    return parser.parse_args()
+
+def open_device():
+    """Find the wheel, claim it and return (dev, interrupt IN endpoint address)."""
     print(f"Looking for device: VID=0x{VENDOR_ID:04X}, PID=0x{PRODUCT_ID:04X}")
 
     # Find device
@@ -237,11 +333,10 @@ def main():
     print()
 
     # Setup device
-    interface_num = 0
     try:
-        if dev.is_kernel_driver_active(interface_num):
+        if dev.is_kernel_driver_active(INTERFACE_NUM):
             try:
-                dev.detach_kernel_driver(interface_num)
+                dev.detach_kernel_driver(INTERFACE_NUM)
             except usb.core.USBError:
                 pass
     except (usb.core.USBError, NotImplementedError):
@@ -266,11 +361,53 @@ def main():
         print(f"{Colors.RED}✗ Could not find interrupt IN endpoint{Colors.RESET}")
         sys.exit(1)
 
+    return dev, endpoint_in
+
+def run_profile(mapper, args):
+    """Non-interactive --profile run: baseline, then one bounded detection window."""
+    if not mapper.capture_baseline():
+        sys.exit(1)
+
+    timer = StageTimer()
+    with Profiler(args.profile_reports, output=args.profile_output) as profiler:
+        changes, min_vals, max_vals, samples = mapper.detect_changes(
+            duration=float('inf'), profiler=profiler, timer=timer)
+        mapper.analyze_changes(changes, min_vals, max_vals)
+
+    profiler.dump()
+    print(f"  Reports: {mapper.source.stats.summary()}")
+    print(f"  Stages:  {timer.summary()}")
+
+def main(args):
+    print_header()
+
+    dev = fake_device_from_args(args)
+    endpoint_in = None
+    session = None
+    if dev is None:
+        dev, endpoint_in = open_device()
+        # Unplugs and USB errors show up as timeouts while the session reattaches
+        dev = session = session_from_device(dev, endpoint_in, VENDOR_ID, PRODUCT_ID, INTERFACE_NUM)
+
     print(f"{Colors.GREEN}✓ Ready to start mapping{Colors.RESET}")
     print()
 
     # Create mapper
     mapper = ControlMapper(dev, endpoint_in)
+    # The endpoint thread is a daemon and goes away with the process
+    start_metrics(args, mapper.source, session=session)
+
+    if args.profile:
+        run_profile(mapper, args)
+        return
+
+    if args.heatmap:
+        try:
+            mapper.heatmap_live(args.window)
+        except ImportError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return
 
     # Main menu
     controls_to_map = [
@@ -298,6 +435,7 @@ def main():
         "D-Pad Down",
         "D-Pad Left",
         "Live Comparison Mode",
+        "Bit Activity Heatmap",
         "Re-capture Baseline",
         "Exit"
     ]
@@ -318,6 +456,16 @@ def main():
 
     # Interactive mapping
     mapping_results = {}
+    recording = None
+    if not args.no_session:
+        try:
+            recording = SessionWriter(args.session, mapper.report_size)
+            if recording.truncated:
+                print(f"{Colors.YELLOW}⚠ {args.session}: dropped {recording.truncated} bytes of an "
+                      f"incomplete last window{Colors.RESET}")
+        except (OSError, SessionFormatError) as e:
+            print(f"{Colors.YELLOW}⚠ Not keeping raw windows ({e}){Colors.RESET}")
+            print()
 
     while True:
         print(f"{Colors.BOLD}Select a control to map:{Colors.RESET}")
@@ -347,6 +495,14 @@ def main():
         if control == "Live Comparison Mode":
             mapper.compare_reports_live()
             continue
+        elif control == "Bit Activity Heatmap":
+            try:
+                mapper.compare_reports_live(heatmap=True, window=args.window)
+            except ImportError as e:
+                # The heatmap needs numpy; the rest of the session doesn't
+                print(f"{Colors.RED}✗ Heatmap unavailable: {e}{Colors.RESET}")
+                print()
+            continue
         elif control == "Re-capture Baseline":
             mapper.capture_baseline()
             continue
@@ -369,6 +525,10 @@ def main():
         changes, min_vals, max_vals, samples = mapper.detect_changes(duration=5)
         results = mapper.analyze_changes(changes, min_vals, max_vals)
 
+        # Keep the raw window (even with no changes) so it can be re-analyzed
+        if recording is not None:
+            recording.write(control, mapper.baseline, mapper.window, samples=samples)
+
         if results:
             mapping_results[control] = results
 
@@ -385,6 +545,8 @@ def main():
                            f"Span: {r['range']:3d}\n")
 
         print(f"{Colors.GREEN}✓ Results saved to control_mapping.txt{Colors.RESET}")
+        if recording is not None:
+            print(f"{Colors.GREEN}✓ Raw window saved to {recording.path}{Colors.RESET}")
         print()
         input("Press ENTER to continue...")
         print()
@@ -396,22 +558,29 @@ def main():
     print()
     print(f"Mapped {len(mapping_results)} controls")
     print(f"Results saved to: control_mapping.txt")
+    if recording is not None:
+        recording.close()
+        print(f"Raw windows saved to: {recording.path} "
+              f"(re-analyze with: python3 mapping_session.py reanalyze {recording.path})")
     print()
 
     # Cleanup
-    try:
-        usb.util.release_interface(dev, interface_num)
-    except:
-        pass
+    if session is not None:
+        print(f"Device: {session.summary()}")
+        session.close()
 
 if __name__ == "__main__":
-    if os.geteuid() != 0:
+    args = parse_args()
+
+    if args.replay is None and args.synthetic is None and os.geteuid() != 0:
         print(f"{Colors.RED}Error: This script must be run with sudo{Colors.RESET}")
         print(f"Usage: sudo python3 {sys.argv[0]}")
         sys.exit(1)
 
     try:
-        main()
+        main(args)
+    except EOFError:
+        print(f"\n\n{Colors.YELLOW}End of capture{Colors.RESET}\n")
     except KeyboardInterrupt:
         print(f"\n\n{Colors.YELLOW}Interrupted by user{Colors.RESET}\n")
     except Exception as e:
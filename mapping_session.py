@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Mapping Sessions
+
+map_controls.py keeps the raw reports of every mapping window, with their
+timestamps and the baseline they were compared against, in a session file
+(mapping_session.hmap by default). A window's statistics (changed values,
+min/max per byte) are then recomputed from the raw reports here, so the
+controls can be classified again with different rules without the wheel -
+e.g. the D-pad, whose single-bit values 0x01/0x02/0x04/0x08 the default
+thresholds call MULTI-BIT.
+
+File layout (little-endian):
+
+    header   magic 'HORIMAP\\0', version u16, report size u16
+    window   meta length u32, report count u32, payload length u32,
+             meta (JSON: control, baseline, samples, ...),
+             payload (zlib: count x i64 host_ns, count x u8 length,
+                      count x report size bytes)
+
+Windows are appended, so one file collects a whole mapping session (or
+several). A window cut short (the tool was killed mid-write) is cut off
+before the next one is appended. Statistics are computed with NumPy over
+all reports of a window at once.
+
+Usage:
+    python3 mapping_session.py show mapping_session.hmap
+    python3 mapping_session.py reanalyze mapping_session.hmap [--rules bitwise]
+    python3 mapping_session.py reanalyze mapping_session.hmap --max-values 8 --max-range 7
+    python3 mapping_session.py reanalyze mapping_session.hmap --rule-file my_rules.py
+    python3 mapping_session.py bench [--windows N] [--reports N]
+"""
+
+import array
+import importlib.util
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+import argparse
+
+from capture_analysis import classify_byte
+from report_source import REPORT_SIZE
+from wheel_state import require
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'HORIMAP\x00'
+VERSION = 1
+DEFAULT_PATH = 'mapping_session.hmap'
+
+FILE_HEADER = struct.Struct('<8sHH')
+WINDOW_HEADER = struct.Struct('<III')
+
+class SessionFormatError(Exception):
+    pass
+
+class WindowRecorder:
+    """Raw reports of one mapping window, appended as they are read."""
+
+    def __init__(self, report_size=REPORT_SIZE):
+        self.report_size = report_size
+        self.timestamps = array.array('q')
+        self.lengths = array.array('B')
+        self.rows = bytearray()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, report, host_ns):
+        n = min(len(report), self.report_size)
+        self.timestamps.append(host_ns)
+        self.lengths.append(n)
+        self.rows += report[:n]
+        if n < self.report_size:
+            self.rows += bytes(self.report_size - n)
+
+class SessionWindow:
+    """One stored window: control name, baseline and the raw reports."""
+
+    def __init__(self, meta, timestamps, lengths, rows, report_size):
+        self.meta = meta
+        self.control = meta.get('control', '?')
+        self.baseline = bytes.fromhex(meta.get('baseline', ''))
+        self.timestamps = timestamps
+        self.lengths = lengths
+        self.rows = rows
+        self.report_size = report_size
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def reports(self):
+        """Each report as bytes, at its recorded length."""
+        size = self.report_size
+        return [bytes(self.rows[i * size:i * size + n]) for i, n in enumerate(self.lengths)]
+
+class SessionWriter:
+    """Appends windows to a session file, writing the header if it is new.
+
+    A truncated last window is cut off first; `truncated` is the number of
+    bytes dropped.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, report_size=REPORT_SIZE):
+        self.path = path
+        self.report_size = report_size
+        self.truncated = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self.file = open(path, 'r+b')
+            data = self.file.read()
+            try:
+                _check_header(data[:FILE_HEADER.size], path, report_size)
+            except SessionFormatError:
+                self.file.close()
+                raise
+            end = _complete_length(data)
+            self.truncated = len(data) - end
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(FILE_HEADER.pack(MAGIC, VERSION, report_size))
+        self.windows = 0
+
+    def write(self, control, baseline, recorder, **meta):
+        """Store one window. Extra keyword arguments go into its metadata."""
+        meta = dict(meta, control=control, baseline=bytes(baseline or b'').hex(),
+                    count=len(recorder), recorded=time.strftime('%Y-%m-%d %H:%M:%S'))
+        meta = json.dumps(meta).encode()
+        payload = zlib.compress(recorder.timestamps.tobytes() + recorder.lengths.tobytes()
+                                + bytes(recorder.rows))
+        self.file.write(WINDOW_HEADER.pack(len(meta), len(recorder), len(payload)))
+        self.file.write(meta)
+        self.file.write(payload)
+        self.file.flush()
+        self.windows += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _check_header(data, path, report_size=None):
+    if len(data) < FILE_HEADER.size:
+        raise SessionFormatError(f"{path}: too short for a mapping session")
+    magic, version, size = FILE_HEADER.unpack(data)
+    if magic != MAGIC:
+        raise SessionFormatError(f"{path}: not a mapping session file")
+    if version != VERSION:
+        raise SessionFormatError(f"{path}: unsupported version {version}")
+    if report_size is not None and size != report_size:
+        raise SessionFormatError(f"{path}: report size {size}, expected {report_size}")
+    return size
+
+def _complete_length(data):
+    """Length of `data` up to the end of its last complete window."""
+    offset = FILE_HEADER.size
+    while offset + WINDOW_HEADER.size <= len(data):
+        meta_len, _, payload_len = WINDOW_HEADER.unpack_from(data, offset)
+        end = offset + WINDOW_HEADER.size + meta_len + payload_len
+        if end > len(data):
+            break
+        offset = end
+    return offset
+
+def read_session(path):
+    """All windows in a session file, in recording order."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    size = _check_header(data[:FILE_HEADER.size], path)
+    windows = []
+    offset = FILE_HEADER.size
+    while offset < len(data):
+        if offset + WINDOW_HEADER.size > len(data):
+            raise SessionFormatError(f"{path}: truncated window header at byte {offset}")
+        meta_len, count, payload_len = WINDOW_HEADER.unpack_from(data, offset)
+        offset += WINDOW_HEADER.size
+        end = offset + meta_len + payload_len
+        if end > len(data):
+            raise SessionFormatError(f"{path}: truncated window at byte {offset}")
+        meta = json.loads(data[offset:offset + meta_len])
+        try:
+            payload = zlib.decompress(data[offset + meta_len:end])
+        except zlib.error as e:
+            raise SessionFormatError(f"{path}: corrupt window at byte {offset}: {e}") from None
+        if len(payload) != count * (9 + size):
+            raise SessionFormatError(f"{path}: window at byte {offset} has the wrong size")
+        timestamps = array.array('q', payload[:8 * count])
+        lengths = payload[8 * count:9 * count]
+        rows = payload[9 * count:]
+        windows.append(SessionWindow(meta, timestamps, lengths, rows, size))
+        offset = end
+    return windows
+
+def window_stats(window):
+    """(changes, min_values, max_values) as ControlMapper.detect_changes() returns them.
+
+    changes maps byte index -> set of values that differed from the
+    baseline. Bytes beyond a report's length or the baseline's are ignored,
+    as they are during recording.
+    """
+    require(np, 'numpy')
+    size = window.report_size
+    min_values = [255] * size
+    max_values = [0] * size
+    changes = {}
+    count = len(window)
+    if not count or not window.baseline:
+        return changes, min_values, max_values
+    rows = np.frombuffer(window.rows, dtype=np.uint8).reshape(count, size)
+    lengths = np.frombuffer(window.lengths, dtype=np.uint8).astype(np.int64)
+    width = min(size, len(window.baseline))
+    valid = np.arange(size) < np.minimum(lengths, width)[:, None]
+    baseline = np.zeros(size, dtype=np.uint8)
+    baseline[:width] = np.frombuffer(window.baseline[:width], dtype=np.uint8)
+
+    lows = np.where(valid, rows, 255).min(axis=0)
+    highs = np.where(valid, rows, 0).max(axis=0)
+    changed = valid & (rows != baseline)
+    min_values = lows.tolist()
+    max_values = highs.tolist()
+    for i in np.flatnonzero(changed.any(axis=0)):
+        changes[int(i)] = set(np.unique(rows[changed[:, i], i]).tolist())
+    return changes, min_values, max_values
+
+def _reference_stats(window):
+    """window_stats() as a per-report loop, the same as detect_changes (bench check)."""
+    min_values = [255] * window.report_size
+    max_values = [0] * window.report_size
+    changes = {}
+    baseline = window.baseline
+    for report in window.reports():
+        for i in range(min(len(report), len(baseline))):
+            if report[i] != baseline[i]:
+                changes.setdefault(i, set()).add(report[i])
+            min_values[i] = min(min_values[i], report[i])
+            max_values[i] = max(max_values[i], report[i])
+    return changes, min_values, max_values
+
+# Rules take (values, value_range, baseline_value) and return a type name
+
+def default_rule(values, value_range, baseline_value):
+    """The thresholds map_controls.py uses while recording."""
+    return classify_byte(values, value_range)
+
+def threshold_rule(max_values=16, max_range=15):
+    """classify_byte() with different MULTI-BIT thresholds."""
+    def rule(values, value_range, baseline_value):
+        return classify_byte(values, value_range, max_values, max_range)
+    return rule
+
+def bitwise_rule(values, value_range, baseline_value):
+    """Like the default, but bytes whose changes are individual bits are BUTTON BITS.
+
+    Each value is XORed with the baseline; if every difference has at most
+    two bits set (a button, or two held together - a D-pad diagonal) and
+    only a few distinct bits ever change, the byte is a set of independent
+    buttons rather than a small number.
+    """
+    flips = [v ^ baseline_value for v in values]
+    used = 0
+    for flip in flips:
+        used |= flip
+    bits = bin(used).count('1')
+    if flips and bits <= 4 and len(values) <= 2 * bits and all(bin(f).count('1') <= 2 for f in flips):
+        return f"BUTTON BITS ({','.join(str(b) for b in range(8) if used >> b & 1)})"
+    return classify_byte(values, value_range)
+
+RULES = {'default': default_rule, 'bitwise': bitwise_rule}
+
+def load_rule_file(path):
+    """classify(values, value_range, baseline_value) from a Python file."""
+    spec = importlib.util.spec_from_file_location('mapping_rules', path)
+    if spec is None:
+        raise ImportError(f"cannot load {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if not callable(getattr(module, 'classify', None)):
+        raise ImportError(f"{path} does not define classify(values, value_range, baseline_value)")
+    return module.classify
+
+def classify_window(window, rule=default_rule, stats=None):
+    """[{byte, type, min, max, range, values}] for every byte that changed."""
+    changes, min_values, max_values = stats or window_stats(window)
+    results = []
+    for byte_idx in sorted(changes):
+        values = sorted(changes[byte_idx])
+        value_range = max_values[byte_idx] - min_values[byte_idx]
+        baseline_value = window.baseline[byte_idx] if byte_idx < len(window.baseline) else 0
+        results.append({'byte': byte_idx,
+                        'type': rule(values, value_range, baseline_value),
+                        'min': min_values[byte_idx],
+                        'max': max_values[byte_idx],
+                        'range': value_range,
+                        'values': values})
+    return results
+
+def reanalyze(windows, rule):
+    """Classify every window with `rule` and with the recording-time default.
+
+    Returns [(window, results, default_results)].
+    """
+    analyzed = []
+    for window in windows:
+        stats = window_stats(window)
+        analyzed.append((window, classify_window(window, rule, stats),
+                         classify_window(window, default_rule, stats)))
+    return analyzed
+
+def print_reanalysis(analyzed, only=None):
+    for window, results, defaults in analyzed:
+        if only and only.lower() not in window.control.lower():
+            continue
+        duration = (window.timestamps[-1] - window.timestamps[0]) / 1e9 if len(window) > 1 else 0.0
+        print(f"{window.control}  ({len(window)} reports over {duration:.1f} s, "
+              f"recorded {window.meta.get('recorded', '?')})")
+        if not results:
+            print("  no changes")
+        was = {r['byte']: r['type'] for r in defaults}
+        for r in results:
+            values = ', '.join(f'0x{v:02X}' for v in r['values'][:8])
+            if len(r['values']) > 8:
+                values += ', ...'
+            note = f"  (was {was[r['byte']]})" if was.get(r['byte']) != r['type'] else ''
+            print(f"  Byte {r['byte']:2d}: {r['type']:18s} 0x{r['min']:02X}-0x{r['max']:02X}  "
+                  f"{len(r['values']):3d} values [{values}]{note}")
+        print()
+
+def print_session(path, windows):
+    total = sum(len(w) for w in windows)
+    print(f"{path}: {len(windows)} windows, {total} reports, {os.path.getsize(path)} bytes "
+          f"({os.path.getsize(path) / max(total, 1):.1f} B/report)")
+    for i, window in enumerate(windows):
+        print(f"  {i:3d}  {window.control:45s} {len(window):6d} reports  "
+              f"{window.meta.get('recorded', '?')}")
+
+def _bench_session(path, windows, reports):
+    """Synthetic session: driving segments plus a D-pad window."""
+    from synth_wheel import SyntheticWheel
+
+    wheel = SyntheticWheel(1000, noise=4)
+    stream = [r for r, _ in wheel.generate(windows * reports)]
+    baseline = bytes(REPORT_SIZE)
+    with SessionWriter(path) as writer:
+        for w in range(windows):
+            recorder = WindowRecorder()
+            for i in range(reports):
+                report = stream[w * reports + i]
+                if w == 0:
+                    # D-pad only: single bits and diagonals on byte 2
+                    report = bytearray(baseline)
+                    report[2] = (0x01, 0x09, 0x08, 0x0A, 0x02, 0x06, 0x04, 0x05, 0x00)[i * 9 // reports]
+                recorder.add(report, i * 1_000_000)
+            writer.write("D-Pad" if w == 0 else f"Segment {w}", baseline, recorder)
+
+def run_benchmark(windows=25, reports=5000):
+    """Re-analysis of a whole session: NumPy stats against the recording loop."""
+    import tempfile
+
+    require(np, 'numpy')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.hmap')
+        _bench_session(path, windows, reports)
+        size = os.path.getsize(path)
+
+        start = time.perf_counter()
+        session = read_session(path)
+        load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        analyzed = reanalyze(session, bitwise_rule)
+        vector = time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference = [_reference_stats(w) for w in session]
+        loop = time.perf_counter() - start
+
+    same = all(window_stats(w) == r for w, r in zip(session, reference))
+    dpad = [r['type'] for r in analyzed[0][1]]
+    total = windows * reports
+    print(f"Session: {windows} windows x {reports} reports, {size} bytes ({size / total:.1f} B/report)")
+    print(f"  read_session():           {load * 1000:8.1f} ms")
+    print(f"  reanalyze() (NumPy):      {vector * 1000:8.1f} ms")
+    print(f"  detect_changes loop:      {loop * 1000:8.1f} ms")
+    print(f"  Stats vs loop: {'match' if same else 'MISMATCH'}")
+    print(f"  D-pad byte 2: {dpad[0] if dpad else '-'} "
+          f"(default rule: {analyzed[0][2][0]['type'] if analyzed[0][2] else '-'})")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Mapping sessions")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('show', help='list the windows in a session file')
+    p.add_argument('path', nargs='?', default=DEFAULT_PATH)
+    p = sub.add_parser('reanalyze', help='classify every window again from its raw reports')
+    p.add_argument('path', nargs='?', default=DEFAULT_PATH)
+    p.add_argument('--rules', choices=sorted(RULES), default='bitwise',
+                   help='classification rules (default: bitwise)')
+    p.add_argument('--max-values', type=int, default=None,
+                   help='default rules with this MULTI-BIT value limit instead of 16')
+    p.add_argument('--max-range', type=int, default=15,
+                   help='MULTI-BIT range limit with --max-values (default: 15)')
+    p.add_argument('--rule-file', metavar='FILE.py', default=None,
+                   help='use classify(values, value_range, baseline_value) from FILE.py')
+    p.add_argument('--control', default=None, help='only windows whose control name contains this')
+    p = sub.add_parser('bench', help='re-analysis time for a synthetic session')
+    p.add_argument('--windows', type=int, default=25)
+    p.add_argument('--reports', type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        try:
+            run_benchmark(args.windows, args.reports)
+        except ImportError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        return
+
+    try:
+        windows = read_session(args.path)
+    except (OSError, SessionFormatError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.command == 'show':
+        print_session(args.path, windows)
+        return
+
+    try:
+        require(np, 'numpy')
+    except ImportError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    rule = RULES[args.rules]
+    if args.max_values is not None:
+        rule = threshold_rule(args.max_values, args.max_range)
+    if args.rule_file:
+        try:
+            rule = load_rule_file(args.rule_file)
+        except (OSError, ImportError, SyntaxError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    start = time.perf_counter()
+    analyzed = reanalyze(windows, rule)
+    elapsed = time.perf_counter() - start
+    print_reanalysis(analyzed, args.control)
+    print(f"Reclassified {len(windows)} windows ({sum(len(w) for w in windows)} reports) "
+          f"in {elapsed * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
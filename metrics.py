@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Live Metrics Endpoint
+
+Optional Prometheus text-format endpoint for unattended rigs, served on
+localhost from a background thread:
+
+    hori_reports_{received,forwarded,duplicate,coalesced}_total
+    hori_read_timeouts_total, hori_usb_errors_total, hori_heartbeats_total
+    hori_usb_{disconnects,reconnects}_total, hori_usb_connected,
+    hori_usb_last_reconnect_seconds                   with the real wheel
+    hori_stage_seconds{stage="read|parse|draw|..."}   latency histograms
+    hori_last_report_age_seconds, hori_uptime_seconds
+
+Nothing here takes a lock on the read path. Counters the tools already keep
+(DispatchStats) are read at scrape time, so they cost nothing per report.
+Counter and Histogram keep one cell per writing thread, updated with plain
+increments and summed by the scraper; stage histograms are fed from the
+StageTimer's sampled reports only.
+
+Usage:
+    python3 test_wheel.py --metrics-port 9105
+    curl -s localhost:9105/metrics
+    python3 metrics.py bench [--reports N]
+"""
+
+import bisect
+import threading
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds (10 us .. 1 s)
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with a private cell per writing thread."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self._local = threading.local()
+        self._cells = []
+
+    def _new_cell(self):
+        cell = [0]
+        self._local.cell = cell
+        self._cells.append(cell)   # atomic under the GIL; cells are never removed
+        return cell
+
+    def inc(self, n=1):
+        try:
+            self._local.cell[0] += n
+        except AttributeError:
+            self._new_cell()[0] += n
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells))
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+class FunctionMetric:
+    """Counter or gauge whose value is read from a callable at scrape time."""
+
+    def __init__(self, name, help, fn, kind='gauge', labels=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labels = labels or {}
+
+    def samples(self):
+        yield self.name, self.labels, self.fn()
+
+class Histogram:
+    """Fixed-bucket histogram with a private (counts, sum) cell per thread."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, labels=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = labels or {}
+        self._local = threading.local()
+        self._cells = []
+
+    def _new_cell(self):
+        cell = [[0] * (len(self.buckets) + 1), 0.0]
+        self._local.cell = cell
+        self._cells.append(cell)
+        return cell
+
+    def observe(self, value):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[0][bisect.bisect_left(self.buckets, value)] += 1
+        cell[1] += value
+
+    def snapshot(self):
+        """(per-bucket counts incl. +Inf, sum) over all threads."""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for cell in list(self._cells):
+            for i, n in enumerate(cell[0]):
+                counts[i] += n
+            total += cell[1]
+        return counts, total
+
+    def samples(self):
+        counts, total = self.snapshot()
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            yield f"{self.name}_bucket", dict(self.labels, le=_format_value(bound)), cumulative
+        yield f"{self.name}_sum", self.labels, total
+        yield f"{self.name}_count", self.labels, cumulative
+
+class Registry:
+    """Set of metrics rendered together in Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=None):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labels=None):
+        return self.register(Histogram(name, help, buckets, labels))
+
+    def function(self, name, help, fn, kind='gauge', labels=None):
+        return self.register(FunctionMetric(name, help, fn, kind, labels))
+
+    def render(self):
+        # Samples of one metric family must be contiguous
+        families = {}
+        for metric in list(self.metrics):
+            families.setdefault(metric.name, []).append(metric)
+        lines = []
+        for name, metrics in families.items():
+            lines.append(f"# HELP {name} {metrics[0].help}")
+            lines.append(f"# TYPE {name} {metrics[0].kind}")
+            for metric in metrics:
+                for sample, labels, value in metric.samples():
+                    lines.append(f"{sample}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+class StageHistograms:
+    """StageTimer observer: one hori_stage_seconds histogram per stage."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.histograms = {}
+
+    def __call__(self, stage, ns):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = self.registry.histogram(
+                'hori_stage_seconds', 'Time per report spent in each stage (sampled)',
+                labels={'stage': stage})
+        histogram.observe(ns / 1e9)
+
+def instrument(registry, source=None, timer=None, session=None):
+    """Expose a ReportSource's counters, a StageTimer's stage latencies and a WheelSession's reconnects."""
+    started = time.monotonic()
+    registry.function('hori_uptime_seconds', 'Seconds since metrics were enabled',
+                      lambda: time.monotonic() - started)
+    if source is not None:
+        stats = source.stats
+        dispatcher = source.dispatcher
+        for attr, name, help in (
+                ('received', 'hori_reports_received_total', 'Reports read from the wheel'),
+                ('forwarded', 'hori_reports_forwarded_total', 'Reports passed on by the dispatch policy'),
+                ('duplicates', 'hori_reports_duplicate_total', 'Byte-identical reports suppressed'),
+                ('coalesced', 'hori_reports_coalesced_total', 'Reports superseded within the coalesce window'),
+                ('heartbeats', 'hori_heartbeats_total', 'Heartbeat reports forced by the policy'),
+                ('timeouts', 'hori_read_timeouts_total', 'Interrupt reads that timed out (errno 110)')):
+            registry.function(name, help, lambda attr=attr: getattr(stats, attr), kind='counter')
+        # A WheelSession turns the error that lost the wheel into a timeout
+        # for the read loop; it still counts as a USB error here
+        registry.function('hori_usb_errors_total', 'Reads that failed with a USB error',
+                          lambda: stats.errors + (session.disconnects if session is not None else 0),
+                          kind='counter')
+        registry.function('hori_last_report_age_seconds', 'Seconds since the last forwarded report',
+                          lambda: time.monotonic() - dispatcher.last_sent_time
+                          if dispatcher.last_sent_time else float('nan'))
+    if session is not None:
+        registry.function('hori_usb_disconnects_total', 'Times the wheel was lost',
+                          lambda: session.disconnects, kind='counter')
+        registry.function('hori_usb_reconnects_total', 'Times the wheel was attached again',
+                          lambda: session.reconnects, kind='counter')
+        registry.function('hori_usb_connected', '1 while the wheel is attached',
+                          lambda: int(session.connected))
+        registry.function('hori_usb_last_reconnect_seconds',
+                          'Failed read to first report after the last reconnect',
+                          lambda: session.reconnect_times[-1] if session.reconnect_times else float('nan'))
+    if timer is not None:
+        timer.observer = StageHistograms(registry)
+    return registry
+
+class MetricsServer:
+    """Serves a Registry at http://HOST:PORT/metrics from a daemon thread."""
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split('?')[0] not in ('/metrics', '/'):
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode()
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'text/plain; version=0.0.4')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def add_metrics_arguments(parser):
+    """Add the --metrics-port option."""
+    group = parser.add_argument_group('metrics')
+    group.add_argument('--metrics-port', type=int, default=None, metavar='PORT',
+                       help='serve Prometheus metrics on localhost:PORT/metrics')
+    return group
+
+def start_metrics(args, source=None, timer=None, session=None):
+    """Start the endpoint if --metrics-port was given. Returns the server or None."""
+    if getattr(args, 'metrics_port', None) is None:
+        return None
+    try:
+        server = MetricsServer(instrument(Registry(), source, timer, session), args.metrics_port).start()
+    except OSError as e:
+        print(f"Warning: could not start metrics endpoint on port {args.metrics_port}: {e}")
+        return None
+    print(f"Metrics: {server.url}")
+    return server
+
+def _read_loop(source, timer, state, reports, counter=None):
+    start = time.perf_counter_ns()
+    for _ in range(reports):
+        timer.begin()
+        data = source.read_buffered()
+        timer.mark('read')
+        if data:
+            state.update(data)
+            timer.mark('parse')
+            if counter is not None:
+                counter.inc()
+    return (time.perf_counter_ns() - start) / reports
+
+def _op_cost(fn, loops=200000, rounds=5):
+    """Best-of-rounds ns per call of fn()."""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for _ in range(loops):
+            fn()
+        best = min(best, (time.perf_counter_ns() - start) / loops)
+    return best
+
+def run_benchmark(reports=300000, rounds=7):
+    """Per-operation cost, and read-loop cost without metrics, with them, and while scraped."""
+    import urllib.request
+
+    from profiling import StageTimer
+    from report_source import DispatchPolicy, DispatchStats, ReportSource
+    from synth_wheel import SyntheticDevice, SyntheticWheel
+    from wheel_state import WheelState
+
+    print("=" * 80)
+    print("Metrics instrumentation cost")
+    print("=" * 80)
+    stats = DispatchStats()
+    counter = Counter('bench_total', 'bench')
+    histogram = Histogram('bench_seconds', 'bench')
+    lock = threading.Lock()
+
+    def bump():
+        stats.received += 1
+
+    def locked():
+        with lock:
+            stats.received += 1
+
+    empty = _op_cost(lambda: None)
+    print("Per operation (call overhead subtracted):")
+    for name, fn in (('DispatchStats attribute += 1', bump),
+                     ('Counter.inc() (per-thread cell)', counter.inc),
+                     ('attribute += 1 under threading.Lock', locked),
+                     ('Histogram.observe()', lambda: histogram.observe(0.0004))):
+        print(f"  {name:40s} {_op_cost(fn) - empty:7.1f} ns")
+    print("  (stage histograms are only fed on every 16th report by StageTimer)")
+
+    def make_source():
+        return ReportSource(SyntheticDevice(SyntheticWheel(rate=1000)), None,
+                            DispatchPolicy(heartbeat_interval=0.0))
+
+    def plain():
+        return make_source(), StageTimer(), None
+
+    def instrumented(registry=None):
+        source, timer = make_source(), StageTimer()
+        registry = instrument(registry if registry is not None else Registry(), source, timer)
+        return source, timer, registry.counter('hori_decoded_total', 'Reports decoded')
+
+    # Variants are interleaved round by round so machine noise hits all alike
+    variants = [('no metrics', plain), ('instrumented (+ per-report counter)', instrumented)]
+    best = {name: float('inf') for name, _ in variants}
+    for _ in range(rounds):
+        for name, setup in variants:
+            source, timer, decoded = setup()
+            best[name] = min(best[name], _read_loop(source, timer, WheelState(), reports, decoded))
+
+    print()
+    print(f"Read + decode loop ({reports} reports, best of {rounds}):")
+    baseline = best['no metrics']
+    for name, _ in variants:
+        print(f"  {name:40s} {best[name]:7.0f} ns/report  ({best[name] - baseline:+.0f} ns)")
+
+    # Scraped continuously from another thread while the loop runs
+    registry = Registry()
+    server = MetricsServer(registry, 0).start()
+    scrapes = [0]
+    stop = threading.Event()
+
+    def scraper():
+        while not stop.is_set():
+            with urllib.request.urlopen(server.url) as response:
+                response.read()
+            scrapes[0] += 1
+            stop.wait(0.01)
+
+    thread = threading.Thread(target=scraper, daemon=True)
+    thread.start()
+    under_scrape = float('inf')
+    try:
+        for _ in range(rounds):
+            registry.metrics.clear()
+            source, timer, decoded = instrumented(registry)
+            under_scrape = min(under_scrape, _read_loop(source, timer, WheelState(), reports, decoded))
+    finally:
+        stop.set()
+        thread.join()
+        server.stop()
+    print(f"  {'instrumented, scraped every 10 ms':40s} {under_scrape:7.0f} ns/report  "
+          f"({under_scrape - baseline:+.0f} ns, {scrapes[0]} scrapes; includes the "
+          f"scraper's own CPU time)")
+    print()
+    print("Sample exposition:")
+    for line in registry.render().splitlines():
+        if line.startswith(('hori_reports_received', 'hori_read_timeouts',
+                            'hori_stage_seconds_count', 'hori_decoded')):
+            print(f"  {line}")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Live Metrics")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('bench', help='instrumentation overhead on the read loop')
+    p.add_argument('--reports', type=int, default=300000)
+    args = parser.parse_args()
+    run_benchmark(args.reports)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Predictive Steering/Pedal Extrapolation
+
+A decoded state is at least one USB poll interval plus processing time old
+by the time a consumer uses it, and a sim sampling at its frame boundary
+sees it older still. WheelPredictor runs an alpha-beta filter on each of
+steering_signed, brake and accel and estimates the value at any requested
+timestamp:
+
+    observe(report, t_ns)   O(1): predict to t_ns, correct position by
+                            alpha and velocity by beta times the residual
+    predict(t_ns)           O(1): position + velocity * (t_ns - last sample),
+                            clamped to the axis range, with a bound
+
+The bound is CONFIDENCE_Z times the running RMS of the one-step residual,
+growing linearly with the horizon in poll intervals. `evaluate` reports how
+often the true value actually fell inside it.
+
+Pedals at 0xFF are ZL/ZR (digital), not travel: they are passed through as
+is and the filter restarts from the next analog sample. A residual beyond
+an axis' `snap` (a jump no hand or foot makes in one poll) or a gap in the
+stream also restarts the filter instead of turning into velocity, and
+extrapolation stops MAX_HORIZON_NS after the last sample, so a stalled
+stream holds rather than runs away.
+
+Each axis publishes its state as one tuple, so predict() may be called from
+another thread than observe() and always sees a consistent sample.
+
+`evaluate` replays captures through the predictor and reports, per axis and
+horizon, the error against the value the capture actually reached (linearly
+interpolated between reports, so measurement noise is part of the error)
+next to holding the last value, plus the cost per observe() and predict().
+
+Usage:
+    python3 uinput_bridge.py run --predict-ms 8
+    python3 prediction.py evaluate [capture.hcap ...] [--horizons 1,2,4,8,16]
+    python3 prediction.py bench
+"""
+
+import math
+import sys
+import time
+import argparse
+
+from capture_file import CaptureFormatError, CaptureReader
+
+# Filter gains (position; velocity follows as alpha^2 / (2 - alpha))
+STEERING_ALPHA = 0.5
+PEDAL_ALPHA = 0.6
+
+# Bound = CONFIDENCE_Z * residual RMS * (1 + horizon / poll interval)
+CONFIDENCE_Z = 3.0
+
+# Extrapolate at most this far past the last sample
+MAX_HORIZON_NS = 50_000_000
+# A gap this long restarts the filter (pause, replug)
+MAX_GAP_NS = 100_000_000
+
+# Residual averaging (samples) for the bound, and for the poll interval
+RESIDUAL_SAMPLES = 64
+INTERVAL_SAMPLES = 16
+
+class AxisPredictor:
+    """Alpha-beta filter on one axis, with timestamps in ns.
+
+    `state` is (t_ns, position, velocity per ns, residual RMS, poll
+    interval ns), or None before the first sample. Position is None while
+    the axis sits at its `digital` overlay value.
+    """
+
+    def __init__(self, alpha, lo, hi, snap, digital=None, z=CONFIDENCE_Z,
+                 max_horizon_ns=MAX_HORIZON_NS, max_gap_ns=MAX_GAP_NS):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.beta = alpha * alpha / (2 - alpha)
+        self.lo = lo
+        self.hi = hi
+        self.snap = snap
+        self.digital = digital
+        self.z = z
+        self.max_horizon_ns = max_horizon_ns
+        self.max_gap_ns = max_gap_ns
+        self.state = None
+        self.restarts = 0
+        self._variance = 0.0
+        self._interval = 0.0
+
+    def reset(self):
+        self.state = None
+        self._variance = 0.0
+        self._interval = 0.0
+
+    def observe(self, value, t_ns):
+        """Fold one sample into the filter (O(1))."""
+        state = self.state
+        if value == self.digital:
+            # Held at the overlay value; the filter restarts after it
+            self.state = (t_ns, None, 0.0, 0.0, self._interval)
+            return
+        if state is None or state[1] is None or t_ns - state[0] > self.max_gap_ns:
+            self.state = (t_ns, value, 0.0, math.sqrt(self._variance), self._interval)
+            return
+        t0, x, v, _, _ = state
+        dt = t_ns - t0
+        if dt > 0:
+            x += v * dt
+            residual = value - x
+            x += self.alpha * residual
+            v += self.beta * residual / dt
+            interval = self._interval
+            self._interval = dt if not interval else interval + (dt - interval) / INTERVAL_SAMPLES
+        else:
+            # Same timestamp: correct the position only
+            t_ns = t0
+            residual = value - x
+            x += self.alpha * residual
+        if abs(residual) > self.snap:
+            self.restarts += 1
+            x = value
+            v = 0.0
+        else:
+            self._variance += (residual * residual - self._variance) / RESIDUAL_SAMPLES
+        self.state = (t_ns, x, v, math.sqrt(self._variance), self._interval)
+
+    def predict(self, t_ns):
+        """(value, bound) at t_ns, or None before the first sample."""
+        state = self.state
+        if state is None:
+            return None
+        t0, x, v, rms, interval = state
+        if x is None:
+            return self.digital, 0.0
+        horizon = min(max(t_ns - t0, 0), self.max_horizon_ns)
+        value = round(x + v * horizon)
+        value = self.lo if value < self.lo else self.hi if value > self.hi else value
+        steps = 1.0 + horizon / interval if interval else 1.0
+        return value, self.z * rms * steps
+
+    def change(self, t_ns):
+        """Predicted value at t_ns minus the value last observed (0 if unknown)."""
+        state = self.state
+        if state is None or state[1] is None:
+            return 0
+        t0, x, v, _, _ = state
+        horizon = min(max(t_ns - t0, 0), self.max_horizon_ns)
+        return round(v * horizon)
+
+class WheelPredictor:
+    """Alpha-beta predictors for steering_signed, brake and accel.
+
+    observe() takes raw reports, observe_values() decoded axes; call one
+    of them for every report, duplicates included (a wheel held still is
+    what brings the velocity back to 0).
+    """
+
+    AXES = ('steering', 'brake', 'accel')
+
+    def __init__(self, steering_alpha=STEERING_ALPHA, pedal_alpha=PEDAL_ALPHA, z=CONFIDENCE_Z,
+                 max_horizon_ns=MAX_HORIZON_NS):
+        # Half of full lock, or half the pedal travel, in one poll is a glitch
+        # or a restart, not motion
+        self.steering = AxisPredictor(steering_alpha, -32768, 32767, 0x4000, None, z, max_horizon_ns)
+        self.brake = AxisPredictor(pedal_alpha, 0, 0xFE, 0x80, 0xFF, z, max_horizon_ns)
+        self.accel = AxisPredictor(pedal_alpha, 0, 0xFE, 0x80, 0xFF, z, max_horizon_ns)
+        self.observed = 0
+
+    def observe(self, data, t_ns=None):
+        """Fold one raw report's axes in; t_ns defaults to time.monotonic_ns()."""
+        if len(data) < 8:
+            return
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+        steering = data[6] | (data[7] << 8)
+        if steering >= 32768:
+            steering -= 65536
+        self.observe_values(steering, data[4], data[5], t_ns)
+
+    def observe_values(self, steering, brake, accel, t_ns):
+        """Fold decoded axes in, e.g. a CalibratedState's, so change() is in their units."""
+        self.observed += 1
+        self.steering.observe(steering, t_ns)
+        self.brake.observe(brake, t_ns)
+        self.accel.observe(accel, t_ns)
+
+    def predict(self, t_ns=None):
+        """{'steering': (value, bound), 'brake': ..., 'accel': ...} at t_ns."""
+        if t_ns is None:
+            t_ns = time.monotonic_ns()
+        return {'steering': self.steering.predict(t_ns),
+                'brake': self.brake.predict(t_ns),
+                'accel': self.accel.predict(t_ns)}
+
+    def summary(self):
+        """One line, e.g. 'steering ±41 | brake ±1.2 | accel ±0.9 (3 restarts)'."""
+        parts = []
+        restarts = 0
+        for name in self.AXES:
+            axis = getattr(self, name)
+            restarts += axis.restarts
+            state = axis.state
+            parts.append(f"{name} ±{axis.z * state[3]:.1f}" if state else f"{name} -")
+        return f"{' | '.join(parts)} ({self.observed} reports, {restarts} restarts)"
+
+def add_prediction_arguments(parser):
+    """Add the --predict-ms option."""
+    parser.add_argument('--predict-ms', type=float, default=0.0, metavar='MS',
+                        help='emit steering and pedals extrapolated MS ahead of each read '
+                             '(alpha-beta filter, 0 = off)')
+
+def predictor_from_args(args):
+    """(predictor, lead_ns): a WheelPredictor for --predict-ms, or (None, 0)."""
+    lead_ms = getattr(args, 'predict_ms', 0.0)
+    if lead_ms <= 0:
+        return None, 0
+    return WheelPredictor(), int(lead_ms * 1e6)
+
+def _axis_values(report):
+    steering = report[6] | (report[7] << 8)
+    return (steering - 65536 if steering >= 32768 else steering, report[4], report[5])
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+def evaluate(records, horizons_ns, predictor=None):
+    """Replay (t_ns, report) records through a predictor and score it.
+
+    Returns {axis: {horizon_ns: (prediction errors, hold errors, inside bound)}}.
+    A query is made after every report, for every horizon; the truth is the
+    recorded value interpolated at t + horizon. Pedal queries touching a
+    ZL/ZR sample are skipped, and so are reports too short to decode, as
+    observe() does.
+    """
+    predictor = predictor if predictor is not None else WheelPredictor()
+    records = [(t, report) for t, report in records if len(report) >= 8]
+    times = [t for t, _ in records]
+    values = [_axis_values(report) for _, report in records]
+    n = len(records)
+    axes = [(i, getattr(predictor, name), name) for i, name in enumerate(WheelPredictor.AXES)]
+    results = {name: {h: ([], [], [0]) for h in horizons_ns} for name in WheelPredictor.AXES}
+    # One forward-moving cursor per horizon into the (sorted) timestamps
+    cursors = {h: 0 for h in horizons_ns}
+
+    for k in range(n):
+        t = times[k]
+        current = values[k]
+        predictor.observe(records[k][1], t)
+        for h in horizons_ns:
+            target = t + h
+            j = cursors[h]
+            while j < n and times[j] < target:
+                j += 1
+            cursors[h] = j
+            if j >= n:
+                continue
+            # times[j - 1] < target <= times[j], and j > k
+            t0 = times[j - 1]
+            t1 = times[j]
+            before = values[j - 1]
+            after = values[j]
+            for i, axis, name in axes:
+                a = before[i]
+                b = after[i]
+                if axis.digital is not None and axis.digital in (current[i], a, b):
+                    continue
+                truth = b if t1 == t0 else a + (b - a) * (target - t0) / (t1 - t0)
+                value, bound = axis.predict(target)
+                error = abs(value - truth)
+                predicted, held, inside = results[name][h]
+                predicted.append(error)
+                held.append(abs(current[i] - truth))
+                if error <= bound:
+                    inside[0] += 1
+    return results
+
+def _read_records(path):
+    return [(host_ns, report) for host_ns, _, report in CaptureReader(path)]
+
+def print_evaluation(results, label):
+    print(f"{label}")
+    print(f"  {'axis':9s} {'horizon':>8s} {'MAE':>9s} {'p99':>9s} {'hold MAE':>9s} "
+          f"{'hold p99':>9s} {'in bound':>9s} {'queries':>9s}")
+    for name, per_horizon in results.items():
+        for h, (predicted, held, inside) in per_horizon.items():
+            n = len(predicted)
+            if not n:
+                continue
+            predicted.sort()
+            held.sort()
+            print(f"  {name:9s} {h / 1e6:6.1f}ms {sum(predicted) / n:9.1f} "
+                  f"{_percentile(predicted, 0.99):9.1f} {sum(held) / n:9.1f} "
+                  f"{_percentile(held, 0.99):9.1f} {inside[0] * 100 / n:8.1f}% {n:9d}")
+
+def query_cost(records, queries=200000):
+    """(ns per observe(), ns per predict() of all three axes), best of 3."""
+    best_observe = best_predict = float('inf')
+    sample = [report for _, report in records[:queries]]
+    stamps = [t for t, _ in records[:queries]]
+    for _ in range(3):
+        predictor = WheelPredictor()
+        observe = predictor.observe
+        start = time.perf_counter_ns()
+        for report, t in zip(sample, stamps):
+            observe(report, t)
+        best_observe = min(best_observe, (time.perf_counter_ns() - start) / len(sample))
+        predict = predictor.predict
+        t = stamps[-1] + 4_000_000
+        start = time.perf_counter_ns()
+        for _ in range(queries):
+            predict(t)
+        best_predict = min(best_predict, (time.perf_counter_ns() - start) / queries)
+    return best_observe, best_predict
+
+def run_evaluation(paths, horizons_ms, alpha=None, noise=8, seconds=120):
+    """Score the predictor on captures (or a synthetic one) and time it."""
+    horizons_ns = [int(h * 1e6) for h in horizons_ms]
+    sources = []
+    if paths:
+        for path in paths:
+            try:
+                sources.append((path, _read_records(path)))
+            except (OSError, CaptureFormatError) as e:
+                print(f"Error: {path}: {e}")
+                sys.exit(1)
+    else:
+        from synth_wheel import SyntheticWheel
+        wheel = SyntheticWheel(rate=1000, noise=noise)
+        records = [(truth.time_ns, report) for report, truth in wheel.generate(seconds * 1000)]
+        sources.append((f"synthetic wheel, 1000 Hz, ±{noise} LSB steering noise, {seconds} s", records))
+
+    print("=" * 80)
+    print("Prediction error vs horizon (absolute error in raw units)")
+    print("=" * 80)
+    for label, records in sources:
+        if len(records) < 2:
+            print(f"{label}: too few reports")
+            continue
+        predictor = WheelPredictor(*(alpha,) * 2) if alpha else WheelPredictor()
+        start = time.perf_counter()
+        results = evaluate(records, horizons_ns, predictor)
+        elapsed = time.perf_counter() - start
+        print_evaluation(results, f"{label} ({len(records)} reports, scored in {elapsed:.1f} s)")
+        print(f"  {predictor.summary()}")
+        observe_ns, predict_ns = query_cost(records)
+        print(f"  Cost: observe() {observe_ns:.0f} ns/report, predict() {predict_ns:.0f} ns/query "
+              f"(3 axes)")
+        print()
+
+def run_benchmark():
+    """Gain sweep on the synthetic wheel: steering MAE at 8 ms for a few alphas."""
+    from synth_wheel import SyntheticWheel
+
+    wheel = SyntheticWheel(rate=1000, noise=8)
+    records = [(truth.time_ns, report) for report, truth in wheel.generate(60000)]
+    horizon = 8_000_000
+    print("=" * 80)
+    print("Alpha sweep (synthetic wheel, 60 s, 8 ms horizon)")
+    print("=" * 80)
+    print(f"  {'alpha':>6s} {'steering MAE':>13s} {'in bound':>9s} {'brake MAE':>10s} {'accel MAE':>10s}")
+    for alpha in (0.2, 0.3, 0.5, 0.7, 0.9):
+        results = evaluate(records, [horizon], WheelPredictor(alpha, alpha))
+        row = []
+        hold = {}
+        for name in WheelPredictor.AXES:
+            predicted, held, inside = results[name][horizon]
+            row.append((sum(predicted) / len(predicted), inside[0] * 100 / len(predicted)))
+            hold[name] = sum(held) / len(held)
+        print(f"  {alpha:6.1f} {row[0][0]:13.1f} {row[0][1]:8.1f}% {row[1][0]:10.2f} {row[2][0]:10.2f}")
+    print(f"  {'hold':>6s} {hold['steering']:13.1f} {'':9s} {hold['brake']:10.2f} {hold['accel']:10.2f}")
+    observe_ns, predict_ns = query_cost(records)
+    print(f"  observe() {observe_ns:.0f} ns/report, predict() {predict_ns:.0f} ns/query (3 axes)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Predictive extrapolation")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('evaluate', help='prediction error vs horizon on captures')
+    p.add_argument('captures', nargs='*', help='captures to replay (default: a synthetic wheel)')
+    p.add_argument('--horizons', default='1,2,4,8,16', help='horizons in ms (default: 1,2,4,8,16)')
+    p.add_argument('--alpha', type=float, default=None,
+                   help=f'gain for all axes (default: steering {STEERING_ALPHA}, pedals {PEDAL_ALPHA})')
+    p = sub.add_parser('bench', help='alpha sweep and per-query cost on a synthetic wheel')
+    args = parser.parse_args()
+
+    if args.command == 'evaluate':
+        try:
+            horizons = [float(h) for h in args.horizons.split(',')]
+        except ValueError:
+            print(f"Error: bad --horizons {args.horizons!r} (expected e.g. 1,2,4,8)")
+            sys.exit(1)
+        run_evaluation(args.captures, horizons, args.alpha)
+    elif args.command == 'bench':
+        run_benchmark()
+
+if __name__ == "__main__":
+    main()
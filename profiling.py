@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Profiling Hooks
+
+Two levels of visibility into where the tools spend their time:
+
+    StageTimer  - always-on, sampled per-stage time accounting (read, parse,
+                  draw, ...) cheap enough to leave enabled in the read loop
+    Profiler    - --profile mode: cProfile + tracemalloc around a bounded
+                  run, dumping sorted hot spots and allocations per report
+"""
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+perf_counter_ns = time.perf_counter_ns
+
+class StageTimer:
+    """Per-stage time accounting, sampled on every Nth report.
+
+    Usage in a read loop:
+        timer.begin()
+        data = source.read();    timer.mark('read')
+        state = parse(data);     timer.mark('parse')
+        draw(state);             timer.mark('draw')
+    """
+
+    def __init__(self, sample_every=16):
+        self.sample_every = max(1, sample_every)
+        self.totals = {}
+        self.reports = 0
+        self.samples = 0
+        self._sampling = False
+        self._last = 0
+        # Optional callable(stage, ns) fed with each sampled stage time
+        self.observer = None
+
+    def begin(self):
+        """Start a new report; every Nth report is timed."""
+        self.reports += 1
+        self._sampling = (self.reports % self.sample_every) == 0
+        if self._sampling:
+            self.samples += 1
+            self._last = perf_counter_ns()
+
+    def mark(self, stage):
+        """Charge the time since the previous mark to `stage`."""
+        if self._sampling:
+            now = perf_counter_ns()
+            elapsed = now - self._last
+            self.totals[stage] = self.totals.get(stage, 0) + elapsed
+            if self.observer is not None:
+                self.observer(stage, elapsed)
+            self._last = now
+
+    def summary(self):
+        """One-line mean time per stage, e.g. 'read 812.0us (71%) | parse ...'."""
+        if not self.samples:
+            return "no samples yet"
+        total = sum(self.totals.values()) or 1
+        parts = []
+        for stage, ns in self.totals.items():
+            parts.append(f"{stage} {ns / self.samples / 1000:.1f}us ({ns * 100 // total}%)")
+        return " | ".join(parts)
+
+class Profiler:
+    """cProfile + tracemalloc around a bounded run of N reports.
+
+    Call count() once per report actually decoded (not per read: timeouts
+    and suppressed duplicates don't count); `done` becomes True at the limit. The
+    first `warmup` reports are excluded from the allocation snapshot diff.
+    """
+
+    def __init__(self, max_reports=5000, warmup=100, top=25, output=None):
+        self.max_reports = max_reports
+        self.warmup = min(warmup, max_reports // 2)
+        self.top = top
+        self.output = output
+        self.reports = 0
+        self.done = False
+        self._profile = cProfile.Profile()
+        self._baseline = None
+        self._baseline_reports = 0
+        self._final = None
+        self._start = 0.0
+        self._elapsed = 0.0
+
+    def __enter__(self):
+        tracemalloc.start(10)
+        self._start = time.perf_counter()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self._profile.disable()
+        self._elapsed = time.perf_counter() - self._start
+        self._final = tracemalloc.take_snapshot()
+        if self._baseline is None:
+            self._baseline = self._final
+            self._baseline_reports = self.reports
+        self.peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return False
+
+    def count(self):
+        """Record one decoded report."""
+        self.reports += 1
+        if self.reports == self.warmup:
+            self._baseline = tracemalloc.take_snapshot()
+            self._baseline_reports = self.reports
+        if self.reports >= self.max_reports:
+            self.done = True
+
+    def report(self):
+        """Return the text report: hot spots and allocations per report."""
+        out = io.StringIO()
+        reports = max(1, self.reports)
+        print("=" * 80, file=out)
+        print(f"PROFILE: {self.reports} reports in {self._elapsed:.3f} s "
+              f"({self.reports / self._elapsed if self._elapsed else 0:.0f} reports/s, "
+              f"{self._elapsed / reports * 1e6:.1f} us/report)", file=out)
+        print("=" * 80, file=out)
+
+        print("\nHot spots (sorted by cumulative time):", file=out)
+        stats = pstats.Stats(self._profile, stream=out)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(self.top)
+        print("Hot spots (sorted by internal time):", file=out)
+        stats.sort_stats('tottime').print_stats(self.top)
+
+        steady = max(1, self.reports - self._baseline_reports)
+        # Leave out the profiler's own bookkeeping
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, __file__),
+                   tracemalloc.Filter(False, '<frozen importlib._bootstrap>')]
+        diff = self._final.filter_traces(filters).compare_to(
+            self._baseline.filter_traces(filters), 'lineno')
+        growth = sum(d.size_diff for d in diff)
+        blocks = sum(d.count_diff for d in diff)
+        print(f"Allocations retained per report (after {self._baseline_reports} warmup reports): "
+              f"{growth / steady:.1f} bytes, {blocks / steady:.3f} blocks", file=out)
+        print(f"Peak traced memory: {self.peak / 1024:.1f} KiB\n", file=out)
+        for d in diff[:self.top]:
+            if not d.size_diff:
+                continue
+            frame = d.traceback[0]
+            print(f"  {d.size_diff / steady:+10.1f} B/report {d.count_diff / steady:+8.3f} blocks/report  "
+                  f"{frame.filename}:{frame.lineno}", file=out)
+        return out.getvalue()
+
+    def dump(self):
+        """Print the report and write raw stats if an output prefix was given."""
+        text = self.report()
+        print(text)
+        if self.output:
+            self._profile.dump_stats(f"{self.output}.prof")
+            with open(f"{self.output}.txt", 'w') as f:
+                f.write(text)
+            print(f"✓ Saved {self.output}.prof (pstats) and {self.output}.txt")
+
+def add_profile_arguments(parser, default_reports=5000):
+    """Add the shared --profile / --replay / --synthetic options to an argparse parser."""
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--profile', action='store_true',
+                       help='run under cProfile + tracemalloc for a bounded report count')
+    group.add_argument('--profile-reports', type=int, default=default_reports,
+                       help=f'reports to process in --profile mode (default: {default_reports})')
+    group.add_argument('--profile-output', metavar='PREFIX', default=None,
+                       help='also write PREFIX.prof and PREFIX.txt')
+    group.add_argument('--replay', metavar='CAPTURE', default=None,
+                       help='read reports from a capture file instead of the device')
+    group.add_argument('--synthetic', metavar='HZ', type=float, default=None,
+                       help='read generated reports at HZ reports/s instead of the device')
+    return group
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - In-Process Report Bus
+
+Fans one wheel stream out to several consumers (dashboard, recorder,
+network exporter, analytics) without letting a slow one stall the reader.
+Every subscriber has its own bounded queue and overflow policy:
+
+    block        the publisher waits for room (optionally up to a timeout,
+                 after which the report is dropped) - for recorders that
+                 must not lose reports and are known to keep up
+    drop-oldest  the oldest queued report is discarded - for consumers
+                 that want every recent report but can fall behind
+    latest       a queue of one that is overwritten - for displays, which
+                 only ever need the current state
+
+A published report is copied once into an immutable bytes object and the
+same Message is handed to every subscriber, so fan-out cost does not grow
+with the report size. Per-subscriber delivered/dropped counts, queue depth
+and lag (reports and seconds behind the publisher) are available from
+stats(), summary() and register_metrics(). A handler that raises has the
+error counted and logged once; its consumer thread keeps running.
+
+Usage:
+    python3 report_bus.py run --synthetic 1000 [--slow-ms 5] [--record out.hcap]
+    python3 report_bus.py run --replay capture.hcap --profile
+    python3 report_bus.py bench [--reports N]
+"""
+
+import sys
+import threading
+import time
+import argparse
+from collections import deque, namedtuple
+
+from report_source import PASSTHROUGH
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+LATEST = 'latest'
+POLICIES = (BLOCK, DROP_OLDEST, LATEST)
+
+# Queue depth for block and drop-oldest subscribers (~0.25 s at 1 kHz)
+DEFAULT_DEPTH = 256
+
+# seq counts published reports from 1; host_ns is time.monotonic_ns()
+Message = namedtuple('Message', 'seq host_ns report')
+
+class Subscription:
+    """One consumer's bounded queue. Use ReportBus.subscribe() to create one."""
+
+    def __init__(self, bus, name, policy=DROP_OLDEST, depth=DEFAULT_DEPTH, block_timeout=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r} (expected one of {', '.join(POLICIES)})")
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        self.bus = bus
+        self.name = name
+        self.policy = policy
+        self.depth = 1 if policy == LATEST else depth
+        self.block_timeout = block_timeout
+        self.queue = deque()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.closed = False
+        self.thread = None
+        # Threads waiting on each condition; notify() costs ~1 us, so skip it
+        # when nobody waits
+        self._getters = 0
+        self._putters = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.blocked_ns = 0
+        self.last_seq = 0
+        self.errors = 0              # handler exceptions (attach() only)
+        self.last_error = None
+
+    def put(self, message):
+        """Queue a message (called by the publisher). Returns False if it was dropped."""
+        with self.lock:
+            queue = self.queue
+            if len(queue) >= self.depth:
+                if self.policy == BLOCK:
+                    start = time.monotonic_ns()
+                    self._putters += 1
+                    try:
+                        room = self.not_full.wait_for(
+                            lambda: len(queue) < self.depth or self.closed, self.block_timeout)
+                    finally:
+                        self._putters -= 1
+                    self.blocked_ns += time.monotonic_ns() - start
+                    if not room or self.closed:
+                        self.dropped += 1
+                        return False
+                else:
+                    queue.popleft()
+                    self.dropped += 1
+            queue.append(message)
+            if len(queue) > self.max_depth:
+                self.max_depth = len(queue)
+            if self._getters:
+                self.not_empty.notify()
+        return True
+
+    def get(self, timeout=None):
+        """Next message, or None on timeout or once the subscription is closed and empty."""
+        with self.lock:
+            if not self.queue:
+                if self.closed:
+                    return None
+                self._getters += 1
+                try:
+                    self.not_empty.wait_for(lambda: self.queue or self.closed, timeout)
+                finally:
+                    self._getters -= 1
+                if not self.queue:
+                    return None
+            message = self.queue.popleft()
+            self.last_seq = message.seq
+            self.delivered += 1
+            if self._putters:
+                self.not_full.notify()
+            return message
+
+    def drain(self):
+        """All queued messages without waiting (for consumers that work in batches)."""
+        with self.lock:
+            messages = list(self.queue)
+            self.queue.clear()
+            if messages:
+                self.last_seq = messages[-1].seq
+                self.delivered += len(messages)
+                if self._putters:
+                    self.not_full.notify()
+            return messages
+
+    def close(self):
+        """Stop accepting messages and wake the consumer and a blocked publisher."""
+        with self.lock:
+            self.closed = True
+            self.not_empty.notify_all()
+            self.not_full.notify_all()
+
+    @property
+    def lag(self):
+        """Reports published since the last one this consumer took."""
+        return self.bus.seq - self.last_seq
+
+    def lag_seconds(self, now_ns=None):
+        """Age of the oldest queued report (0 when the consumer is caught up)."""
+        queue = self.queue
+        try:
+            oldest = queue[0].host_ns
+        except IndexError:
+            return 0.0
+        return ((now_ns if now_ns is not None else time.monotonic_ns()) - oldest) / 1e9
+
+    def stats(self):
+        return {
+            'policy': self.policy,
+            'depth': len(self.queue),
+            'max_depth': self.max_depth,
+            'capacity': self.depth,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'lag': self.lag,
+            'lag_seconds': round(self.lag_seconds(), 6),
+            'blocked_seconds': round(self.blocked_ns / 1e9, 6),
+            'errors': self.errors,
+        }
+
+    def summary(self):
+        s = self.stats()
+        line = (f"{self.name} ({self.policy}): delivered {s['delivered']}, dropped {s['dropped']}, "
+                f"depth {s['depth']}/{s['capacity']} (max {s['max_depth']}), "
+                f"lag {s['lag']} ({s['lag_seconds'] * 1000:.1f} ms)")
+        if self.errors:
+            line += f", {self.errors} handler errors (last: {self.last_error!r})"
+        return line
+
+class ReportBus:
+    """Publishes reports to any number of subscriptions.
+
+    publish() is meant for a single reader thread; subscribe()/unsubscribe()
+    may be called from anywhere (the subscriber list is replaced, not
+    mutated, so publish() never takes the bus lock).
+    """
+
+    def __init__(self, clock=time.monotonic_ns):
+        self.clock = clock
+        self.seq = 0
+        self.subscribers = ()
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, policy=DROP_OLDEST, depth=DEFAULT_DEPTH, block_timeout=None):
+        sub = Subscription(self, name, policy, depth, block_timeout)
+        sub.last_seq = self.seq
+        with self._lock:
+            self.subscribers = self.subscribers + (sub,)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self.subscribers = tuple(s for s in self.subscribers if s is not sub)
+        sub.close()
+
+    def attach(self, name, handler, policy=DROP_OLDEST, depth=DEFAULT_DEPTH, block_timeout=None):
+        """Subscribe and call handler(message) for each message on a daemon thread.
+
+        An exception from the handler is counted in sub.errors and the
+        thread goes on with the next message, so a BLOCK subscriber never
+        leaves the publisher waiting on a dead consumer.
+        """
+        sub = self.subscribe(name, policy, depth, block_timeout)
+
+        def consume():
+            while True:
+                message = sub.get()
+                if message is None:
+                    if sub.closed:
+                        return
+                    continue
+                try:
+                    handler(message)
+                except Exception as e:
+                    sub.errors += 1
+                    sub.last_error = e
+                    if sub.errors == 1:
+                        print(f"Warning: report bus subscriber {name!r} failed on report "
+                              f"{message.seq}: {e!r} (counting further errors)", file=sys.stderr)
+
+        sub.thread = threading.Thread(target=consume, name=f'bus-{name}', daemon=True)
+        sub.thread.start()
+        return sub
+
+    def publish(self, report, host_ns=None):
+        """Copy `report` once and queue it for every subscriber. Returns the Message."""
+        if type(report) is not bytes:
+            report = bytes(report)   # the only copy: views of a reused buffer
+        self.seq += 1
+        message = Message(self.seq, host_ns if host_ns is not None else self.clock(), report)
+        for sub in self.subscribers:
+            sub.put(message)
+        return message
+
+    def close(self, timeout=1.0):
+        """Close every subscription and wait for attached consumers to drain."""
+        subscribers = self.subscribers
+        for sub in subscribers:
+            sub.close()
+        for sub in subscribers:
+            if sub.thread is not None:
+                sub.thread.join(timeout)
+
+    def stats(self):
+        return {'published': self.seq,
+                'subscribers': {sub.name: sub.stats() for sub in self.subscribers}}
+
+    def summary(self):
+        lines = [f"published {self.seq}"]
+        lines.extend(sub.summary() for sub in self.subscribers)
+        return '\n'.join(lines)
+
+    def register_metrics(self, registry):
+        """Expose published count and per-subscriber drops, depth and lag on a metrics.Registry."""
+        registry.function('hori_bus_published_total', 'Reports published on the report bus',
+                          lambda: self.seq, kind='counter')
+        for sub in self.subscribers:
+            labels = {'subscriber': sub.name, 'policy': sub.policy}
+            registry.function('hori_bus_delivered_total', 'Reports taken by each subscriber',
+                              lambda sub=sub: sub.delivered, kind='counter', labels=labels)
+            registry.function('hori_bus_dropped_total', 'Reports dropped for each subscriber',
+                              lambda sub=sub: sub.dropped, kind='counter', labels=labels)
+            registry.function('hori_bus_handler_errors_total', 'Handler exceptions for each subscriber',
+                              lambda sub=sub: sub.errors, kind='counter', labels=labels)
+            registry.function('hori_bus_queue_depth', 'Reports waiting in each subscriber queue',
+                              lambda sub=sub: len(sub.queue), labels=labels)
+            registry.function('hori_bus_lag_reports', 'Reports published since each subscriber last took one',
+                              lambda sub=sub: sub.lag, labels=labels)
+            registry.function('hori_bus_lag_seconds', 'Age of the oldest report in each subscriber queue',
+                              lambda sub=sub: sub.lag_seconds(), labels=labels)
+        return registry
+
+def pump(source, bus, stop=None, limit=None):
+    """Read from a ReportSource and publish every forwarded report.
+
+    Runs until `stop` (a threading.Event) is set, `limit` reports have been
+    published, or the source raises (EOFError at the end of a capture).
+    """
+    clock = time.monotonic_ns
+    published = 0
+    while (stop is None or not stop.is_set()) and (limit is None or published < limit):
+        data = source.read_buffered()
+        if data:
+            bus.publish(data, clock())
+            published += 1
+    return published
+
+def run(args):
+    from profiling import Profiler
+    from usb_session import open_source
+    from wheel_state import WheelState
+
+    source, session = open_source(args, PASSTHROUGH)
+    bus = ReportBus()
+
+    # Display: only the newest state matters
+    display = WheelState()
+    bus.attach('display', lambda m: display.update(m.report), policy=LATEST)
+
+    # Analytics: every report, may fall behind briefly
+    analytics = WheelState()
+    bus.attach('analytics', lambda m: analytics.update(m.report), policy=DROP_OLDEST)
+
+    # A stand-in for a network exporter that takes --slow-ms per report
+    if args.slow_ms > 0:
+        delay = args.slow_ms / 1000.0
+        bus.attach('exporter', lambda m: time.sleep(delay), policy=DROP_OLDEST, depth=args.depth)
+
+    writer = None
+    if args.record:
+        from capture_file import CaptureWriter
+        writer = CaptureWriter(args.record)
+        bus.attach('recorder', lambda m: writer.write(m.report, m.host_ns), policy=BLOCK,
+                   depth=args.depth, block_timeout=0.1)
+
+    stop = threading.Event()
+    if args.seconds:
+        threading.Timer(args.seconds, stop.set).start()
+    print(f"Fanning out to {len(bus.subscribers)} subscribers (Ctrl+C to stop)")
+    batch = max(1, int(args.synthetic or 1000) // 2)
+    profiler = None
+    try:
+        if args.profile:
+            # Profiles the reader and publish(); the consumers run on their own threads
+            with Profiler(args.profile_reports, output=args.profile_output) as profiler:
+                _fan_out(source, bus, display, stop, batch, profiler)
+        else:
+            _fan_out(source, bus, display, stop, batch)
+    except EOFError:
+        print("End of capture")
+    except KeyboardInterrupt:
+        print()
+    finally:
+        stop.set()
+        bus.close()
+        if writer is not None:
+            writer.close()
+        if session is not None:
+            session.close()
+    if profiler is not None:
+        profiler.dump()
+    print(bus.summary())
+
+def _fan_out(source, bus, display, stop, batch, profiler=None):
+    last = time.monotonic()
+    while not stop.is_set():
+        limit = batch
+        if profiler is not None:
+            if profiler.done:
+                break
+            limit = min(batch, profiler.max_reports - profiler.reports)
+        published = pump(source, bus, stop, limit)
+        if profiler is not None:
+            for _ in range(published):
+                profiler.count()
+        now = time.monotonic()
+        if now - last >= 1.0:
+            last = now
+            print(f"  steering {display.steering_signed:6d}  brake {display.brake:3d}  "
+                  f"accel {display.accel:3d}  | " +
+                  '  '.join(f"{s.name}: lag {s.lag} drop {s.dropped}" for s in bus.subscribers))
+
+def _bench_case(subscribers, policy, reports, depth, rate=None):
+    """Publish `reports` reports to `subscribers` consumers.
+
+    Flat out (rate None) this times the publisher; paced at `rate` reports/s
+    it also measures publish-to-handler latency.
+    """
+    from synth_wheel import SyntheticWheel
+
+    payloads = [report for report, _ in SyntheticWheel(1000, noise=8).generate(1024)]
+    bus = ReportBus()
+    clock = time.monotonic_ns
+    delivery = []
+
+    def handler(message):
+        if message.seq & 15 == 0:
+            delivery.append(clock() - message.host_ns)
+
+    for i in range(subscribers):
+        bus.attach(f'sub{i}', handler, policy=policy, depth=depth)
+
+    publish = []
+    start = time.perf_counter()
+    for i in range(reports):
+        if rate is not None:
+            # Publish whatever is due, then yield like a reader waiting on USB
+            while i >= (time.perf_counter() - start) * rate:
+                time.sleep(0.0002)
+        t0 = time.perf_counter_ns()
+        bus.publish(payloads[i & 1023])
+        if i & 15 == 0:
+            publish.append(time.perf_counter_ns() - t0)
+    elapsed = time.perf_counter() - start
+    bus.close(timeout=5.0)
+    publish.sort()
+    delivery.sort()
+
+    def pct(values, p):
+        return values[min(len(values) - 1, int(len(values) * p))] / 1000 if values else float('nan')
+
+    total = reports * subscribers
+    return {
+        'publish_hz': reports / elapsed,
+        'publish_p50_us': pct(publish, 0.5),
+        'publish_p99_us': pct(publish, 0.99),
+        'delivery_p50_us': pct(delivery, 0.5),
+        'delivery_p99_us': pct(delivery, 0.99),
+        'delivered': sum(sub.delivered for sub in bus.subscribers) / total,
+        'dropped': sum(sub.dropped for sub in bus.subscribers) / total,
+    }
+
+def run_benchmark(reports=100000, depth=DEFAULT_DEPTH, rate=1000.0):
+    """Fan-out to 1/4/16 subscribers under each policy, flat out and paced."""
+    for label, case_rate, count in (('flat out', None, reports),
+                                    (f'paced at {rate:g} Hz', rate, max(1000, int(rate * 2)))):
+        print(f"{count:,} reports {label} (queue depth {depth}, consumers on daemon threads)")
+        print(f"{'subs':>4s}  {'policy':12s} {'publish/s':>10s} {'pub p50':>8s} {'pub p99':>8s} "
+              f"{'dlv p50':>8s} {'dlv p99':>8s} {'delivered':>9s} {'dropped':>8s}")
+        for subscribers in (1, 4, 16):
+            for policy in POLICIES:
+                r = _bench_case(subscribers, policy, count, depth, case_rate)
+                print(f"{subscribers:4d}  {policy:12s} {r['publish_hz']:10,.0f} "
+                      f"{r['publish_p50_us']:8.1f} {r['publish_p99_us']:8.1f} "
+                      f"{r['delivery_p50_us']:8.1f} {r['delivery_p99_us']:8.1f} "
+                      f"{r['delivered']:9.1%} {r['dropped']:8.1%}")
+        print()
+    print("pub: reader time per publish() in us (includes waiting under 'block');")
+    print("dlv: publish-to-handler latency in us; delivered/dropped: share of reports x subscribers.")
+
+def main():
+    from profiling import add_profile_arguments
+
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - In-process report bus")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='fan the wheel out to sample consumers')
+    p.add_argument('--record', metavar='PATH', help='also record through a blocking subscriber')
+    p.add_argument('--slow-ms', type=float, default=0.0,
+                   help='add an exporter that takes this long per report (default: off)')
+    p.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                   help=f'queue depth for exporter and recorder (default: {DEFAULT_DEPTH})')
+    p.add_argument('--seconds', type=float, default=0.0, help='stop after N seconds (default: run)')
+    add_profile_arguments(p)
+    p = sub.add_parser('bench', help='measure fan-out to 1/4/16 subscribers')
+    p.add_argument('--reports', type=int, default=100000)
+    p.add_argument('--depth', type=int, default=DEFAULT_DEPTH)
+    p.add_argument('--rate', type=float, default=1000.0, help='paced publish rate (default: 1000)')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'bench':
+        run_benchmark(args.reports, args.depth, args.rate)
+
+if __name__ == "__main__":
+    main()
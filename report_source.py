@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Shared Report Source
+
+Wraps the interrupt IN endpoint read that every tool performs and applies a
+common dispatch policy before handing reports to consumers:
+
+    - suppress exact duplicates of the last forwarded report (the idle case)
+    - coalesce changes that arrive within a time window (latest wins)
+    - force a periodic heartbeat so consumers know the device is alive
+
+The same policy is implemented in the driver's ReadComplete path
+(HORIRacingWheelDriver/HORIRacingWheelDriver.cpp).
+"""
+
+import array
+import errno
+import time
+
+# Interrupt IN report size and read timeout used by all tools
+REPORT_SIZE = 64
+READ_TIMEOUT_MS = 100
+
+# pyusb reports read timeouts as USBError with errno ETIMEDOUT (110 on Linux)
+TIMEOUT_ERRNO = errno.ETIMEDOUT
+
+class DispatchPolicy:
+    """Configuration for which reports are forwarded to consumers."""
+
+    def __init__(self, suppress_duplicates=True, coalesce_window=0.0, heartbeat_interval=1.0):
+        self.suppress_duplicates = suppress_duplicates
+        self.coalesce_window = coalesce_window        # seconds, 0 = forward every change
+        self.heartbeat_interval = heartbeat_interval  # seconds, 0 = no heartbeat
+
+    def __repr__(self):
+        return (f"DispatchPolicy(suppress_duplicates={self.suppress_duplicates}, "
+                f"coalesce_window={self.coalesce_window}, "
+                f"heartbeat_interval={self.heartbeat_interval})")
+
+# Forward everything, exactly as the tools behaved before the policy existed
+PASSTHROUGH = DispatchPolicy(suppress_duplicates=False, coalesce_window=0.0, heartbeat_interval=0.0)
+
+class DispatchStats:
+    """Counters for suppressed versus forwarded reports."""
+
+    def __init__(self):
+        self.received = 0
+        self.forwarded = 0
+        self.duplicates = 0
+        self.coalesced = 0
+        self.heartbeats = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    @property
+    def suppressed(self):
+        return self.duplicates + self.coalesced
+
+    def summary(self):
+        """One-line summary suitable for a status footer."""
+        return (f"received {self.received}, forwarded {self.forwarded}, "
+                f"suppressed {self.suppressed} (dup {self.duplicates}, "
+                f"coalesced {self.coalesced}), heartbeats {self.heartbeats}")
+
+class ReportDispatcher:
+    """Applies a DispatchPolicy to a stream of reports.
+
+    The last forwarded and the held (coalesced) reports are kept as owned
+    copies, so callers may offer a view of a buffer they reuse for the next
+    read; the hot path (duplicate compare, copy on change) never allocates.
+    """
+
+    def __init__(self, policy=None, clock=time.monotonic):
+        self.policy = policy if policy is not None else DispatchPolicy()
+        self.clock = clock
+        self.stats = DispatchStats()
+        self.last_sent_time = 0.0
+        self._last = bytearray()
+        self._has_last = False
+        self._pending = bytearray()
+        self._has_pending = False
+
+    @property
+    def last_sent(self):
+        """Copy of the last forwarded report, or None."""
+        return bytes(self._last) if self._has_last else None
+
+    def reset(self):
+        """Forget the last forwarded report so the next one is always sent."""
+        self._has_last = False
+        self._has_pending = False
+        self.last_sent_time = 0.0
+
+    def offer(self, report, now=None):
+        """Offer a newly read report. Returns the report to forward, or None.
+
+        `report` may be bytes, bytearray or a memoryview. When it is forwarded
+        the same object is returned; held or heartbeat reports are returned
+        as bytes.
+        """
+        if now is None:
+            now = self.clock()
+        policy = self.policy
+        self.stats.received += 1
+
+        if self._has_pending:
+            if report == self._pending:
+                self.stats.duplicates += 1
+                return self.flush(now)
+            # A newer change supersedes the held one before it was ever sent
+            self.stats.coalesced += 1
+            self._has_pending = False
+
+        if policy.suppress_duplicates and self._has_last and report == self._last:
+            if self._heartbeat_due(now):
+                self.stats.heartbeats += 1
+                return self._forward(report, now)
+            self.stats.duplicates += 1
+            return None
+
+        if (policy.coalesce_window and self._has_last
+                and now - self.last_sent_time < policy.coalesce_window):
+            self._pending[:] = report  # reuses storage when the size matches
+            self._has_pending = True
+            return None
+
+        return self._forward(report, now)
+
+    def flush(self, now=None):
+        """Forward a held or heartbeat report if one is due (call on idle/timeout)."""
+        if now is None:
+            now = self.clock()
+
+        if self._has_pending:
+            if now - self.last_sent_time >= self.policy.coalesce_window:
+                self._has_pending = False
+                return self._forward(bytes(self._pending), now)
+            return None
+
+        if self._has_last and self._heartbeat_due(now):
+            self.stats.heartbeats += 1
+            return self._forward(bytes(self._last), now)
+
+        return None
+
+    def _heartbeat_due(self, now):
+        interval = self.policy.heartbeat_interval
+        return bool(interval) and now - self.last_sent_time >= interval
+
+    def _forward(self, report, now):
+        self._last[:] = report
+        self._has_last = True
+        self.last_sent_time = now
+        self.stats.forwarded += 1
+        return report
+
+class ReportSource:
+    """Reads reports from the wheel and filters them through a dispatch policy.
+
+    `dev` is anything with a pyusb-style read(endpoint, size, timeout) method.
+    """
+
+    def __init__(self, dev, endpoint, policy=None, report_size=REPORT_SIZE,
+                 timeout=READ_TIMEOUT_MS, clock=time.monotonic):
+        self.dev = dev
+        self.endpoint = endpoint
+        self.report_size = report_size
+        self.timeout = timeout
+        self.dispatcher = ReportDispatcher(policy, clock)
+        # Reused by readinto()/read_buffered(): pyusb fills an array.array in
+        # place when given one instead of a size
+        self.buffer = array.array('B', bytes(report_size))
+        self.view = memoryview(self.buffer)
+        # Optional callable(report) fed every report read, before the policy
+        self.observer = None
+
+    @property
+    def policy(self):
+        return self.dispatcher.policy
+
+    @property
+    def stats(self):
+        return self.dispatcher.stats
+
+    def read_raw(self):
+        """Read one report, bypassing the policy. Returns bytes or None on timeout."""
+        try:
+            data = self.dev.read(self.endpoint, self.report_size, timeout=self.timeout)
+        except OSError as e:  # usb.core.USBError is an IOError subclass
+            if e.errno != TIMEOUT_ERRNO:
+                self.stats.errors += 1
+                raise
+            self.stats.timeouts += 1
+            return None
+
+        if not data:
+            return None
+        return bytes(data)
+
+    def read(self):
+        """Read one report and return it if the policy forwards it, else None."""
+        report = self.read_raw()
+        if report is None:
+            return self.dispatcher.flush()
+        if self.observer is not None:
+            self.observer(report)
+        return self.dispatcher.offer(report)
+
+    def readinto(self, buffer):
+        """Read one report into a preallocated array.array('B'), bypassing the policy.
+
+        Returns the number of bytes read, 0 on timeout.
+        """
+        try:
+            return self.dev.read(self.endpoint, buffer, timeout=self.timeout)
+        except OSError as e:
+            if e.errno != TIMEOUT_ERRNO:
+                self.stats.errors += 1
+                raise
+            self.stats.timeouts += 1
+            return 0
+
+    def read_buffered(self):
+        """Allocation-free read(): returns a memoryview of the reused buffer.
+
+        The view is only valid until the next read; copy it to keep it.
+        Held or heartbeat reports flushed by the policy are returned as bytes.
+        """
+        n = self.readinto(self.buffer)
+        if not n:
+            return self.dispatcher.flush()
+        view = self.view if n == self.report_size else self.view[:n]
+        if self.observer is not None:
+            self.observer(view)
+        return self.dispatcher.offer(view)
+
+def add_policy_arguments(parser, coalesce_ms=0.0, heartbeat=1.0):
+    """Add the shared dispatch policy options to an argparse parser."""
+    group = parser.add_argument_group('dispatch policy')
+    group.add_argument('--no-dedup', action='store_true',
+                       help='forward byte-identical reports instead of suppressing them')
+    group.add_argument('--coalesce-ms', type=float, default=coalesce_ms,
+                       help=f'coalesce changes within this window (default: {coalesce_ms:g} ms)')
+    group.add_argument('--heartbeat', type=float, default=heartbeat,
+                       help=f'force a report every N seconds, 0 to disable (default: {heartbeat:g})')
+    return group
+
+def policy_from_args(args):
+    """Build a DispatchPolicy from options added by add_policy_arguments."""
+    return DispatchPolicy(suppress_duplicates=not args.no_dedup,
+                          coalesce_window=args.coalesce_ms / 1000.0,
+                          heartbeat_interval=args.heartbeat)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Session Analytics
+
+Driving metrics for recorded captures, computed on NumPy columns instead of
+a parse_report() loop:
+
+    - steering velocity and acceleration (LSB/s, LSB/s^2) over a short
+      time span, so sensor noise isn't differentiated sample by sample
+    - time at full lock, per side
+    - throttle/brake overlap time (both pedals pressed, ZL/ZR excluded)
+    - paddle-shift counts and rate
+    - per-button press counts and hold durations (incl. ZL/ZR)
+
+The capture is mapped with np.memmap and decoded column by column; edges
+come from np.diff of unpacked button bits, and hold times from pairing each
+press with its release. Times are sample-and-hold: a state lasts until the
+next record, and gaps over MAX_HOLD (unplugs, paused recording) don't count.
+
+Results are cached in a sidecar (CAPTURE.analytics.json) keyed by a BLAKE2b
+hash of the capture's contents, so an edited or re-recorded file is
+re-analyzed and an unchanged one is not.
+
+Usage:
+    python3 session_analytics.py report capture.hcap [more.hcap ...] [--json] [--no-cache]
+    python3 session_analytics.py bench [--reports N]
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+import argparse
+
+from capture_analysis import BUTTON_BITS
+from capture_file import HEADER, CaptureFormatError, CaptureReader, record_dtype
+from wheel_state import require
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bump when a metric's definition changes, to invalidate cached results
+ANALYTICS_VERSION = 2
+
+# Steering velocity is measured between samples at least this far apart
+VELOCITY_SPAN = 0.02
+# |steering| at or beyond this counts as full lock (98% of the range)
+FULL_LOCK = 32112
+# A pedal counts as pressed above this (below it is rest noise)
+PEDAL_PRESSED = 16
+# Longer gaps between records are not attributed to the earlier state
+MAX_HOLD = 2.0
+
+HASH_CHUNK = 1 << 22
+
+def cache_path(capture_path):
+    return f"{capture_path}.analytics.json"
+
+def content_hash(path):
+    """BLAKE2b hex digest of a file's contents."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_columns(path):
+    """Decode a capture into a dict of NumPy columns (t in seconds from the first record)."""
+    require(np, 'numpy')
+    count = len(CaptureReader(path))
+    if not count:
+        return None
+    records = np.memmap(path, dtype=record_dtype(), mode='r', offset=HEADER.size, shape=(count,))
+    report = records['report']
+    host_ns = np.array(records['host_ns'])
+    return {
+        't': (host_ns - host_ns[0]) / 1e9,
+        'byte2': np.array(report[:, 2]),
+        'byte3': np.array(report[:, 3]),
+        'brake': np.array(report[:, 4]),
+        'accel': np.array(report[:, 5]),
+        'steering': np.ascontiguousarray(report[:, 6:8]).view('<i2').ravel(),
+    }
+
+def _hold_times(t):
+    """Seconds each record's state lasts (until the next record, capped by MAX_HOLD)."""
+    dt = np.empty_like(t)
+    dt[:-1] = np.diff(t)
+    dt[-1] = 0.0
+    dt[dt > MAX_HOLD] = 0.0
+    return dt
+
+def _rate_of_change(t, values, span=VELOCITY_SPAN):
+    """(midpoint times, d values / dt) between each sample and the first one `span` later."""
+    later = np.searchsorted(t, t + span)
+    valid = later < len(t)
+    i = np.flatnonzero(valid)
+    j = later[valid]
+    dt = t[j] - t[i]
+    keep = (dt > 0) & (dt <= MAX_HOLD)
+    i, j, dt = i[keep], j[keep], dt[keep]
+    rate = (values[j] - values[i]) / dt
+    return (t[i] + t[j]) / 2, rate
+
+def _percentiles(values):
+    if not len(values):
+        return None
+    p50, p95, p99 = np.percentile(np.abs(values), (50, 95, 99))
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+            'max': float(np.abs(values).max())}
+
+def _presses(held, dt):
+    """Press count, held seconds and per-press durations for a boolean column.
+
+    A press lasts the sum of its records' hold times, so gaps over MAX_HOLD
+    are left out of mean_hold and max_hold as they are of held_seconds.
+    """
+    edges = np.diff(held.astype(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # A release at index len(t) means still held at the end of the capture
+    elapsed = np.concatenate(([0.0], np.cumsum(dt)))
+    durations = elapsed[ends] - elapsed[starts]
+    return {
+        'presses': int(len(starts)),
+        'held_seconds': float(durations.sum()),
+        'mean_hold': float(durations.mean()) if len(durations) else 0.0,
+        'max_hold': float(durations.max()) if len(durations) else 0.0,
+    }
+
+def compute_metrics(columns):
+    """All session metrics from load_columns() output."""
+    t = columns['t']
+    dt = _hold_times(t)
+    # float64: np.abs() of int16 -32768 would wrap back to -32768
+    steering = columns['steering'].astype(np.float64)
+    brake = columns['brake']
+    accel = columns['accel']
+    zl = brake == 0xFF
+    zr = accel == 0xFF
+
+    mid, velocity = _rate_of_change(t, steering)
+    _, acceleration = _rate_of_change(mid, velocity)
+
+    brake_on = (brake > PEDAL_PRESSED) & ~zl
+    accel_on = (accel > PEDAL_PRESSED) & ~zr
+    overlap = brake_on & accel_on
+
+    bits = np.unpackbits(np.stack([columns['byte2'], columns['byte3']], axis=1),
+                         axis=1, bitorder='little').astype(bool)
+    buttons = {}
+    for (byte, bit), name in BUTTON_BITS.items():
+        buttons[name] = _presses(bits[:, (byte - 2) * 8 + bit], dt)
+    buttons['ZL'] = _presses(zl, dt)
+    buttons['ZR'] = _presses(zr, dt)
+
+    duration = float(dt.sum())
+    shifts = buttons['Paddle Up']['presses'] + buttons['Paddle Down']['presses']
+    return {
+        'reports': int(len(t)),
+        'span_seconds': float(t[-1]),
+        'active_seconds': duration,
+        'steering_velocity': _percentiles(velocity),
+        'steering_acceleration': _percentiles(acceleration),
+        'full_lock_seconds': float(dt[np.abs(steering) >= FULL_LOCK].sum()),
+        'full_lock_left_seconds': float(dt[steering <= -FULL_LOCK].sum()),
+        'full_lock_right_seconds': float(dt[steering >= FULL_LOCK].sum()),
+        'brake_seconds': float(dt[brake_on].sum()),
+        'throttle_seconds': float(dt[accel_on].sum()),
+        'overlap_seconds': float(dt[overlap].sum()),
+        'overlap_events': int(np.count_nonzero(np.diff(overlap.astype(np.int8), prepend=np.int8(0)) == 1)),
+        'shifts_up': buttons['Paddle Up']['presses'],
+        'shifts_down': buttons['Paddle Down']['presses'],
+        'shifts_per_minute': shifts * 60.0 / duration if duration else 0.0,
+        'buttons': buttons,
+    }
+
+def analyze(path, use_cache=True):
+    """(metrics, cached) for a capture, reusing the sidecar when the content hash matches."""
+    digest = content_hash(path)
+    sidecar = cache_path(path)
+    if use_cache:
+        try:
+            with open(sidecar) as f:
+                cached = json.load(f)
+            if cached.get('version') == ANALYTICS_VERSION and cached.get('hash') == digest:
+                return cached['metrics'], True
+        except (OSError, ValueError, KeyError):
+            pass
+
+    columns = load_columns(path)
+    metrics = compute_metrics(columns) if columns is not None else {'reports': 0}
+    if use_cache:
+        try:
+            with open(sidecar, 'w') as f:
+                json.dump({'version': ANALYTICS_VERSION, 'hash': digest, 'metrics': metrics}, f)
+        except OSError as e:
+            print(f"Warning: could not write {sidecar}: {e}")
+    return metrics, False
+
+def print_metrics(path, metrics, cached=False):
+    print(f"{path}{'  (cached)' if cached else ''}")
+    if not metrics.get('reports'):
+        print("  No reports")
+        return
+    print(f"  Reports:   {metrics['reports']}  ({metrics['active_seconds']:.1f} s active, "
+          f"{metrics['span_seconds']:.1f} s span)")
+    for key, label, unit in (('steering_velocity', 'Steer vel', 'LSB/s'),
+                             ('steering_acceleration', 'Steer acc', 'LSB/s^2')):
+        p = metrics[key]
+        if p:
+            print(f"  {label}:  p50 {p['p50']:12,.0f}  p95 {p['p95']:12,.0f}  "
+                  f"p99 {p['p99']:12,.0f}  max {p['max']:14,.0f} {unit}")
+    print(f"  Full lock: {metrics['full_lock_seconds']:.2f} s  (left {metrics['full_lock_left_seconds']:.2f}, "
+          f"right {metrics['full_lock_right_seconds']:.2f})")
+    print(f"  Pedals:    throttle {metrics['throttle_seconds']:.1f} s, brake {metrics['brake_seconds']:.1f} s, "
+          f"overlap {metrics['overlap_seconds']:.2f} s in {metrics['overlap_events']} events")
+    print(f"  Shifts:    up {metrics['shifts_up']}, down {metrics['shifts_down']}  "
+          f"({metrics['shifts_per_minute']:.1f}/min)")
+    print("  Buttons:")
+    for name, b in metrics['buttons'].items():
+        if b['presses']:
+            print(f"    {name:14s} {b['presses']:6d} presses  held {b['held_seconds']:8.2f} s  "
+                  f"mean {b['mean_hold'] * 1000:7.1f} ms  max {b['max_hold'] * 1000:8.1f} ms")
+
+def season_totals(results):
+    """Additive metrics summed over several captures."""
+    totals = {'captures': len(results), 'reports': 0, 'active_seconds': 0.0,
+              'full_lock_seconds': 0.0, 'overlap_seconds': 0.0, 'shifts': 0, 'presses': {}}
+    for metrics in results:
+        if not metrics.get('reports'):
+            continue
+        totals['reports'] += metrics['reports']
+        totals['active_seconds'] += metrics['active_seconds']
+        totals['full_lock_seconds'] += metrics['full_lock_seconds']
+        totals['overlap_seconds'] += metrics['overlap_seconds']
+        totals['shifts'] += metrics['shifts_up'] + metrics['shifts_down']
+        for name, b in metrics['buttons'].items():
+            totals['presses'][name] = totals['presses'].get(name, 0) + b['presses']
+    return totals
+
+def _reference_metrics(path, limit):
+    """Press counts, overlap and full-lock time from a parse_report() loop (bench check)."""
+    from wheel_state import parse_report
+
+    presses = {'A': 0, 'Paddle Up': 0, 'ZL': 0}
+    keys = {'A': 'btn_a', 'Paddle Up': 'paddle_up', 'ZL': 'btn_zl'}
+    previous = dict.fromkeys(presses, False)
+    overlap = full_lock = 0.0
+    last_t = last = None
+    for n, (host_ns, _, report) in enumerate(CaptureReader(path)):
+        if n >= limit:
+            break
+        state = parse_report(report)
+        t = host_ns / 1e9
+        if last is not None and t - last_t <= MAX_HOLD:
+            dt = t - last_t
+            brake_on = PEDAL_PRESSED < last['brake'] < 0xFF
+            accel_on = PEDAL_PRESSED < last['accel'] < 0xFF
+            if brake_on and accel_on:
+                overlap += dt
+            if abs(last['steering_signed']) >= FULL_LOCK:
+                full_lock += dt
+        for name, key in keys.items():
+            if state[key] and not previous[name]:
+                presses[name] += 1
+            previous[name] = state[key]
+        last_t, last = t, state
+    return presses, overlap, full_lock, n
+
+def run_benchmark(reports=1000000):
+    """Vectorized analysis against a parse_report() loop, and the cache hit path."""
+    from synth_wheel import write_long_capture
+
+    require(np, 'numpy')
+    path = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'session-analytics-bench.hcap')
+    print(f"Writing {reports} synthetic reports ({reports / 60000:.1f} min at 1 kHz)...")
+    write_long_capture(path, reports)
+    try:
+        if os.path.exists(cache_path(path)):
+            os.remove(cache_path(path))
+        print("=" * 80)
+        print(f"Session analytics ({reports} reports, {os.path.getsize(path) / 1e6:.0f} MB)")
+        print("=" * 80)
+
+        start = time.perf_counter()
+        columns = load_columns(path)
+        decoded = time.perf_counter()
+        metrics = compute_metrics(columns)
+        done = time.perf_counter()
+        print(f"  Decode to columns:  {decoded - start:7.3f} s")
+        print(f"  Compute metrics:    {done - decoded:7.3f} s")
+        vector = done - start
+        print(f"  Vectorized total:   {vector:7.3f} s  {reports / vector:12,.0f} reports/s")
+
+        sample = min(reports, 200000)
+        start = time.perf_counter()
+        presses, overlap, full_lock, _ = _reference_metrics(path, sample)
+        loop = (time.perf_counter() - start) * reports / sample
+        print(f"  parse_report loop:  {loop:7.3f} s  {reports / loop:12,.0f} reports/s "
+              f"(3 metrics, extrapolated from {sample})  speedup {loop / vector:.0f}x")
+
+        head = {key: value[:sample] for key, value in columns.items()}
+        check = compute_metrics(head)
+        same = (all(check['buttons'][name]['presses'] == count for name, count in presses.items())
+                and abs(check['overlap_seconds'] - overlap) < 1e-6
+                and abs(check['full_lock_seconds'] - full_lock) < 1e-6)
+        print(f"  Check vs loop on first {sample}: {'match' if same else 'MISMATCH'}")
+
+        start = time.perf_counter()
+        analyze(path)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        _, cached = analyze(path)
+        hit = time.perf_counter() - start
+        print(f"  analyze() miss:     {first:7.3f} s   hit: {hit:7.3f} s (hash only)"
+              f"{'' if cached else '  CACHE NOT USED'}")
+        print()
+        print_metrics(path, metrics)
+    finally:
+        for leftover in (path, cache_path(path)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Session Analytics")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('report', help='driving metrics for one or more captures')
+    p.add_argument('paths', nargs='+')
+    p.add_argument('--json', action='store_true', help='print metrics as JSON')
+    p.add_argument('--no-cache', action='store_true', help='ignore and do not write sidecar caches')
+    p = sub.add_parser('bench', help='vectorized analysis against a parse_report loop')
+    p.add_argument('--reports', type=int, default=1000000)
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'bench':
+            run_benchmark(args.reports)
+            return
+        require(np, 'numpy')
+    except ImportError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    results = {}
+    for path in args.paths:
+        try:
+            metrics, cached = analyze(path, use_cache=not args.no_cache)
+        except (OSError, ValueError, CaptureFormatError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        results[path] = metrics
+        if not args.json:
+            print_metrics(path, metrics, cached)
+            print()
+
+    if args.json:
+        print(json.dumps({'captures': results, 'totals': season_totals(list(results.values()))}, indent=2))
+    elif len(results) > 1:
+        totals = season_totals(list(results.values()))
+        print(f"Season: {totals['captures']} captures, {totals['reports']} reports, "
+              f"{totals['active_seconds'] / 3600:.2f} h active, full lock {totals['full_lock_seconds']:.1f} s, "
+              f"overlap {totals['overlap_seconds']:.1f} s, {totals['shifts']} shifts")
+
+if __name__ == "__main__":
+    main()
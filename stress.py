@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Stress and Soak Harness
+
+Finds the input rate at which each pipeline stage stops keeping up, and
+watches long runs for memory growth:
+
+    reader          ReportSource.read_buffered() (passthrough policy)
+    parse_report    reader + parse_report() (a dict per report)
+    wheel_state     reader + WheelState.update()
+    detect_changes  ControlMapper.detect_changes() (map_controls.py)
+    draw_ui         reader + WheelState + test_wheel.draw_ui() to /dev/null
+    capture_writer  reader + CaptureWriter.write() to a temporary file
+
+Each stage reads from PacedDevice, a synthetic wheel producing reports in
+real time at a fixed rate into a bounded queue (QUEUE_REPORTS deep, like
+the host's pending-transfer buffer). A rate passes when nothing is dropped,
+the queue ends (nearly) empty and the stage consumed what was produced.
+Rates double from a fraction of the stage's flat-out service rate until one
+fails (or halve until one passes), then bisect to the knee. A rate only
+fails if it fails twice in a row, so one scheduler hiccup doesn't set it.
+
+The soak phase runs each stage at a fraction of its knee under tracemalloc,
+as one uninterrupted run on objects built once, and reports the growth
+after warmup with its top allocation sites, so
+unbounded buffers and per-report leaks show up while bounded ones (a full
+deque(maxlen=...)) don't.
+
+Usage:
+    python3 stress.py [--stages reader,wheel_state] [--step-seconds S]
+                      [--soak-seconds S] [--output capacity.json]
+"""
+
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import argparse
+
+from report_source import PASSTHROUGH, REPORT_SIZE, ReportSource
+
+# Reports the host buffers before the oldest are lost
+QUEUE_REPORTS = 128
+# A rate fails if more than this fraction of the queue is still waiting at the end
+BACKLOG_LIMIT = 0.25
+# Bisection steps between the last passing and the first failing rate
+BISECT_STEPS = 4
+# The rate ramp starts at a fraction of the flat-out rate, capped here
+START_RATE = 10000
+MIN_RATE = 50
+# Growth after warmup (bytes) that counts as a suspected leak in a soak run
+LEAK_THRESHOLD = 256 * 1024
+
+class PacedDevice:
+    """Synthetic wheel producing `rate` reports/s into a queue of `capacity`.
+
+    read() has the pyusb interface. rate=None serves reports as fast as
+    they are read (for measuring the flat-out service rate). Reports the
+    reader is too slow for are dropped once the queue is full.
+    """
+
+    def __init__(self, rate=None, capacity=QUEUE_REPORTS, reports=None):
+        if reports is None:
+            from synth_wheel import SyntheticWheel
+            reports = [r for r, _ in SyntheticWheel(rate=1000).generate(4096)]
+        self.reports = reports
+        self.rate = rate
+        self.capacity = capacity
+        self.consumed = 0
+        self.dropped = 0
+        self.max_backlog = 0
+        self.start = time.perf_counter()
+
+    def backlog(self):
+        """Reports produced but not yet read."""
+        if self.rate is None:
+            return 0
+        produced = int((time.perf_counter() - self.start) * self.rate)
+        return max(0, produced - self.consumed - self.dropped)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        if self.rate is not None:
+            pending = self.backlog()
+            if pending > self.capacity:
+                self.dropped += pending - self.capacity
+                pending = self.capacity
+            self.max_backlog = max(self.max_backlog, pending)
+            if not pending:
+                # Wait for the next report to be produced
+                due = self.start + (self.consumed + self.dropped + 1) / self.rate
+                delay = due - time.perf_counter()
+                if delay > 0.001:
+                    time.sleep(delay - 0.0005)
+                while time.perf_counter() < due:
+                    pass
+        report = self.reports[self.consumed % len(self.reports)]
+        self.consumed += 1
+        if isinstance(size_or_buffer, int):
+            return report[:size_or_buffer]
+        memoryview(size_or_buffer)[:len(report)] = report
+        return len(report)
+
+def _read_loop(make_work=None):
+    """Stage: read through a ReportSource and apply a work function to each report.
+
+    A stage is a context manager taking the device. It builds its objects
+    once on entry and yields step(seconds), which runs the loop and may be
+    called repeatedly on the same objects.
+    """
+    @contextlib.contextmanager
+    def stage(dev):
+        source = ReportSource(dev, 0x81, PASSTHROUGH)
+        read = source.read_buffered
+        work = make_work() if make_work is not None else None
+
+        def step(seconds):
+            end = time.perf_counter() + seconds
+            if work is None:
+                while time.perf_counter() < end:
+                    read()
+            else:
+                while time.perf_counter() < end:
+                    data = read()
+                    if data:
+                        work(data)
+        yield step
+    return stage
+
+def _stage_reader():
+    return _read_loop()
+
+def _stage_parse_report():
+    from wheel_state import parse_report
+    return _read_loop(lambda: lambda data: parse_report(bytes(data)))
+
+def _stage_wheel_state():
+    from wheel_state import WheelState
+    return _read_loop(lambda: WheelState().update)
+
+def _stage_detect_changes():
+    from map_controls import ControlMapper
+
+    @contextlib.contextmanager
+    def stage(dev):
+        mapper = ControlMapper(dev, 0x81)
+        mapper.baseline = bytes(REPORT_SIZE)
+        yield lambda seconds: mapper.detect_changes(duration=seconds)
+    return stage
+
+def _stage_draw_ui():
+    from test_wheel import draw_ui
+    from wheel_state import WheelState
+
+    def make_work():
+        state = WheelState()
+
+        def work(data):
+            if state.update(data):
+                draw_ui(state)
+        return work
+    return _read_loop(make_work)
+
+def _stage_capture_writer():
+    from capture_file import CaptureWriter
+
+    @contextlib.contextmanager
+    def stage(dev):
+        fd, path = tempfile.mkstemp(suffix='.hcap')
+        os.close(fd)
+        writer = CaptureWriter(path)
+        try:
+            with _read_loop(lambda: writer.write)(dev) as step:
+                yield step
+        finally:
+            writer.close()
+            os.unlink(path)
+    return stage
+
+STAGES = {
+    'reader': _stage_reader,
+    'parse_report': _stage_parse_report,
+    'wheel_state': _stage_wheel_state,
+    'detect_changes': _stage_detect_changes,
+    'draw_ui': _stage_draw_ui,
+    'capture_writer': _stage_capture_writer,
+}
+
+@contextlib.contextmanager
+def _quiet():
+    """Send stdout (including subprocesses such as 'clear') to /dev/null."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+            yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def _run_step(stage, rate, seconds, reports):
+    dev = PacedDevice(rate, reports=reports)
+    with _quiet(), stage(dev) as step:
+        step(seconds)
+        # Read before the stage's teardown, which the device keeps producing through
+        backlog = dev.backlog()
+        consumed = dev.consumed
+        dropped = dev.dropped
+    produced = consumed + dropped + backlog
+    result = {
+        'rate_hz': rate,
+        'achieved_hz': round(consumed / seconds, 1),
+        'dropped': dropped,
+        'backlog_end': backlog,
+        'max_backlog': dev.max_backlog,
+    }
+    result['ok'] = (dropped == 0 and backlog <= BACKLOG_LIMIT * QUEUE_REPORTS
+                    and consumed >= 0.98 * produced - QUEUE_REPORTS)
+    return result
+
+def find_knee(name, stage, step_seconds=1.0, reports=None):
+    """Flat-out service rate, the rate ramp and the knee for one stage."""
+    dev = PacedDevice(None, reports=reports)
+    start = time.perf_counter()
+    with _quiet(), stage(dev) as step:
+        step(step_seconds)
+    service = dev.consumed / (time.perf_counter() - start)
+
+    steps = []
+
+    def probe(rate):
+        # A single miss on a loaded host can be a scheduler hiccup; a rate only
+        # fails if a second attempt fails too.
+        for _ in range(2):
+            step = _run_step(stage, rate, step_seconds, reports)
+            steps.append(step)
+            print(f"  {name:15s} {rate:10,.0f} Hz  achieved {step['achieved_hz']:10,.0f}  "
+                  f"dropped {step['dropped']:7d}  backlog {step['backlog_end']:4d}  "
+                  f"{'ok' if step['ok'] else 'FAIL'}")
+            if step['ok']:
+                return True
+        return False
+
+    rate = max(MIN_RATE, round(min(service / 8, START_RATE), -1))
+    good = None
+    bad = None
+    if probe(rate):
+        good = rate
+        while rate <= 4 * service:   # beyond that the source itself is the limit
+            rate *= 2
+            if not probe(rate):
+                bad = rate
+                break
+            good = rate
+    else:
+        bad = rate
+        while rate > MIN_RATE:
+            rate = max(MIN_RATE, round(rate / 2, -1))
+            if probe(rate):
+                good = rate
+                break
+            bad = rate
+
+    if good is not None and bad is not None:
+        for _ in range(BISECT_STEPS):
+            rate = round((good + bad) / 2, -1)
+            if rate in (good, bad):
+                break
+            if probe(rate):
+                good = rate
+            else:
+                bad = rate
+
+    return {
+        'service_hz': round(service, 1),
+        'knee_hz': good,
+        'first_failing_hz': bad,
+        'steps': steps,
+    }
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def soak(name, stage, rate, seconds, reports=None, interval=1.0):
+    """Run `stage` at `rate` for `seconds` under tracemalloc; report memory growth.
+
+    The stage's objects are built once and run without a break for the
+    whole soak, so anything they accumulate per report stays reachable; a
+    sampler thread reads the traced memory every `interval` seconds.
+    """
+    warmup = max(interval, seconds * 0.2)
+    dev = PacedDevice(rate, reports=reports)
+    samples = []
+    marks = {}
+    stop = threading.Event()
+
+    def sample():
+        if stop.wait(warmup):
+            return
+        marks['baseline'] = tracemalloc.take_snapshot()
+        marks['traced'] = tracemalloc.get_traced_memory()[0]
+        marks['rss'] = _rss_bytes()
+        start = time.perf_counter()
+        while not stop.wait(interval):
+            samples.append((round(time.perf_counter() - start, 3), tracemalloc.get_traced_memory()[0]))
+
+    tracemalloc.start(5)
+    sampler = threading.Thread(target=sample, name='soak-sampler', daemon=True)
+    try:
+        with _quiet(), stage(dev) as step:
+            sampler.start()
+            step(seconds)
+            stop.set()
+            sampler.join()
+            # Taken while the stage's objects are still alive
+            final = tracemalloc.take_snapshot()
+    finally:
+        stop.set()
+        tracemalloc.stop()
+    end_rss = _rss_bytes()
+    baseline = marks.get('baseline', final)
+    start_traced = marks.get('traced', 0)
+    start_rss = marks.get('rss')
+
+    growth = samples[-1][1] - start_traced if samples else 0
+    half = samples[len(samples) // 2][1] if samples else start_traced
+    late_growth = samples[-1][1] - half if samples else 0
+    # A bounded buffer fills during warmup or the first half and then stays
+    # flat; a leak keeps growing in the second half too
+    suspected = growth > LEAK_THRESHOLD and late_growth > LEAK_THRESHOLD / 2
+    # tracemalloc's own bookkeeping isn't the stage's
+    own = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    sites = []
+    diffs = final.filter_traces(own).compare_to(baseline.filter_traces(own), 'lineno')
+    for diff in diffs[:5]:
+        if diff.size_diff <= 0:
+            continue
+        frame = diff.traceback[0]
+        sites.append({'site': f"{os.path.basename(frame.filename)}:{frame.lineno}",
+                      'bytes': diff.size_diff, 'blocks': diff.count_diff})
+    result = {
+        'rate_hz': rate,
+        'seconds': seconds,
+        'warmup_seconds': warmup,
+        'reports': dev.consumed,
+        'dropped': dev.dropped,
+        'traced_growth_bytes': growth,
+        'traced_growth_second_half_bytes': late_growth,
+        'bytes_per_report': round(growth / max(1, dev.consumed), 3),
+        'rss_start_bytes': start_rss,
+        'rss_end_bytes': end_rss,
+        'leak_suspected': suspected,
+        'top_growth_sites': sites,
+        'samples': samples,
+    }
+    print(f"  {name:15s} {rate:10,.0f} Hz  {seconds:5.0f} s  growth {growth / 1024:8.1f} KiB "
+          f"(second half {late_growth / 1024:7.1f} KiB)  "
+          f"{'LEAK SUSPECTED' if suspected else 'flat'}")
+    for site in sites[:3]:
+        print(f"  {'':15s}   +{site['bytes'] / 1024:8.1f} KiB  {site['site']}")
+    return result
+
+def run(stages, step_seconds=1.0, soak_seconds=10.0, soak_fraction=0.5, output=None):
+    from synth_wheel import SyntheticWheel
+    reports = [r for r, _ in SyntheticWheel(rate=1000).generate(4096)]
+
+    report = {
+        'host': {'python': platform.python_version(), 'machine': platform.machine(),
+                 'system': platform.system(), 'cpus': os.cpu_count()},
+        'queue_reports': QUEUE_REPORTS,
+        'step_seconds': step_seconds,
+        'stages': {},
+    }
+    loaded = {}
+    for name in stages:
+        try:
+            loaded[name] = STAGES[name]()
+        except (ImportError, SystemExit) as e:
+            print(f"  {name:15s} unavailable ({e})")
+            report['stages'][name] = {'error': str(e)}
+
+    print("=" * 80)
+    print(f"Knee search ({step_seconds:g} s per rate, queue {QUEUE_REPORTS} reports)")
+    print("=" * 80)
+    for name, stage in loaded.items():
+        report['stages'][name] = find_knee(name, stage, step_seconds, reports)
+
+    if soak_seconds:
+        print()
+        print("=" * 80)
+        print(f"Soak ({soak_seconds:g} s per stage at {soak_fraction:.0%} of the knee, tracemalloc on)")
+        print("=" * 80)
+        for name, stage in loaded.items():
+            knee = report['stages'][name]['knee_hz']
+            if not knee:
+                continue
+            report['stages'][name]['soak'] = soak(name, stage, knee * soak_fraction,
+                                                  soak_seconds, reports)
+
+    print()
+    print(f"{'stage':16s} {'flat out':>12s} {'knee':>12s}  soak")
+    for name, result in report['stages'].items():
+        if 'error' in result:
+            print(f"{name:16s} {'unavailable':>12s}")
+            continue
+        knee = f"{result['knee_hz']:,.0f} Hz" if result['knee_hz'] else 'none'
+        soak_result = result.get('soak')
+        verdict = '' if soak_result is None else (
+            'LEAK SUSPECTED' if soak_result['leak_suspected']
+            else f"flat ({soak_result['bytes_per_report']:+.3f} B/report)")
+        print(f"{name:16s} {result['service_hz']:9,.0f} Hz {knee:>12s}  {verdict}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nCapacity report written to {output}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel stress and soak harness")
+    parser.add_argument('--stages', default=','.join(STAGES),
+                        help=f"comma-separated stages (default: all of {', '.join(STAGES)})")
+    parser.add_argument('--step-seconds', type=float, default=1.0, help='seconds per rate step')
+    parser.add_argument('--soak-seconds', type=float, default=10.0,
+                        help='soak time per stage, 0 to skip (default: 10)')
+    parser.add_argument('--soak-fraction', type=float, default=0.5,
+                        help='soak rate as a fraction of the knee (default: 0.5)')
+    parser.add_argument('--output', help='write the JSON capacity report here')
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        print(f"Error: unknown stage(s): {', '.join(unknown)}")
+        sys.exit(1)
+    run(stages, args.step_seconds, args.soak_seconds, args.soak_fraction, args.output)
+
+if __name__ == "__main__":
+    main()
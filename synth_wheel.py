@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Synthetic Report Generator
+
+Produces realistic report streams in the layout parse_report() decodes, so
+the tools, decoders and filters can be benchmarked without anyone turning
+the wheel:
+
+    Bytes 6-7: steering sweeps (signed 16-bit) with holds at center and
+               both locks
+    Byte 4:    brake ramps, with ZL appearing as a digital 0xFF jump
+    Byte 5:    accelerator ramps plus the documented brake cross-talk
+               (0-86), with ZR appearing as a digital 0xFF jump
+    Bytes 2-3: button chords (D-pad incl. diagonals, shoulders, +/-,
+               paddles, Home, A/B/X/Y)
+
+Every report comes with its ground truth (the physical control positions
+before cross-talk and noise), so decoders and filters can be scored for
+accuracy as well as speed. SyntheticDevice serves the stream through the
+pyusb read(endpoint, size, timeout) interface, flat out or paced in real
+time at rates up to tens of kHz.
+
+Usage:
+    python3 synth_wheel.py capture out.hcap [--rate HZ] [--seconds S] [--noise LSB]
+    python3 synth_wheel.py bench [--reports N]
+    python3 synth_wheel.py realtime [--rate HZ] [--seconds S]
+
+The tools accept --synthetic HZ in place of a connected wheel.
+"""
+
+import bisect
+import csv
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+from report_source import REPORT_SIZE
+
+# Physical control positions behind one report
+Truth = namedtuple('Truth', 'index time_ns steering brake accel zl zr byte2 byte3')
+
+MASK64 = (1 << 64) - 1
+
+# Brake at 0xFE shows up as 86 (0x56) on the accelerator byte
+CROSSTALK_MAX = 0x56
+
+# Control profiles over one period: (phase, value) breakpoints, linearly
+# interpolated. Pedals stop at 0xFE so an analog press never reads as ZL/ZR.
+STEERING_PROFILE = ((0.0, 0), (0.1, 0), (0.35, 32767), (0.4, 32767),
+                    (0.85, -32768), (0.9, -32768), (1.0, 0))
+BRAKE_PROFILE = ((0.0, 0), (0.2, 0), (0.45, 0xFE), (0.6, 0xFE), (0.8, 0), (1.0, 0))
+ACCEL_PROFILE = ((0.0, 0), (0.3, 0), (0.5, 0xFE), (0.7, 0xFE), (0.75, 120),
+                 (0.85, 0), (1.0, 0))
+
+# Phase windows (within the pedal's period, pedal released) where ZL/ZR are held
+ZL_WINDOW = (0.85, 0.92)
+ZR_WINDOW = (0.9, 0.96)
+
+# Button chords as (byte2, byte3, name); each is held for half a chord period
+CHORDS = (
+    (0x01, 0x00, 'Up'), (0x09, 0x00, 'Up+Right'), (0x08, 0x00, 'Right'),
+    (0x0A, 0x00, 'Down+Right'), (0x02, 0x00, 'Down'), (0x06, 0x00, 'Down+Left'),
+    (0x04, 0x00, 'Left'), (0x05, 0x00, 'Up+Left'),
+    (0x10, 0x00, 'Plus'), (0x20, 0x00, 'Minus'), (0x30, 0x00, 'Plus+Minus'),
+    (0xC0, 0x00, 'LSB+RSB'), (0x00, 0x03, 'Both paddles'), (0x00, 0x01, 'Paddle down'),
+    (0x00, 0x02, 'Paddle up'), (0x00, 0x04, 'Home'), (0x00, 0x30, 'A+B'),
+    (0x00, 0xC0, 'X+Y'), (0x00, 0xF0, 'A+B+X+Y'), (0x01, 0x10, 'Up+A'),
+    (0x48, 0x82, 'Right+LSB+Y+Paddle up'), (0xFF, 0xF7, 'Everything'),
+)
+
+def _profile_table(points, samples):
+    """Sample a piecewise-linear profile at `samples` evenly spaced phases."""
+    phases = [p for p, _ in points]
+    table = []
+    for i in range(samples):
+        phase = i / samples
+        k = min(bisect.bisect_right(phases, phase), len(points) - 1)
+        (p0, v0), (p1, v1) = points[k - 1], points[k]
+        table.append(int(round(v0 + (v1 - v0) * (phase - p0) / (p1 - p0))) if p1 > p0 else v1)
+    return table
+
+def _window_table(window, samples):
+    start, end = window
+    return [start <= i / samples < end for i in range(samples)]
+
+class SyntheticWheel:
+    """Deterministic report stream at `rate` reports per second.
+
+    Report i is a pure function of i and the seed (the noise is hashed from
+    both), so any slice of the stream can be regenerated. Control profiles
+    are sampled once into per-period tables, making generation a handful of
+    lookups per report.
+    """
+
+    def __init__(self, rate=1000, seed=0, noise=0, crosstalk=True, steering_period=4.0,
+                 brake_period=3.0, accel_period=2.5, chord_period=0.2):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.period_ns = 1e9 / rate
+        self.noise = noise
+        self.crosstalk = crosstalk
+        self.seed = seed
+        self._seed_mix = (seed * 0xD1B54A32D192ED03 + 1) & MASK64
+        self._noise_span = 2 * noise + 1
+
+        def samples(seconds):
+            return max(1, int(round(seconds * rate)))
+
+        self._steering = _profile_table(STEERING_PROFILE, samples(steering_period))
+        self._brake = _profile_table(BRAKE_PROFILE, samples(brake_period))
+        self._accel = _profile_table(ACCEL_PROFILE, samples(accel_period))
+        self._zl = _window_table(ZL_WINDOW, len(self._brake))
+        self._zr = _window_table(ZR_WINDOW, len(self._accel))
+        self._chord_samples = samples(chord_period)
+        self._crosstalk = [b * CROSSTALK_MAX // 0xFE if crosstalk else 0 for b in range(256)]
+
+    def truth_at(self, index):
+        """Ground truth for report `index`."""
+        brake_i = index % len(self._brake)
+        accel_i = index % len(self._accel)
+        chord_i, within = divmod(index, self._chord_samples)
+        if within < self._chord_samples // 2:
+            byte2, byte3, _ = CHORDS[chord_i % len(CHORDS)]
+        else:
+            byte2 = byte3 = 0
+        return Truth(index, int(index * self.period_ns),
+                     self._steering[index % len(self._steering)],
+                     self._brake[brake_i], self._accel[accel_i],
+                     self._zl[brake_i], self._zr[accel_i], byte2, byte3)
+
+    def noise_at(self, index):
+        """Steering noise of report `index`, uniform in [-noise, noise] (splitmix64 of seed and index)."""
+        x = (index * 0x9E3779B97F4A7C15 + self._seed_mix) & MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+        return (x ^ (x >> 31)) % self._noise_span - self.noise
+
+    def render(self, truth, buffer):
+        """Write the report for `truth` into a REPORT_SIZE bytearray/array."""
+        steering = truth.steering
+        if self.noise:
+            steering = max(-32768, min(32767, steering + self.noise_at(truth.index)))
+        steering &= 0xFFFF
+        buffer[2] = truth.byte2
+        buffer[3] = truth.byte3
+        buffer[4] = 0xFF if truth.zl else truth.brake
+        buffer[5] = 0xFF if truth.zr else min(0xFE, truth.accel + self._crosstalk[truth.brake])
+        buffer[6] = steering & 0xFF
+        buffer[7] = steering >> 8
+
+    def report_at(self, index):
+        """Report bytes for `index`."""
+        report = bytearray(REPORT_SIZE)
+        self.render(self.truth_at(index), report)
+        return bytes(report)
+
+    def generate(self, count, start=0):
+        """Yield (report bytes, Truth) for `count` consecutive reports."""
+        report = bytearray(REPORT_SIZE)
+        for index in range(start, start + count):
+            truth = self.truth_at(index)
+            self.render(truth, report)
+            yield bytes(report), truth
+
+class SyntheticDevice:
+    """Fake device serving a SyntheticWheel through the pyusb read() interface.
+
+    Flat out by default; with realtime=True reports are paced at the wheel's
+    rate (sleeping for long gaps, spinning for the last fraction of a
+    millisecond so tens of kHz stay accurate) and a slow reader catches up
+    rather than drifting. `truth` is the ground truth of the last report
+    read and `device_ns` its time on the wheel's own schedule (the device
+    clock for clock_sync). Raises EOFError after `count` reports if a count
+    is given.
+    """
+
+    def __init__(self, wheel=None, realtime=False, count=None):
+        self.wheel = wheel if wheel is not None else SyntheticWheel()
+        self.realtime = realtime
+        self.count = count
+        self.index = 0
+        self.truth = None
+        self.device_ns = 0
+        self._report = bytearray(REPORT_SIZE)
+        self._start_ns = None
+
+    def read(self, endpoint, size, timeout=None):
+        # `size` is a byte count or, pyusb-style, a buffer to read into
+        if self.count is not None and self.index >= self.count:
+            raise EOFError(f"end of synthetic stream ({self.count} reports)")
+        truth = self.wheel.truth_at(self.index)
+        self.index += 1
+
+        if self.realtime:
+            if self._start_ns is None:
+                self._start_ns = time.monotonic_ns() - truth.time_ns
+            due = self._start_ns + truth.time_ns
+            delay = due - time.monotonic_ns()
+            if delay > 1_000_000:
+                time.sleep((delay - 500_000) / 1e9)
+            while time.monotonic_ns() < due:
+                pass
+
+        self.truth = truth
+        # +1 so the first report's timestamp isn't the "no device clock" 0
+        self.device_ns = truth.time_ns + 1
+        if isinstance(size, int):
+            report = self._report
+            self.wheel.render(truth, report)
+            return bytes(report[:size])
+        self.wheel.render(truth, size)
+        return min(len(size), REPORT_SIZE)
+
+    def skip_to_now(self):
+        """Drop the reports a real wheel would have sent while nobody read (realtime only)."""
+        if self.realtime and self._start_ns is not None:
+            self.index = max(self.index, int((time.monotonic_ns() - self._start_ns) / self.wheel.period_ns))
+
+def fake_device_from_args(args):
+    """Device for the shared --replay/--synthetic options, or None for the wheel.
+
+    Replays and synthetic streams run in real time for viewing and flat out
+    (looping where needed) in --profile mode.
+    """
+    profile = getattr(args, 'profile', False)
+    if getattr(args, 'replay', None):
+        from capture_file import ReplayDevice
+        print(f"Replaying capture: {args.replay}")
+        return ReplayDevice(args.replay, realtime=not profile, loop=profile)
+    if getattr(args, 'synthetic', None):
+        print(f"Synthetic wheel at {args.synthetic:g} reports/s")
+        return SyntheticDevice(SyntheticWheel(args.synthetic), realtime=not profile)
+    return None
+
+def score_decoder(decode, wheel, count):
+    """Run `decode(report)` over `count` reports and score it against the truth.
+
+    `decode` returns a parse_report()-style mapping (a dict or a WheelState).
+    Pedal errors are measured where ZL/ZR are not held, so the accelerator
+    error of a plain decoder is the uncorrected brake cross-talk.
+    Returns a dict of rate and error figures.
+    """
+    cases = list(wheel.generate(count))
+    start = time.perf_counter()
+    for report, _ in cases:
+        decode(report)
+    elapsed = time.perf_counter() - start
+
+    steering_err = steering_max = brake_err = accel_err = 0
+    pedal_samples = button_errors = overlay_errors = 0
+    for report, truth in cases:
+        state = decode(report)
+        err = abs(state['steering_signed'] - truth.steering)
+        steering_err += err
+        steering_max = max(steering_max, err)
+        if not truth.zl and not truth.zr:
+            brake_err += abs(state['brake'] - truth.brake)
+            accel_err += abs(state['accel'] - truth.accel)
+            pedal_samples += 1
+        if state['byte2'] != truth.byte2 or state['byte3'] != truth.byte3:
+            button_errors += 1
+        if state['btn_zl'] != truth.zl or state['btn_zr'] != truth.zr:
+            overlay_errors += 1
+
+    pedal_samples = max(1, pedal_samples)
+    return {
+        'rate': count / elapsed,
+        'steering_mae': steering_err / count,
+        'steering_max': steering_max,
+        'brake_mae': brake_err / pedal_samples,
+        'accel_mae': accel_err / pedal_samples,
+        'button_errors': button_errors,
+        'overlay_errors': overlay_errors,
+    }
+
+def write_capture(path, wheel, count):
+    """Write `count` reports to a capture file and their truth to PATH.truth.csv."""
+    from capture_file import CaptureWriter
+
+    truth_path = f"{path}.truth.csv"
+    with CaptureWriter(path) as writer, open(truth_path, 'w', newline='') as f:
+        out = csv.writer(f)
+        out.writerow(Truth._fields)
+        for report, truth in wheel.generate(count):
+            writer.write(report, host_ns=truth.time_ns)
+            out.writerow((truth.index, truth.time_ns, truth.steering, truth.brake, truth.accel,
+                          int(truth.zl), int(truth.zr), truth.byte2, truth.byte3))
+    return truth_path
+
+def write_long_capture(path, reports, rate=1000, noise=8):
+    """Large benchmark capture, fast: one minute of synthetic reports is
+    generated once and repeated with shifted timestamps (no truth file)."""
+    from capture_file import RECORD_HEADER, RECORD_SIZE, pack_header, pack_record_into
+
+    wheel = SyntheticWheel(rate=rate, noise=noise)
+    period = min(int(60 * rate), reports)
+    body = bytearray(period * RECORD_SIZE)
+    for k, (report, truth) in enumerate(wheel.generate(period)):
+        pack_record_into(body, k * RECORD_SIZE, report, truth.time_ns)
+    span_ns = int(period * wheel.period_ns)
+    with open(path, 'wb') as f:
+        f.write(pack_header())
+        written = 0
+        while written < reports:
+            n = min(period, reports - written)
+            chunk = bytearray(body[:n * RECORD_SIZE])
+            offset_ns = (written // period) * span_ns
+            if offset_ns:
+                for k in range(0, n * RECORD_SIZE, RECORD_SIZE):
+                    ns, device_ns, length = RECORD_HEADER.unpack_from(chunk, k)
+                    RECORD_HEADER.pack_into(chunk, k, ns + offset_ns, device_ns, length)
+            f.write(chunk)
+            written += n
+
+def run_benchmark(reports=100000):
+    """Generator and fake device throughput, plus decoder speed and accuracy."""
+    from report_source import PASSTHROUGH, ReportSource
+    from wheel_state import WheelState, parse_report
+
+    print("=" * 80)
+    print(f"Synthetic wheel benchmark ({reports} reports)")
+    print("=" * 80)
+
+    wheel = SyntheticWheel(rate=1000)
+    start = time.perf_counter()
+    for _ in wheel.generate(reports):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"  {'generate (bytes + truth)':34s} {reports / elapsed:12,.0f} reports/s")
+
+    source = ReportSource(SyntheticDevice(wheel), None, PASSTHROUGH)
+    start = time.perf_counter()
+    for _ in range(reports):
+        source.read_buffered()
+    elapsed = time.perf_counter() - start
+    print(f"  {'SyntheticDevice via read_buffered':34s} {reports / elapsed:12,.0f} reports/s")
+
+    print()
+    print("Decoders against ground truth:")
+    state = WheelState()
+
+    def update(report):
+        state.update(report)
+        return state
+
+    for noise in (0, 16):
+        for name, decode in (('parse_report', parse_report), ('WheelState.update', update)):
+            s = score_decoder(decode, SyntheticWheel(rate=1000, noise=noise), reports)
+            print(f"  {name:18s} noise {noise:2d}: {s['rate']:10,.0f} reports/s  "
+                  f"steering MAE {s['steering_mae']:6.2f} (max {s['steering_max']})  "
+                  f"brake MAE {s['brake_mae']:5.2f}  accel MAE {s['accel_mae']:5.2f}  "
+                  f"button errors {s['button_errors']}  ZL/ZR errors {s['overlay_errors']}")
+    print()
+    print("  accel MAE is the brake cross-talk a decoder leaves uncorrected.")
+
+def run_realtime(rate, seconds):
+    """How closely the paced device holds `rate` reports/s."""
+    from report_source import PASSTHROUGH, ReportSource
+
+    count = int(rate * seconds)
+    device = SyntheticDevice(SyntheticWheel(rate), realtime=True, count=count)
+    source = ReportSource(device, None, PASSTHROUGH)
+    gaps = []
+    last = None
+    start = time.perf_counter()
+    try:
+        while True:
+            source.readinto(source.buffer)
+            now = time.perf_counter_ns()
+            if last is not None:
+                gaps.append(now - last)
+            last = now
+    except EOFError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    gaps.sort()
+    period_us = 1e6 / rate
+    print(f"Requested {rate:,.0f} reports/s for {seconds:g} s: delivered {count} reports in "
+          f"{elapsed:.3f} s ({count / elapsed:,.0f} reports/s)")
+    if gaps:
+        def pct(p):
+            return gaps[min(len(gaps) - 1, int(len(gaps) * p))] / 1000
+        print(f"Inter-report gap (target {period_us:.1f} us): p50 {pct(0.5):.1f} us  "
+              f"p99 {pct(0.99):.1f} us  max {gaps[-1] / 1000:.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Synthetic Report Generator")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('capture', help='write a synthetic capture file plus ground truth')
+    p.add_argument('path')
+    p.add_argument('--rate', type=float, default=1000, help='reports per second (default: 1000)')
+    p.add_argument('--seconds', type=float, default=10, help='duration (default: 10)')
+    p.add_argument('--seed', type=int, default=0, help='noise seed (default: 0)')
+    p.add_argument('--noise', type=int, default=0, help='steering noise in LSB (default: 0)')
+    p.add_argument('--no-crosstalk', action='store_true', help='omit the brake cross-talk')
+    p = sub.add_parser('bench', help='generator throughput and decoder accuracy')
+    p.add_argument('--reports', type=int, default=100000)
+    p = sub.add_parser('realtime', help='check pacing of the real-time device')
+    p.add_argument('--rate', type=float, default=20000, help='reports per second (default: 20000)')
+    p.add_argument('--seconds', type=float, default=2)
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        wheel = SyntheticWheel(args.rate, seed=args.seed, noise=args.noise,
+                               crosstalk=not args.no_crosstalk)
+        count = int(args.rate * args.seconds)
+        try:
+            truth_path = write_capture(args.path, wheel, count)
+        except OSError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"✓ Wrote {count} reports to {args.path} (truth: {truth_path})")
+    elif args.command == 'bench':
+        run_benchmark(args.reports)
+    else:
+        run_realtime(args.rate, args.seconds)
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,13 @@ This tool displays the current state of all wheel inputs in real-time.
 Use this to verify button mappings and test all controls.
 
 Usage:
-    sudo python3 test_wheel.py
+    sudo python3 test_wheel.py [--no-dedup] [--coalesce-ms MS] [--heartbeat SECONDS]
+    sudo python3 test_wheel.py --metrics-port 9105
+    sudo python3 test_wheel.py --auto-calibrate
+    python3 test_wheel.py --replay capture.hcap
+    python3 test_wheel.py --replay capture.hcap --profile [--profile-reports N]
+    python3 test_wheel.py --synthetic 1000 [--profile]
+    sudo python3 test_wheel.py --record capture.hcap [--record-policy drop] [--fsync-interval S]
 
 Controls:
     Ctrl+C to exit
@@ -15,6 +21,7 @@ Controls:
 import sys
 import time
 import os
+import argparse
 
 try:
     import usb.core
@@ -24,9 +31,20 @@ except ImportError:
     print("Install with: sudo python3 -m pip install --break-system-packages pyusb")
     sys.exit(1)
 
+from calibration import add_calibration_arguments, state_from_args
+from capture_recorder import (BLOCK, DEFAULT_BLOCK_TIMEOUT, DEFAULT_FSYNC_INTERVAL, POLICIES,
+                              BackgroundCaptureWriter)
+from metrics import add_metrics_arguments, start_metrics
+from profiling import Profiler, StageTimer, add_profile_arguments
+from report_source import ReportSource, add_policy_arguments, policy_from_args
+from synth_wheel import fake_device_from_args
+from usb_session import session_from_device
+from wheel_state import WheelState
+
 # HORI Racing Wheel USB IDs
 VENDOR_ID = 0x0F0D
 PRODUCT_ID = 0x013E
+INTERFACE_NUM = 0
 
 # ANSI color codes
 class Colors:
@@ -132,84 +150,7 @@ def draw_buttons(buttons):
 
     return [row1, row2, row3]
 
-def parse_report(data):
-    """Parse HID report and extract values - CORRECTED BASED ON ACTUAL MAPPING."""
-    if len(data) < 8:
-        return None
-
-    # Extract button state (TODO: actual button positions TBD)
-    buttons = data[0] | (data[1] << 8)
-
-    # Extract D-pad (individual bits, not 0-8 encoding)
-    dpad_bits = data[2] & 0x0F
-    # Convert to hat switch encoding
-    if dpad_bits == 0x01: dpad = 0      # Up
-    elif dpad_bits == 0x09: dpad = 1    # NE
-    elif dpad_bits == 0x08: dpad = 2    # Right
-    elif dpad_bits == 0x0A: dpad = 3    # SE
-    elif dpad_bits == 0x02: dpad = 4    # Down
-    elif dpad_bits == 0x06: dpad = 5    # SW
-    elif dpad_bits == 0x04: dpad = 6    # Left
-    elif dpad_bits == 0x05: dpad = 7    # NW
-    else: dpad = 8  # Neutral
-
-    # Extract axes - CORRECTED POSITIONS!
-    brake = data[4]     # Byte 4: Brake
-    accel = data[5]     # Byte 5: Accelerator
-
-    # Extract 16-bit steering (bytes 6-7, little-endian)
-    # 0x0000 = center, 0x0001-0x7FFF = right, 0x8000-0xFFFF = left
-    steering16 = data[6] | (data[7] << 8)
-    steering_signed = steering16 if steering16 < 32768 else steering16 - 65536  # Convert to signed
-
-    # Extract shoulder buttons and plus/minus from byte 2 (upper 4 bits)
-    btn_plus = (data[2] & 0x10) != 0     # Bit 4: + button
-    btn_minus = (data[2] & 0x20) != 0    # Bit 5: - button
-    btn_lsb = (data[2] & 0x40) != 0      # Bit 6: LSB (Left Shoulder Button)
-    btn_rsb = (data[2] & 0x80) != 0      # Bit 7: RSB (Right Shoulder Button)
-
-    # Extract paddle shifters and face buttons (byte 3)
-    paddle_down = (data[3] & 0x01) != 0  # Bit 0: gear down (left paddle)
-    paddle_up = (data[3] & 0x02) != 0    # Bit 1: gear up (right paddle)
-    btn_home = (data[3] & 0x04) != 0     # Bit 2: home button
-    # Bit 3 (0x08): unknown
-    btn_a = (data[3] & 0x10) != 0        # Bit 4: A button
-    btn_b = (data[3] & 0x20) != 0        # Bit 5: B button
-    btn_x = (data[3] & 0x40) != 0        # Bit 6: X button
-    btn_y = (data[3] & 0x80) != 0        # Bit 7: Y button
-
-    # Detect ZL and ZR buttons (they overlay on the pedal axes)
-    btn_zl = (brake == 0xFF)
-    btn_zr = (accel == 0xFF)
-
-    return {
-        'buttons': buttons,
-        'dpad': dpad,
-        'dpad_bits': dpad_bits,
-        'steering16': steering16,
-        'steering_signed': steering_signed,
-        'accel': accel,
-        'brake': brake,
-        'paddle_down': paddle_down,
-        'paddle_up': paddle_up,
-        'btn_home': btn_home,
-        'btn_a': btn_a,
-        'btn_b': btn_b,
-        'btn_x': btn_x,
-        'btn_y': btn_y,
-        'btn_plus': btn_plus,
-        'btn_minus': btn_minus,
-        'btn_lsb': btn_lsb,
-        'btn_rsb': btn_rsb,
-        'btn_zl': btn_zl,
-        'btn_zr': btn_zr,
-        'byte2': data[2],
-        'byte3': data[3],
-        'byte0': data[0],
-        'byte1': data[1]
-    }
-
-def draw_ui(state):
+def draw_ui(state, stats=None, timer=None, calibrator=None, session=None):
     """Draw the entire UI."""
     clear_screen()
 
@@ -315,10 +256,36 @@ def draw_ui(state):
 
     # Footer
     print(f"{Colors.CYAN}{'─'*80}{Colors.RESET}")
+    if stats is not None:
+        print(f"  Reports: {stats.summary()}")
+    if timer is not None:
+        print(f"  Stages:  {timer.summary()}")
+    if calibrator is not None:
+        print(f"  Calibration: {calibrator.summary()}")
+    if session is not None:
+        color = Colors.RED if not session.connected else ''
+        print(f"  Device:  {color}{session.summary()}{Colors.RESET}")
     print(f"{Colors.YELLOW}  Press Ctrl+C to exit{Colors.RESET}")
 
-def main():
-    print(f"{Colors.BOLD}HORI Racing Wheel - Real-time Input Tester{Colors.RESET}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Real-time Input Tester")
+    # Coalesce to roughly the terminal's useful redraw rate
+    add_policy_arguments(parser, coalesce_ms=25.0, heartbeat=1.0)
+    add_calibration_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profile_arguments(parser)
+    group = parser.add_argument_group('recording')
+    group.add_argument('--record', metavar='CAPTURE', default=None,
+                       help='record every report (before the dispatch policy) while displaying')
+    group.add_argument('--record-policy', choices=POLICIES, default=BLOCK,
+                       help=f'when the disk falls behind: wait for it (at most {DEFAULT_BLOCK_TIMEOUT * 1000:g} ms, '
+                            f'then drop), or drop and count at once (default: block)')
+    group.add_argument('--fsync-interval', type=float, default=DEFAULT_FSYNC_INTERVAL,
+                       help=f'seconds between group commits (default: {DEFAULT_FSYNC_INTERVAL:g})')
+    return parser.parse_args()
+
+def open_device():
+    """Find the wheel, claim it and return (dev, interrupt IN endpoint address)."""
     print(f"Looking for device: VID=0x{VENDOR_ID:04X}, PID=0x{PRODUCT_ID:04X}")
     print()
 
@@ -336,11 +303,10 @@ def main():
     print()
 
     # Detach kernel driver if necessary
-    interface_num = 0
     try:
-        if dev.is_kernel_driver_active(interface_num):
+        if dev.is_kernel_driver_active(INTERFACE_NUM):
             try:
-                dev.detach_kernel_driver(interface_num)
+                dev.detach_kernel_driver(INTERFACE_NUM)
             except usb.core.USBError:
                 pass
     except (usb.core.USBError, NotImplementedError):
@@ -369,58 +335,121 @@ def main():
 
     print(f"{Colors.GREEN}✓ Found interrupt endpoint: 0x{endpoint_in:02X}{Colors.RESET}")
     print()
+    return dev, endpoint_in
+
+def run_monitor(source, timer, profiler=None, state=None, calibrator=None, session=None):
+    """Read, parse and draw until interrupted (or the profiler's report limit)."""
+    # Reads go into the source's reused buffer and decode into one WheelState,
+    # so nothing is allocated per report outside draw_ui
+    if state is None:
+        state = WheelState()
+    clear_screen()
+    while profiler is None or not profiler.done:
+        timer.begin()
+        data = source.read_buffered()
+        timer.mark('read')
+
+        if data:
+            decoded = state.update(data)
+            timer.mark('parse')
+
+            if decoded:
+                draw_ui(state, source.stats, timer, calibrator, session)
+                timer.mark('draw')
+                if profiler is not None:
+                    profiler.count()
+
+def main(args):
+    print(f"{Colors.BOLD}HORI Racing Wheel - Real-time Input Tester{Colors.RESET}")
+
+    dev = fake_device_from_args(args)
+    endpoint_in = None
+    session = None
+    if dev is None:
+        dev, endpoint_in = open_device()
+        # Unplugs and USB errors show up as timeouts while the session reattaches
+        dev = session = session_from_device(dev, endpoint_in, VENDOR_ID, PRODUCT_ID, INTERFACE_NUM)
+
     print(f"{Colors.BOLD}Starting real-time monitor...{Colors.RESET}")
     print(f"{Colors.YELLOW}Move the wheel, press pedals, and push buttons!{Colors.RESET}")
     print()
-    time.sleep(2)
-
-    # Start reading
-    last_state = None
-    update_counter = 0
+    if not args.profile:
+        time.sleep(2)
+
+    # Start reading - duplicates are suppressed and bursts coalesced by the
+    # dispatch policy, so every forwarded report is worth a redraw
+    source = ReportSource(dev, endpoint_in, policy_from_args(args))
+    timer = StageTimer()
+    profiler = None
+    metrics = start_metrics(args, source, timer, session)
+    state, calibrator = state_from_args(args, source)
+
+    # Every report is recorded, including the duplicates and coalesced
+    # changes the display skips; the disk work runs on the recorder's thread
+    recorder = None
+    if args.record:
+        recorder = BackgroundCaptureWriter(args.record, args.record_policy,
+                                           fsync_interval=args.fsync_interval)
+        calibrate = source.observer
+        if calibrate is None:
+            source.observer = recorder.write
+        else:
+            def observe(report):
+                calibrate(report)
+                recorder.write(report)
+            source.observer = observe
 
     try:
-        clear_screen()
-        while True:
-            try:
-                # Read from device
-                data = dev.read(endpoint_in, 64, timeout=100)
-
-                if data:
-                    state = parse_report(data)
+        if args.profile:
+            with Profiler(args.profile_reports, output=args.profile_output) as profiler:
+                run_monitor(source, timer, profiler, state, calibrator, session)
+        else:
+            run_monitor(source, timer, state=state, calibrator=calibrator, session=session)
 
-                    if state:
-                        # Update display every few reports to reduce flicker
-                        update_counter += 1
-                        if update_counter >= 3 or last_state is None or state != last_state:
-                            draw_ui(state)
-                            last_state = state
-                            update_counter = 0
+    except usb.core.USBError as e:
+        print(f"\n{Colors.RED}USB Error: {e}{Colors.RESET}")
 
-            except usb.core.USBError as e:
-                if e.errno != 110:  # Ignore timeout errors
-                    print(f"\n{Colors.RED}USB Error: {e}{Colors.RESET}")
-                    break
+    except EOFError:
+        print(f"\n\n{Colors.YELLOW}End of capture{Colors.RESET}")
 
     except KeyboardInterrupt:
         print(f"\n\n{Colors.YELLOW}Exiting...{Colors.RESET}")
 
     finally:
-        # Cleanup
-        try:
-            usb.util.release_interface(dev, interface_num)
-        except:
-            pass
-
+        # Cleanup; the recorder hands over and fsyncs its last batch even
+        # if the monitor failed
+        if session is not None:
+            session.close()
+        if metrics is not None:
+            metrics.stop()
+        if calibrator is not None:
+            calibrator.stop()
+        if recorder is not None:
+            recorder.close()
+
+    if profiler is not None:
+        profiler.dump()
+
+    print(f"  Reports: {source.stats.summary()}")
+    print(f"  Stages:  {timer.summary()}")
+    if calibrator is not None:
+        print(f"  Calibration: {calibrator.summary()}")
+    if session is not None:
+        print(f"  Device:  {session.summary()}")
+    if recorder is not None:
+        print(f"  Recorded: {args.record}: {recorder.summary()}")
     print(f"{Colors.GREEN}✓ Test complete!{Colors.RESET}\n")
 
 if __name__ == "__main__":
-    if os.geteuid() != 0:
+    args = parse_args()
+
+    if args.replay is None and args.synthetic is None and os.geteuid() != 0:
         print(f"{Colors.RED}Error: This script must be run with sudo{Colors.RESET}")
         print(f"Usage: sudo python3 {sys.argv[0]}")
         sys.exit(1)
 
     try:
-        main()
+        main(args)
     except Exception as e:
         print(f"\n{Colors.RED}Error: {e}{Colors.RESET}")
         import traceback
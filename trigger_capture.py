@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Triggered Capture
+
+Logic-analyzer style capture for intermittent glitches: every report goes
+into a preallocated ring holding the last few seconds, a trigger expression
+is evaluated on each one, and on a match the pre-trigger window plus the
+following post-trigger window are saved as a capture file.
+
+Trigger expressions are Python-like and are compiled once into a plain
+lambda over the current and previous report:
+
+    byte[i]          report byte i            prev[i]        previous report's byte i
+    bit(i, b)        bit b of byte i          prevbit(i, b)  same, previous report
+    u16(i), s16(i)   little-endian 16-bit value at bytes i, i+1 (unsigned/signed)
+    prev_u16(i), prev_s16(i)
+    changed(i)       byte i differs from the previous report
+    abs(x)
+
+with and/or/not, comparisons and integer arithmetic/bit operators. E.g.:
+
+    byte[4] == 0xFF and bit(3,3)              ZL with the unknown byte 3 bit
+    abs(s16(6) - prev_s16(6)) > 4000           steering jump between reports
+
+Triggers fire on the rising edge (false -> true) and re-arm once the
+post-trigger window has been saved.
+
+Usage:
+    sudo python3 capture_hid_descriptor.py --trigger EXPR [--pre S] [--post S] [--record out.hcap]
+    python3 trigger_capture.py check EXPR
+    python3 trigger_capture.py bench [--reports N]
+"""
+
+import ast
+import array
+import os
+import sys
+import time
+import argparse
+
+from capture_file import CaptureWriter
+from profiling import StageTimer
+from report_source import REPORT_SIZE
+
+# Report rate the ring is initially sized for (full-speed interrupt endpoint);
+# faster sources (replays, --synthetic) grow it to cover the pre-trigger time
+MAX_REPORT_RATE = 1000
+# Growth stops here (64 MiB of reports); beyond it the pre-trigger window shortens
+MAX_RING_REPORTS = 1 << 20
+
+class TriggerError(Exception):
+    """Raised when a trigger expression is invalid."""
+
+_BOOL_OPS = (ast.And, ast.Or)
+_UNARY_OPS = (ast.Not, ast.USub, ast.UAdd, ast.Invert)
+_BIN_OPS = (ast.Add, ast.Sub, ast.Mult, ast.FloorDiv, ast.Mod,
+            ast.BitAnd, ast.BitOr, ast.BitXor, ast.LShift, ast.RShift)
+_CMP_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+# Function name -> (report variable, kind, number of arguments)
+_FUNCTIONS = {
+    'bit': ('r', 'bit', 2), 'prevbit': ('p', 'bit', 2),
+    'u16': ('r', 'u16', 1), 'prev_u16': ('p', 'u16', 1),
+    's16': ('r', 's16', 1), 'prev_s16': ('p', 's16', 1),
+    'changed': (None, 'changed', 1),
+    'abs': (None, 'abs', 1),
+}
+
+def _byte(var, index):
+    return ast.Subscript(ast.Name(var, ast.Load()), ast.Constant(index), ast.Load())
+
+def _u16(var, index):
+    # r[i] | r[i + 1] << 8
+    return ast.BinOp(_byte(var, index), ast.BitOr(),
+                     ast.BinOp(_byte(var, index + 1), ast.LShift(), ast.Constant(8)))
+
+class _TriggerCompiler(ast.NodeTransformer):
+    """Checks a parsed expression against the trigger grammar and lowers the
+    helper calls to direct indexing, so the compiled predicate does no calls
+    or lookups beyond the report subscripts."""
+
+    def _index(self, node, limit, what='byte index'):
+        if not (isinstance(node, ast.Constant) and type(node.value) is int):
+            raise TriggerError(f"{what} must be an integer constant")
+        if not 0 <= node.value < limit:
+            raise TriggerError(f"{what} {node.value} out of range 0-{limit - 1}")
+        return node.value
+
+    def generic_visit(self, node):
+        raise TriggerError(f"unsupported syntax: {ast.unparse(node)!r}")
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Constant(self, node):
+        if type(node.value) not in (int, bool):
+            raise TriggerError(f"unsupported constant {node.value!r}")
+        return node
+
+    def visit_BoolOp(self, node):
+        if not isinstance(node.op, _BOOL_OPS):
+            raise TriggerError("unsupported boolean operator")
+        node.values = [self.visit(v) for v in node.values]
+        return node
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, _UNARY_OPS):
+            raise TriggerError("unsupported unary operator")
+        node.operand = self.visit(node.operand)
+        return node
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, _BIN_OPS):
+            raise TriggerError(f"unsupported operator in {ast.unparse(node)!r}")
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_Compare(self, node):
+        if not all(isinstance(op, _CMP_OPS) for op in node.ops):
+            raise TriggerError(f"unsupported comparison in {ast.unparse(node)!r}")
+        node.left = self.visit(node.left)
+        node.comparators = [self.visit(c) for c in node.comparators]
+        return node
+
+    def visit_Subscript(self, node):
+        if not (isinstance(node.value, ast.Name) and node.value.id in ('byte', 'prev')):
+            raise TriggerError(f"only byte[i] and prev[i] can be indexed, not {ast.unparse(node)!r}")
+        index = self._index(node.slice, REPORT_SIZE)
+        return _byte('r' if node.value.id == 'byte' else 'p', index)
+
+    def visit_Name(self, node):
+        raise TriggerError(f"unknown name {node.id!r}")
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS:
+            raise TriggerError(f"unknown function {ast.unparse(node.func)!r}")
+        name = node.func.id
+        var, kind, nargs = _FUNCTIONS[name]
+        if node.keywords or len(node.args) != nargs:
+            raise TriggerError(f"{name}() takes {nargs} argument(s)")
+
+        if kind == 'abs':
+            node.args = [self.visit(node.args[0])]
+            return node
+        if kind == 'bit':
+            index = self._index(node.args[0], REPORT_SIZE)
+            bit = self._index(node.args[1], 8, 'bit number')
+            # r[i] >> b & 1
+            return ast.BinOp(ast.BinOp(_byte(var, index), ast.RShift(), ast.Constant(bit)),
+                             ast.BitAnd(), ast.Constant(1))
+        if kind == 'changed':
+            index = self._index(node.args[0], REPORT_SIZE)
+            return ast.Compare(_byte('r', index), [ast.NotEq()], [_byte('p', index)])
+        index = self._index(node.args[0], REPORT_SIZE - 1)
+        if kind == 'u16':
+            return _u16(var, index)
+        # s16: (u16 ^ 0x8000) - 0x8000
+        return ast.BinOp(ast.BinOp(_u16(var, index), ast.BitXor(), ast.Constant(0x8000)),
+                         ast.Sub(), ast.Constant(0x8000))
+
+def compile_trigger(expression):
+    """Compile a trigger expression into predicate(report, prev) -> truthy.
+
+    Both arguments must be indexable by every byte position the expression
+    uses (TriggeredCapture passes zero-padded REPORT_SIZE slots). The lowered
+    source is available as predicate.source.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise TriggerError(f"syntax error in trigger: {e.msg}") from None
+    tree = ast.fix_missing_locations(_TriggerCompiler().visit(tree))
+    source = ast.unparse(tree)
+    predicate = eval(f"lambda r, p: {source}", {'__builtins__': {}, 'abs': abs})
+    predicate.source = source
+    predicate.expression = expression
+    return predicate
+
+class ReportRing:
+    """Preallocated ring of the last `capacity` reports and their timestamps.
+
+    Each slot is a zero-padded REPORT_SIZE region of one bytearray, so
+    pushing copies the report in place and never allocates. With `span_ns`,
+    the ring doubles instead of overwriting a report younger than span_ns
+    (up to `max_capacity`), so it holds that much time at any report rate;
+    `shortened` counts the overwrites that happened within the span anyway.
+    """
+
+    def __init__(self, capacity, report_size=REPORT_SIZE, span_ns=0, max_capacity=MAX_RING_REPORTS):
+        self.capacity = max(2, capacity)
+        self.report_size = report_size
+        self.span_ns = span_ns
+        self.max_capacity = max(self.capacity, max_capacity)
+        self.shortened = 0
+        self._allocate(self.capacity)
+        self.head = 0      # slot the next report goes into
+        self.count = 0
+
+    def _allocate(self, capacity):
+        report_size = self.report_size
+        self._data = bytearray(capacity * report_size)
+        self._view = memoryview(self._data)
+        self._slots = [self._view[i * report_size:(i + 1) * report_size]
+                       for i in range(capacity)]
+        self._times = array.array('q', bytes(8 * capacity))
+        self._lengths = array.array('H', bytes(2 * capacity))
+
+    def _grow(self):
+        """Double the capacity (full ring), keeping the reports oldest first.
+
+        Views returned earlier keep pointing at the old (unchanged) buffer.
+        """
+        old_slots, old_times, old_lengths = self._slots, self._times, self._lengths
+        old_capacity = self.capacity
+        start = self.head
+        capacity = min(self.max_capacity, old_capacity * 2)
+        self._allocate(capacity)
+        for k in range(old_capacity):
+            i = (start + k) % old_capacity
+            self._slots[k][:] = old_slots[i]
+            self._times[k] = old_times[i]
+            self._lengths[k] = old_lengths[i]
+        self.capacity = capacity
+        self.head = old_capacity
+
+    def __len__(self):
+        return self.count
+
+    def push(self, report, host_ns):
+        """Copy a report into the next slot and return that slot's view."""
+        head = self.head
+        if self.count == self.capacity and self.span_ns and host_ns - self._times[head] < self.span_ns:
+            # The oldest report is still inside the span
+            if self.capacity < self.max_capacity:
+                self._grow()
+                head = self.head
+            else:
+                self.shortened += 1
+        slot = self._slots[head]
+        n = len(report)
+        if n >= self.report_size:
+            n = self.report_size
+            slot[:] = report[:n]
+        else:
+            slot[:n] = report
+            slot[n:] = bytes(self.report_size - n)
+        self._times[head] = host_ns
+        self._lengths[head] = n
+        self.head = head + 1 if head + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        return slot
+
+    def last(self, back=1):
+        """View of the report pushed `back` pushes ago (1 = most recent)."""
+        return self._slots[(self.head - back) % self.capacity]
+
+    def items(self, since_ns=None):
+        """Yield (host_ns, report view) oldest first, optionally from since_ns on."""
+        start = (self.head - self.count) % self.capacity
+        for k in range(self.count):
+            i = (start + k) % self.capacity
+            if since_ns is not None and self._times[i] < since_ns:
+                continue
+            yield self._times[i], self._slots[i][:self._lengths[i]]
+
+class TriggeredCapture:
+    """Ring-buffered capture that saves a window around each trigger match.
+
+    `source` is a ReportSource (read with PASSTHROUGH, so the ring sees every
+    report); events are written to PREFIX-NNN.hcap. Call poll() per read,
+    or run() to loop until `duration`, `max_events` or end of input.
+    """
+
+    def __init__(self, source, trigger, pre=2.0, post=1.0, prefix='trigger',
+                 max_rate=MAX_REPORT_RATE, clock=time.monotonic_ns, timer=None):
+        self.source = source
+        self.trigger = compile_trigger(trigger) if isinstance(trigger, str) else trigger
+        self.pre_ns = int(pre * 1e9)
+        self.post_ns = int(post * 1e9)
+        self.prefix = prefix
+        self.clock = clock
+        self.timer = timer if timer is not None else StageTimer()
+        # Sized for max_rate, grown to keep `pre` seconds at faster rates; one
+        # extra slot so the report before the window start is still there
+        self.ring = ReportRing(int(pre * max_rate) + 1, span_ns=self.pre_ns)
+        self.reports = 0
+        self.events = []      # paths of saved event captures
+        self._armed = True
+        self._writer = None
+        self._post_end = 0
+
+    def poll(self):
+        """Read and process one report. Returns False on a read timeout."""
+        source = self.source
+        timer = self.timer
+        timer.begin()
+        n = source.readinto(source.buffer)
+        timer.mark('read')
+        if not n:
+            return False
+        now = self.clock()
+        ring = self.ring
+        prev = ring.last()
+        report = ring.push(source.view[:n] if n != source.report_size else source.view, now)
+        timer.mark('ring')
+        self.reports += 1
+
+        fired = self.trigger(report, prev)
+        timer.mark('trigger')
+
+        writer = self._writer
+        if writer is not None:
+            writer.write(report[:n], host_ns=now)
+            if now >= self._post_end:
+                self._finish_event()
+            timer.mark('write')
+        elif fired and self._armed:
+            self._start_event(now)
+            timer.mark('write')
+        else:
+            self._armed = not fired
+        return True
+
+    def _start_event(self, now):
+        path = f"{self.prefix}-{len(self.events) + 1:03d}.hcap"
+        self._writer = CaptureWriter(path)
+        ring = self.ring
+        items = ring.items(since_ns=now - self.pre_ns)
+        first = None
+        for host_ns, report in items:
+            if first is None:
+                first = host_ns
+            self._writer.write(report, host_ns=host_ns)
+        self._post_end = now + self.post_ns
+        self._armed = False
+        self.events.append(path)
+        print(f"⚡ Trigger {len(self.events)} at report {self.reports}: "
+              f"saving {self._writer.count} pre-trigger reports to {path}")
+        if ring.shortened and first is not None and first > now - self.pre_ns + self.pre_ns // 100:
+            print(f"  ⚠ ring full at {ring.capacity} reports: only {(now - first) / 1e9:.2f} s "
+                  f"of the {self.pre_ns / 1e9:g} s pre-trigger window kept")
+
+    def _finish_event(self):
+        self._writer.close()
+        print(f"  ✓ {self._writer.path}: {self._writer.count} reports")
+        self._writer = None
+        self._armed = False   # re-arms once the trigger condition clears
+
+    def close(self):
+        """Save a partially filled post-trigger window."""
+        if self._writer is not None:
+            self._finish_event()
+
+    def run(self, duration=None, max_events=None, profiler=None):
+        """Poll until duration elapses, max_events are saved, or end of input."""
+        deadline = None if duration is None else time.monotonic() + duration
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                if max_events is not None and len(self.events) >= max_events and self._writer is None:
+                    break
+                if profiler is not None and profiler.done:
+                    break
+                if self.poll() and profiler is not None:
+                    profiler.count()
+        except EOFError:
+            pass
+        finally:
+            self.close()
+        return self.events
+
+def event_prefix(record):
+    """Event file prefix for --record PATH (trigger.hcap -> trigger-001.hcap ...)."""
+    if not record:
+        return 'trigger'
+    root, ext = os.path.splitext(record)
+    return root if ext == '.hcap' else record
+
+def add_trigger_arguments(parser):
+    """Add the --trigger / --pre / --post / --events options."""
+    group = parser.add_argument_group('triggered capture')
+    group.add_argument('--trigger', metavar='EXPR', default=None,
+                       help="save reports around matches of EXPR, e.g. 'byte[4] == 0xFF and bit(3,3)'")
+    group.add_argument('--pre', type=float, default=2.0,
+                       help='seconds kept before the trigger (default: 2)')
+    group.add_argument('--post', type=float, default=1.0,
+                       help='seconds saved after the trigger (default: 1)')
+    group.add_argument('--events', type=int, default=None,
+                       help='stop after saving N events')
+    return group
+
+def _interpreted(expression):
+    """Baseline for the benchmark: evaluate the source expression each report."""
+    code = compile(expression, '<trigger>', 'eval')
+
+    def predicate(report, prev):
+        return eval(code, {
+            'byte': report, 'prev': prev,
+            'bit': lambda i, b: report[i] >> b & 1,
+            'prevbit': lambda i, b: prev[i] >> b & 1,
+            'u16': lambda i: report[i] | report[i + 1] << 8,
+            'prev_u16': lambda i: prev[i] | prev[i + 1] << 8,
+            's16': lambda i: ((report[i] | report[i + 1] << 8) ^ 0x8000) - 0x8000,
+            'prev_s16': lambda i: ((prev[i] | prev[i + 1] << 8) ^ 0x8000) - 0x8000,
+            'changed': lambda i: report[i] != prev[i],
+            'abs': abs,
+        })
+    return predicate
+
+BENCH_TRIGGERS = (
+    'byte[4] == 0xFF and bit(3,3)',
+    'byte[4] == 0xFF',
+    'abs(s16(6) - prev_s16(6)) > 4000',
+    'changed(2) and bit(2, 0) and not prevbit(2, 0)',
+)
+
+def run_benchmark(reports=100000):
+    """Trigger evaluation cost per report, and full-loop throughput."""
+    from report_source import PASSTHROUGH, ReportSource
+    from synth_wheel import SyntheticDevice, SyntheticWheel
+
+    wheel = SyntheticWheel(rate=1000)
+    ring = ReportRing(4096)
+    for report, truth in wheel.generate(4096):
+        ring.push(report, truth.time_ns)
+    slots = [(ring.last(k + 1), ring.last(k + 2)) for k in range(4094)]
+    cases = (slots * (reports // len(slots) + 1))[:reports]
+
+    print("=" * 80)
+    print(f"Trigger evaluation ({reports} reports)")
+    print("=" * 80)
+    for expression in BENCH_TRIGGERS:
+        compiled = compile_trigger(expression)
+        interpreted = _interpreted(expression)
+        timings = []
+        for predicate in (compiled, interpreted):
+            start = time.perf_counter_ns()
+            hits = 0
+            for report, prev in cases:
+                if predicate(report, prev):
+                    hits += 1
+            timings.append((time.perf_counter_ns() - start) / reports)
+        print(f"  {expression}")
+        print(f"    compiled {timings[0]:7.0f} ns/report   interpreted {timings[1]:7.0f} ns/report   "
+              f"({timings[1] / timings[0]:.0f}x)  matches {hits}")
+
+    print()
+    print("Full loop: read + ring + trigger (synthetic device, flat out)")
+    prefix = os.path.join(os.environ.get('TMPDIR', '/tmp'), 'trigger-bench')
+    source = ReportSource(SyntheticDevice(wheel, count=reports), None, PASSTHROUGH)
+    capture = TriggeredCapture(source, BENCH_TRIGGERS[1], pre=0.5, post=0.25, prefix=prefix,
+                               timer=StageTimer(sample_every=1))
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull
+    start = time.perf_counter()
+    try:
+        events = capture.run()
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    elapsed = time.perf_counter() - start
+    for path in events:
+        os.remove(path)
+    rate = capture.reports / elapsed
+    print(f"  {rate:,.0f} reports/s ({rate / MAX_REPORT_RATE:.0f}x the wheel's {MAX_REPORT_RATE} Hz), "
+          f"{len(events)} events saved")
+    print(f"  Stages: {capture.timer.summary()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Triggered Capture")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('check', help='validate a trigger expression and show its compiled form')
+    p.add_argument('expression')
+    p = sub.add_parser('bench', help='trigger evaluation cost per report')
+    p.add_argument('--reports', type=int, default=100000)
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        try:
+            predicate = compile_trigger(args.expression)
+        except TriggerError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"✓ {args.expression}")
+        print(f"  compiled: lambda r, p: {predicate.source}")
+    else:
+        run_benchmark(args.reports)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Linux uinput Bridge
+
+User-space counterpart of the macOS DriverKit driver: reads the wheel,
+decodes it (the parse_report() layout, via WheelState) and re-emits it as a
+standard joystick on a virtual uinput device:
+
+    ABS_X            steering, signed 16-bit
+    ABS_Z / ABS_RZ   brake / accelerator, 0-254 (ZL/ZR are buttons, so the
+                     0xFF overlay never reaches the axes)
+    ABS_HAT0X/Y      D-pad
+    BTN_*            shoulders, ZL/ZR, +/-, Home, A/B/X/Y, gear paddles
+
+Only changed axes and buttons are emitted, batched per report behind a
+single SYN_REPORT and handed to the backend in one write(). Backends are
+pluggable: UinputDevice talks to /dev/uinput with plain ioctls (no
+python-evdev needed) and MemorySink records the batches for tests and
+benchmarks on hosts without uinput.
+
+With --predict-ms, steering and pedals are emitted as predicted that far
+after the read (see prediction.py) to make up for the pipeline delay.
+
+Usage:
+    sudo python3 uinput_bridge.py run [--auto-calibrate] [--predict-ms MS]
+    python3 uinput_bridge.py run --synthetic 1000 --sink memory --verbose
+    python3 uinput_bridge.py bench [--reports N]
+"""
+
+import array
+import fcntl
+import os
+import struct
+import sys
+import time
+import argparse
+
+from report_source import DispatchPolicy, ReportSource
+from wheel_state import WheelState
+
+# linux/input-event-codes.h
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_ABS = 0x03
+SYN_REPORT = 0
+
+ABS_X = 0x00
+ABS_Z = 0x02
+ABS_RZ = 0x05
+ABS_HAT0X = 0x10
+ABS_HAT0Y = 0x11
+
+BTN_SOUTH = 0x130
+BTN_EAST = 0x131
+BTN_NORTH = 0x133
+BTN_WEST = 0x134
+BTN_TL = 0x136
+BTN_TR = 0x137
+BTN_TL2 = 0x138
+BTN_TR2 = 0x139
+BTN_SELECT = 0x13A
+BTN_START = 0x13B
+BTN_MODE = 0x13C
+BTN_GEAR_DOWN = 0x150
+BTN_GEAR_UP = 0x151
+
+BUS_USB = 0x03
+
+# Button bits per report byte. Face buttons follow the kernel's Nintendo
+# layout (hid-nintendo): A is east, B south, X north, Y west.
+BYTE2_KEYS = ((0x10, BTN_START), (0x20, BTN_SELECT), (0x40, BTN_TL), (0x80, BTN_TR))
+BYTE3_KEYS = ((0x01, BTN_GEAR_DOWN), (0x02, BTN_GEAR_UP), (0x04, BTN_MODE),
+              (0x10, BTN_EAST), (0x20, BTN_SOUTH), (0x40, BTN_NORTH), (0x80, BTN_WEST))
+KEYS = tuple(code for _, code in BYTE2_KEYS + BYTE3_KEYS) + (BTN_TL2, BTN_TR2)
+
+# (code, minimum, maximum, fuzz, flat)
+AXES = ((ABS_X, -32768, 32767, 0, 0),
+        (ABS_Z, 0, 0xFE, 0, 0),
+        (ABS_RZ, 0, 0xFE, 0, 0),
+        (ABS_HAT0X, -1, 1, 0, 0),
+        (ABS_HAT0Y, -1, 1, 0, 0))
+
+# D-pad bits (0x01=Up, 0x02=Down, 0x04=Left, 0x08=Right) -> (hat x, hat y)
+HAT_FROM_BITS = tuple((((b >> 3) & 1) - ((b >> 2) & 1), ((b >> 1) & 1) - (b & 1))
+                      for b in range(16))
+
+# linux/uinput.h ioctls
+def _IOC(direction, number, size):
+    return (direction << 30) | (size << 16) | (ord('U') << 8) | number
+
+def _IOW(number, size):
+    return _IOC(1, number, size)
+
+UI_DEV_CREATE = _IOC(0, 1, 0)
+UI_DEV_DESTROY = _IOC(0, 2, 0)
+UINPUT_SETUP = struct.Struct('<HHHH80sI')        # input_id, name, ff_effects_max
+UINPUT_ABS_SETUP = struct.Struct('<HxxiiiiII')   # code, input_absinfo
+UI_DEV_SETUP = _IOW(3, UINPUT_SETUP.size)
+UI_ABS_SETUP = _IOW(4, UINPUT_ABS_SETUP.size)
+UI_SET_EVBIT = _IOW(100, 4)
+UI_SET_KEYBIT = _IOW(101, 4)
+UI_SET_ABSBIT = _IOW(103, 4)
+
+# struct input_event: timeval (native longs), type, code, value. The kernel
+# stamps injected events itself, so the time is left zero.
+INPUT_EVENT = struct.Struct('@llHHi')
+
+DEVICE_NAME = 'HORI Racing Wheel (uinput bridge)'
+
+class MemorySink:
+    """Backend that keeps the emitted batches in memory.
+
+    `batches` holds (monotonic ns, events) pairs, events being the
+    (type, code, value) tuples of one report including its SYN_REPORT.
+    With keep=False only the counters are updated.
+    """
+
+    def __init__(self, keep=True):
+        self.keep = keep
+        self.batches = []
+        self.events = 0
+        self.writes = 0
+        self.config = None
+
+    def setup(self, name, vendor, product, keys, axes):
+        self.config = (name, vendor, product, tuple(keys), tuple(axes))
+
+    def write(self, events):
+        self.writes += 1
+        self.events += len(events)
+        if self.keep:
+            self.batches.append((time.monotonic_ns(), list(events)))
+
+    def close(self):
+        pass
+
+class UinputDevice:
+    """Backend writing to a virtual device created through /dev/uinput."""
+
+    def __init__(self, path='/dev/uinput'):
+        self.path = path
+        self.fd = None
+        self._buffer = bytearray(INPUT_EVENT.size * 32)
+
+    def setup(self, name, vendor, product, keys, axes):
+        """Create the device. Raises OSError if uinput is missing or not writable."""
+        fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            fcntl.ioctl(fd, UI_SET_EVBIT, EV_KEY)
+            for code in keys:
+                fcntl.ioctl(fd, UI_SET_KEYBIT, code)
+            fcntl.ioctl(fd, UI_SET_EVBIT, EV_ABS)
+            for code, minimum, maximum, fuzz, flat in axes:
+                fcntl.ioctl(fd, UI_SET_ABSBIT, code)
+                fcntl.ioctl(fd, UI_ABS_SETUP,
+                            UINPUT_ABS_SETUP.pack(code, 0, minimum, maximum, fuzz, flat, 0))
+            fcntl.ioctl(fd, UI_DEV_SETUP,
+                        UINPUT_SETUP.pack(BUS_USB, vendor, product, 1, name.encode()[:79], 0))
+            fcntl.ioctl(fd, UI_DEV_CREATE)
+        except OSError:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    def write(self, events):
+        size = INPUT_EVENT.size
+        if len(events) * size > len(self._buffer):
+            self._buffer = bytearray(len(events) * size)
+        buffer = self._buffer
+        pack_into = INPUT_EVENT.pack_into
+        for i, (event_type, code, value) in enumerate(events):
+            pack_into(buffer, i * size, 0, 0, event_type, code, value)
+        os.write(self.fd, memoryview(buffer)[:len(events) * size])
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+            finally:
+                os.close(self.fd)
+                self.fd = None
+
+class Bridge:
+    """Turns decoded reports into batched input events for a backend.
+
+    `state` is the WheelState (or CalibratedState) reports decode into.
+    With a `predictor` (prediction.WheelPredictor), the axes move by the
+    change it predicts `lead_ns` after the read, from the decoded (and
+    possibly calibrated) values.
+    Latency from the end of the read to the end of the backend write is
+    kept for the last LATENCY_SAMPLES batches.
+    """
+
+    LATENCY_SAMPLES = 65536
+
+    def __init__(self, backend, state=None, vendor=0x0F0D, product=0x013E, predictor=None, lead_ns=0):
+        self.backend = backend
+        self.state = state if state is not None else WheelState()
+        self.predictor = predictor
+        self.lead_ns = lead_ns
+        self.reports = 0
+        self.batches = 0
+        self.events = 0
+        self.latency_ns = array.array('q', bytes(8 * self.LATENCY_SAMPLES))
+        self._events = []
+        # Last emitted value per axis, and the last button bytes
+        self._steering = 0
+        self._brake = 0
+        self._accel = 0
+        self._hat = (0, 0)
+        self._byte2 = 0
+        self._byte3 = 0
+        self._zl = False
+        self._zr = False
+        backend.setup(DEVICE_NAME, vendor, product, KEYS, AXES)
+
+    def update(self, data, read_ns=None):
+        """Decode one report and emit whatever changed. Returns the event count."""
+        state = self.state
+        if not state.update(data):
+            return 0
+        self.reports += 1
+        events = self._events
+        events.clear()
+        append = events.append
+
+        steering = state.steering_signed
+        predictor = self.predictor
+        if predictor is not None:
+            at = read_ns if read_ns is not None else time.perf_counter_ns()
+            # The state's values, not the raw report: with --auto-calibrate
+            # the predicted change has to be in calibrated units
+            predictor.observe_values(steering, state.brake, state.accel, at)
+            at += self.lead_ns
+            steering = min(32767, max(-32768, steering + predictor.steering.change(at)))
+        if steering != self._steering:
+            self._steering = steering
+            append((EV_ABS, ABS_X, steering))
+
+        # ZL/ZR overlay the pedals with 0xFF: report the button and keep the
+        # axis where it was
+        brake = state.brake
+        zl = brake == 0xFF
+        if zl != self._zl:
+            self._zl = zl
+            append((EV_KEY, BTN_TL2, int(zl)))
+        if not zl and predictor is not None:
+            brake = min(0xFE, max(0, brake + predictor.brake.change(at)))
+        if not zl and brake != self._brake:
+            self._brake = brake
+            append((EV_ABS, ABS_Z, brake))
+        accel = state.accel
+        zr = accel == 0xFF
+        if zr != self._zr:
+            self._zr = zr
+            append((EV_KEY, BTN_TR2, int(zr)))
+        if not zr and predictor is not None:
+            accel = min(0xFE, max(0, accel + predictor.accel.change(at)))
+        if not zr and accel != self._accel:
+            self._accel = accel
+            append((EV_ABS, ABS_RZ, accel))
+
+        byte2 = state.byte2
+        changed = byte2 ^ self._byte2
+        if changed:
+            self._byte2 = byte2
+            if changed & 0x0F:
+                hat = HAT_FROM_BITS[byte2 & 0x0F]
+                old = self._hat
+                self._hat = hat
+                if hat[0] != old[0]:
+                    append((EV_ABS, ABS_HAT0X, hat[0]))
+                if hat[1] != old[1]:
+                    append((EV_ABS, ABS_HAT0Y, hat[1]))
+            for mask, code in BYTE2_KEYS:
+                if changed & mask:
+                    append((EV_KEY, code, 1 if byte2 & mask else 0))
+        byte3 = state.byte3
+        changed = byte3 ^ self._byte3
+        if changed:
+            self._byte3 = byte3
+            for mask, code in BYTE3_KEYS:
+                if changed & mask:
+                    append((EV_KEY, code, 1 if byte3 & mask else 0))
+
+        if not events:
+            return 0
+        append((EV_SYN, SYN_REPORT, 0))
+        self.backend.write(events)
+        count = len(events)
+        self.events += count
+        if read_ns is not None:
+            self.latency_ns[self.batches % self.LATENCY_SAMPLES] = time.perf_counter_ns() - read_ns
+        self.batches += 1
+        return count
+
+    def latency_summary(self):
+        """e.g. 'p50 9.1us p99 21.4us max 80.2us per batch, 3.1us per event'."""
+        n = min(self.batches, self.LATENCY_SAMPLES)
+        if not n:
+            return 'no batches'
+        samples = sorted(self.latency_ns[:n])
+        per_event = sum(samples) / n / (self.events / self.batches)
+        return (f"p50 {samples[n // 2] / 1000:.1f}us p99 {samples[min(n - 1, n * 99 // 100)] / 1000:.1f}us "
+                f"max {samples[-1] / 1000:.1f}us per batch, {per_event / 1000:.2f}us per event")
+
+    def summary(self):
+        per_report = self.events / self.reports if self.reports else 0.0
+        return (f"reports {self.reports}, batches {self.batches}, events {self.events} "
+                f"({per_report:.2f}/report)")
+
+    def close(self):
+        self.backend.close()
+
+def backend_from_name(name):
+    if name == 'memory':
+        return MemorySink(keep=False)
+    return UinputDevice()
+
+def run_bridge(source, bridge, timer=None, profiler=None, verbose=False):
+    """Read, decode and emit until interrupted (or the profiler's report limit)."""
+    perf_counter_ns = time.perf_counter_ns
+    while profiler is None or not profiler.done:
+        if timer is not None:
+            timer.begin()
+        data = source.read_buffered()
+        read_ns = perf_counter_ns()
+        if timer is not None:
+            timer.mark('read')
+        if data:
+            count = bridge.update(data, read_ns)
+            if timer is not None:
+                timer.mark('emit')
+            if verbose and count:
+                print(' '.join(f"{'KEY' if t == EV_KEY else 'ABS'}:{c:#x}={v}"
+                               for t, c, v in bridge._events if t != EV_SYN))
+            if profiler is not None:
+                profiler.count()
+
+def run(args):
+    from calibration import state_from_args
+    from prediction import predictor_from_args
+    from profiling import Profiler, StageTimer
+    from usb_session import open_source
+
+    # Duplicates carry no events; coalescing would only add latency. The
+    # predictor needs the duplicates though: they are what stops it
+    predictor, lead_ns = predictor_from_args(args)
+    # The virtual joystick stays put while the session reattaches the wheel
+    source, session = open_source(args, DispatchPolicy(suppress_duplicates=predictor is None,
+                                                       coalesce_window=0.0, heartbeat_interval=0.0))
+    state, calibrator = state_from_args(args, source)
+    try:
+        bridge = Bridge(backend_from_name(args.sink), state, predictor=predictor, lead_ns=lead_ns)
+    except OSError as e:
+        print(f"Error: could not create the uinput device: {e}")
+        print("Load the module (sudo modprobe uinput) and run with sudo, or use --sink memory")
+        sys.exit(1)
+    print(f"Bridging to {'memory sink' if args.sink == 'memory' else DEVICE_NAME} (Ctrl+C to stop)")
+
+    timer = StageTimer()
+    profiler = None
+    try:
+        if args.profile:
+            with Profiler(args.profile_reports, output=args.profile_output) as profiler:
+                run_bridge(source, bridge, timer, profiler, args.verbose)
+        else:
+            run_bridge(source, bridge, timer, verbose=args.verbose)
+    except EOFError:
+        print("End of capture")
+    except KeyboardInterrupt:
+        print()
+    finally:
+        bridge.close()
+        if calibrator is not None:
+            calibrator.stop()
+        if session is not None:
+            session.close()
+
+    if profiler is not None:
+        profiler.dump()
+    print(f"  Bridge:  {bridge.summary()}")
+    print(f"  Latency: {bridge.latency_summary()}")
+    print(f"  Reports: {source.stats.summary()}")
+    print(f"  Stages:  {timer.summary()}")
+    if predictor is not None:
+        print(f"  Predict: {lead_ns / 1e6:g} ms ahead, {predictor.summary()}")
+    if session is not None:
+        print(f"  Device:  {session.summary()}")
+
+def run_benchmark(reports=200000):
+    """Added latency per batch and per event, memory sink vs /dev/uinput if available."""
+    from synth_wheel import SyntheticDevice, SyntheticWheel
+
+    print("=" * 80)
+    print(f"uinput bridge benchmark ({reports} synthetic reports)")
+    print("=" * 80)
+    backends = [('memory sink', lambda: MemorySink(keep=False))]
+    if os.access('/dev/uinput', os.W_OK):
+        backends.append(('/dev/uinput', UinputDevice))
+    else:
+        print("  (/dev/uinput not writable here; memory sink only)")
+
+    for name, factory in backends:
+        source = ReportSource(SyntheticDevice(SyntheticWheel(rate=1000), count=reports), 0x81,
+                              DispatchPolicy(coalesce_window=0.0, heartbeat_interval=0.0))
+        bridge = Bridge(factory())
+        start = time.perf_counter()
+        try:
+            run_bridge(source, bridge)
+        except EOFError:
+            pass
+        elapsed = time.perf_counter() - start
+        bridge.close()
+        print(f"  {name}")
+        print(f"    {bridge.summary()}, {reports / elapsed:,.0f} reports/s end to end")
+        print(f"    {bridge.latency_summary()}")
+
+def main():
+    from profiling import add_profile_arguments
+    from calibration import add_calibration_arguments
+    from prediction import add_prediction_arguments
+
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - Linux uinput bridge")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('run', help='bridge the wheel to a virtual joystick')
+    p.add_argument('--sink', choices=('uinput', 'memory'), default='uinput',
+                   help='event backend (default: uinput)')
+    p.add_argument('--verbose', action='store_true', help='print every emitted batch')
+    add_calibration_arguments(p)
+    add_prediction_arguments(p)
+    add_profile_arguments(p)
+    p = sub.add_parser('bench', help='measure added latency per event')
+    p.add_argument('--reports', type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'bench':
+        run_benchmark(args.reports)
+
+if __name__ == "__main__":
+    main()
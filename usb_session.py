@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Hot-plug Resilient USB Session
+
+Every tool used to open the wheel once (find, kernel-driver detach,
+set_configuration, get_active_configuration, endpoint scan) and exit on the
+first USBError. WheelSession wraps that device instead: it has the same
+pyusb read(endpoint, size_or_buffer, timeout) interface, so a ReportSource
+on top of it never notices a disconnect. On a lost device it
+
+    - reports read timeouts to the caller while the wheel is away, so the
+      read loop (and its heartbeats, metrics and UI) keeps running
+    - looks for the wheel again with exponential backoff
+    - reattaches through the configuration cached for its port path and
+      serial number: only the kernel-driver detach and interface claim are
+      redone, falling back to the full sequence if that fails
+    - records how long each reconnect took, from the failed read to the
+      first report after reattaching
+
+The bus is pluggable: PyUsbBus talks to the real wheel (pyusb is imported
+lazily), SimulatedBus unplugs a synthetic wheel on a schedule with modeled
+enumeration and configuration costs.
+
+Usage:
+    python3 usb_session.py simulate [--seconds S] [--up S] [--down S] [--no-cache]
+"""
+
+import errno
+import os
+import sys
+import time
+import argparse
+from collections import deque, namedtuple
+
+from report_source import TIMEOUT_ERRNO, ReportSource
+
+# Everything the full open sequence resolves, cached per path and serial
+DeviceConfig = namedtuple('DeviceConfig', 'path serial configuration interface endpoint packet_size')
+
+class PyUsbBus:
+    """The real bus via pyusb."""
+
+    def __init__(self, vendor, product, interface=0):
+        import usb.core
+        import usb.util
+        self.usb = usb
+        self.vendor = vendor
+        self.product = product
+        self.interface = interface
+
+    def identify(self, dev):
+        """(port path, serial) of a device; the path is stable across replugs into one port."""
+        path = f"{dev.bus}-{'.'.join(str(p) for p in (dev.port_numbers or ()))}"
+        try:
+            serial = dev.serial_number
+        except (ValueError, self.usb.core.USBError):
+            serial = None
+        return path, serial
+
+    def find(self, config=None):
+        """The wheel at the cached path, else the one with the cached serial, else any."""
+        devices = list(self.usb.core.find(find_all=True, idVendor=self.vendor, idProduct=self.product))
+        if not devices:
+            return None
+        if config is not None:
+            for dev in devices:
+                if self.identify(dev)[0] == config.path:
+                    return dev
+            for dev in devices:
+                if config.serial is not None and self.identify(dev)[1] == config.serial:
+                    return dev
+        return devices[0]
+
+    def _detach(self, dev):
+        try:
+            if dev.is_kernel_driver_active(self.interface):
+                dev.detach_kernel_driver(self.interface)
+        except (self.usb.core.USBError, NotImplementedError):
+            pass
+
+    def resolve(self, dev):
+        """Full open sequence. Returns the DeviceConfig."""
+        self._detach(dev)
+        try:
+            dev.set_configuration()
+        except self.usb.core.USBError:
+            pass
+        cfg = dev.get_active_configuration()
+        for ep in cfg[(self.interface, 0)]:
+            if (ep.bEndpointAddress & 0x80) and ((ep.bmAttributes & 0x03) == 0x03):
+                path, serial = self.identify(dev)
+                return DeviceConfig(path, serial, cfg.bConfigurationValue, self.interface,
+                                    ep.bEndpointAddress, ep.wMaxPacketSize)
+        raise OSError(errno.ENODEV, "no interrupt IN endpoint")
+
+    def attach(self, dev, config):
+        """Fast reattach with a cached config: detach and claim only."""
+        self._detach(dev)
+        self.usb.util.claim_interface(dev, config.interface)
+
+    def release(self, dev, config):
+        try:
+            self.usb.util.release_interface(dev, config.interface)
+            self.usb.util.dispose_resources(dev)
+        except self.usb.core.USBError:
+            pass
+
+class WheelSession:
+    """pyusb-style device that survives unplugs and USB errors.
+
+    The `endpoint` passed to read() is ignored in favour of the resolved
+    one (it cannot change for a given config). `clock` and `sleep` are
+    injectable for simulations.
+    """
+
+    def __init__(self, bus, backoff=0.02, max_backoff=0.5, cache=True,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.bus = bus
+        self.min_backoff = backoff
+        self.max_backoff = max_backoff
+        self.use_cache = cache
+        self.clock = clock
+        self.sleep = sleep
+        self.cache = {}
+        self.dev = None
+        self.config = None
+        self.disconnects = 0
+        self.reconnects = 0
+        self.attempts = 0
+        self.fast_attaches = 0
+        self.full_attaches = 0
+        self.reconnect_times = deque(maxlen=100)
+        self.attach_times = deque(maxlen=100)
+        self.last_error = None
+        self._backoff = backoff
+        self._next_attempt = 0.0
+        self._down_since = None
+
+    @property
+    def endpoint(self):
+        return self.config.endpoint if self.config is not None else None
+
+    @property
+    def connected(self):
+        return self.dev is not None
+
+    def _remember(self, config):
+        self.config = config
+        if self.use_cache:
+            self.cache[('path', config.path)] = config
+            if config.serial is not None:
+                self.cache[('serial', config.serial)] = config
+
+    def adopt(self, dev, endpoint, interface=0):
+        """Take over a device the caller already opened and resolved to `endpoint`."""
+        path, serial = self.bus.identify(dev)
+        self.dev = dev
+        self._remember(DeviceConfig(path, serial, None, interface, endpoint, None))
+        return self
+
+    def connect(self):
+        """Find and open the wheel. Returns True if it is attached."""
+        self.attempts += 1
+        start = self.clock()
+        try:
+            dev = self.bus.find(self.config if self.use_cache else None)
+            if dev is None:
+                return False
+            config = None
+            if self.use_cache:
+                path, serial = self.bus.identify(dev)
+                config = self.cache.get(('path', path)) or self.cache.get(('serial', serial))
+            if config is not None:
+                try:
+                    self.bus.attach(dev, config)
+                    self.fast_attaches += 1
+                except OSError:
+                    config = None
+            if config is None:
+                config = self.bus.resolve(dev)
+                self.full_attaches += 1
+        except OSError as e:
+            self.last_error = e
+            return False
+        if self.use_cache:
+            # Same device in another port: keep the config under its new path
+            path, serial = self.bus.identify(dev)
+            config = config._replace(path=path, serial=serial)
+
+        self.dev = dev
+        self._remember(config)
+        self.attach_times.append(self.clock() - start)
+        return True
+
+    def _lost(self, error):
+        self.disconnects += 1
+        self.last_error = error
+        if self.dev is not None:
+            self.bus.release(self.dev, self.config)
+        self.dev = None
+        self._down_since = self.clock()
+        self._backoff = self.min_backoff
+        self._next_attempt = self._down_since
+
+    def _timeout(self, message):
+        return OSError(TIMEOUT_ERRNO, message)
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        if self.dev is None:
+            now = self.clock()
+            wait = self._next_attempt - now
+            if wait > 0:
+                # Sleep out the backoff, but never longer than the read timeout
+                self.sleep(min(wait, timeout / 1000.0) if timeout else wait)
+                raise self._timeout("wheel disconnected, waiting to retry")
+            if not self.connect():
+                self._next_attempt = self.clock() + self._backoff
+                self._backoff = min(self._backoff * 2, self.max_backoff)
+                raise self._timeout("wheel disconnected, not found yet")
+            self.reconnects += 1
+
+        try:
+            data = self.dev.read(self.config.endpoint, size_or_buffer, timeout)
+        except OSError as e:
+            if e.errno == TIMEOUT_ERRNO:
+                raise
+            self._lost(e)
+            raise self._timeout(f"wheel lost ({e}), reconnecting")
+
+        if self._down_since is not None:
+            self.reconnect_times.append(self.clock() - self._down_since)
+            self._down_since = None
+        return data
+
+    def ctrl_transfer(self, *args, **kwargs):
+        """Control transfer on the current device (raises ENODEV while it is away)."""
+        dev = self.dev
+        if dev is None:
+            raise OSError(errno.ENODEV, "wheel disconnected")
+        return dev.ctrl_transfer(*args, **kwargs)
+
+    def close(self):
+        if self.dev is not None:
+            self.bus.release(self.dev, self.config)
+            self.dev = None
+
+    def summary(self):
+        """One line, e.g. 'disconnects 3, reconnects 3 (fast 3, full 0), last 512.3 ms'."""
+        line = (f"disconnects {self.disconnects}, reconnects {self.reconnects} "
+                f"(fast {self.fast_attaches}, full {self.full_attaches})")
+        if self.reconnect_times:
+            line += f", last {self.reconnect_times[-1] * 1000:.1f} ms"
+        if self.dev is None and self.disconnects:
+            line += ", DISCONNECTED"
+        return line
+
+def session_from_device(dev, endpoint, vendor, product, interface=0):
+    """Wrap a wheel already opened by a tool's open_device() in a WheelSession."""
+    return WheelSession(PyUsbBus(vendor, product, interface)).adopt(dev, endpoint, interface)
+
+def open_source(args, policy):
+    """(ReportSource, session) for the shared --replay/--synthetic options or the wheel.
+
+    The wheel is opened through a WheelSession, returned so the caller can
+    close it and print its summary; session is None for fake devices.
+    Exits with a message if reading the wheel needs sudo.
+    """
+    from synth_wheel import fake_device_from_args
+
+    dev = fake_device_from_args(args)
+    endpoint_in = None
+    session = None
+    if dev is None:
+        if os.geteuid() != 0:
+            print("Error: reading the wheel requires sudo (or use --replay/--synthetic)")
+            sys.exit(1)
+        from test_wheel import INTERFACE_NUM, PRODUCT_ID, VENDOR_ID, open_device
+        dev, endpoint_in = open_device()
+        dev = session = session_from_device(dev, endpoint_in, VENDOR_ID, PRODUCT_ID, INTERFACE_NUM)
+    return ReportSource(dev, endpoint_in, policy), session
+
+# Modeled costs of the open sequence on the simulated bus, in seconds
+SIM_COSTS = {'find': 0.002, 'detach': 0.0005, 'set_configuration': 0.012,
+             'get_active_configuration': 0.003, 'claim': 0.0005}
+
+class _SimulatedHandle:
+    """One plug-in of the simulated wheel; dead once it is unplugged."""
+
+    def __init__(self, bus, generation, path):
+        self.bus = bus
+        self.generation = generation
+        self.path = path
+        self.reads = 0
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        if not self.bus.plugged() or self.bus.generation != self.generation:
+            raise OSError(errno.ENODEV, "No such device (it may have been disconnected)")
+        if not self.reads:
+            self.bus.device.skip_to_now()
+        self.reads += 1
+        return self.bus.device.read(endpoint, size_or_buffer, timeout)
+
+class SimulatedBus:
+    """A synthetic wheel that is unplugged for `down` seconds after every `up` seconds.
+
+    Every `move_every`th replug lands in a different port, so the cached
+    config has to be found by serial. Each open step sleeps for its
+    SIM_COSTS entry and is counted in `calls`.
+    """
+
+    def __init__(self, device, up=2.0, down=0.5, move_every=3, costs=SIM_COSTS,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.device = device
+        self.up = up
+        self.down = down
+        self.move_every = move_every
+        self.costs = costs
+        self.clock = clock
+        self.sleep = sleep
+        self.start = clock()
+        self.calls = dict.fromkeys(costs, 0)
+
+    def _cost(self, step):
+        self.calls[step] += 1
+        self.sleep(self.costs[step])
+
+    @property
+    def generation(self):
+        return int((self.clock() - self.start) // (self.up + self.down))
+
+    def plugged(self):
+        return (self.clock() - self.start) % (self.up + self.down) < self.up
+
+    def _path(self, generation):
+        port = 1 + (generation // self.move_every) % 4 if self.move_every else 1
+        return f"1-{port}"
+
+    def identify(self, dev):
+        return dev.path, 'SIM0001'
+
+    def find(self, config=None):
+        self._cost('find')
+        if not self.plugged():
+            return None
+        generation = self.generation
+        return _SimulatedHandle(self, generation, self._path(generation))
+
+    def resolve(self, dev):
+        for step in ('detach', 'set_configuration', 'get_active_configuration', 'claim'):
+            self._cost(step)
+        return DeviceConfig(dev.path, 'SIM0001', 1, 0, 0x81, 64)
+
+    def attach(self, dev, config):
+        self._cost('detach')
+        self._cost('claim')
+
+    def release(self, dev, config):
+        pass
+
+def run_simulation(seconds=10.0, up=2.0, down=0.5, rate=1000, cache=True):
+    """Stream a synthetic wheel through a session that keeps losing it."""
+    from report_source import DispatchPolicy, ReportSource
+    from synth_wheel import SyntheticDevice, SyntheticWheel
+    from wheel_state import WheelState
+
+    bus = SimulatedBus(SyntheticDevice(SyntheticWheel(rate), realtime=True), up=up, down=down)
+    session = WheelSession(bus, cache=cache)
+    if not session.connect():
+        print("Error: simulated wheel not present at start")
+        return
+    source = ReportSource(session, session.endpoint, DispatchPolicy(heartbeat_interval=0.5))
+    state = WheelState()
+
+    print("=" * 80)
+    print(f"Hot-plug simulation: {seconds:g} s, unplugged {down:g} s every {up + down:g} s, "
+          f"config cache {'on' if cache else 'off'}")
+    print("=" * 80)
+    end = time.monotonic() + seconds
+    decoded = 0
+    while time.monotonic() < end:
+        data = source.read_buffered()
+        if data and state.update(data):
+            decoded += 1
+
+    cycles = int(seconds // (up + down))
+    print(f"  Session:  {session.summary()}")
+    print(f"  Reports:  {source.stats.summary()}, decoded {decoded}")
+    print(f"  Expected: ~{int(rate * seconds * up / (up + down)):,} received over {cycles} unplug cycles")
+    if session.reconnect_times:
+        times = sorted(session.reconnect_times)
+        attach = sorted(session.attach_times)
+        print(f"  Reconnect (failed read -> first report): min {times[0] * 1000:.1f} ms, "
+              f"median {times[len(times) // 2] * 1000:.1f} ms, max {times[-1] * 1000:.1f} ms "
+              f"(of which unplugged {down * 1000:.0f} ms)")
+        print(f"  Attach (find -> attached, modeled costs): median "
+              f"{attach[len(attach) // 2] * 1000:.1f} ms")
+    print(f"  Open steps run: {', '.join(f'{k} {v}' for k, v in bus.calls.items())}")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel hot-plug resilient session")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('simulate', help='stream through a wheel that disconnects on a schedule')
+    p.add_argument('--seconds', type=float, default=10.0)
+    p.add_argument('--up', type=float, default=2.0, help='seconds plugged in per cycle')
+    p.add_argument('--down', type=float, default=0.5, help='seconds unplugged per cycle')
+    p.add_argument('--rate', type=float, default=1000)
+    p.add_argument('--no-cache', action='store_true', help='redo the full open sequence every time')
+    args = parser.parse_args()
+
+    if args.command == 'simulate':
+        run_simulation(args.seconds, args.up, args.down, args.rate, cache=not args.no_cache)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - C Report Decoder (ctypes binding)
+
+Loads HORIRacingWheelDriver/wheel_report.c, the decoder the driver itself
+uses, as a shared library. The library is built with the system C compiler
+on first use (or `make parser`) and rebuilt when the source is newer.
+
+parse_report() returns the same dict as wheel_state.parse_report();
+parse_batch() decodes a whole buffer of fixed-size reports (e.g. a capture
+file's payloads) in one call, which is where C pays off - a ctypes call per
+report costs more than WheelState.update() does.
+
+`fuzz` runs the C decoder, wheel_state.parse_report() and WheelState
+side by side on random reports (biased towards the edge values each field
+cares about), synthetic driving and, optionally, recorded captures, and
+stops at the first report where they disagree.
+
+Usage:
+    python3 wheel_report_c.py fuzz [--reports N] [--seed S] [capture.hcap ...]
+    python3 wheel_report_c.py bench [--reports N]
+"""
+
+import os
+import sys
+import time
+import random
+import ctypes
+import argparse
+import subprocess
+
+from report_source import REPORT_SIZE
+from wheel_state import WheelState, parse_report as reference_parse
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'HORIRacingWheelDriver')
+SOURCE = os.path.join(SOURCE_DIR, 'wheel_report.c')
+HEADER = os.path.join(SOURCE_DIR, 'wheel_report.h')
+BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
+LIBRARY = os.path.join(BUILD_DIR, 'libwheel_report' + ('.dylib' if sys.platform == 'darwin' else '.so'))
+
+# Must match HORI_WHEEL_ABI_VERSION in wheel_report.h
+ABI_VERSION = 1
+
+class WheelStateC(ctypes.Structure):
+    """Mirror of hori_wheel_state."""
+    _fields_ = [('byte0', ctypes.c_uint8), ('byte1', ctypes.c_uint8),
+                ('byte2', ctypes.c_uint8), ('byte3', ctypes.c_uint8),
+                ('buttons', ctypes.c_uint16),
+                ('dpad_bits', ctypes.c_uint8), ('dpad', ctypes.c_uint8),
+                ('brake', ctypes.c_uint8), ('accel', ctypes.c_uint8),
+                ('steering16', ctypes.c_uint16), ('steering_signed', ctypes.c_int16),
+                ('flags', ctypes.c_uint16)]
+
+# hori_wheel_state.flags bit order (HORI_WHEEL_* in wheel_report.h)
+FLAG_KEYS = ('btn_plus', 'btn_minus', 'btn_lsb', 'btn_rsb', 'paddle_down', 'paddle_up',
+             'btn_home', 'btn_a', 'btn_b', 'btn_x', 'btn_y', 'btn_zl', 'btn_zr')
+
+_lib = None
+
+def build(force=False):
+    """Compile the shared library if it is missing or older than the source.
+
+    Returns an error message, or None on success.
+    """
+    if not force and os.path.exists(LIBRARY):
+        built = os.path.getmtime(LIBRARY)
+        if built >= os.path.getmtime(SOURCE) and built >= os.path.getmtime(HEADER):
+            return None
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    cc = os.environ.get('CC', 'cc')
+    command = [cc, '-std=c99', '-O2', '-Wall', '-Wextra', '-shared', '-fPIC', '-o', LIBRARY, SOURCE]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True)
+    except OSError as e:
+        return f"C compiler '{cc}' not available ({e})"
+    if result.returncode != 0:
+        return f"{' '.join(command)} failed:\n{result.stderr.strip()}"
+    return None
+
+def load():
+    """The loaded library, building it first if needed. Returns None if it can't be."""
+    global _lib
+    if _lib is not None:
+        return _lib
+    if build() is not None:
+        return None
+    lib = ctypes.CDLL(LIBRARY)
+    lib.hori_wheel_parse.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(WheelStateC))
+    lib.hori_wheel_parse.restype = ctypes.c_int
+    lib.hori_wheel_parse_batch.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t,
+                                           ctypes.POINTER(WheelStateC))
+    lib.hori_wheel_parse_batch.restype = ctypes.c_size_t
+    lib.hori_wheel_abi_version.restype = ctypes.c_int
+    if lib.hori_wheel_abi_version() != ABI_VERSION or ctypes.sizeof(WheelStateC) != 16:
+        return None
+    _lib = lib
+    return lib
+
+def require_library():
+    """load(), or exit with the reason."""
+    lib = load()
+    if lib is None:
+        error = build()
+        print("Error: could not load the C report decoder")
+        print(error or f"{LIBRARY} does not match ABI version {ABI_VERSION}; rebuild with: make parser")
+        print("A C compiler is needed (Xcode command line tools on macOS, gcc/clang on Linux)")
+        sys.exit(1)
+    return lib
+
+def state_to_dict(state):
+    """A WheelStateC as the dict wheel_state.parse_report() returns."""
+    flags = state.flags
+    result = {
+        'buttons': state.buttons,
+        'dpad': state.dpad,
+        'dpad_bits': state.dpad_bits,
+        'steering16': state.steering16,
+        'steering_signed': state.steering_signed,
+        'accel': state.accel,
+        'brake': state.brake,
+    }
+    for bit, key in enumerate(FLAG_KEYS):
+        result[key] = (flags >> bit) & 1 == 1
+    result['byte2'] = state.byte2
+    result['byte3'] = state.byte3
+    result['byte0'] = state.byte0
+    result['byte1'] = state.byte1
+    return result
+
+def parse_report(data):
+    """C-decoded drop-in for wheel_state.parse_report() (None if too short)."""
+    lib = require_library()
+    state = WheelStateC()
+    buffer = (ctypes.c_uint8 * len(data)).from_buffer_copy(data) if len(data) else None
+    if not lib.hori_wheel_parse(buffer, len(data), ctypes.byref(state)):
+        return None
+    return state_to_dict(state)
+
+def parse_batch(data, stride=REPORT_SIZE, out=None):
+    """Decode len(data) // stride reports from one buffer.
+
+    Returns a ctypes array of WheelStateC; pass `out` (from a previous call)
+    to reuse it. With NumPy, np.ctypeslib.as_array(result) gives a
+    structured array view without copying.
+    """
+    lib = require_library()
+    count = len(data) // stride
+    if out is None or len(out) < count:
+        out = (WheelStateC * count)()
+    if count:
+        source = (ctypes.c_uint8 * len(data)).from_buffer(data) if isinstance(data, bytearray) \
+            else ctypes.c_char_p(bytes(data))
+        lib.hori_wheel_parse_batch(source, count, stride, out)
+    return out
+
+def _edge_byte(rng):
+    return rng.choice((0x00, 0x01, 0x7F, 0x80, 0xFE, 0xFF, rng.randrange(256)))
+
+def random_reports(count, seed=0):
+    """Random reports: uniform bytes, edge values and every length up to REPORT_SIZE."""
+    rng = random.Random(seed)
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            yield rng.randbytes(REPORT_SIZE)
+        elif kind == 1:
+            # Edge values in every field the layout gives meaning to
+            report = bytearray(rng.randbytes(REPORT_SIZE))
+            for index in range(8):
+                report[index] = _edge_byte(rng)
+            report[2] = (report[2] & 0xF0) | rng.randrange(16)
+            yield bytes(report)
+        elif kind == 2:
+            yield rng.randbytes(rng.randrange(0, 16))
+        else:
+            yield rng.randbytes(rng.randrange(8, REPORT_SIZE + 1))
+
+def _synthetic_reports(count):
+    from synth_wheel import SyntheticWheel
+    for report, _ in SyntheticWheel(1000, noise=8).generate(count):
+        yield report
+
+def _capture_reports(path):
+    from capture_file import CaptureReader, CaptureFormatError
+    try:
+        reader = CaptureReader(path)
+    except (OSError, CaptureFormatError) as e:
+        print(f"Error: {path}: {e}")
+        sys.exit(1)
+    for _, _, report in reader:
+        yield report
+
+def _compare(data, state):
+    """Differences between the three decoders for one report ([] if they agree)."""
+    expected = reference_parse(data)
+    got = parse_report(data)
+    if expected is None or got is None:
+        return [] if expected is got else [('(length)', expected, got)]
+    diffs = [(key, expected[key], got[key]) for key in expected if expected[key] != got.get(key)]
+    state.update(data)
+    diffs += [(f"WheelState.{key}", expected[key], value)
+              for key, value in state.as_dict().items() if value != expected[key]]
+    return diffs
+
+def run_fuzz(reports=200000, seed=0, captures=()):
+    """Differential fuzz: C decoder vs parse_report() vs WheelState."""
+    require_library()
+    sources = [(f"random (seed {seed})", random_reports(reports, seed)),
+               ("synthetic driving", _synthetic_reports(min(reports, 50000)))]
+    sources += [(path, _capture_reports(path)) for path in captures]
+
+    state = WheelState()
+    total = 0
+    for name, stream in sources:
+        checked = 0
+        for data in stream:
+            diffs = _compare(data, state)
+            checked += 1
+            if diffs:
+                print(f"MISMATCH in {name} after {checked} reports")
+                print(f"  report [{len(data)} bytes]: {bytes(data[:16]).hex(' ')}")
+                for key, expected, got in diffs:
+                    print(f"  {key:24s} reference {expected!r:8}  got {got!r}")
+                sys.exit(1)
+        print(f"  {name:40s} {checked:9d} reports  agree")
+        total += checked
+
+    # Batch decoding of the same bytes must match one-at-a-time decoding
+    blob = b''.join(r for r in random_reports(4096, seed + 1) if len(r) == REPORT_SIZE)
+    for i, row in enumerate(parse_batch(blob)):
+        report = blob[i * REPORT_SIZE:(i + 1) * REPORT_SIZE]
+        if state_to_dict(row) != reference_parse(report):
+            print(f"MISMATCH in parse_batch() at report {i}: {report[:8].hex(' ')}")
+            sys.exit(1)
+    print(f"  {'parse_batch() vs reference':40s} {len(blob) // REPORT_SIZE:9d} reports  agree")
+    print(f"All decoders agree on {total} reports")
+
+def run_benchmark(reports=200000):
+    """Per-report decode cost: Python reference, WheelState, C per call and C batch."""
+    lib = require_library()
+    stream = list(_synthetic_reports(reports))
+    blob = bytearray(b''.join(stream))
+    buffers = [(ctypes.c_uint8 * REPORT_SIZE).from_buffer_copy(r) for r in stream]
+    state = WheelState()
+    cstate = WheelStateC()
+    parse = lib.hori_wheel_parse
+    ref = ctypes.byref(cstate)
+    out = (WheelStateC * reports)()
+
+    def reference():
+        for data in stream:
+            reference_parse(data)
+
+    def wheel_state():
+        update = state.update
+        for data in stream:
+            update(data)
+
+    def c_call():
+        for buffer in buffers:
+            parse(buffer, REPORT_SIZE, ref)
+
+    def c_batch():
+        parse_batch(blob, out=out)
+
+    print("=" * 80)
+    print(f"Report decode benchmark ({reports} reports, best of 3)")
+    print("=" * 80)
+    rows = (('wheel_state.parse_report() (dict)', reference),
+            ('WheelState.update()', wheel_state),
+            ('C hori_wheel_parse() per call', c_call),
+            ('C parse_batch() one call', c_batch))
+    baseline = None
+    for name, fn in rows:
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter_ns()
+            fn()
+            best = min(best, time.perf_counter_ns() - start)
+        per = best / reports
+        baseline = baseline or per
+        print(f"  {name:36s} {per:8.1f} ns/report  {1e9 / per:14,.0f} reports/s  "
+              f"{baseline / per:6.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel - C report decoder")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('fuzz', help='differential fuzz against wheel_state.parse_report()')
+    p.add_argument('captures', nargs='*', help='capture files to replay as well')
+    p.add_argument('--reports', type=int, default=200000)
+    p.add_argument('--seed', type=int, default=0)
+    p = sub.add_parser('bench', help='decode throughput of the Python and C decoders')
+    p.add_argument('--reports', type=int, default=200000)
+    sub.add_parser('build', help='(re)compile the shared library')
+    args = parser.parse_args()
+
+    if args.command == 'fuzz':
+        run_fuzz(args.reports, args.seed, args.captures)
+    elif args.command == 'bench':
+        run_benchmark(args.reports)
+    elif args.command == 'build':
+        error = build(force=True)
+        if error:
+            print(f"Error: {error}")
+            sys.exit(1)
+        print(f"✓ Built {LIBRARY}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+HORI Racing Wheel - Report Decoding
+
+Decodes the wheel's input report layout (see DISCOVERED_MAPPING.md):
+
+    Byte 2:   D-pad bits + Plus/Minus + L/R shoulder buttons
+    Byte 3:   Paddle shifters + Home + A/B/X/Y
+    Byte 4:   Brake (ZL overlays as 0xFF)
+    Byte 5:   Accelerator (ZR overlays as 0xFF)
+    Byte 6-7: 16-bit steering, little-endian, 0x0000 = center
+
+parse_report() is the reference decoder returning a dict. WheelState is the
+hot-loop form: a __slots__ object updated in place from a reused read
+buffer, so steady-state decoding allocates (almost) nothing.
+
+A state packs into 8 bytes (STATE_STRUCT), identical to report bytes 0-7,
+and STATE_DTYPE describes the same layout for NumPy arrays of states.
+
+Usage:
+    python3 wheel_state.py bench [--reports N]
+    python3 wheel_state.py bench-state [--states N]
+"""
+
+import array
+import struct
+import sys
+import time
+import argparse
+import tracemalloc
+
+from report_source import REPORT_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Packed state: byte0, byte1, byte2, byte3, brake, accel, steering16
+# (the same bytes, in the same order, as report bytes 0-7)
+STATE_STRUCT = struct.Struct('<BBBBBBH')
+STATE_SIZE = STATE_STRUCT.size
+
+# NumPy record for arrays of states; steering is stored as its signed view
+STATE_DTYPE = None
+if np is not None:
+    STATE_DTYPE = np.dtype([('byte0', 'u1'), ('byte1', 'u1'), ('byte2', 'u1'), ('byte3', 'u1'),
+                            ('brake', 'u1'), ('accel', 'u1'), ('steering_signed', '<i2')])
+
+def parse_report(data):
+    """Parse HID report and extract values - CORRECTED BASED ON ACTUAL MAPPING."""
+    if len(data) < 8:
+        return None
+
+    # Extract button state (TODO: actual button positions TBD)
+    buttons = data[0] | (data[1] << 8)
+
+    # Extract D-pad (individual bits, not 0-8 encoding)
+    dpad_bits = data[2] & 0x0F
+    # Convert to hat switch encoding
+    if dpad_bits == 0x01: dpad = 0      # Up
+    elif dpad_bits == 0x09: dpad = 1    # NE
+    elif dpad_bits == 0x08: dpad = 2    # Right
+    elif dpad_bits == 0x0A: dpad = 3    # SE
+    elif dpad_bits == 0x02: dpad = 4    # Down
+    elif dpad_bits == 0x06: dpad = 5    # SW
+    elif dpad_bits == 0x04: dpad = 6    # Left
+    elif dpad_bits == 0x05: dpad = 7    # NW
+    else: dpad = 8  # Neutral
+
+    # Extract axes - CORRECTED POSITIONS!
+    brake = data[4]     # Byte 4: Brake
+    accel = data[5]     # Byte 5: Accelerator
+
+    # Extract 16-bit steering (bytes 6-7, little-endian)
+    # 0x0000 = center, 0x0001-0x7FFF = right, 0x8000-0xFFFF = left
+    steering16 = data[6] | (data[7] << 8)
+    steering_signed = steering16 if steering16 < 32768 else steering16 - 65536  # Convert to signed
+
+    # Extract shoulder buttons and plus/minus from byte 2 (upper 4 bits)
+    btn_plus = (data[2] & 0x10) != 0     # Bit 4: + button
+    btn_minus = (data[2] & 0x20) != 0    # Bit 5: - button
+    btn_lsb = (data[2] & 0x40) != 0      # Bit 6: LSB (Left Shoulder Button)
+    btn_rsb = (data[2] & 0x80) != 0      # Bit 7: RSB (Right Shoulder Button)
+
+    # Extract paddle shifters and face buttons (byte 3)
+    paddle_down = (data[3] & 0x01) != 0  # Bit 0: gear down (left paddle)
+    paddle_up = (data[3] & 0x02) != 0    # Bit 1: gear up (right paddle)
+    btn_home = (data[3] & 0x04) != 0     # Bit 2: home button
+    # Bit 3 (0x08): unknown
+    btn_a = (data[3] & 0x10) != 0        # Bit 4: A button
+    btn_b = (data[3] & 0x20) != 0        # Bit 5: B button
+    btn_x = (data[3] & 0x40) != 0        # Bit 6: X button
+    btn_y = (data[3] & 0x80) != 0        # Bit 7: Y button
+
+    # Detect ZL and ZR buttons (they overlay on the pedal axes)
+    btn_zl = (brake == 0xFF)
+    btn_zr = (accel == 0xFF)
+
+    return {
+        'buttons': buttons,
+        'dpad': dpad,
+        'dpad_bits': dpad_bits,
+        'steering16': steering16,
+        'steering_signed': steering_signed,
+        'accel': accel,
+        'brake': brake,
+        'paddle_down': paddle_down,
+        'paddle_up': paddle_up,
+        'btn_home': btn_home,
+        'btn_a': btn_a,
+        'btn_b': btn_b,
+        'btn_x': btn_x,
+        'btn_y': btn_y,
+        'btn_plus': btn_plus,
+        'btn_minus': btn_minus,
+        'btn_lsb': btn_lsb,
+        'btn_rsb': btn_rsb,
+        'btn_zl': btn_zl,
+        'btn_zr': btn_zr,
+        'byte2': data[2],
+        'byte3': data[3],
+        'byte0': data[0],
+        'byte1': data[1]
+    }
+
+# D-pad bits (0x01=Up, 0x02=Down, 0x04=Left, 0x08=Right) -> hat switch 0-7, 8=neutral
+DPAD_FROM_BITS = (8, 0, 4, 8, 6, 7, 5, 8, 2, 1, 3, 8, 8, 8, 8, 8)
+
+class WheelState:
+    """Decoded wheel state, updated in place from each report.
+
+    Only the raw bytes and the multi-bit fields are stored; the individual
+    buttons are derived on access. Supports state['field'] lookups with the
+    same keys as parse_report(), so it can be passed to draw_ui().
+    """
+
+    __slots__ = ('byte0', 'byte1', 'byte2', 'byte3', 'buttons', 'dpad_bits', 'dpad',
+                 'brake', 'accel', 'steering16', 'steering_signed')
+
+    def __init__(self):
+        self.byte0 = self.byte1 = self.byte2 = self.byte3 = 0
+        self.buttons = 0
+        self.dpad_bits = 0
+        self.dpad = 8
+        self.brake = self.accel = 0
+        self.steering16 = self.steering_signed = 0
+
+    def update(self, data):
+        """Decode a report into this object. Returns False if it is too short."""
+        if len(data) < 8:
+            return False
+        b0 = data[0]
+        b1 = data[1]
+        b2 = data[2]
+        self.byte0 = b0
+        self.byte1 = b1
+        self.byte2 = b2
+        self.byte3 = data[3]
+        self.buttons = b0 | (b1 << 8)
+        self.dpad_bits = b2 & 0x0F
+        self.dpad = DPAD_FROM_BITS[b2 & 0x0F]
+        self.brake = data[4]
+        self.accel = data[5]
+        steering16 = data[6] | (data[7] << 8)
+        self.steering16 = steering16
+        self.steering_signed = steering16 if steering16 < 32768 else steering16 - 65536
+        return True
+
+    # Byte 2 (upper 4 bits)
+    btn_plus = property(lambda self: (self.byte2 & 0x10) != 0)
+    btn_minus = property(lambda self: (self.byte2 & 0x20) != 0)
+    btn_lsb = property(lambda self: (self.byte2 & 0x40) != 0)
+    btn_rsb = property(lambda self: (self.byte2 & 0x80) != 0)
+
+    # Byte 3
+    paddle_down = property(lambda self: (self.byte3 & 0x01) != 0)
+    paddle_up = property(lambda self: (self.byte3 & 0x02) != 0)
+    btn_home = property(lambda self: (self.byte3 & 0x04) != 0)
+    btn_a = property(lambda self: (self.byte3 & 0x10) != 0)
+    btn_b = property(lambda self: (self.byte3 & 0x20) != 0)
+    btn_x = property(lambda self: (self.byte3 & 0x40) != 0)
+    btn_y = property(lambda self: (self.byte3 & 0x80) != 0)
+
+    # ZL/ZR overlay on the pedal axes
+    btn_zl = property(lambda self: self.brake == 0xFF)
+    btn_zr = property(lambda self: self.accel == 0xFF)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def as_dict(self):
+        """Same dict parse_report() would return for the current report."""
+        return {key: getattr(self, key) for key in STATE_KEYS}
+
+    def to_bytes(self):
+        """Pack into STATE_SIZE (8) bytes."""
+        return STATE_STRUCT.pack(self.byte0, self.byte1, self.byte2, self.byte3,
+                                 self.brake, self.accel, self.steering16)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Unpack a state packed by to_bytes() (or the first 8 bytes of a report)."""
+        state = cls()
+        if not state.update(data):
+            raise ValueError(f"need {STATE_SIZE} bytes, got {len(data)}")
+        return state
+
+    def copy(self):
+        """Snapshot of the current state (update() mutates in place)."""
+        state = WheelState()
+        for name in WheelState.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
+
+    def __eq__(self, other):
+        if not isinstance(other, WheelState):
+            return NotImplemented
+        # Every other field is derived from these
+        return (self.steering16 == other.steering16 and self.brake == other.brake
+                and self.accel == other.accel and self.buttons == other.buttons
+                and self.byte2 == other.byte2 and self.byte3 == other.byte3)
+
+    # Mutable, so not hashable; use to_bytes() as a key
+    __hash__ = None
+
+    def __repr__(self):
+        return (f"WheelState(steering={self.steering_signed}, accel={self.accel}, "
+                f"brake={self.brake}, byte2=0x{self.byte2:02X}, byte3=0x{self.byte3:02X}, "
+                f"buttons=0x{self.buttons:04X})")
+
+# Keys returned by parse_report(), in order
+STATE_KEYS = ('buttons', 'dpad', 'dpad_bits', 'steering16', 'steering_signed', 'accel', 'brake',
+              'paddle_down', 'paddle_up', 'btn_home', 'btn_a', 'btn_b', 'btn_x', 'btn_y',
+              'btn_plus', 'btn_minus', 'btn_lsb', 'btn_rsb', 'btn_zl', 'btn_zr',
+              'byte2', 'byte3', 'byte0', 'byte1')
+
+def require(module, package):
+    """Raise ImportError if an optional dependency (imported as None) is missing.
+
+    Library code calls this; the tools' main() turn it into an error message.
+    """
+    if module is None:
+        raise ImportError(f"{package} not installed (install with: python3 -m pip install {package})")
+
+def states_to_array(states):
+    """Pack an iterable of WheelState (or 8-byte packed states) into a STATE_DTYPE array."""
+    require(np, 'numpy')
+    packed = b''.join(s if isinstance(s, (bytes, bytearray)) else s.to_bytes() for s in states)
+    return np.frombuffer(packed, dtype=STATE_DTYPE).copy()
+
+def array_from_packed(data):
+    """Zero-copy STATE_DTYPE view of concatenated 8-byte packed states."""
+    require(np, 'numpy')
+    return np.frombuffer(data, dtype=STATE_DTYPE)
+
+def changed_mask(states):
+    """Boolean mask of states that differ from the previous one (first is True).
+
+    Each 8-byte record is compared as one uint64, so this runs at memory speed.
+    """
+    require(np, 'numpy')
+    words = states.view('<u8')
+    mask = np.empty(len(words), dtype=bool)
+    if len(words):
+        mask[0] = True
+        np.not_equal(words[1:], words[:-1], out=mask[1:])
+    return mask
+
+class _BenchDevice:
+    """In-memory device cycling through prebuilt reports, pyusb read() semantics."""
+
+    def __init__(self, reports):
+        self.reports = [array.array('B', r) for r in reports]
+        self.index = 0
+
+    def read(self, endpoint, size_or_buffer, timeout=None):
+        report = self.reports[self.index]
+        self.index = (self.index + 1) % len(self.reports)
+        if isinstance(size_or_buffer, int):
+            return array.array('B', report)  # pyusb allocates a new array per read
+        size_or_buffer[:] = report
+        return len(report)
+
+def _bench_reports(count=1024):
+    """Steering sweep with pedal and button activity in the parse_report layout."""
+    reports = []
+    for i in range(count):
+        report = bytearray(REPORT_SIZE)
+        steering = (i * 64) & 0xFFFF
+        report[2] = (i >> 4) & 0xFF
+        report[3] = (i >> 2) & 0xFF
+        report[4] = (i * 3) & 0xFF
+        report[5] = (255 - i) & 0xFF
+        report[6] = steering & 0xFF
+        report[7] = steering >> 8
+        reports.append(bytes(report))
+    return reports
+
+def _bench_paths(source):
+    state = WheelState()
+
+    def legacy():
+        data = source.read_raw()
+        return parse_report(data)
+
+    def buffered():
+        n = source.readinto(source.buffer)
+        return state.update(source.view if n == source.report_size else source.view[:n])
+
+    return [('dev.read + bytes + parse_report', legacy),
+            ('readinto + WheelState.update', buffered)]
+
+def run_benchmark(reports=200000):
+    """Throughput and allocations per report: legacy dict path vs in-place path."""
+    from report_source import PASSTHROUGH, ReportSource
+
+    source = ReportSource(_BenchDevice(_bench_reports()), 0x81, PASSTHROUGH)
+    print("=" * 80)
+    print(f"Read + decode benchmark ({reports} reports per path)")
+    print("=" * 80)
+
+    results = []
+    for name, step in _bench_paths(source):
+        for _ in range(1000):
+            step()
+        start = time.perf_counter()
+        for _ in range(reports):
+            step()
+        elapsed = time.perf_counter() - start
+
+        # Retained memory over a steady-state run, and the largest transient
+        # allocation made while handling a single report
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for _ in range(10000):
+            step()
+        after = tracemalloc.take_snapshot()
+        retained = sum(d.size_diff for d in after.compare_to(before, 'filename'))
+        transient = 0
+        for _ in range(1000):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            step()
+            transient = max(transient, tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+
+        rate = reports / elapsed
+        results.append(rate)
+        print(f"  {name:34s} {rate:12,.0f} reports/s  {elapsed / reports * 1e9:7.0f} ns/report  "
+              f"transient {transient:5d} B/report  retained {retained / 10000:6.2f} B/report")
+
+    print()
+    print(f"  Speedup: {results[1] / results[0]:.2f}x")
+
+def _bytes_per_object(factory, count):
+    """Memory allocated per object when `count` of them are kept alive."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Don't charge the list itself to the objects
+    return (after - before - sys.getsizeof(kept)) / count
+
+def _comparisons_per_second(a, b, rounds=5):
+    """Pairwise a[i] == b[i] throughput over two equal-length lists."""
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for x, y in zip(a, b):
+            x == y
+        best = min(best, time.perf_counter() - start)
+    return len(a) / best
+
+def run_state_benchmark(states=200000):
+    """Memory per state and comparison throughput: dict vs WheelState vs packed."""
+    reports = _bench_reports()
+    n = len(reports)
+
+    def report(i):
+        return reports[i % n]
+
+    def make_state(i):
+        state = WheelState()
+        state.update(report(i))
+        return state
+
+    print("=" * 80)
+    print(f"State representation benchmark ({states} states)")
+    print("=" * 80)
+    print()
+    print("Memory per stored state:")
+    rows = [('parse_report() dict', lambda i: parse_report(report(i))),
+            ('WheelState (__slots__)', make_state),
+            ('packed bytes (to_bytes)', lambda i: make_state(i).to_bytes())]
+    for name, factory in rows:
+        print(f"  {name:28s} {_bytes_per_object(factory, states):8.1f} bytes")
+    if np is not None:
+        print(f"  {'NumPy STATE_DTYPE row':28s} {STATE_DTYPE.itemsize:8.1f} bytes")
+    print()
+
+    # Compare each state against its successor (mostly unequal) and against an
+    # equal copy; a distinct object, so == can't take the identity shortcut
+    print("Equality comparisons (pairwise, half equal / half different):")
+    dicts = [parse_report(report(i)) for i in range(states)]
+    objs = [make_state(i) for i in range(states)]
+    packed = [o.to_bytes() for o in objs]
+    for name, items, copy in (('dict ==', dicts, dict), ('WheelState ==', objs, WheelState.copy),
+                              ('packed bytes ==', packed, lambda b: bytes(bytearray(b)))):
+        left = items
+        right = items[1:] + items[:1]
+        right = [copy(left[i]) if i % 2 else right[i] for i in range(len(left))]
+        print(f"  {name:28s} {_comparisons_per_second(left, right):14,.0f} compares/s")
+
+    if np is not None:
+        arr = states_to_array(packed)
+        best = float('inf')
+        for _ in range(5):
+            start = time.perf_counter()
+            changed_mask(arr)
+            best = min(best, time.perf_counter() - start)
+        print(f"  {'NumPy changed_mask()':28s} {len(arr) / best:14,.0f} compares/s")
+    else:
+        print("  (install numpy for the STATE_DTYPE array results)")
+
+def main():
+    parser = argparse.ArgumentParser(description="HORI Racing Wheel report decoding")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('bench', help='benchmark read + decode paths')
+    p.add_argument('--reports', type=int, default=200000)
+    p = sub.add_parser('bench-state', help='benchmark state memory and comparison cost')
+    p.add_argument('--states', type=int, default=200000)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        run_benchmark(args.reports)
+    elif args.command == 'bench-state':
+        run_state_benchmark(args.states)
+
+if __name__ == "__main__":
+    main()